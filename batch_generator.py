@@ -13,6 +13,8 @@ import base64
 import threading
 from pathlib import Path
 
+from modules.utils import decode_base64_to_file
+
 try:
     from DrissionPage import ChromiumPage, ChromiumOptions
 except ImportError:
@@ -397,9 +399,8 @@ class BatchGenerator:
         saved = []
         for i, b64 in enumerate(images_b64):
             try:
-                img_data = base64.b64decode(b64)
                 filename = f"batch_{idx:03d}_{i+1}.png"
-                (OUTPUT_DIR / filename).write_bytes(img_data)
+                decode_base64_to_file(b64, OUTPUT_DIR / filename)
                 saved.append(filename)
             except:
                 pass
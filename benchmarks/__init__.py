@@ -0,0 +1,10 @@
+"""
+VE3 Tool - Offline Benchmarks
+=============================
+Đo throughput/tail latency của pipeline mà không cần Chrome, Google Flow,
+DeepSeek/Ollama hay FFmpeg thật.
+
+Chạy:
+    python -m benchmarks.run_benchmark                # tất cả stage
+    python -m benchmarks.run_benchmark --stages llm,flow_video --json out.json
+"""
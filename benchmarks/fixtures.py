@@ -0,0 +1,296 @@
+"""
+VE3 Tool - Synthetic Inputs cho benchmark
+=========================================
+Tạo voice (WAV im lặng), SRT, Excel prompts, ảnh PNG/MP4 giả và
+FFmpeg/FFprobe stand-in để chạy pipeline offline.
+"""
+
+import os
+import sys
+import json
+import wave
+import zlib
+import struct
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from modules.excel_manager import PromptWorkbook, Character, Scene
+
+
+# =============================================================================
+# MEDIA
+# =============================================================================
+
+def make_png(width: int = 512, height: int = 288) -> bytes:
+    """PNG RGB nhiễu ngẫu nhiên (không nén được → size gần ảnh thật)."""
+    raw = b"".join(b"\x00" + os.urandom(width * 3) for _ in range(height))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        body = tag + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+def make_fake_mp4(size_kb: int = 2048) -> bytes:
+    """Bytes giả cho video (chỉ dùng để đo download/compose stand-in)."""
+    header = b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom"
+    return header + os.urandom(size_kb * 1024 - len(header))
+
+
+def write_wav(path: Path, seconds: float, rate: int = 8000) -> Path:
+    """WAV mono 16-bit im lặng, dài `seconds`."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x00\x00" * int(seconds * rate))
+    return path
+
+
+def _srt_time(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def write_srt(path: Path, entries: int, seconds_per_entry: float) -> Path:
+    """SRT với `entries` câu, mỗi câu dài `seconds_per_entry`."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = []
+    for i in range(entries):
+        start = i * seconds_per_entry
+        lines.append(str(i + 1))
+        lines.append(f"{_srt_time(start)} --> {_srt_time(start + seconds_per_entry)}")
+        lines.append(f"Benchmark sentence number {i + 1} of the synthetic story.")
+        lines.append("")
+    path.write_text("\n".join(lines), encoding="utf-8")
+    return path
+
+
+# =============================================================================
+# PROJECT
+# =============================================================================
+
+def build_project(
+    root: Path,
+    name: str,
+    scenes: int = 20,
+    characters: int = 3,
+    seconds_per_scene: float = 5.0,
+    with_images: bool = True,
+    image_bytes: Optional[bytes] = None
+) -> Dict[str, Path]:
+    """
+    Tạo project giống output của make_srt + make_prompts.
+
+    Args:
+        root: Thư mục chứa project
+        name: Tên project (= tên voice)
+        scenes: Số scene
+        characters: Số ảnh tham chiếu (nvc, nv1...)
+        seconds_per_scene: Độ dài mỗi scene
+        with_images: Tạo sẵn img/*.png, nv/*.png (+ media_id) như đã chạy xong bước ảnh
+        image_bytes: PNG dùng cho ảnh (None = tự tạo)
+
+    Returns:
+        Dict paths: project, voice, srt, excel
+    """
+    proj_dir = Path(root) / name
+    for d in ["srt", "prompts", "nv", "img"]:
+        (proj_dir / d).mkdir(parents=True, exist_ok=True)
+
+    voice = write_wav(proj_dir / f"{name}.wav", scenes * seconds_per_scene)
+    srt = write_srt(proj_dir / "srt" / f"{name}.srt", scenes, seconds_per_scene)
+
+    excel = proj_dir / "prompts" / f"{name}_prompts.xlsx"
+    if excel.exists():
+        excel.unlink()
+    workbook = PromptWorkbook(excel).load_or_create()
+
+    char_ids = ["nvc"] + [f"nv{i}" for i in range(1, characters)]
+    for i, cid in enumerate(char_ids[:characters]):
+        workbook.add_character(Character(
+            id=cid,
+            role="main" if i == 0 else "supporting",
+            name=f"Character {i}",
+            english_prompt=f"portrait of character {i}, white background, benchmark",
+            image_file=f"{cid}.png",
+            status="done" if with_images else "pending",
+            media_id=f"media-{cid}" if with_images else "",
+        ))
+
+    for i in range(scenes):
+        start = i * seconds_per_scene
+        refs = [f"{cid}.png" for cid in char_ids[:characters][: 1 + i % 2]]
+        workbook.add_scene(Scene(
+            scene_id=i + 1,
+            srt_start=_srt_time(start),
+            srt_end=_srt_time(start + seconds_per_scene),
+            duration=seconds_per_scene,
+            srt_text=f"Benchmark sentence number {i + 1} of the synthetic story.",
+            img_prompt=f"cinematic shot {i + 1}, character in a quiet village, golden hour",
+            video_prompt=f"slow camera push-in, scene {i + 1}",
+            status_img="done" if with_images else "pending",
+            reference_files=json.dumps(refs),
+        ))
+    workbook.save()
+
+    if with_images:
+        data = image_bytes or make_png()
+        for cid in char_ids[:characters]:
+            (proj_dir / "nv" / f"{cid}.png").write_bytes(data)
+        for i in range(scenes):
+            (proj_dir / "img" / f"{i + 1}.png").write_bytes(data)
+
+    return {"project": proj_dir, "voice": voice, "srt": srt, "excel": excel}
+
+
+def scene_prompts(count: int, prefix: str = "") -> List[Dict[str, Any]]:
+    """Prompt dicts (id/prompt) như _load_prompts trả về."""
+    return [
+        {"id": f"{prefix}{i + 1}", "prompt": f"cinematic shot {i + 1}, benchmark scene"}
+        for i in range(count)
+    ]
+
+
+def prompt_post_inputs(count: int, seed: int = 7) -> Dict[str, Any]:
+    """
+    Output AI giả cho bước hậu xử lý prompt: characters/locations của project
+    + mỗi scene (img_prompt, video_prompt, srt_text, reference_files).
+
+    Một phần scene cố ý có lỗi hay gặp: location mâu thuẫn với hành động,
+    lời dẫn bị chép vào prompt, nhân vật trẻ em trong reference_files.
+    """
+    import random
+    from modules.excel_manager import Location
+
+    rnd = random.Random(seed)
+    characters = [
+        Character(id="nvc", role="main", character_lock="a 35-year-old woman with long black hair, green dress"),
+        Character(id="nv1", character_lock="an elderly man with a grey beard, brown coat"),
+        Character(id="nv2", character_lock="a tall young man in a navy suit, short hair"),
+        Character(id="nvc1", character_lock="8-year-old girl with pigtails, yellow raincoat", is_child=True),
+    ]
+    locations = [
+        Location(id="loc_home", location_lock="cozy suburban living room, beige sofa, warm lamps"),
+        Location(id="loc_hospital", location_lock="long hospital corridor, fluorescent lights"),
+        Location(id="loc_street", location_lock="rainy city street at night, neon reflections"),
+    ]
+    subjects = [c.character_lock for c in characters[:3]] + ["a figure"]
+    actions = ["standing by the window", "lying in bed staring at the ceiling", "cooking dinner",
+               "walking slowly", "sitting at the table", "looking into the mirror", "driving alone"]
+    places = [l.location_lock for l in locations] + ["in the hallway", "in a quiet office", "in the park"]
+    styles = ["cinematic lighting, 35mm film grain, shallow depth of field",
+              "golden hour, soft shadows, photorealistic, highly detailed",
+              "moody blue tones, dramatic contrast, wide shot"]
+    narration = ["I remember the night she left us alone in that house",
+                 "By the time I was 12 years old we had moved three times",
+                 "She told me that nothing would ever be the same again",
+                 "My father never said a word about the letter he found"]
+
+    scenes = []
+    for i in range(count):
+        srt_text = rnd.choice(narration)
+        img = f"{rnd.choice(subjects)} {rnd.choice(actions)}, {rnd.choice(places)}, {rnd.choice(styles)}"
+        if i % 7 == 0:
+            img += f'. "{srt_text}"'
+        refs = [f"{c.id}.png" for c in rnd.sample(characters, rnd.randint(1, 3))]
+        refs.append(f"{rnd.choice(locations).id}.png")
+        scenes.append({
+            "img_prompt": img,
+            "video_prompt": f"slow push-in, {img}",
+            "srt_text": srt_text,
+            "reference_files": refs,
+        })
+    return {"characters": characters, "locations": locations, "scenes": scenes}
+
+
+# =============================================================================
+# FFMPEG STAND-IN
+# =============================================================================
+
+_FAKE_TOOL = r'''#!{python}
+"""FFmpeg/FFprobe stand-in (benchmark). Sinh file output, sleep theo -t / speed."""
+import os, sys, time, json, wave
+
+tool = os.path.basename(sys.argv[0]).lower()
+argv = sys.argv[1:]
+start = time.time()
+
+if tool.startswith("ffprobe"):
+    path = argv[-1] if argv else ""
+    duration = 8.0
+    if path.lower().endswith(".wav"):
+        with wave.open(path, "rb") as w:
+            duration = w.getnframes() / float(w.getframerate())
+    if "json" in argv:
+        print(json.dumps({{"format": {{"duration": f"{{duration:.3f}}"}}, "streams": []}}))
+    else:
+        print(f"{{duration:.3f}}")
+    kind = "probe"
+elif "-version" in argv:
+    print("ffmpeg version benchmark-stand-in")
+    kind = "version"
+elif "-encoders" in argv:
+    print(" V....D libx264              libx264 H.264 (stand-in)")
+    kind = "encoders"
+else:
+    speed = float(os.environ.get("VE3_BENCH_FFMPEG_SPEED", "50"))
+    pass_s = float(os.environ.get("VE3_BENCH_FFMPEG_PASS_S", "0.05"))
+    duration = float(argv[argv.index("-t") + 1]) if "-t" in argv else 0.0
+    time.sleep(pass_s + duration / max(speed, 1e-6))
+    with open(argv[-1], "wb") as f:
+        f.write(b"\x00" * 1024)
+    kind = "clip" if "-t" in argv else ("concat" if "concat" in argv else "pass")
+
+log_path = os.environ.get("VE3_BENCH_FFMPEG_LOG")
+if log_path:
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({{"tool": tool, "kind": kind, "wall_s": time.time() - start}}) + "\n")
+'''
+
+
+def install_fake_ffmpeg(bin_dir: Path, speed: float = 50.0, pass_s: float = 0.05,
+                        log_path: Optional[Path] = None) -> Path:
+    """
+    Ghi ffmpeg/ffprobe stand-in vào bin_dir và đưa lên đầu PATH.
+
+    Chỉ dùng được trên POSIX (subprocess Windows không chạy script không đuôi .exe).
+
+    Args:
+        bin_dir: Thư mục chứa script
+        speed: Clip ảnh dài D giây mất D/speed giây "encode"
+        pass_s: Thời gian cố định mỗi lần gọi ffmpeg
+        log_path: File JSONL ghi mỗi lần gọi (kind + wall_s)
+
+    Returns:
+        bin_dir
+    """
+    if sys.platform == "win32":
+        raise RuntimeError("FFmpeg stand-in chỉ hỗ trợ POSIX - dùng --real-ffmpeg trên Windows")
+
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    script = _FAKE_TOOL.format(python=sys.executable)
+    for name in ("ffmpeg", "ffprobe"):
+        path = bin_dir / name
+        path.write_text(script, encoding="utf-8")
+        path.chmod(0o755)
+
+    os.environ["PATH"] = str(bin_dir) + os.pathsep + os.environ.get("PATH", "")
+    os.environ["VE3_BENCH_FFMPEG_SPEED"] = str(speed)
+    os.environ["VE3_BENCH_FFMPEG_PASS_S"] = str(pass_s)
+    if log_path:
+        os.environ["VE3_BENCH_FFMPEG_LOG"] = str(log_path)
+    return bin_dir
@@ -0,0 +1,443 @@
+"""
+VE3 Tool - Mock Servers cho benchmark
+=====================================
+HTTP server local thay cho Google Flow và DeepSeek/Ollama.
+
+MockFlowServer (thay BASE_URL của GoogleFlowAPI):
+- POST /v1/projects/<pid>/flowMedia:batchGenerateImages  → media[].image.generatedImage
+- POST /v1/projects/<pid>/flowMedia:uploadImage           → {"name": ...}
+- POST /v1/video:batchAsyncGenerateVideoText / ...ReferenceImages → operations[]
+- POST /v1/video:batchCheckAsyncVideoGenerationStatus     → PENDING cho tới khi đủ video_latency
+- GET  /media/<name>.png|.mp4                             → bytes (fifeUrl), hỗ trợ Range
+
+FakeLLMServer:
+- POST /v1/chat/completions   (DeepSeek/OpenAI format)
+- POST /api/generate          (Ollama, stream=false; prompt rỗng = load model)
+- POST /api/chat              (Ollama native chat, stream=false)
+- GET  /api/tags
+
+Latency = base + jitter (+ output tokens / tokens_per_s cho LLM).
+Số request xử lý đồng thời giới hạn bởi `slots` (giống GPU/quota thật).
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import random
+import base64
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List
+
+
+class _MockServer:
+    """Base: ThreadingHTTPServer chạy trong daemon thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, slots: int = 0):
+        """
+        Args:
+            host: Địa chỉ bind
+            port: Port (0 = tự chọn)
+            slots: Số request xử lý đồng thời tối đa (0 = không giới hạn)
+        """
+        self.host = host
+        self.port = port
+        self._slots = threading.BoundedSemaphore(slots) if slots > 0 else None
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._lock = threading.Lock()
+        self.request_counts: Dict[str, int] = {}
+        self.connections = 0  # TCP connections đã nhận (đo keep-alive phía client)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "_MockServer":
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_GET(self):
+                server._dispatch(self, "GET")
+
+            def do_POST(self):
+                server._dispatch(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        threading.Thread(
+            target=self._httpd.serve_forever, name=type(self).__name__, daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # =========================================================================
+    # REQUEST HANDLING
+    # =========================================================================
+
+    def _dispatch(self, handler: BaseHTTPRequestHandler, method: str):
+        path = handler.path.split("?", 1)[0]
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw = handler.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+
+        with self._lock:
+            key = f"{method} {self._route_name(path)}"
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            status, headers, payload = self.handle(method, path, body, handler)
+        except Exception as e:
+            status, headers, payload = 500, {}, {"error": {"message": str(e)}}
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+        if isinstance(payload, (dict, list)):
+            data = json.dumps(payload).encode("utf-8")
+            headers.setdefault("Content-Type", "application/json")
+        else:
+            data = payload or b""
+        handler.send_response(status)
+        for k, v in headers.items():
+            handler.send_header(k, v)
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _route_name(self, path: str) -> str:
+        return path
+
+    def handle(self, method: str, path: str, body: Dict[str, Any],
+               handler: BaseHTTPRequestHandler):
+        """Trả về (status, headers, payload dict hoặc bytes)."""
+        return 404, {}, {"error": {"message": f"Not found: {path}"}}
+
+    @staticmethod
+    def _sleep(base: float, jitter: float):
+        delay = base + (random.uniform(0, jitter) if jitter > 0 else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+
+# =============================================================================
+# GOOGLE FLOW
+# =============================================================================
+
+class MockFlowServer(_MockServer):
+    """Giả lập Flow API (ảnh, upload, video async) + storage cho fifeUrl."""
+
+    def __init__(
+        self,
+        image_bytes: bytes,
+        video_bytes: bytes,
+        image_latency: float = 0.5,
+        upload_latency: float = 0.2,
+        video_latency: float = 3.0,
+        status_latency: float = 0.02,
+        jitter: float = 0.1,
+        inline_base64: bool = False,
+        slots: int = 0,
+        **kwargs
+    ):
+        """
+        Args:
+            image_bytes: PNG trả về cho mỗi ảnh
+            video_bytes: MP4 trả về cho mỗi video
+            image_latency: Thời gian tạo 1 request ảnh (giây)
+            upload_latency: Thời gian upload reference
+            video_latency: Thời gian từ lúc tạo operation tới SUCCESSFUL
+            status_latency: Thời gian mỗi lần poll status
+            jitter: Random thêm 0..jitter giây mỗi request
+            inline_base64: Trả encodedImage (base64) thay vì chỉ fifeUrl
+            slots: Số request xử lý đồng thời (0 = không giới hạn)
+        """
+        super().__init__(slots=slots, **kwargs)
+        self.image_bytes = image_bytes
+        self.video_bytes = video_bytes
+        self.image_latency = image_latency
+        self.upload_latency = upload_latency
+        self.video_latency = video_latency
+        self.status_latency = status_latency
+        self.jitter = jitter
+        self.inline_base64 = inline_base64
+        self._operations: Dict[str, float] = {}
+        self._image_b64 = base64.b64encode(image_bytes).decode("ascii")
+
+    def _route_name(self, path: str) -> str:
+        if path.startswith("/media/"):
+            return "/media/*"
+        if path.startswith("/v1/projects/"):
+            return "/v1/projects/*/" + path.rsplit("/", 1)[-1]
+        return path
+
+    def handle(self, method, path, body, handler):
+        if method == "GET" and path.startswith("/media/"):
+            return self._serve_media(path, handler)
+
+        if path.endswith("flowMedia:batchGenerateImages"):
+            return self._generate_images(body)
+        if path.endswith("flowMedia:uploadImage"):
+            self._sleep(self.upload_latency, self.jitter)
+            return 200, {}, {"name": f"upload-{uuid.uuid4().hex}"}
+        if path.startswith("/v1/video:batchAsyncGenerateVideo"):
+            return self._generate_videos(body)
+        if path == "/v1/video:batchCheckAsyncVideoGenerationStatus":
+            return self._video_status(body)
+
+        return super().handle(method, path, body, handler)
+
+    def _generate_images(self, body):
+        self._sleep(self.image_latency, self.jitter)
+        media = []
+        for req in body.get("requests", [{}]):
+            name = f"img-{uuid.uuid4().hex}"
+            generated = {
+                "fifeUrl": f"{self.url}/media/{name}.png",
+                "mediaGenerationId": name,
+                "seed": req.get("seed", 0),
+                "prompt": req.get("prompt", ""),
+                "aspectRatio": req.get("imageAspectRatio", ""),
+            }
+            if self.inline_base64:
+                generated["encodedImage"] = self._image_b64
+            media.append({
+                "name": name,
+                "workflowId": f"wf-{name}",
+                "image": {"generatedImage": generated},
+            })
+        return 200, {}, {"media": media}
+
+    def _generate_videos(self, body):
+        self._sleep(self.upload_latency, self.jitter)
+        operations = []
+        with self._lock:
+            for req in body.get("requests", [{}]):
+                op_name = f"op-{uuid.uuid4().hex}"
+                self._operations[op_name] = time.time() + self.video_latency
+                operations.append({
+                    "operation": {"name": op_name},
+                    "sceneId": req.get("metadata", {}).get("sceneId", ""),
+                    "status": "MEDIA_GENERATION_STATUS_PENDING",
+                })
+        # "name" ở top-level để _parse_video_response lấy được operation_id
+        return 200, {}, {"operations": operations, "name": operations[0]["operation"]["name"]}
+
+    def _video_status(self, body):
+        self._sleep(self.status_latency, 0)
+        names = list(body.get("operationNames", []))
+        for op in body.get("operations", []):
+            names.append(op.get("operation", {}).get("name", ""))
+
+        now = time.time()
+        result = []
+        for name in names:
+            with self._lock:
+                ready_at = self._operations.get(name)
+            if ready_at is None:
+                result.append({"operation": {"name": name}, "status": "MEDIA_GENERATION_STATUS_FAILED"})
+            elif now < ready_at:
+                result.append({"operation": {"name": name}, "status": "MEDIA_GENERATION_STATUS_PENDING"})
+            else:
+                video_url = f"{self.url}/media/{name}.mp4"
+                result.append({
+                    "operation": {"name": name, "metadata": {"video": {"fifeUrl": video_url}}},
+                    "status": "MEDIA_GENERATION_STATUS_SUCCESSFUL",
+                    "media": [{"video": {"url": video_url}}],
+                })
+        return 200, {}, {"operations": result}
+
+    def _serve_media(self, path, handler):
+        data = self.video_bytes if path.endswith(".mp4") else self.image_bytes
+        content_type = "video/mp4" if path.endswith(".mp4") else "image/png"
+        range_header = handler.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            start = int(range_header[6:].split("-", 1)[0] or 0)
+            if start >= len(data):
+                return 416, {"Content-Range": f"bytes */{len(data)}"}, b""
+            return 206, {
+                "Content-Type": content_type,
+                "Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}",
+            }, data[start:]
+        return 200, {"Content-Type": content_type}, data
+
+
+# =============================================================================
+# LLM (DeepSeek / Ollama)
+# =============================================================================
+
+class FakeLLMServer(_MockServer):
+    """Giả lập DeepSeek chat completions + Ollama generate."""
+
+    def __init__(
+        self,
+        base_latency: float = 0.3,
+        tokens_per_s: float = 400.0,
+        output_tokens: int = 300,
+        jitter: float = 0.1,
+        slots: int = 4,
+        model_load_s: float = 0.0,
+        tail_prob: float = 0.0,
+        tail_latency: float = 0.0,
+        **kwargs
+    ):
+        """
+        Args:
+            base_latency: Time-to-first-token (giây)
+            tokens_per_s: Tốc độ sinh token (mỗi request)
+            output_tokens: Số token output mỗi response (≈ 4 ký tự/token)
+            jitter: Random thêm 0..jitter giây
+            slots: Số request song song (như OLLAMA_NUM_PARALLEL / quota)
+            model_load_s: Ollama load model (lần đầu / đổi num_ctx)
+            tail_prob: Xác suất 1 request bị chậm bất thường (tail latency)
+            tail_latency: Số giây chậm thêm của request đó
+        """
+        super().__init__(slots=slots, **kwargs)
+        self.base_latency = base_latency
+        self.tokens_per_s = tokens_per_s
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+        self.model_load_s = model_load_s
+        self.tail_prob = tail_prob
+        self.tail_latency = tail_latency
+        self._ollama_ctx = 0  # num_ctx model đang load (0 = chưa load)
+        self._ollama_load_lock = threading.Lock()
+        # Prefix cache giả lập: DeepSeek cache theo đơn vị 64 token trên các prompt
+        # đã gửi; Ollama chỉ dùng lại KV của prompt ngay trước (1 slot)
+        self._seen_prompts: List[str] = []
+        self._last_ollama_prompt = ""
+
+    def _deepseek_cache_hit(self, prompt: str) -> int:
+        """Số ký tự prefix trúng cache (làm tròn xuống 64 token ≈ 256 ký tự)."""
+        with self._lock:
+            hit = max((len(os.path.commonprefix([prompt, seen])) for seen in self._seen_prompts), default=0)
+            self._seen_prompts.append(prompt)
+            del self._seen_prompts[:-64]
+        return hit - hit % 256
+
+    def _ollama_load(self, num_ctx: int) -> float:
+        """Load model nếu chưa load / num_ctx khác model đang load → số giây load."""
+        with self._ollama_load_lock:
+            if num_ctx == self._ollama_ctx:
+                return 0.0
+            self._sleep(self.model_load_s, 0)
+            self._ollama_ctx = num_ctx
+            return self.model_load_s
+
+    # Dòng scene trong pacing_script của generate_scenes: '12. [Medium shot] "..."'
+    SCENE_LINE_RE = re.compile(r'^(\d+)\. \[[^\]]*\] "', re.MULTILINE)
+
+    def _completion(self, prompt: str, max_tokens: int, json_mode: bool = False) -> str:
+        tokens = min(self.output_tokens, max_tokens or self.output_tokens)
+        tail = self.tail_latency if self.tail_prob and random.random() < self.tail_prob else 0.0
+        self._sleep(self.base_latency + tail + tokens / max(self.tokens_per_s, 1e-6), self.jitter)
+        filler = ("lorem ipsum " * (tokens // 2 + 1))[:tokens * 4]
+        if json_mode or "json" in prompt.lower():
+            scene_ids = [int(sid) for sid in self.SCENE_LINE_RE.findall(prompt)]
+            if scene_ids:
+                return json.dumps({"scenes": self._scene_prompts(scene_ids, filler)})
+            return json.dumps({"ok": True, "text": filler})
+        return filler
+
+    @staticmethod
+    def _scene_prompts(scene_ids: List[int], filler: str) -> List[Dict[str, Any]]:
+        """Body scene prompts hợp lệ (SCENE_PROMPTS_SCHEMA) cho các scene trong prompt."""
+        part = max(8, len(filler) // (2 * len(scene_ids)))
+        return [{
+            "scene_id": sid,
+            "characters_used": [],
+            "location_used": "",
+            "reference_files": [],
+            "img_prompt": f"Scene {sid}, {filler[:part]}",
+            "video_prompt": f"Scene {sid} camera move, {filler[:part]}",
+        } for sid in scene_ids]
+
+    def handle(self, method, path, body, handler):
+        if method == "GET" and path == "/api/tags":
+            return 200, {}, {"models": [{"name": "bench:latest"}]}
+
+        if path == "/v1/chat/completions":
+            messages = body.get("messages", [])
+            prompt = messages[-1].get("content", "") if messages else ""
+            full_prompt = "".join(m.get("content", "") for m in messages)
+            hit_chars = self._deepseek_cache_hit(full_prompt)
+            content = self._completion(prompt, body.get("max_tokens", 0), json_mode="response_format" in body)
+            return 200, {}, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "model": body.get("model", "deepseek-chat"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": len(full_prompt) // 4,
+                    "prompt_cache_hit_tokens": hit_chars // 4,
+                    "prompt_cache_miss_tokens": len(full_prompt) // 4 - hit_chars // 4,
+                    "completion_tokens": len(content) // 4,
+                },
+            }
+
+        if path in ("/api/generate", "/api/chat"):
+            if path == "/api/chat":
+                prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+            else:
+                prompt = body.get("prompt", "")
+            options = body.get("options", {})
+            start = time.time()
+            load_s = self._ollama_load(options.get("num_ctx") or 2048)
+            if not prompt:
+                # Prompt rỗng = chỉ load model (warm-up)
+                return 200, {}, {"model": body.get("model", ""), "response": "", "done": True,
+                                 "done_reason": "load", "load_duration": int(load_s * 1e9)}
+            with self._lock:
+                reused = len(os.path.commonprefix([prompt, self._last_ollama_prompt]))
+                self._last_ollama_prompt = prompt
+            eval_start = time.time()
+            # format (JSON mode / schema) → luôn trả JSON
+            content = self._completion(prompt, options.get("num_predict", 0), json_mode="format" in body)
+            result = {
+                "model": body.get("model", ""),
+                "done": True,
+                "prompt_eval_count": max(1, (len(prompt) - reused) // 4),
+                "eval_count": len(content) // 4,
+                "eval_duration": int((time.time() - eval_start) * 1e9),
+                "load_duration": int(load_s * 1e9),
+                "total_duration": int((time.time() - start) * 1e9),
+            }
+            if path == "/api/chat":
+                result["message"] = {"role": "assistant", "content": content}
+            else:
+                result["response"] = content
+            return 200, {}, result
+
+        return super().handle(method, path, body, handler)
@@ -0,0 +1,250 @@
+"""
+VE3 Tool - Offline Benchmark Runner
+===================================
+Chạy các stage của pipeline trên mock Flow/LLM server + FFmpeg stand-in,
+in bảng items/giây + p50/p95/p99 và (tuỳ chọn) ghi JSON để so sánh giữa
+các lần tối ưu.
+
+Usage:
+    python -m benchmarks.run_benchmark
+    python -m benchmarks.run_benchmark --stages llm,flow_video --llm-latency 1.0
+    python -m benchmarks.run_benchmark --real-ffmpeg --json bench.json
+    python -m benchmarks.run_benchmark --stages whisper --whisper-audio voice.mp3 --whisper-models base,small
+"""
+
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import platform
+from pathlib import Path
+from datetime import datetime
+
+# Cho phép chạy trực tiếp: python benchmarks/run_benchmark.py
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from benchmarks import stages
+from benchmarks.fixtures import make_png, make_fake_mp4, install_fake_ffmpeg
+from benchmarks.mock_servers import MockFlowServer, FakeLLMServer
+
+
+ALL_STAGES = ["llm", "flow_video", "round_robin", "parallel_flow", "prompt_rules",
+              "prompt_cache", "scene_reuse", "whisper", "compose", "draft", "engine"]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="VE3 offline benchmark (mock Flow/LLM/FFmpeg)")
+    parser.add_argument("--stages", default=",".join(ALL_STAGES),
+                        help=f"Các stage cần chạy, phân cách bằng dấu phẩy ({','.join(ALL_STAGES)})")
+    parser.add_argument("--json", dest="json_path", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--work-dir", help="Thư mục tạm (mặc định: tự tạo và xoá)")
+
+    llm = parser.add_argument_group("LLM")
+    llm.add_argument("--llm-provider", choices=["deepseek", "ollama", "both"], default="both")
+    llm.add_argument("--llm-requests", type=int, default=24)
+    llm.add_argument("--llm-concurrency", type=int, default=4)
+    llm.add_argument("--llm-latency", type=float, default=0.3, help="Time-to-first-token (giây)")
+    llm.add_argument("--llm-tokens-per-s", type=float, default=400.0)
+    llm.add_argument("--llm-output-tokens", type=int, default=300)
+    llm.add_argument("--llm-slots", type=int, default=4, help="Request song song phía server")
+    llm.add_argument("--llm-model-load", type=float, default=0.0,
+                     help="Ollama: giây load model (lần đầu / đổi num_ctx)")
+    llm.add_argument("--llm-tail-prob", type=float, default=0.0, help="Xác suất 1 request chậm bất thường")
+    llm.add_argument("--llm-tail-latency", type=float, default=0.0, help="Giây chậm thêm của request đó")
+    llm.add_argument("--llm-hedge", action="store_true",
+                     help="Chạy thêm DeepSeek có hedging (2 key + Ollama dự phòng)")
+    llm.add_argument("--llm-async", action="store_true",
+                     help="Chạy thêm agenerate_many trên 1 event loop để so với thread pool")
+
+    flow = parser.add_argument_group("Flow")
+    flow.add_argument("--image-latency", type=float, default=0.3)
+    flow.add_argument("--upload-latency", type=float, default=0.1)
+    flow.add_argument("--video-latency", type=float, default=2.0)
+    flow.add_argument("--flow-jitter", type=float, default=0.1)
+    flow.add_argument("--flow-slots", type=int, default=0)
+    flow.add_argument("--inline-base64", action="store_true", help="Trả encodedImage thay vì chỉ fifeUrl")
+    flow.add_argument("--video-kb", type=int, default=2048)
+    flow.add_argument("--videos", type=int, default=8)
+    flow.add_argument("--video-concurrency", type=int, default=4)
+    flow.add_argument("--poll-interval", type=float, default=0.5)
+
+    sched = parser.add_argument_group("Scheduling")
+    sched.add_argument("--voices", type=int, default=3)
+    sched.add_argument("--images-per-voice", type=int, default=5)
+    sched.add_argument("--browsers", type=int, default=3)
+    sched.add_argument("--browser-start", type=float, default=0.5, help="Thời gian giả lập mở Chrome")
+    sched.add_argument("--characters", type=int, default=3)
+    sched.add_argument("--scenes", type=int, default=12)
+
+    prompts = parser.add_argument_group("Prompts")
+    prompts.add_argument("--prompt-scenes", type=int, default=5000,
+                         help="Số scene cho micro-benchmark hậu xử lý prompt")
+    prompts.add_argument("--cache-scenes", type=int, default=120,
+                         help="Số scene cho benchmark prefix cache (prompt_cache)")
+    prompts.add_argument("--reuse-threshold", type=float, default=0.82,
+                         help="Ngưỡng cosine của semantic cache (scene_reuse, số scene = --cache-scenes)")
+
+    voice = parser.add_argument_group("Whisper")
+    voice.add_argument("--whisper-audio", help="File voice thật cho stage whisper (không có = bỏ qua stage)")
+    voice.add_argument("--whisper-backends", default="faster_whisper,whisper_timestamped,whisper",
+                       help="Backend so sánh (chỉ chạy backend đã cài)")
+    voice.add_argument("--whisper-models", default="tiny,base,small")
+    voice.add_argument("--whisper-language", default="vi")
+    voice.add_argument("--whisper-compute-type", default="int8", help="faster_whisper compute_type")
+
+    compose = parser.add_argument_group("Compose")
+    compose.add_argument("--compose-scenes", type=int, default=20)
+    compose.add_argument("--seconds-per-scene", type=float, default=5.0)
+    compose.add_argument("--real-ffmpeg", action="store_true", help="Dùng FFmpeg thật trong PATH")
+    compose.add_argument("--ffmpeg-speed", type=float, default=50.0,
+                         help="Stand-in: clip D giây encode mất D/speed giây")
+    compose.add_argument("--ffmpeg-pass", type=float, default=0.05,
+                         help="Stand-in: chi phí cố định mỗi lần gọi ffmpeg")
+    return parser.parse_args(argv)
+
+
+def print_table(results):
+    header = f"{'stage':<16}{'items':>7}{'fail':>6}{'wall_s':>9}{'items/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}"
+    print("\n" + header)
+    print("-" * len(header))
+    for r in results:
+        d = r.to_dict()
+        print(f"{d['stage']:<16}{d['items']:>7}{d['failed']:>6}{d['wall_s']:>9.2f}"
+              f"{d['items_per_s']:>9.2f}{d['p50_s']:>8.3f}{d['p95_s']:>8.3f}"
+              f"{d['p99_s']:>8.3f}{d['max_s']:>8.3f}")
+        for key in ("stages_s", "ffmpeg_calls", "cold_s", "incremental_s", "per_scene_us", "connections",
+                    "cache_hit", "tokens_per_s", "cold_loads", "hedges", "rtf", "load_s"):
+            if key in d:
+                print(f"{'':<16}{key}: {d[key]}")
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    selected = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in selected if s not in ALL_STAGES]
+    if unknown:
+        print(f"Stage không hợp lệ: {unknown}")
+        return 2
+
+    owns_work_dir = not args.work_dir
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="ve3_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    if "whisper" in selected and not (args.whisper_audio and Path(args.whisper_audio).exists()):
+        print("Stage whisper cần --whisper-audio (file voice thật) - bỏ qua whisper")
+        selected = [s for s in selected if s != "whisper"]
+
+    ffmpeg_log = None
+    if {"compose", "draft", "engine"} & set(selected):
+        if args.real_ffmpeg:
+            if not shutil.which("ffmpeg"):
+                print("Không tìm thấy ffmpeg trong PATH - bỏ qua compose/draft/engine")
+                selected = [s for s in selected if s not in ("compose", "draft", "engine")]
+        else:
+            ffmpeg_log = work_dir / "ffmpeg_calls.jsonl"
+            install_fake_ffmpeg(work_dir / "bin", speed=args.ffmpeg_speed,
+                                pass_s=args.ffmpeg_pass, log_path=ffmpeg_log)
+
+    image_bytes = make_png()
+    flow = MockFlowServer(
+        image_bytes=image_bytes,
+        video_bytes=make_fake_mp4(args.video_kb),
+        image_latency=args.image_latency,
+        upload_latency=args.upload_latency,
+        video_latency=args.video_latency,
+        jitter=args.flow_jitter,
+        inline_base64=args.inline_base64,
+        slots=args.flow_slots,
+    )
+    llm = FakeLLMServer(
+        base_latency=args.llm_latency,
+        tokens_per_s=args.llm_tokens_per_s,
+        output_tokens=args.llm_output_tokens,
+        slots=args.llm_slots,
+        model_load_s=args.llm_model_load,
+        tail_prob=args.llm_tail_prob,
+        tail_latency=args.llm_tail_latency,
+    )
+
+    results = []
+    try:
+        with flow, llm:
+            for stage in selected:
+                print(f"[BENCH] {stage}...")
+                if stage == "llm":
+                    providers = ["deepseek", "ollama"] if args.llm_provider == "both" else [args.llm_provider]
+                    for provider in providers:
+                        results.append(stages.bench_llm(
+                            llm.url, args.llm_requests, args.llm_concurrency, provider,
+                            connections=lambda: llm.connections))
+                        if args.llm_async:
+                            results.append(stages.bench_llm(
+                                llm.url, args.llm_requests, args.llm_concurrency, provider,
+                                use_async=True, connections=lambda: llm.connections))
+                        if args.llm_hedge and provider == "deepseek":
+                            results.append(stages.bench_llm(
+                                llm.url, args.llm_requests, args.llm_concurrency, provider,
+                                use_async=args.llm_async, connections=lambda: llm.connections,
+                                hedging=True))
+                elif stage == "flow_video":
+                    results.append(stages.bench_flow_video(
+                        flow.url, work_dir, args.videos, args.video_concurrency, args.poll_interval))
+                elif stage == "round_robin":
+                    results.append(stages.bench_round_robin(
+                        flow.url, work_dir, args.voices, args.images_per_voice))
+                elif stage == "parallel_flow":
+                    results.append(stages.bench_parallel_flow(
+                        flow.url, work_dir, args.scenes, args.characters,
+                        args.browsers, args.browser_start))
+                elif stage == "prompt_rules":
+                    results.append(stages.bench_prompt_rules(args.prompt_scenes))
+                elif stage == "prompt_cache":
+                    providers = ["deepseek", "ollama"] if args.llm_provider == "both" else [args.llm_provider]
+                    for provider in providers:
+                        results.append(stages.bench_prompt_cache(llm.url, args.cache_scenes, provider))
+                elif stage == "scene_reuse":
+                    results.append(stages.bench_scene_reuse(args.cache_scenes, args.reuse_threshold))
+                elif stage == "whisper":
+                    results.append(stages.bench_whisper(
+                        Path(args.whisper_audio), work_dir,
+                        [b.strip() for b in args.whisper_backends.split(",") if b.strip()],
+                        [m.strip() for m in args.whisper_models.split(",") if m.strip()],
+                        language=args.whisper_language or None,
+                        compute_type=args.whisper_compute_type))
+                elif stage == "compose":
+                    results.append(stages.bench_compose(
+                        work_dir, args.compose_scenes, args.seconds_per_scene, ffmpeg_log))
+                elif stage == "draft":
+                    results.append(stages.bench_draft(
+                        work_dir, args.compose_scenes, args.seconds_per_scene, ffmpeg_log))
+                elif stage == "engine":
+                    results.append(stages.bench_engine_run(
+                        work_dir, args.compose_scenes, args.seconds_per_scene, ffmpeg_log))
+            flow_requests = dict(flow.request_counts)
+            llm_requests = dict(llm.request_counts)
+    finally:
+        if owns_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(results)
+
+    if args.json_path:
+        report = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+            "results": [r.to_dict() for r in results],
+            "server_requests": {"flow": flow_requests, "llm": llm_requests},
+        }
+        Path(args.json_path).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nJSON: {args.json_path}")
+
+    return 0 if all(r.failed == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
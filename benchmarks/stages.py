@@ -0,0 +1,786 @@
+"""
+VE3 Tool - Benchmark Stages
+===========================
+Mỗi stage chạy code thật của pipeline trên mock server / input giả và
+trả về StageResult (items/giây + p50/p95/p99 latency mỗi item).
+
+Stages:
+- llm:          MultiAIClient.generate_content (DeepSeek/Ollama) → FakeLLMServer
+                (--llm-async: agenerate_many trên 1 event loop)
+- flow_video:   GoogleFlowAPI.generate_video + poll + download_video → MockFlowServer
+- round_robin:  RoundRobinCoordinator (run_round_robin) nhiều voice → MockFlowServer
+- parallel_flow: ParallelFlowGenerator.generate_parallel với browser stand-in
+- prompt_rules: hậu xử lý prompt (location/lời dẫn/annotation) trên N scene
+- prompt_cache: PromptGenerator._generate_scene_prompts nhiều batch → tỉ lệ token
+                prompt trúng prefix cache (DeepSeek / Ollama giả lập)
+- scene_reuse:  semantic cache scene prompts → tỉ lệ scene dùng lại prompt giữa 2 project
+- whisper:      VoiceToSrt.transcribe voice thật với từng backend × model → real-time factor
+- draft: bản xem trước 480p (lần đầu + lần 2 incremental)
+- compose:      SmartEngine._compose_video (FFmpeg stand-in hoặc thật)
+- engine:       SmartEngine.run trên project đã có ảnh (resume → export → compose)
+"""
+
+import re
+import json
+import time
+import shutil
+import asyncio
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Callable
+
+from modules.google_flow_api import GoogleFlowAPI, ImageInput
+from benchmarks.fixtures import build_project, scene_prompts
+
+
+BENCH_TOKEN = "ya29.benchmark-token"
+
+
+@dataclass
+class StageResult:
+    """Kết quả một stage."""
+    name: str
+    items: int = 0
+    failed: int = 0
+    wall_s: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stage": self.name,
+            "items": self.items,
+            "failed": self.failed,
+            "wall_s": round(self.wall_s, 3),
+            "items_per_s": round(self.items / self.wall_s, 3) if self.wall_s > 0 else 0.0,
+            "p50_s": round(self.percentile(0.50), 4),
+            "p95_s": round(self.percentile(0.95), 4),
+            "p99_s": round(self.percentile(0.99), 4),
+            "max_s": round(max(self.latencies), 4) if self.latencies else 0.0,
+            **self.extra,
+        }
+
+
+def _run_items(name: str, items: List[Any], worker: Callable[[Any], bool],
+               concurrency: int) -> StageResult:
+    """Chạy worker(item) song song, đo latency từng item."""
+    result = StageResult(name=name)
+    lock = threading.Lock()
+
+    def timed(item):
+        start = time.time()
+        try:
+            ok = bool(worker(item))
+        except Exception:
+            ok = False
+        elapsed = time.time() - start
+        with lock:
+            result.latencies.append(elapsed)
+            result.items += 1
+            if not ok:
+                result.failed += 1
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        list(executor.map(timed, items))
+    result.wall_s = time.time() - start
+    return result
+
+
+def _flow_client(flow_url: str) -> GoogleFlowAPI:
+    client = GoogleFlowAPI(bearer_token=BENCH_TOKEN, timeout=60)
+    client.BASE_URL = flow_url
+    return client
+
+
+# =============================================================================
+# LLM
+# =============================================================================
+
+def bench_llm(llm_url: str, requests_count: int, concurrency: int,
+              provider: str = "deepseek", use_async: bool = False,
+              connections: Callable[[], int] = None, hedging: bool = False) -> StageResult:
+    """
+    MultiAIClient qua FakeLLMServer (DeepSeek hoặc Ollama).
+
+    use_async: agenerate_many trên 1 event loop thay vì thread pool generate_content
+    connections: Hàm trả về số TCP connection server đã nhận (báo cáo keep-alive)
+    hedging: Bật hedge (2 key DeepSeek + Ollama làm target dự phòng)
+    """
+    from modules.prompts_generator import MultiAIClient
+    from modules.llm_transport import run_async
+
+    config = {"ollama_endpoint": llm_url, "ollama_model": "bench:latest"}
+    if provider == "deepseek":
+        config["deepseek_api_keys"] = ["sk-benchmark", "sk-benchmark-2"] if hedging else ["sk-benchmark"]
+    if hedging:
+        config["llm_hedging"] = True
+    client = MultiAIClient(config, auto_filter=False)
+    client.DEEPSEEK_URL = f"{llm_url}/v1/chat/completions"
+    client.ollama_available = provider == "ollama" or hedging
+    if hedging:
+        # Latency giả lập ~1s: ngưỡng sàn thấp hơn mặc định (request thật 20-180s)
+        client.hedging.min_after = 0.2
+
+    prompts = [
+        f"Scene {i}: describe the shot as JSON with keys img_prompt, video_prompt."
+        for i in range(requests_count)
+    ]
+    connections_before = connections() if connections else 0
+    if use_async:
+        result = StageResult(name=f"llm_{provider}_async" + ("_hedged" if hedging else ""))
+
+        async def one(prompt, semaphore):
+            async with semaphore:
+                start = time.time()
+                try:
+                    ok = bool(await client.agenerate(prompt, temperature=0.5, max_tokens=2048, max_retries=1))
+                except Exception:
+                    ok = False
+                result.latencies.append(time.time() - start)
+                result.items += 1
+                result.failed += 0 if ok else 1
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+            await asyncio.gather(*(one(p, semaphore) for p in prompts))
+
+        start = time.time()
+        run_async(run_all())
+        result.wall_s = time.time() - start
+    else:
+        result = _run_items(
+            f"llm_{provider}" + ("_hedged" if hedging else ""), prompts,
+            lambda p: client.generate_content(p, temperature=0.5, max_tokens=2048, max_retries=1),
+            concurrency,
+        )
+    result.extra["concurrency"] = concurrency
+    if connections:
+        result.extra["connections"] = connections() - connections_before
+    if hedging:
+        result.extra["hedges"] = client.hedging.stats()
+    if provider == "ollama":
+        ollama = client.ollama.stats()
+        result.extra["tokens_per_s"] = ollama["tokens_per_s"]
+        result.extra["cold_loads"] = ollama["cold_loads"]
+    return result
+
+
+# =============================================================================
+# FLOW VIDEO (generate → poll → download)
+# =============================================================================
+
+def bench_flow_video(flow_url: str, work_dir: Path, videos: int, concurrency: int,
+                     poll_interval: float = 0.5) -> StageResult:
+    """I2V/T2V: generate_video + batchCheckAsyncVideoGenerationStatus + download."""
+    out_dir = Path(work_dir) / "videos"
+    client = _flow_client(flow_url)
+
+    def worker(i):
+        ok, video, _ = client.generate_video(
+            prompt=f"slow camera push-in {i}", scene_id=str(i),
+            reference_image_id=f"media-{i}"
+        )
+        if not ok or not video.operation_id:
+            return False
+        operations = [{
+            "operation": {"name": video.operation_id},
+            "sceneId": str(i),
+            "status": "MEDIA_GENERATION_STATUS_PENDING",
+        }]
+        ok, done, _ = client._poll_google_with_operations(
+            operations, video.prompt, video.seed, str(i), poll_interval=poll_interval
+        )
+        return ok and client.download_video(done, out_dir, f"{i}") is not None
+
+    result = _run_items("flow_video", list(range(videos)), worker, concurrency)
+    result.extra["concurrency"] = concurrency
+    return result
+
+
+# =============================================================================
+# ROUND ROBIN COORDINATOR
+# =============================================================================
+
+def bench_round_robin(flow_url: str, work_dir: Path, voices: int,
+                      images_per_voice: int) -> StageResult:
+    """run_round_robin: mỗi voice 1 thread, tạo + tải ảnh theo lượt."""
+    from modules.round_robin_coordinator import run_round_robin
+
+    folders = []
+    prompts_per_folder = {}
+    for v in range(voices):
+        folder = Path(work_dir) / f"rr_voice{v}"
+        folder.mkdir(parents=True, exist_ok=True)
+        folders.append(folder)
+        prompts_per_folder[v] = scene_prompts(images_per_voice)
+
+    clients: Dict[int, GoogleFlowAPI] = {}
+    result = StageResult(name="round_robin")
+    lock = threading.Lock()
+
+    def setup(voice_id):
+        clients[voice_id] = _flow_client(flow_url)
+        return True
+
+    def process(voice_id, task):
+        start = time.time()
+        client = clients[voice_id]
+        ok, images, _ = client.generate_images(task.prompt_data["prompt"], count=1)
+        if ok and images:
+            ok = client.download_image(
+                images[0], task.output_path.parent, task.output_path.stem
+            ) is not None
+        with lock:
+            result.latencies.append(time.time() - start)
+        return ok, False
+
+    start = time.time()
+    stats = run_round_robin(
+        folders, prompts_per_folder, process, setup_callback=setup,
+        num_workers=voices, log_callback=lambda *a: None
+    )
+    result.wall_s = time.time() - start
+    result.items = stats.get("success", 0) + stats.get("failed", 0)
+    result.failed = stats.get("failed", 0)
+    result.extra["voices"] = voices
+    # Thời gian chờ lượt = wall - tổng thời gian xử lý mỗi voice (ước lượng)
+    busy = sum(result.latencies)
+    result.extra["busy_ratio"] = round(busy / (result.wall_s * voices), 3) if result.wall_s else 0.0
+    return result
+
+
+# =============================================================================
+# PARALLEL FLOW GENERATOR (browser stand-in)
+# =============================================================================
+
+class _StandInDriver:
+    """Thay selenium driver: thực thi VE3.run()/VE3.setMediaName qua Flow API mock."""
+
+    _SCENE_RE = re.compile(r'sceneId:\s*"([^"]*)"')
+    _PROMPT_RE = re.compile(r"prompt:\s*`((?:\\.|[^`\\])*)`", re.S)
+    _REFS_RE = re.compile(r"referenceFiles:\s*(\[.*?\])", re.S)
+    _SET_NAME_RE = re.compile(r"VE3\.setMediaName\('([^']*)',\s*'([^']*)'")
+
+    def __init__(self, generator: "FlowStandInGenerator"):
+        self.generator = generator
+
+    def execute_async_script(self, script: str):
+        pid = self._SCENE_RE.search(script).group(1)
+        prompt = self._PROMPT_RE.search(script).group(1)
+        return self.generator._run_prompt(pid, prompt)
+
+    def execute_script(self, script: str):
+        match = self._SET_NAME_RE.search(script)
+        if match:
+            self.generator.media_names[match.group(1)] = {"mediaName": match.group(2)}
+            return None
+        if "getMediaNames" in script:
+            return dict(self.generator.media_names)
+        if "setMediaNames" in script:
+            payload = script[script.index("(") + 1:script.rindex(")")]
+            self.generator.media_names.update(json.loads(payload))
+        return None
+
+
+class FlowStandInGenerator:
+    """
+    Stand-in cho BrowserFlowGenerator trong ParallelFlowGenerator:
+    cùng interface (start_browser, _inject_js, driver.execute_async_script...)
+    nhưng tạo ảnh bằng GoogleFlowAPI trỏ tới MockFlowServer.
+    """
+
+    flow_url = ""
+    browser_start_s = 0.5
+
+    def __init__(self, project_path: str, profile_name: str = "main",
+                 headless: bool = True, verbose: bool = False,
+                 config_path: str = "", **kwargs):
+        self.project_path = Path(project_path)
+        self.profile_name = profile_name
+        self.driver = None
+        self.client = _flow_client(self.flow_url)
+        self.media_names: Dict[str, Any] = {}
+        self.uploaded: List[ImageInput] = []
+        self.downloads = self.project_path / f".downloads_{id(self)}"
+        self.latencies: List[float] = []
+
+    def start_browser(self) -> bool:
+        time.sleep(self.browser_start_s)
+        self.driver = _StandInDriver(self)
+        return True
+
+    def wait_for_login(self, timeout: int = 120) -> bool:
+        return True
+
+    def _inject_js(self) -> bool:
+        return True
+
+    def stop_browser(self):
+        self.driver = None
+        shutil.rmtree(self.downloads, ignore_errors=True)
+
+    def _escape_js_string(self, s: str) -> str:
+        return s.replace("\\", "\\\\").replace("`", "\\`").replace("$", "\\$")
+
+    def _cache_path(self) -> Path:
+        return self.project_path / "prompts" / ".media_cache.json"
+
+    def _load_media_cache(self) -> Dict[str, Any]:
+        try:
+            with open(self._cache_path(), "r", encoding="utf-8") as f:
+                return {k: v for k, v in json.load(f).items() if not k.startswith("_")}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_media_cache(self, media_names: Dict[str, Any]) -> None:
+        path = self._cache_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cache = {}
+        if path.exists():
+            try:
+                cache = json.loads(path.read_text(encoding="utf-8"))
+            except ValueError:
+                cache = {}
+        cache.update(media_names)
+        path.write_text(json.dumps(cache), encoding="utf-8")
+
+    def _load_media_names_to_js(self, media_names: Dict[str, Any]) -> None:
+        self.media_names.update(media_names)
+
+    def _get_media_names_from_js(self) -> Dict[str, Any]:
+        return dict(self.media_names)
+
+    def _upload_reference_images(self, reference_files: List[str]) -> bool:
+        self.uploaded = []
+        for name in reference_files:
+            ok, image_input, _ = self.client.upload_image(self.project_path / "nv" / name)
+            if ok:
+                self.uploaded.append(image_input)
+        return True
+
+    def _run_prompt(self, pid: str, prompt: str) -> Dict[str, Any]:
+        start = time.time()
+        ok, images, error = self.client.generate_images(prompt, count=1, image_inputs=self.uploaded)
+        if ok and images:
+            path = self.client.download_image(images[0], self.downloads, pid)
+            ok = path is not None
+        self.latencies.append(time.time() - start)
+        if not ok:
+            return {"success": False, "error": error}
+        return {"success": True, "result": {"images": [{"mediaName": images[0].media_name, "seed": images[0].seed}]}}
+
+    def _move_downloaded_images(self, scene_id: str, min_score: float = 50.0):
+        src = self.downloads / f"{scene_id}.png"
+        if not src.exists():
+            return None, 0.0, False
+        is_ref = scene_id.startswith("nv") or scene_id.startswith("loc")
+        dest_dir = self.project_path / ("nv" if is_ref else "img")
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        dest = dest_dir / f"{scene_id}.png"
+        shutil.move(str(src), str(dest))
+        return dest, 100.0, False
+
+
+@contextmanager
+def _patched_browser_generator(flow_url: str, browser_start_s: float, collected: List[float]):
+    """Thay BrowserFlowGenerator trong parallel_flow_generator bằng stand-in."""
+    import modules.parallel_flow_generator as pfg
+
+    class _Generator(FlowStandInGenerator):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.latencies = collected
+
+    _Generator.flow_url = flow_url
+    _Generator.browser_start_s = browser_start_s
+    original = pfg.BrowserFlowGenerator
+    pfg.BrowserFlowGenerator = _Generator
+    try:
+        yield
+    finally:
+        pfg.BrowserFlowGenerator = original
+
+
+def bench_parallel_flow(flow_url: str, work_dir: Path, scenes: int, characters: int,
+                        browsers: int, browser_start_s: float = 0.5) -> StageResult:
+    """ParallelFlowGenerator.generate_parallel (ref → scene theo DAG)."""
+    from modules.parallel_flow_generator import ParallelFlowGenerator
+
+    paths = build_project(work_dir, "parallel_flow", scenes=scenes,
+                          characters=characters, with_images=False)
+    latencies: List[float] = []
+    with _patched_browser_generator(flow_url, browser_start_s, latencies):
+        generator = ParallelFlowGenerator(
+            project_path=str(paths["project"]), num_browsers=browsers,
+            headless=True, verbose=False, config_path=str(Path(work_dir) / "none.yaml")
+        )
+        start = time.time()
+        output = generator.generate_parallel(excel_path=paths["excel"], overwrite=True)
+        wall = time.time() - start
+
+    stats = output.get("stats", {}) if isinstance(output.get("stats"), dict) else {}
+    result = StageResult(
+        name="parallel_flow",
+        items=stats.get("success", 0) + stats.get("failed", 0),
+        failed=stats.get("failed", 0),
+        wall_s=wall,
+        latencies=latencies,
+    )
+    result.extra.update({
+        "browsers": browsers,
+        "ref_phase_s": round(stats.get("step1_time", 0.0), 3),
+        "scene_phase_s": round(stats.get("step2_time", 0.0), 3),
+        "overlap_s": round(stats.get("overlap_time", 0.0), 3),
+    })
+    return result
+
+
+# =============================================================================
+# PROMPT POST-PROCESSING
+# =============================================================================
+
+def bench_prompt_rules(scenes: int) -> StageResult:
+    """
+    Hậu xử lý prompt (modules.prompt_rules) trên `scenes` output AI giả:
+    fix_location + clean_narration + lọc trẻ em/annotation cho từng scene.
+    """
+    from modules.prompt_rules import ProjectPromptRules, fix_location, clean_narration
+    from benchmarks.fixtures import prompt_post_inputs
+
+    data = prompt_post_inputs(scenes)
+    result = StageResult(name="prompt_rules")
+
+    start = time.time()
+    rules = ProjectPromptRules(data["characters"], data["locations"])
+    for scene in data["scenes"]:
+        t = time.time()
+        img = fix_location(scene["img_prompt"], scene["srt_text"])
+        img = clean_narration(img, scene["srt_text"][:100])
+        img, video, refs = rules.finalize(img, scene["video_prompt"], scene["reference_files"])
+        result.latencies.append(time.time() - t)
+        result.items += 1
+        if not img or any(r not in img for r in refs):
+            result.failed += 1
+    result.wall_s = time.time() - start
+    result.extra["per_scene_us"] = round(result.wall_s / max(1, scenes) * 1e6, 1)
+    return result
+
+
+def bench_scene_reuse(scenes: int, threshold: float = 0.82) -> StageResult:
+    """
+    Semantic cache scene prompts (modules.scene_prompt_cache): index `scenes`
+    scene của project A, tra `scenes` scene của project B (nhân vật/bối cảnh
+    khác lock; nửa đầu là lời dẫn A viết lại nhẹ, nửa sau lời dẫn mới).
+
+    Báo cáo tỉ lệ hit (tối đa 50%) + µs mỗi lần tra; failed = hit ở lời dẫn
+    mới, hoặc prompt còn lock/style của project A / thiếu lock/style của B.
+    """
+    import random
+    from modules.excel_manager import Character, Location
+    from modules.scene_prompt_cache import ScenePromptCache, SceneKey
+
+    rnd = random.Random(11)
+    openers = ["I remember", "I never forgot", "She told me about", "My father never spoke of"]
+    objects = ["the night she left us alone", "the letter he found in the drawer",
+               "the day we moved to the city", "the rain on the hospital windows",
+               "the last dinner we had together", "the money that went missing",
+               "the phone call at midnight", "the wedding ring in the snow"]
+    codas = ["in that old house", "before the winter came", "when I was twelve",
+             "and nothing was the same again", "while the lawyers waited outside"]
+    lines = [f"{o} {b} {c}" for o in openers for b in objects for c in codas]
+    rnd.shuffle(lines)
+    seen, unseen = lines[:len(lines) // 2], lines[len(lines) // 2:]
+
+    def project(tag: str):
+        chars = [Character(id=f"nv{i}", name=f"{tag}{i}", role=role,
+                           character_lock=f"{tag} {role} lock {i}, {rnd.choice(['grey coat', 'red scarf', 'blue shirt'])}")
+                 for i, role in enumerate(["narrator", "mother", "lawyer"])]
+        locs = [Location(id=f"loc_{i}", name=name, location_lock=f"{tag} {name} lock")
+                for i, name in enumerate(["old house", "hospital corridor", "courthouse"])]
+        return chars, locs
+
+    styles = {"alpha": "Cinematic, 4K photorealistic, alpha film grain",
+              "beta": "Moody 35mm film look, beta muted palette"}
+
+    def key(text: str, i: int, chars, locs, tag: str) -> SceneKey:
+        c = chars[i % len(chars)]
+        loc = locs[i % len(locs)]
+        return SceneKey(text, "FRAME_PRESENT", [(c.id, c.character_lock, c.role)],
+                        (loc.id, loc.location_lock, loc.name), style=styles[tag])
+
+    chars_a, locs_a = project("alpha")
+    chars_b, locs_b = project("beta")
+    cache = ScenePromptCache(path=None, threshold=threshold)
+    for i in range(scenes):
+        k = key(seen[i % len(seen)], i, chars_a, locs_a, "alpha")
+        cache.add(k, f"Medium shot, {k.characters[0][1]} ({k.characters[0][0]}.png) looking down, "
+                     f"{k.location[1]} ({k.location[0]}.png), {k.style}")
+    cache.reset_run()
+
+    result = StageResult(name="scene_reuse")
+    start = time.time()
+    for i in range(scenes):
+        if i < scenes // 2:
+            text = seen[i % len(seen)].replace(" the ", " that ", 1).replace("She told", "She once told", 1)
+        else:
+            text = unseen[i % len(unseen)]
+        k = key(text, i, chars_b, locs_b, "beta")
+        t = time.time()
+        hit = cache.lookup(k)
+        result.latencies.append(time.time() - t)
+        result.items += 1
+        if hit and (i >= scenes // 2 or "alpha" in hit["img_prompt"] or k.characters[0][1] not in hit["img_prompt"]
+                    or k.location[1] not in hit["img_prompt"] or k.style not in hit["img_prompt"]):
+            result.failed += 1
+    result.wall_s = time.time() - start
+    stats = cache.stats()
+    result.extra["cache_hit"] = {"hits": stats["hits"], "lookups": scenes, "ratio": stats["hit_rate"]}
+    result.extra["per_scene_us"] = round(result.wall_s / max(1, scenes) * 1e6, 1)
+    return result
+
+
+def bench_prompt_cache(llm_url: str, scenes: int, provider: str = "deepseek") -> StageResult:
+    """
+    Scene prompts cho `scenes` scene (chia batch như pipeline) qua FakeLLMServer,
+    báo cáo token prompt cached / tổng (prefix giống hệt giữa các batch).
+
+    failed = batch có scene phải dùng _create_fallback_prompts (response không
+    parse được / thiếu scene) hoặc thiếu prompt.
+    """
+    from modules.prompts_generator import PromptGenerator
+    from benchmarks.fixtures import prompt_post_inputs
+
+    data = prompt_post_inputs(scenes)
+    scenes_data = [
+        {
+            "scene_id": i + 1,
+            "text": scene["srt_text"],
+            "location_id": data["locations"][i % len(data["locations"])].id,
+            "characters_in_scene": [c.id for c in data["characters"][:2]],
+        }
+        for i, scene in enumerate(data["scenes"])
+    ]
+
+    gen = PromptGenerator({"ollama_endpoint": llm_url, "ollama_model": "bench:latest", "scene_prompt_cache": False})
+    if provider == "deepseek":
+        gen.ai_client.deepseek_keys = ["sk-benchmark"]
+        gen.ai_client.DEEPSEEK_URL = f"{llm_url}/v1/chat/completions"
+
+    # Đếm scene đi đường fallback (latency khi đó không phải của đường LLM)
+    fallbacks: List[int] = []
+    create_fallback = gen._create_fallback_prompts
+
+    def counting_fallback(scenes_data, *args, **kwargs):
+        fallbacks.append(len(scenes_data))
+        return create_fallback(scenes_data, *args, **kwargs)
+
+    gen._create_fallback_prompts = counting_fallback
+
+    result = StageResult(name=f"prompt_cache_{provider}")
+    batches = gen._scene_batches(scenes_data, data["characters"], data["locations"])
+    start = time.time()
+    for batch in batches:
+        fallback_before = len(fallbacks)
+        t = time.time()
+        prompts = gen._generate_scene_prompts(data["characters"], batch, locations=data["locations"])
+        result.latencies.append(time.time() - t)
+        result.items += 1
+        if len(prompts) != len(batch) or len(fallbacks) > fallback_before:
+            result.failed += 1
+    result.wall_s = time.time() - start
+
+    totals = gen.ai_client.usage_snapshot().get(provider, {})
+    prompt_tokens = totals.get("prompt_tokens", 0)
+    result.extra["fallback_scenes"] = sum(fallbacks)
+    result.extra["cache_hit"] = {
+        "cached_tokens": totals.get("cached_tokens", 0),
+        "prompt_tokens": prompt_tokens,
+        "ratio": round(totals.get("cached_tokens", 0) / prompt_tokens, 3) if prompt_tokens else 0.0,
+    }
+    return result
+
+
+# =============================================================================
+# VOICE → SRT (Whisper backends)
+# =============================================================================
+
+def bench_whisper(audio_path: Path, work_dir: Path, backends: List[str], models: List[str],
+                  language: Optional[str] = None, compute_type: str = "int8") -> StageResult:
+    """
+    VoiceToSrt.transcribe trên 1 file voice thật với từng backend × model đã cài.
+
+    Báo cáo real-time factor (giây xử lý / giây audio, thấp hơn = nhanh hơn)
+    + thời gian load model riêng (lần đầu có thể gồm tải model).
+    """
+    from modules.voice_to_srt import VoiceToSrt, available_backends
+
+    installed = available_backends()
+    result = StageResult(name="whisper")
+    rtf: Dict[str, float] = {}
+    load_s: Dict[str, float] = {}
+    out_dir = Path(work_dir) / "whisper"
+    start = time.time()
+    for backend in backends:
+        if backend not in installed:
+            print(f"[BENCH] whisper: {backend} chưa cài - bỏ qua")
+            continue
+        for model in models:
+            label = f"{backend}/{model}"
+            result.items += 1
+            try:
+                conv = VoiceToSrt(model_name=model, language=language,
+                                  backend=backend, compute_type=compute_type)
+                conv._load_model()
+                t = time.time()
+                transcript = conv.transcribe(audio_path, out_dir / f"{backend}_{model}.srt")
+                result.latencies.append(time.time() - t)
+                rtf[label] = transcript.get("rtf", 0.0)
+                load_s[label] = round(conv.load_seconds, 2)
+            except Exception as e:
+                print(f"[BENCH] whisper {label} lỗi: {e}")
+                result.failed += 1
+    result.wall_s = time.time() - start
+    result.extra["rtf"] = rtf
+    result.extra["load_s"] = load_s
+    return result
+
+
+# =============================================================================
+# COMPOSE + SMART ENGINE
+# =============================================================================
+
+def _bench_engine(work_dir: Path):
+    """SmartEngine với config tạm (không đọc accounts/tokens của máy)."""
+    import sys
+    from modules.smart_engine import SmartEngine
+
+    config_dir = Path(work_dir) / "config"
+    config_dir.mkdir(parents=True, exist_ok=True)
+    accounts = config_dir / "accounts.json"
+    # chrome_path: chỉ cần tồn tại để qua check_requirements (ảnh đã có sẵn)
+    accounts.write_text(json.dumps({"chrome_path": sys.executable}), encoding="utf-8")
+    (config_dir / "settings.yaml").write_text(
+        "generation_mode: api\nvideo_count: 0\nvideo_compose_mode: fast\n", encoding="utf-8"
+    )
+    engine = SmartEngine(config_path=str(accounts))
+    engine.callback = lambda msg: None
+    return engine
+
+
+def _ffmpeg_calls(log_path: Optional[Path]) -> Dict[str, Any]:
+    if not log_path or not Path(log_path).exists():
+        return {}
+    calls: Dict[str, int] = {}
+    for line in Path(log_path).read_text(encoding="utf-8").splitlines():
+        kind = json.loads(line).get("kind", "?")
+        calls[kind] = calls.get(kind, 0) + 1
+    Path(log_path).unlink()
+    return {"ffmpeg_calls": calls}
+
+
+def bench_compose(work_dir: Path, scenes: int, seconds_per_scene: float,
+                  ffmpeg_log: Optional[Path] = None) -> StageResult:
+    """SmartEngine._compose_video trên project có sẵn ảnh + voice + SRT."""
+    paths = build_project(work_dir, "compose", scenes=scenes,
+                          seconds_per_scene=seconds_per_scene, with_images=True)
+    engine = _bench_engine(work_dir)
+    output = paths["project"] / "compose.mp4"
+    if output.exists():
+        output.unlink()
+
+    start = time.time()
+    video = engine._compose_video(paths["project"], paths["excel"], "compose")
+    wall = time.time() - start
+
+    result = StageResult(name="compose", items=scenes, failed=0 if video else scenes,
+                         wall_s=wall, latencies=[wall])
+    result.extra.update(_ffmpeg_calls(ffmpeg_log))
+    return result
+
+
+def bench_draft(work_dir: Path, scenes: int, seconds_per_scene: float,
+                ffmpeg_log: Optional[Path] = None) -> StageResult:
+    """
+    SmartEngine._compose_draft_video: lần đầu (render hết clip) rồi lần 2 sau
+    khi đổi 1 ảnh (chỉ render lại clip đó).
+    """
+    paths = build_project(work_dir, "draft", scenes=scenes,
+                          seconds_per_scene=seconds_per_scene, with_images=True)
+    engine = _bench_engine(work_dir)
+    # Scene cuối "chưa có ảnh" ở lần đầu → khung giữ chỗ
+    last_img = paths["project"] / "img" / f"{scenes}.png"
+    img_bytes = last_img.read_bytes()
+    last_img.unlink()
+
+    latencies = []
+    start = time.time()
+    cold = engine._compose_draft_video(paths["project"], paths["excel"], "draft")
+    latencies.append(time.time() - start)
+
+    last_img.write_bytes(img_bytes)
+    t = time.time()
+    warm = engine._compose_draft_video(paths["project"], paths["excel"], "draft")
+    latencies.append(time.time() - t)
+    wall = time.time() - start
+
+    failed = sum(1 for v in (cold, warm) if not v)
+    result = StageResult(name="draft", items=2, failed=failed, wall_s=wall, latencies=latencies)
+    result.extra.update({
+        "cold_s": round(latencies[0], 3),
+        "incremental_s": round(latencies[1], 3),
+    })
+    result.extra.update(_ffmpeg_calls(ffmpeg_log))
+    return result
+
+
+def bench_engine_run(work_dir: Path, scenes: int, seconds_per_scene: float,
+                     ffmpeg_log: Optional[Path] = None) -> StageResult:
+    """
+    SmartEngine.run(.xlsx) trên project đã có ảnh: resume check → load prompts
+    → export → compose. (Stage ảnh cần Chrome thật nên được bỏ qua ở đây,
+    đo riêng ở parallel_flow / round_robin.)
+    """
+    from modules.metrics import get_metrics
+
+    paths = build_project(work_dir, "engine", scenes=scenes,
+                          seconds_per_scene=seconds_per_scene, with_images=True)
+    engine = _bench_engine(work_dir)
+    engine.metrics_enabled = True
+    # run() đặt tên project theo stem của input (.xlsx)
+    name = paths["excel"].stem
+    final = paths["project"] / f"{name}.mp4"
+    if final.exists():
+        final.unlink()
+
+    start = time.time()
+    output = engine.run(str(paths["excel"]), output_dir=str(paths["project"]),
+                        callback=lambda msg: None)
+    wall = time.time() - start
+    get_metrics().enabled = True
+
+    result = StageResult(name="engine", items=scenes,
+                         failed=0 if output.get("video") else scenes,
+                         wall_s=wall, latencies=[wall])
+
+    # Breakdown theo stage từ summary JSONL của metrics
+    metrics_path = paths["project"] / "logs" / f"metrics_{name}.jsonl"
+    if metrics_path.exists():
+        for line in metrics_path.read_text(encoding="utf-8").splitlines():
+            event = json.loads(line)
+            if event.get("type") == "summary":
+                result.extra["stages_s"] = {
+                    h["name"][len("stage_"):-len("_seconds")]: h["sum_s"]
+                    for h in event["histograms"] if h["name"].startswith("stage_")
+                }
+    result.extra.update(_ffmpeg_calls(ffmpeg_log))
+    return result
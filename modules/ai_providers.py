@@ -12,10 +12,15 @@ Cac AI provider mien phi de thay the Gemini:
 import os
 import json
 import time
+import asyncio
 import requests
-from typing import Optional, List, Dict, Any, Callable
+from abc import ABC, abstractmethod
+from typing import Optional, List, Dict, Any, Callable, Tuple
 from dataclasses import dataclass
 
+from modules.llm_transport import get_transport
+from modules.ollama_manager import get_ollama_manager
+
 
 @dataclass
 class AIProvider:
@@ -26,7 +31,90 @@ class AIProvider:
     endpoint: str
 
 
-class OllamaClient:
+class _PooledChatClient(ABC):
+    """
+    Base cho provider clients: gửi request qua transport dùng chung (keep-alive).
+
+    Subclass chỉ cần:
+    - _build_request(): (url, headers, data, timeout)
+    - _parse_response(resp): text hoặc None
+    - _handle_error(e): None hoặc raise (tuỳ provider)
+    """
+
+    @abstractmethod
+    def _build_request(
+        self,
+        prompt: str,
+        system_prompt: str,
+        temperature: float,
+        max_tokens: int
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any], float]:
+        """(url, headers, data, timeout) cho 1 request chat."""
+
+    @abstractmethod
+    def _parse_response(self, resp) -> Optional[str]:
+        """Text từ response thành công, None nếu rỗng."""
+
+    def _handle_error(self, error: Exception) -> Optional[str]:
+        return None
+
+    @staticmethod
+    def _chat_messages(prompt: str, system_prompt: str = None) -> List[Dict[str, str]]:
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def generate(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 4096
+    ) -> Optional[str]:
+        """Generate text."""
+        url, headers, data, timeout = self._build_request(prompt, system_prompt, temperature, max_tokens)
+        try:
+            resp = get_transport().post(url, json=data, headers=headers, timeout=timeout)
+            return self._parse_response(resp)
+        except Exception as e:
+            return self._handle_error(e)
+
+    async def agenerate(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 4096
+    ) -> Optional[str]:
+        """Generate text (async, cùng connection pool)."""
+        url, headers, data, timeout = self._build_request(prompt, system_prompt, temperature, max_tokens)
+        try:
+            resp = await get_transport().apost(url, json=data, headers=headers, timeout=timeout)
+            return self._parse_response(resp)
+        except Exception as e:
+            return self._handle_error(e)
+
+    async def agenerate_many(
+        self,
+        prompts: List[str],
+        system_prompt: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 4096,
+        concurrency: int = 16
+    ) -> List[Optional[str]]:
+        """Generate nhiều prompts song song trên 1 event loop (giữ thứ tự)."""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(prompt: str) -> Optional[str]:
+            async with semaphore:
+                return await self.agenerate(prompt, system_prompt, temperature, max_tokens)
+
+        return list(await asyncio.gather(*(one(p) for p in prompts)))
+
+
+class OllamaClient(_PooledChatClient):
     """
     Ollama API Client - FREE, chay LOCAL tren may tinh cua ban!
 
@@ -52,66 +140,71 @@ class OllamaClient:
         "gemma3:27b",       # Google Gemma 3 27B - Slow but quality
     ]
 
-    def __init__(self, model: str = None, endpoint: str = None):
+    def __init__(self, model: str = None, endpoint: str = None, keep_alive: str = None, num_parallel: int = 0):
         self.model = model or self.MODELS[0]
         self.endpoint = endpoint or self.DEFAULT_ENDPOINT
-        self.chat_endpoint = f"{self.endpoint}/v1/chat/completions"
-
-    def generate(
-        self,
-        prompt: str,
-        system_prompt: str = None,
-        temperature: float = 0.7,
-        max_tokens: int = 4096
-    ) -> Optional[str]:
-        """Generate text using Ollama (OpenAI compatible API)."""
-
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
+        # API native (/api/chat): OpenAI compatible API không nhận num_ctx / keep_alive
+        self.manager = get_ollama_manager(self.endpoint, self.model, keep_alive=keep_alive, num_parallel=num_parallel)
+        self.chat_endpoint = self.manager.chat_url
+        self.last_speed: Dict[str, float] = {}
 
+    def _build_request(self, prompt, system_prompt, temperature, max_tokens):
+        """Ollama native chat API."""
         headers = {
             "Content-Type": "application/json"
         }
 
         data = {
             "model": self.model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "stream": False
+            "messages": self._chat_messages(prompt, system_prompt),
+            "stream": False,
+            "keep_alive": self.manager.keep_alive,
+            "options": {
+                "temperature": temperature,
+                "num_predict": max_tokens,
+                "num_ctx": self.manager.num_ctx_for((system_prompt or "") + prompt, max_tokens),
+            }
         }
+        # Ollama local can be slow on first run
+        return self.chat_endpoint, headers, data, 300
+
+    def _parse_response(self, resp) -> Optional[str]:
+        if resp.status_code == 200:
+            result = resp.json()
+            self.last_speed = self.manager.record(result)
+            return result["message"]["content"]
+        print(f"[Ollama Error] {resp.status_code}: {resp.text[:200]}")
+        return None
 
-        try:
-            resp = requests.post(
-                self.chat_endpoint,
-                headers=headers,
-                json=data,
-                timeout=300  # Ollama local can be slow on first run
-            )
+    def generate(self, prompt: str, system_prompt: str = None, temperature: float = 0.7,
+                 max_tokens: int = 4096) -> Optional[str]:
+        """Generate text (chờ slot trống của server)."""
+        with self.manager.slot():
+            return super().generate(prompt, system_prompt, temperature, max_tokens)
 
-            if resp.status_code == 200:
-                result = resp.json()
-                return result["choices"][0]["message"]["content"]
-            else:
-                print(f"[Ollama Error] {resp.status_code}: {resp.text[:200]}")
-                return None
+    async def agenerate(self, prompt: str, system_prompt: str = None, temperature: float = 0.7,
+                        max_tokens: int = 4096) -> Optional[str]:
+        """Generate text async (chờ slot trống của server)."""
+        async with self.manager.aslot():
+            return await super().agenerate(prompt, system_prompt, temperature, max_tokens)
 
-        except requests.exceptions.ConnectionError:
+    def warm_up(self, background: bool = True) -> bool:
+        """Load model trước request đầu tiên (xem OllamaManager.warm_up)."""
+        return self.manager.warm_up(background=background)
+
+    def _handle_error(self, error: Exception) -> Optional[str]:
+        if isinstance(error, requests.exceptions.ConnectionError):
             print(f"[Ollama Error] Khong ket noi duoc! Chay 'ollama serve' truoc.")
-            return None
-        except requests.exceptions.Timeout:
+        elif isinstance(error, requests.exceptions.Timeout):
             print(f"[Ollama Error] Timeout! Model co the dang load lan dau.")
-            return None
-        except Exception as e:
-            print(f"[Ollama Error] {e}")
-            return None
+        else:
+            print(f"[Ollama Error] {error}")
+        return None
 
     def is_available(self) -> bool:
         """Check if Ollama is running."""
         try:
-            resp = requests.get(f"{self.endpoint}/api/tags", timeout=5)
+            resp = get_transport().get(f"{self.endpoint}/api/tags", timeout=5)
             return resp.status_code == 200
         except:
             return False
@@ -119,7 +212,7 @@ class OllamaClient:
     def list_models(self) -> List[str]:
         """List available models in Ollama."""
         try:
-            resp = requests.get(f"{self.endpoint}/api/tags", timeout=10)
+            resp = get_transport().get(f"{self.endpoint}/api/tags", timeout=10)
             if resp.status_code == 200:
                 data = resp.json()
                 return [m["name"] for m in data.get("models", [])]
@@ -128,7 +221,7 @@ class OllamaClient:
         return []
 
 
-class DeepSeekClient:
+class DeepSeekClient(_PooledChatClient):
     """
     DeepSeek API Client - Re va manh!
 
@@ -151,20 +244,7 @@ class DeepSeekClient:
         self.api_key = api_key
         self.model = model or self.MODELS[0]
 
-    def generate(
-        self,
-        prompt: str,
-        system_prompt: str = None,
-        temperature: float = 0.7,
-        max_tokens: int = 4096
-    ) -> Optional[str]:
-        """Generate text."""
-
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
-
+    def _build_request(self, prompt, system_prompt, temperature, max_tokens):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -172,35 +252,28 @@ class DeepSeekClient:
 
         data = {
             "model": self.model,
-            "messages": messages,
+            "messages": self._chat_messages(prompt, system_prompt),
             "temperature": temperature,
             "max_tokens": max_tokens
         }
-
-        try:
-            resp = requests.post(
-                self.ENDPOINT,
-                headers=headers,
-                json=data,
-                timeout=120
-            )
-
-            if resp.status_code == 200:
-                result = resp.json()
-                return result["choices"][0]["message"]["content"]
-            elif resp.status_code == 429:
-                print(f"DeepSeek rate limit, waiting...")
-                return None
-            else:
-                print(f"[DeepSeek Error] {resp.status_code}: {resp.text[:200]}")
-                return None
-
-        except Exception as e:
-            print(f"[DeepSeek Error] {e}")
+        return self.ENDPOINT, headers, data, 120
+
+    def _parse_response(self, resp) -> Optional[str]:
+        if resp.status_code == 200:
+            result = resp.json()
+            return result["choices"][0]["message"]["content"]
+        elif resp.status_code == 429:
+            print(f"DeepSeek rate limit, waiting...")
             return None
+        print(f"[DeepSeek Error] {resp.status_code}: {resp.text[:200]}")
+        return None
+
+    def _handle_error(self, error: Exception) -> Optional[str]:
+        print(f"[DeepSeek Error] {error}")
+        return None
     
 
-class GroqClient:
+class GroqClient(_PooledChatClient):
     """
     Groq API Client - Mien phi va rat nhanh!
     
@@ -224,54 +297,34 @@ class GroqClient:
     def __init__(self, api_key: str, model: str = None):
         self.api_key = api_key
         self.model = model or self.MODELS[0]
-    
-    def generate(
-        self,
-        prompt: str,
-        system_prompt: str = None,
-        temperature: float = 0.7,
-        max_tokens: int = 4096
-    ) -> Optional[str]:
-        """Generate text."""
-        
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
-        
+
+    def _build_request(self, prompt, system_prompt, temperature, max_tokens):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        
+
         data = {
             "model": self.model,
-            "messages": messages,
+            "messages": self._chat_messages(prompt, system_prompt),
             "temperature": temperature,
             "max_tokens": max_tokens
         }
-        
-        try:
-            resp = requests.post(
-                self.ENDPOINT,
-                headers=headers,
-                json=data,
-                timeout=120
-            )
-            
-            if resp.status_code == 200:
-                result = resp.json()
-                return result["choices"][0]["message"]["content"]
-            else:
-                print(f"[Groq Error] {resp.status_code}: {resp.text[:200]}")
-                return None
-                
-        except Exception as e:
-            print(f"[Groq Error] {e}")
-            return None
+        return self.ENDPOINT, headers, data, 120
+
+    def _parse_response(self, resp) -> Optional[str]:
+        if resp.status_code == 200:
+            result = resp.json()
+            return result["choices"][0]["message"]["content"]
+        print(f"[Groq Error] {resp.status_code}: {resp.text[:200]}")
+        return None
+
+    def _handle_error(self, error: Exception) -> Optional[str]:
+        print(f"[Groq Error] {error}")
+        return None
 
 
-class OpenRouterClient:
+class OpenRouterClient(_PooledChatClient):
     """
     OpenRouter API Client - Nhieu model mien phi!
     
@@ -294,56 +347,36 @@ class OpenRouterClient:
     def __init__(self, api_key: str, model: str = None):
         self.api_key = api_key
         self.model = model or self.FREE_MODELS[0]
-    
-    def generate(
-        self,
-        prompt: str,
-        system_prompt: str = None,
-        temperature: float = 0.7,
-        max_tokens: int = 4096
-    ) -> Optional[str]:
-        """Generate text."""
-        
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
-        
+
+    def _build_request(self, prompt, system_prompt, temperature, max_tokens):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
             "HTTP-Referer": "https://ve3tool.local",
             "X-Title": "VE3 Tool"
         }
-        
+
         data = {
             "model": self.model,
-            "messages": messages,
+            "messages": self._chat_messages(prompt, system_prompt),
             "temperature": temperature,
             "max_tokens": max_tokens
         }
-        
-        try:
-            resp = requests.post(
-                self.ENDPOINT,
-                headers=headers,
-                json=data,
-                timeout=120
-            )
-            
-            if resp.status_code == 200:
-                result = resp.json()
-                return result["choices"][0]["message"]["content"]
-            else:
-                print(f"[OpenRouter Error] {resp.status_code}: {resp.text[:200]}")
-                return None
-                
-        except Exception as e:
-            print(f"[OpenRouter Error] {e}")
-            return None
+        return self.ENDPOINT, headers, data, 120
+
+    def _parse_response(self, resp) -> Optional[str]:
+        if resp.status_code == 200:
+            result = resp.json()
+            return result["choices"][0]["message"]["content"]
+        print(f"[OpenRouter Error] {resp.status_code}: {resp.text[:200]}")
+        return None
+
+    def _handle_error(self, error: Exception) -> Optional[str]:
+        print(f"[OpenRouter Error] {error}")
+        return None
 
 
-class GeminiClient:
+class GeminiClient(_PooledChatClient):
     """
     Google Gemini API Client.
     
@@ -365,22 +398,14 @@ class GeminiClient:
     def __init__(self, api_key: str, model: str = None):
         self.api_key = api_key
         self.model = model or self.MODELS[0]
-    
-    def generate(
-        self,
-        prompt: str,
-        system_prompt: str = None,
-        temperature: float = 0.7,
-        max_tokens: int = 4096
-    ) -> Optional[str]:
-        """Generate text."""
-        
+
+    def _build_request(self, prompt, system_prompt, temperature, max_tokens):
         url = self.ENDPOINT.format(model=self.model) + f"?key={self.api_key}"
-        
+
         content = prompt
         if system_prompt:
             content = f"{system_prompt}\n\n{prompt}"
-        
+
         data = {
             "contents": [{"parts": [{"text": content}]}],
             "generationConfig": {
@@ -388,31 +413,30 @@ class GeminiClient:
                 "maxOutputTokens": max_tokens
             }
         }
-        
-        try:
-            resp = requests.post(url, json=data, timeout=120)
-            
-            if resp.status_code == 200:
-                result = resp.json()
-                return result["candidates"][0]["content"]["parts"][0]["text"]
-            else:
-                error_msg = resp.text[:300]
-                print(f"[Gemini Error] {resp.status_code}: {error_msg}")
-                
-                # Check specific errors
-                if "API key" in error_msg and "leaked" in error_msg:
-                    raise Exception("API key bi leak! Vui long tao key moi.")
-                elif resp.status_code == 429:
-                    raise Exception("Rate limit! Doi 1 phut va thu lai.")
-                
-                return None
-                
-        except requests.exceptions.Timeout:
+        return url, None, data, 120
+
+    def _parse_response(self, resp) -> Optional[str]:
+        if resp.status_code == 200:
+            result = resp.json()
+            return result["candidates"][0]["content"]["parts"][0]["text"]
+
+        error_msg = resp.text[:300]
+        print(f"[Gemini Error] {resp.status_code}: {error_msg}")
+
+        # Check specific errors
+        if "API key" in error_msg and "leaked" in error_msg:
+            raise Exception("API key bi leak! Vui long tao key moi.")
+        elif resp.status_code == 429:
+            raise Exception("Rate limit! Doi 1 phut va thu lai.")
+
+        return None
+
+    def _handle_error(self, error: Exception) -> Optional[str]:
+        if isinstance(error, requests.exceptions.Timeout):
             print("[Gemini Error] Timeout")
             return None
-        except Exception as e:
-            print(f"[Gemini Error] {e}")
-            raise
+        print(f"[Gemini Error] {error}")
+        raise error
 
 
 class MultiAIClient:
@@ -470,7 +494,11 @@ class MultiAIClient:
         ollama_model = self.config.get("ollama_model")
         if ollama_model:
             ollama_endpoint = self.config.get("ollama_endpoint", "http://localhost:11434")
-            client = OllamaClient(model=ollama_model, endpoint=ollama_endpoint)
+            client = OllamaClient(
+                model=ollama_model, endpoint=ollama_endpoint,
+                keep_alive=self.config.get("ollama_keep_alive", "30m"),
+                num_parallel=self.config.get("ollama_num_parallel", 0),
+            )
             if auto_filter:
                 print(f"  Testing Ollama ({ollama_model})...", end=" ")
                 if client.is_available():
@@ -506,6 +534,9 @@ class MultiAIClient:
                 first_provider = self.clients[0][0] if self.clients else None
                 if first_provider:
                     print(f"[API Filter] Se dung: {first_provider.capitalize()} (uu tien)")
+                if first_provider == "ollama":
+                    # Ollama là provider chính → load model ngay (chạy nền)
+                    self.clients[0][1].warm_up()
     
     def generate(
         self,
@@ -527,7 +558,7 @@ class MultiAIClient:
         errors = []
         clients_to_remove = []
 
-        for idx, (name, client) in enumerate(self.clients):
+        for name, client in self.clients:
             for attempt in range(retry_count):
                 try:
                     print(f"[MultiAI] {name.capitalize()} (attempt {attempt + 1})...")
@@ -543,30 +574,105 @@ class MultiAIClient:
                         return result
 
                 except Exception as e:
-                    error_msg = str(e).lower()
-                    errors.append(f"{name}: {str(e)[:50]}")
-
-                    # Loi nghiem trong - xoa client nay
-                    if "leaked" in error_msg or "quota" in error_msg or "unauthorized" in error_msg:
-                        print(f"[MultiAI] {name} khong dung duoc, bo qua...")
-                        clients_to_remove.append(idx)
+                    if self._skip_client((name, client), e, errors, clients_to_remove):
                         break
 
-                    # Rate limit - chuyen sang provider khac ngay
-                    if "rate" in error_msg or "429" in error_msg:
-                        print(f"[MultiAI] {name} rate limit, chuyen provider...")
+                time.sleep(1)
+
+        self._remove_clients(clients_to_remove)
+
+        if errors:
+            print(f"[MultiAI] Tat ca providers failed")
+        return None
+
+    async def agenerate(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 4096,
+        retry_count: int = 2
+    ) -> Optional[str]:
+        """generate() bản async - cùng thứ tự provider/retry, không chiếm thread khi chờ."""
+
+        if not self.clients:
+            print("[MultiAI] Khong co AI provider nao hoat dong!")
+            return None
+
+        errors = []
+        clients_to_remove = []
+
+        for name, client in list(self.clients):
+            for attempt in range(retry_count):
+                try:
+                    result = await client.agenerate(
+                        prompt=prompt,
+                        system_prompt=system_prompt,
+                        temperature=temperature,
+                        max_tokens=max_tokens
+                    )
+
+                    if result:
+                        return result
+
+                except Exception as e:
+                    if self._skip_client((name, client), e, errors, clients_to_remove):
                         break
 
-                time.sleep(1)
+                await asyncio.sleep(1)
 
-        # Xoa cac client khong dung duoc
-        for idx in reversed(clients_to_remove):
-            if idx < len(self.clients):
-                self.clients.pop(idx)
+        self._remove_clients(clients_to_remove)
 
         if errors:
             print(f"[MultiAI] Tat ca providers failed")
         return None
+
+    async def agenerate_many(
+        self,
+        prompts: List[str],
+        system_prompt: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 4096,
+        concurrency: int = 16
+    ) -> List[Optional[str]]:
+        """
+        Generate nhiều prompts trên 1 event loop (giữ thứ tự).
+
+        Args:
+            concurrency: Số request đang bay tối đa (giới hạn theo quota provider)
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(prompt: str) -> Optional[str]:
+            async with semaphore:
+                return await self.agenerate(prompt, system_prompt, temperature, max_tokens)
+
+        return list(await asyncio.gather(*(one(p) for p in prompts)))
+
+    @staticmethod
+    def _skip_client(entry: tuple, error: Exception, errors: list, clients_to_remove: list) -> bool:
+        """Ghi lỗi; True = bỏ qua provider này (không retry)."""
+        name = entry[0]
+        error_msg = str(error).lower()
+        errors.append(f"{name}: {str(error)[:50]}")
+
+        # Loi nghiem trong - xoa client nay
+        if "leaked" in error_msg or "quota" in error_msg or "unauthorized" in error_msg:
+            print(f"[MultiAI] {name} khong dung duoc, bo qua...")
+            clients_to_remove.append(entry)
+            return True
+
+        # Rate limit - chuyen sang provider khac ngay
+        if "rate" in error_msg or "429" in error_msg:
+            print(f"[MultiAI] {name} rate limit, chuyen provider...")
+            return True
+        return False
+
+    def _remove_clients(self, clients_to_remove: list):
+        """Xoa cac client khong dung duoc."""
+        for entry in clients_to_remove:
+            if entry in self.clients:
+                self.clients.remove(entry)
     
     def get_available_providers(self) -> List[str]:
         """Tra ve danh sach providers kha dung."""
@@ -32,6 +32,7 @@ from datetime import datetime
 # Import PromptWorkbook
 from modules.excel_manager import PromptWorkbook, Scene
 from modules.utils import get_logger, load_settings
+from modules.metrics import timed
 
 # Browser driver imports - PREFER SELENIUM (more stable)
 DRIVER_TYPE = None
@@ -1267,6 +1268,7 @@ class BrowserFlowGenerator:
             "stats": self.stats.copy()
         }
 
+    @timed("browser_prompt", ok=lambda r: r[0])
     def _process_single_prompt(self, prompt_data: Dict, index: int, total: int) -> Tuple[bool, Optional[Path], float, str]:
         """
         Xu ly mot prompt don le.
@@ -1722,6 +1724,7 @@ class BrowserFlowGenerator:
             "stats": self.stats.copy()
         }
 
+    @timed("browser_character_images")
     def generate_character_images(
         self,
         excel_path: Optional[Path] = None,
@@ -2421,6 +2424,7 @@ class BrowserFlowGenerator:
     # API MODE - Direct API call without browser
     # =========================================================================
 
+    @timed("browser_scene_images_api")
     def generate_scene_images_api(
         self,
         excel_path: Optional[Path] = None,
@@ -2694,6 +2698,7 @@ class BrowserFlowGenerator:
             "stats": self.stats.copy()
         }
 
+    @timed("browser_scene_videos_api")
     def generate_scene_videos_api(
         self,
         excel_path: Optional[Path] = None,
@@ -2892,6 +2897,7 @@ class BrowserFlowGenerator:
             "stats": self.stats.copy()
         }
 
+    @timed("browser_prompts_api")
     def generate_from_prompts_api(
         self,
         prompts: List[Dict],
@@ -3175,6 +3181,7 @@ class BrowserFlowGenerator:
         # Generate images - use self.img_path as output directory
         return self._generate_images_drission_mode(prompts, self.img_path, excel_path)
 
+    @timed("browser_drission_mode")
     def _generate_images_drission_mode(
         self,
         prompts: List[Dict[str, Any]],
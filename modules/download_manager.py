@@ -0,0 +1,273 @@
+"""
+VE3 Tool - Download Manager
+===========================
+Download ảnh/video đã tạo qua một HTTP session dùng chung.
+
+Tính năng:
+- Connection pool (requests.Session + HTTPAdapter) - không mở TCP/TLS mới mỗi file
+- Stream từng chunk ra file tạm (.part) rồi rename atomic khi xong
+- Kiểm tra size (Content-Length) và hash (x-goog-hash md5)
+- Resume bằng HTTP Range cho video lớn khi kết nối bị đứt
+
+Usage:
+    from modules.download_manager import get_download_manager
+
+    dm = get_download_manager()
+    ok = dm.download(url, Path("img/scene_001.png"))
+"""
+
+import os
+import base64
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Callable
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Chunk 256KB - đủ lớn để ít syscall, đủ nhỏ để không giữ cả file trong RAM
+CHUNK_SIZE = 256 * 1024
+
+# File lớn hơn ngưỡng này mới giữ lại .part để resume (ảnh nhỏ thì tải lại luôn)
+RESUME_MIN_BYTES = 1024 * 1024
+
+
+@dataclass
+class DownloadResult:
+    """Kết quả download một file."""
+    url: str
+    path: Path
+    success: bool = False
+    size: int = 0
+    resumed: bool = False
+    status_code: int = 0
+    error: Optional[str] = None
+
+
+class DownloadManager:
+    """
+    Quản lý download với connection pool dùng chung.
+
+    Thread-safe: requests.Session an toàn cho nhiều thread khi chỉ dùng để GET
+    (không thay đổi headers/cookies sau khi tạo).
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 16,
+        max_workers: int = 6,
+        timeout: int = 120,
+        max_retries: int = 3,
+        log_callback: Optional[Callable[[str], None]] = None
+    ):
+        """
+        Args:
+            pool_size: Số connection giữ lại mỗi host
+            max_workers: Số download song song tối đa (caller dùng làm cỡ thread pool)
+            timeout: Timeout (giây) cho connect/read
+            max_retries: Số lần thử lại (có resume) khi lỗi mạng
+            log_callback: Callback để log messages
+        """
+        self.pool_size = pool_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.log_callback = log_callback
+        self.session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        """Tạo session với HTTPAdapter pool cho cả http và https."""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _log(self, msg: str):
+        if self.log_callback:
+            self.log_callback(msg)
+
+    # =========================================================================
+    # SINGLE DOWNLOAD
+    # =========================================================================
+
+    def download(
+        self,
+        url: str,
+        output_path: Path,
+        expected_size: Optional[int] = None,
+        proxies: Optional[Dict[str, str]] = None
+    ) -> DownloadResult:
+        """
+        Download URL về output_path (stream + atomic rename + resume).
+
+        Args:
+            url: URL cần tải (signed URL, không cần auth)
+            output_path: Đường dẫn file đích
+            expected_size: Size mong đợi (bytes), None = lấy từ Content-Length
+            proxies: Proxy cho request (nếu có)
+
+        Returns:
+            DownloadResult
+        """
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = output_path.with_name(output_path.name + ".part")
+        result = DownloadResult(url=url, path=output_path)
+
+        for attempt in range(self.max_retries):
+            try:
+                self._download_once(url, part_path, result, expected_size, proxies)
+                break
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                result.error = f"Network error: {e}"
+                self._log(f"[Download] {output_path.name}: {result.error} (lần {attempt + 1})")
+            except Exception as e:
+                result.error = str(e)
+                break
+        else:
+            # Hết lượt thử vì lỗi mạng → giữ .part để lần gọi sau resume
+            return result
+
+        if result.error:
+            # Chỉ bỏ .part khi không dùng tiếp được (HTTP 4xx, sai size/MD5)
+            if 400 <= result.status_code < 500 or "mismatch" in result.error:
+                self._discard_part(part_path)
+            return result
+
+        os.replace(part_path, output_path)
+        result.success = True
+        return result
+
+    def _download_once(
+        self,
+        url: str,
+        part_path: Path,
+        result: DownloadResult,
+        expected_size: Optional[int],
+        proxies: Optional[Dict[str, str]]
+    ) -> None:
+        """
+        Một lần tải (có thể resume từ .part).
+
+        Lỗi không retry được (HTTP 4xx, sai hash) → set result.error.
+        Lỗi mạng/đứt giữa chừng → raise để download() thử lại (resume).
+        """
+        result.error = None
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        with self.session.get(url, headers=headers, stream=True,
+                              timeout=self.timeout, proxies=proxies) as resp:
+            result.status_code = resp.status_code
+
+            if resp.status_code == 416 and offset:
+                # .part đã hỏng/đủ - tải lại từ đầu
+                self._discard_part(part_path)
+                return self._download_once(url, part_path, result, expected_size, proxies)
+
+            if resp.status_code not in (200, 206):
+                result.error = f"HTTP {resp.status_code}"
+                return
+
+            # Server bỏ qua Range → ghi lại từ đầu
+            if resp.status_code == 200:
+                offset = 0
+            result.resumed = offset > 0
+
+            total = self._total_size(resp, offset)
+            if expected_size is None:
+                expected_size = total
+
+            md5 = hashlib.md5()
+            if offset:
+                # Hash phần đã có để kiểm tra toàn bộ file
+                with open(part_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        md5.update(chunk)
+
+            mode = "ab" if offset else "wb"
+            written = offset
+            with open(part_path, mode) as f:
+                for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    md5.update(chunk)
+                    written += len(chunk)
+
+            result.size = written
+
+        if expected_size is not None and written != expected_size:
+            if written < expected_size:
+                # Đứt giữa chừng - file lớn giữ .part để resume, file nhỏ tải lại
+                if written < RESUME_MIN_BYTES:
+                    self._discard_part(part_path)
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"incomplete body {written}/{expected_size}"
+                )
+            result.error = f"Size mismatch: {written} != {expected_size}"
+            return
+
+        goog_md5 = self._goog_md5(resp)
+        if goog_md5 and md5.digest() != goog_md5:
+            result.error = "MD5 mismatch (x-goog-hash)"
+
+    @staticmethod
+    def _total_size(resp: requests.Response, offset: int) -> Optional[int]:
+        """Tổng size file từ Content-Range (206) hoặc Content-Length (200)."""
+        content_range = resp.headers.get("Content-Range", "")
+        if "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            if total.isdigit():
+                return int(total)
+        length = resp.headers.get("Content-Length")
+        if length and length.isdigit():
+            return int(length) + offset
+        return None
+
+    @staticmethod
+    def _goog_md5(resp: requests.Response) -> Optional[bytes]:
+        """Lấy md5 từ header x-goog-hash của Google Storage (nếu có)."""
+        for part in resp.headers.get("x-goog-hash", "").split(","):
+            key, _, value = part.strip().partition("=")
+            if key == "md5" and value:
+                try:
+                    return base64.b64decode(value)
+                except Exception:
+                    return None
+        return None
+
+    @staticmethod
+    def _discard_part(part_path: Path):
+        try:
+            part_path.unlink()
+        except OSError:
+            pass
+
+    def close(self):
+        self.session.close()
+
+
+# =============================================================================
+# SHARED INSTANCE
+# =============================================================================
+
+_shared_manager: Optional[DownloadManager] = None
+_shared_lock = threading.Lock()
+
+
+def get_download_manager() -> DownloadManager:
+    """Lấy DownloadManager dùng chung cho toàn process (tạo lần đầu gọi)."""
+    global _shared_manager
+    with _shared_lock:
+        if _shared_manager is None:
+            _shared_manager = DownloadManager()
+        return _shared_manager
@@ -23,6 +23,9 @@ from typing import Optional, Tuple, List, Dict, Any, Callable
 from dataclasses import dataclass
 from datetime import datetime
 
+from modules.utils import decode_base64_to_file
+from modules.metrics import timed
+
 # Optional DrissionPage import
 DRISSION_AVAILABLE = False
 try:
@@ -699,6 +702,7 @@ class DrissionFlowAPI:
         except Exception as e:
             pass
 
+    @timed("drission_setup", ok=bool)
     def setup(
         self,
         wait_for_project: bool = True,
@@ -1306,6 +1310,7 @@ class DrissionFlowAPI:
         self.log("    ✗ Không lấy được recaptchaToken mới", "ERROR")
         return False
 
+    @timed("drission_call_api", ok=lambda r: r[1] is None)
     def call_api(self, prompt: str = None, num_images: int = 1, image_inputs: Optional[List[Dict]] = None) -> Tuple[List[GeneratedImage], Optional[str]]:
         """
         Gọi API với captured tokens.
@@ -1560,6 +1565,7 @@ class DrissionFlowAPI:
         self.log("✗ Timeout đợi response từ browser", "ERROR")
         return [], "Timeout waiting for browser response"
 
+    @timed("drission_generate_image", ok=lambda r: r[0])
     def generate_image(
         self,
         prompt: str,
@@ -1800,7 +1806,7 @@ class DrissionFlowAPI:
 
                 if img.base64_data:
                     img_path = save_dir / f"{fname}.png"
-                    img_path.write_bytes(base64.b64decode(img.base64_data))
+                    decode_base64_to_file(img.base64_data, img_path)
                     img.local_path = img_path
                     self.log(f"✓ Saved: {img_path.name}")
                 elif img.url:
@@ -1875,7 +1881,7 @@ class DrissionFlowAPI:
                     fname = f"batch_{i+1:03d}_{j+1}"
                     if img.base64_data:
                         img_path = save_dir / f"{fname}.png"
-                        img_path.write_bytes(base64.b64decode(img.base64_data))
+                        decode_base64_to_file(img.base64_data, img_path)
                         img.local_path = img_path
 
                 results["success"] += 1
@@ -1893,6 +1899,7 @@ class DrissionFlowAPI:
         self.log(f"DONE: {results['success']}/{results['total']}")
         return results
 
+    @timed("drission_generate_video", ok=lambda r: r[0])
     def generate_video(
         self,
         media_id: str,
@@ -4,6 +4,7 @@ VE3 Tool - Excel Manager Module
 Quản lý file Excel chứa prompts và thông tin nhân vật.
 """
 
+import threading
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
@@ -15,6 +16,29 @@ from openpyxl.utils import get_column_letter
 from modules.utils import get_logger
 
 
+# ============================================================================
+# WORKBOOK LOCK
+# ============================================================================
+
+_WORKBOOK_LOCKS: Dict[str, threading.RLock] = {}
+_WORKBOOK_LOCKS_GUARD = threading.Lock()
+
+
+def workbook_lock(path: Union[str, Path]) -> threading.RLock:
+    """
+    Lock theo file Excel (dùng chung mọi PromptWorkbook cùng path).
+
+    load/save tự lấy lock; giữ lock ngoài để load → sửa → save không bị
+    thread tạo ảnh ghi chen giữa.
+    """
+    key = str(Path(path).resolve())
+    with _WORKBOOK_LOCKS_GUARD:
+        lock = _WORKBOOK_LOCKS.get(key)
+        if lock is None:
+            lock = _WORKBOOK_LOCKS[key] = threading.RLock()
+        return lock
+
+
 # ============================================================================
 # CONSTANTS
 # ============================================================================
@@ -44,6 +68,7 @@ DIRECTOR_PLAN_COLUMNS = [
     "reference_files",  # JSON list reference files (backup)
     "img_prompt",       # Backup prompt (dùng nếu director fail)
     "status",           # backup/pending/done
+    "srt_hash",         # Hash lời dẫn SRT nguyên văn trong khoảng (diff khi SRT bị sửa)
 ]
 
 # Cột cho sheet Scenes
@@ -359,7 +384,8 @@ class PromptWorkbook:
         """
         if self.path.exists():
             self.logger.info(f"Loading existing Excel file: {self.path}")
-            self.workbook = load_workbook(self.path)
+            with workbook_lock(self.path):
+                self.workbook = load_workbook(self.path)
         else:
             self.logger.info(f"Creating new Excel file: {self.path}")
             self._create_new_workbook()
@@ -480,6 +506,7 @@ class PromptWorkbook:
             "reference_files": 30,
             "img_prompt": 60,
             "status": 10,
+            "srt_hash": 18,
         }
 
         for col, column_name in enumerate(DIRECTOR_PLAN_COLUMNS, start=1):
@@ -493,7 +520,8 @@ class PromptWorkbook:
         # Đảm bảo thư mục tồn tại
         self.path.parent.mkdir(parents=True, exist_ok=True)
         
-        self.workbook.save(self.path)
+        with workbook_lock(self.path):
+            self.workbook.save(self.path)
         self.logger.debug(f"Saved Excel file: {self.path}")
     
     # ========================================================================
@@ -781,6 +809,7 @@ class PromptWorkbook:
             scenes_data: List các scene dict với keys:
                 - scene_id, srt_start, srt_end, duration, text (required)
                 - characters_used, location_used, reference_files, img_prompt (optional - backup)
+                - srt_hash (optional - hash lời dẫn SRT nguyên văn, xem PromptGenerator)
         """
         self._ensure_director_plan_sheet()
 
@@ -789,6 +818,9 @@ class PromptWorkbook:
         # Xóa dữ liệu cũ (giữ header)
         if ws.max_row > 1:
             ws.delete_rows(2, ws.max_row)
+        # Excel cũ (10 cột) → thêm header srt_hash
+        if not ws.cell(row=1, column=11).value:
+            ws.cell(row=1, column=11, value=DIRECTOR_PLAN_COLUMNS[10])
 
         # Thêm scenes
         for scene in scenes_data:
@@ -806,6 +838,7 @@ class PromptWorkbook:
             ws.cell(row=next_row, column=8, value=scene.get("reference_files", "[]"))
             ws.cell(row=next_row, column=9, value=scene.get("img_prompt", "")[:1000])
             ws.cell(row=next_row, column=10, value=scene.get("status", "backup"))
+            ws.cell(row=next_row, column=11, value=scene.get("srt_hash", ""))
 
         self.save()
         self.logger.info(f"Saved {len(scenes_data)} scenes to director_plan")
@@ -826,7 +859,7 @@ class PromptWorkbook:
             if row[0] is None:
                 continue
 
-            # Handle both old format (6 cols) and new format (10 cols)
+            # Handle old format (6 / 10 cols) and new format (11 cols)
             plans.append({
                 "plan_id": row[0],
                 "srt_start": row[1] or "",
@@ -838,6 +871,7 @@ class PromptWorkbook:
                 "reference_files": row[7] if len(row) > 7 else "[]",
                 "img_prompt": row[8] if len(row) > 8 else "",
                 "status": row[9] if len(row) > 9 else "pending",
+                "srt_hash": (row[10] or "") if len(row) > 10 else "",
             })
 
         return plans
@@ -0,0 +1,306 @@
+"""
+VE3 Tool - Forced Alignment (script → SRT)
+==========================================
+Voice đọc từ kịch bản có sẵn: thay vì nhận dạng tự do bằng Whisper, căn
+chỉnh (forced alignment) đúng text kịch bản vào audio để lấy timestamp.
+Nhanh hơn nhiều trên CPU (1 lượt acoustic model, không decode beam search)
+và text trong SRT chính xác 100% theo kịch bản.
+
+- Model CTC đa ngôn ngữ MMS_FA (torchaudio) - text romanize (bỏ dấu tiếng
+  Việt, đ → d) về bảng chữ a-z của model
+- Audio decode bằng ffmpeg (mono 16 kHz), emission tính theo cửa sổ 30s
+- Căn theo block ~60s kịch bản: cửa sổ audio ước lượng theo tốc độ đọc
+  trung bình + dư; token "*" cuối block hút phần audio của block sau
+  (CTC Viterbi - torchaudio.functional.forced_align)
+- Độ tin cậy = xác suất trung bình mỗi từ; thấp hơn ngưỡng (kịch bản không
+  khớp voice, đọc lệch nhiều) → trả None để caller dùng Whisper
+
+Usage:
+    from modules.forced_align import ForcedAligner, find_script, FORCED_ALIGN_AVAILABLE
+
+    script = find_script(voice_path)
+    if script and FORCED_ALIGN_AVAILABLE:
+        result = ForcedAligner(min_score=0.45).align(voice_path, script.read_text("utf-8"))
+        if result:   # cùng format dict của VoiceToSrt.transcribe
+            write_transcript(result, srt_path)
+"""
+
+import re
+import time
+import subprocess
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from modules.utils import get_logger
+from modules.metrics import inc, observe
+
+
+# ============================================================================
+# AVAILABILITY CHECK
+# ============================================================================
+
+FORCED_ALIGN_AVAILABLE = False
+
+try:
+    import torch
+    import torchaudio
+    from torchaudio.pipelines import MMS_FA
+    FORCED_ALIGN_AVAILABLE = True
+except ImportError:
+    torch = None
+    torchaudio = None
+    MMS_FA = None
+
+
+SAMPLE_RATE = 16000
+
+# Emission tính theo cửa sổ (giây) - giới hạn RAM với voice dài
+EMISSION_WINDOW_S = 30.0
+
+# Mỗi block căn chỉnh ~ bấy nhiêu giây audio (ước lượng theo số ký tự)
+BLOCK_SECONDS = 60.0
+
+# Cửa sổ audio của block = ước lượng × hệ số + dư (giây)
+WINDOW_SLACK = 1.5
+WINDOW_EXTRA_S = 10.0
+
+# Số từ tối đa mỗi dòng SRT (câu dài tách theo dấu phẩy / số từ)
+MAX_CUE_WORDS = 14
+
+# Tên file kịch bản cạnh voice: <tên>.txt, <tên>_script.txt, <tên>.script.txt
+SCRIPT_SUFFIXES = (".txt", "_script.txt", ".script.txt")
+
+SENTENCE_RE = re.compile(r"[^.!?…。\n]+[.!?…。]*")
+
+
+def find_script(voice_path: Path) -> Optional[Path]:
+    """File kịch bản nằm cạnh voice (None nếu không có / rỗng)."""
+    voice_path = Path(voice_path)
+    for suffix in SCRIPT_SUFFIXES:
+        candidate = voice_path.parent / f"{voice_path.stem}{suffix}"
+        if candidate.is_file() and candidate.stat().st_size > 0:
+            return candidate
+    return None
+
+
+def romanize(word: str) -> str:
+    """Từ → chữ a-z + ' cho model MMS_FA (bỏ dấu, đ → d)."""
+    word = word.lower().replace("đ", "d")
+    word = unicodedata.normalize("NFKD", word)
+    return "".join(ch for ch in word if "a" <= ch <= "z" or ch == "'")
+
+
+def split_cues(text: str, max_words: int = MAX_CUE_WORDS) -> List[List[str]]:
+    """
+    Kịch bản → các dòng SRT (list từ gốc, giữ dấu câu).
+
+    Tách theo câu; câu dài tách tiếp ở dấu phẩy rồi theo max_words.
+    """
+    cues = []
+    for sentence in SENTENCE_RE.findall(text or ""):
+        words = sentence.split()
+        if not words:
+            continue
+        current: List[str] = []
+        split = False
+        for word in words:
+            current.append(word)
+            at_comma = word.endswith((",", ";", ":"))
+            if len(current) >= max_words or (at_comma and len(current) >= max_words // 2):
+                cues.append(current)
+                current = []
+                split = True
+        if current:
+            # Đuôi câu quá ngắn → gộp vào dòng trước của cùng câu
+            if split and len(current) < 3 and len(cues[-1]) + len(current) <= max_words + 3:
+                cues[-1].extend(current)
+            else:
+                cues.append(current)
+    return cues
+
+
+# ============================================================================
+# FORCED ALIGNER
+# ============================================================================
+
+class ForcedAligner:
+    """
+    Căn chỉnh kịch bản vào voice bằng model CTC MMS_FA (CPU).
+
+    Model load 1 lần (lazy), dùng lại cho nhiều voice.
+    """
+
+    def __init__(self, min_score: float = 0.45, max_low_words: float = 0.2,
+                 device: Optional[str] = None):
+        """
+        Args:
+            min_score: Xác suất trung bình tối thiểu mỗi từ (0-1)
+            max_low_words: Tối đa bấy nhiêu phần từ có xác suất < 0.1
+            device: cpu / cuda (None = cpu)
+        """
+        if not FORCED_ALIGN_AVAILABLE:
+            raise RuntimeError("Forced alignment cần torch + torchaudio >= 2.1 (pip install torchaudio)")
+        self.min_score = min_score
+        self.max_low_words = max_low_words
+        self.device = device or "cpu"
+        self.logger = get_logger("forced_align")
+        self._model = None
+        self._tokenizer = None
+        self._aligner = None
+
+    def _load_model(self):
+        if self._model is not None:
+            return
+        self.logger.info("Loading MMS_FA alignment model")
+        self._model = MMS_FA.get_model(with_star=True).to(self.device)
+        self._model.eval()
+        self._tokenizer = MMS_FA.get_tokenizer()
+        self._aligner = MMS_FA.get_aligner()
+
+    @staticmethod
+    def _decode_audio(audio_path: Path) -> "torch.Tensor":
+        """Voice (mp3/wav/...) → tensor float32 mono 16 kHz (ffmpeg)."""
+        cmd = ["ffmpeg", "-nostdin", "-v", "error", "-i", str(audio_path),
+               "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "-"]
+        proc = subprocess.run(cmd, capture_output=True, check=True)
+        return torch.frombuffer(bytearray(proc.stdout), dtype=torch.float32)
+
+    def _emission(self, waveform: "torch.Tensor") -> "torch.Tensor":
+        """Log-prob (frames × vocab) cho cả voice, tính theo cửa sổ EMISSION_WINDOW_S."""
+        step = int(EMISSION_WINDOW_S * SAMPLE_RATE)
+        parts = []
+        with torch.inference_mode():
+            for start in range(0, waveform.numel(), step):
+                chunk = waveform[start:start + step]
+                if chunk.numel() < SAMPLE_RATE // 10:
+                    break
+                emission, _ = self._model(chunk.unsqueeze(0).to(self.device))
+                parts.append(emission[0].cpu())
+        return torch.cat(parts) if parts else torch.empty(0)
+
+    def align(self, audio_path: Path, script_text: str) -> Optional[Dict[str, Any]]:
+        """
+        Căn kịch bản vào voice.
+
+        Returns:
+            Dict cùng format VoiceToSrt.transcribe (segments có words), thêm
+            alignment_score; None nếu độ tin cậy thấp hoặc kịch bản rỗng.
+        """
+        cues = split_cues(script_text)
+        tokens_words = [(ci, w, r) for ci, cue in enumerate(cues) for w in cue for r in [romanize(w)] if r]
+        if not tokens_words:
+            return None
+
+        start = time.time()
+        self._load_model()
+        waveform = self._decode_audio(Path(audio_path))
+        duration = waveform.numel() / SAMPLE_RATE
+        emission = self._emission(waveform)
+        if not emission.numel():
+            return None
+        seconds_per_frame = duration / emission.size(0)
+
+        timings = self._align_blocks(emission, [r for _, _, r in tokens_words], seconds_per_frame)
+        if timings is None:
+            inc("forced_align", result="failed")
+            return None
+
+        scores = [score for _, _, score in timings]
+        mean_score = sum(scores) / len(scores)
+        low_ratio = sum(1 for s in scores if s < 0.1) / len(scores)
+        seconds = time.time() - start
+        self.logger.info(
+            f"[Align] {len(tokens_words)} từ, score {mean_score:.2f}, {low_ratio:.0%} từ thấp, "
+            f"{duration:.0f}s audio trong {seconds:.1f}s"
+        )
+        if mean_score < self.min_score or low_ratio > self.max_low_words:
+            inc("forced_align", result="low_confidence")
+            return None
+        inc("forced_align", result="ok")
+        observe("forced_align_rtf", seconds / duration if duration else 0.0)
+
+        # Gộp timing từ → dòng SRT (từ chỉ có số/ký hiệu không có timing riêng)
+        by_cue: Dict[int, List[tuple]] = {}
+        for (ci, word, _), (s, e, score) in zip(tokens_words, timings):
+            by_cue.setdefault(ci, []).append((word, s, e, score))
+        segments: List[Dict[str, Any]] = []
+        for ci, cue in enumerate(cues):
+            cue_words = by_cue.get(ci)
+            if not cue_words:
+                # Dòng không có từ căn được (vd. chỉ có số) → nối vào dòng trước
+                if segments:
+                    segments[-1]["text"] += " " + " ".join(cue)
+                continue
+            segments.append({
+                "id": len(segments),
+                "start": cue_words[0][1],
+                "end": cue_words[-1][2],
+                "text": " ".join(cue),
+                "words": [
+                    {"text": w, "start": s, "end": e, "confidence": sc}
+                    for w, s, e, sc in cue_words
+                ],
+            })
+        # Kéo end mỗi dòng tới sát dòng sau (tối đa 0.5s) - tránh phụ đề nhấp nháy
+        for cur, nxt in zip(segments, segments[1:]):
+            cur["end"] = max(cur["end"], min(nxt["start"], cur["end"] + 0.5))
+
+        return {
+            "text": " ".join(" ".join(cue) for cue in cues),
+            "segments": segments,
+            "duration": duration,
+            "alignment_score": round(mean_score, 3),
+            "transcribe_seconds": round(seconds, 3),
+            "rtf": round(seconds / duration, 4) if duration else 0.0,
+        }
+
+    def _align_blocks(self, emission: "torch.Tensor", words: List[str],
+                      seconds_per_frame: float) -> Optional[List[tuple]]:
+        """
+        Căn lần lượt từng block ~BLOCK_SECONDS: cửa sổ frame bắt đầu từ cuối
+        từ đã căn của block trước, độ dài theo tốc độ đọc trung bình.
+
+        Returns:
+            [(start_s, end_s, score)] theo từng từ, None nếu block lỗi
+        """
+        total_frames = emission.size(0)
+        total_chars = sum(len(w) for w in words)
+        frames_per_char = total_frames / total_chars
+        chars_per_block = max(1, int(BLOCK_SECONDS / seconds_per_frame / frames_per_char))
+        extra_frames = int(WINDOW_EXTRA_S / seconds_per_frame)
+
+        timings: List[tuple] = []
+        idx = 0
+        frame = 0
+        while idx < len(words):
+            block: List[str] = []
+            chars = 0
+            while idx + len(block) < len(words) and (not block or chars < chars_per_block):
+                block.append(words[idx + len(block)])
+                chars += len(block[-1])
+            last_block = idx + len(block) >= len(words)
+            if last_block:
+                end_frame = total_frames
+            else:
+                end_frame = min(total_frames, frame + int(chars * frames_per_char * WINDOW_SLACK) + extra_frames)
+            window = emission[frame:end_frame]
+            # Block sau vẫn nằm trong cửa sổ → "*" hút phần audio đó
+            transcript = block if last_block else block + ["*"]
+            tokens = self._tokenizer(transcript)
+            if window.size(0) < sum(len(t) for t in tokens):
+                return None
+            try:
+                spans = self._aligner(window, tokens)
+            except Exception as e:
+                self.logger.warning(f"[Align] Block từ {idx} lỗi: {e}")
+                return None
+            for word_spans in spans[:len(block)]:
+                s = frame + word_spans[0].start
+                e = frame + word_spans[-1].end
+                length = sum(sp.end - sp.start for sp in word_spans) or 1
+                score = sum(sp.score * (sp.end - sp.start) for sp in word_spans) / length
+                timings.append((s * seconds_per_frame, e * seconds_per_frame, float(score)))
+            frame = frame + spans[len(block) - 1][-1].end
+            idx += len(block)
+        return timings
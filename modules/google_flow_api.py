@@ -22,6 +22,10 @@ from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 from dataclasses import dataclass, field
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
+
+from .download_manager import get_download_manager
+from .utils import decode_base64_to_file
 
 
 # =============================================================================
@@ -842,34 +846,22 @@ class GoogleFlowAPI:
             if image.url:
                 self._log(f"Downloading from fifeUrl...")
                 
-                # Use simple GET request (no auth needed - URL is signed)
-                response = requests.get(image.url, timeout=60)
+                # Shared pooled session (no auth needed - URL is signed)
+                result = get_download_manager().download(image.url, output_path)
                 
-                if response.status_code == 200:
-                    with open(output_path, "wb") as f:
-                        f.write(response.content)
+                if result.success:
                     image.local_path = output_path
                     self._log(f"✓ Saved to {output_path}")
                     return output_path
                 else:
-                    self._log(f"URL download failed ({response.status_code}), trying base64...")
+                    self._log(f"URL download failed ({result.error}), trying base64...")
             
             # Priority 2: Decode from encodedImage (base64)
             if image.base64_data:
                 self._log("Decoding base64 encodedImage...")
                 
-                # Remove data URL prefix if present
-                b64_data = image.base64_data
-                if "," in b64_data:
-                    b64_data = b64_data.split(",")[1]
-                
-                # Remove any whitespace/newlines
-                b64_data = b64_data.strip().replace("\n", "").replace("\r", "")
-                
-                img_bytes = base64.b64decode(b64_data)
-                
-                with open(output_path, "wb") as f:
-                    f.write(img_bytes)
+                # Decode theo chunk thẳng ra file (xử lý cả data URL prefix/newlines)
+                decode_base64_to_file(image.base64_data, output_path)
                 
                 image.local_path = output_path
                 self._log(f"✓ Saved to {output_path}")
@@ -899,17 +891,21 @@ class GoogleFlowAPI:
         Returns:
             List of paths to downloaded files
         """
-        downloaded = []
+        if not images:
+            return []
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filenames = [f"{prefix}_{timestamp}_{i+1}" for i in range(len(images))]
+
+        # Download song song (bounded pool), giữ đúng thứ tự kết quả
+        workers = min(get_download_manager().max_workers, len(images))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            paths = list(executor.map(
+                lambda args: self.download_image(args[0], output_dir, args[1]),
+                zip(images, filenames)
+            ))
         
-        for i, img in enumerate(images):
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{prefix}_{timestamp}_{i+1}"
-            
-            path = self.download_image(img, output_dir, filename)
-            if path:
-                downloaded.append(path)
-        
-        return downloaded
+        return [path for path in paths if path]
     
     # =========================================================================
     # IMAGE UPLOAD (Reference Images)
@@ -1972,18 +1968,15 @@ class GoogleFlowAPI:
         try:
             self._log(f"Downloading video from: {video_result.video_url[:60]}...")
 
-            response = requests.get(video_result.video_url, timeout=120, stream=True)
-
-            if response.status_code == 200:
-                with open(output_path, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
+            # Stream + resume (Range) qua pooled session
+            result = get_download_manager().download(video_result.video_url, output_path)
 
+            if result.success:
                 video_result.local_path = output_path
                 self._log(f"✓ Saved to {output_path}")
                 return output_path
             else:
-                self._log(f"Download failed: {response.status_code}")
+                self._log(f"Download failed: {result.error}")
                 return None
 
         except Exception as e:
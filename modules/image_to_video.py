@@ -31,6 +31,7 @@ from .google_flow_api import (
     VideoModel,
     PaygateTier
 )
+from .download_manager import get_download_manager
 
 
 @dataclass
@@ -611,19 +612,13 @@ class ImageToVideoConverter:
         self._log(f"Downloading video to: {output_path.name}")
 
         try:
-            response = requests.get(video_url, stream=True, timeout=120)
-
-            if response.status_code == 200:
-                output_path.parent.mkdir(parents=True, exist_ok=True)
-
-                with open(output_path, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
+            result = get_download_manager().download(video_url, output_path)
 
+            if result.success:
                 self._log(f"Downloaded: {output_path.name}")
                 return True
             else:
-                self._log(f"Download failed: {response.status_code}", "error")
+                self._log(f"Download failed: {result.error}", "error")
                 return False
 
         except Exception as e:
@@ -0,0 +1,166 @@
+"""
+VE3 Tool - LLM Request Hedging
+==============================
+Cắt tail latency khi 1 request LLM bị treo lâu trên 1 key / provider:
+
+- Học latency theo provider + cỡ prompt (bucket theo số token ước lượng),
+  ngưỡng hedge = percentile (mặc định p90) của các request gần đây
+- Request vượt ngưỡng → gửi bản sao sang provider/key khác đang rảnh,
+  lấy response hợp lệ đến trước, huỷ request còn lại
+- Trần chi phí mỗi run: số token (ước lượng) gửi thêm cho provider trả phí
+  + tỷ lệ request được hedge
+
+Usage:
+    from modules.llm_hedging import HedgePolicy
+
+    policy = HedgePolicy(percentile=0.9, max_extra_tokens=300000)
+    delay = policy.hedge_delay("deepseek", prompt_tokens)
+    if policy.try_reserve("deepseek", prompt_tokens + max_tokens):
+        ... gửi bản sao
+    policy.record_latency("deepseek", prompt_tokens, seconds)
+"""
+
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+
+# Số mẫu latency giữ lại mỗi (provider, bucket)
+LATENCY_WINDOW = 50
+
+# Cần ít nhất bấy nhiêu mẫu mới dùng percentile đã học
+MIN_SAMPLES = 5
+
+# Ngưỡng khi chưa đủ mẫu (giây) - chỉ hedge request thật sự treo
+DEFAULT_HEDGE_AFTER = 120.0
+
+# Không hedge sớm hơn mức này (request ngắn: hedge không đáng)
+MIN_HEDGE_AFTER = 5.0
+
+# Provider chạy local - không tính vào trần chi phí
+FREE_PROVIDERS = ("ollama",)
+
+
+def _bucket(prompt_tokens: int) -> int:
+    """Bucket cỡ prompt: 0 (<1K), 1 (1-2K), 2 (2-4K), 3 (4-8K)..."""
+    bucket = 0
+    size = 1024
+    while prompt_tokens >= size and bucket < 8:
+        size *= 2
+        bucket += 1
+    return bucket
+
+
+class HedgePolicy:
+    """
+    Ngưỡng hedge theo latency đã học + trần chi phí hedge mỗi run.
+
+    Thread-safe (request chạy song song trên nhiều thread / event loop).
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.9,
+        default_after: float = DEFAULT_HEDGE_AFTER,
+        max_extra_tokens: int = 300000,
+        max_hedge_ratio: float = 0.2,
+        min_after: float = MIN_HEDGE_AFTER
+    ):
+        """
+        Args:
+            percentile: Percentile latency làm ngưỡng hedge
+            default_after: Ngưỡng (giây) khi chưa đủ mẫu
+            max_extra_tokens: Trần token gửi thêm cho provider trả phí mỗi run
+            max_hedge_ratio: Tối đa bấy nhiêu phần request được hedge mỗi run
+            min_after: Ngưỡng tối thiểu (giây)
+        """
+        self.percentile = percentile
+        self.default_after = default_after
+        self.max_extra_tokens = max_extra_tokens
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_after = min_after
+        self._latencies: Dict[Tuple[str, int], Deque[float]] = {}
+        self._lock = threading.Lock()
+        self.reset_run()
+
+    def reset_run(self) -> None:
+        """Bắt đầu run mới (trần chi phí tính lại từ 0; latency đã học giữ nguyên)."""
+        with self._lock:
+            self.requests = 0
+            self.hedges = 0
+            self.hedge_wins = 0
+            self.extra_tokens = 0
+            self.skipped_budget = 0
+
+    # =========================================================================
+    # LATENCY
+    # =========================================================================
+
+    def record_latency(self, provider: str, prompt_tokens: int, seconds: float) -> None:
+        """Ghi latency 1 request thành công."""
+        key = (provider, _bucket(prompt_tokens))
+        with self._lock:
+            samples = self._latencies.get(key)
+            if samples is None:
+                samples = self._latencies[key] = deque(maxlen=LATENCY_WINDOW)
+            samples.append(seconds)
+
+    def hedge_delay(self, provider: str, prompt_tokens: int) -> float:
+        """Số giây chờ request chính trước khi gửi bản sao."""
+        with self._lock:
+            samples = self._latencies.get((provider, _bucket(prompt_tokens)))
+            if not samples or len(samples) < MIN_SAMPLES:
+                return self.default_after
+            ordered = sorted(samples)
+        idx = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.min_after, ordered[idx])
+
+    # =========================================================================
+    # BUDGET
+    # =========================================================================
+
+    def count_request(self) -> None:
+        """Đếm 1 request (mẫu số cho max_hedge_ratio)."""
+        with self._lock:
+            self.requests += 1
+
+    def try_reserve(self, provider: str, tokens: int) -> bool:
+        """
+        Giữ chỗ chi phí cho 1 bản sao; False nếu vượt trần run.
+
+        tokens: Ước lượng prompt + completion tối đa (provider trả phí)
+        """
+        with self._lock:
+            if self.hedges + 1 > max(1, int(self.requests * self.max_hedge_ratio)):
+                self.skipped_budget += 1
+                return False
+            if provider not in FREE_PROVIDERS:
+                if self.extra_tokens + tokens > self.max_extra_tokens:
+                    self.skipped_budget += 1
+                    return False
+                self.extra_tokens += tokens
+            self.hedges += 1
+            return True
+
+    def settle(self, provider: str, reserved: int, actual: Optional[int]) -> None:
+        """Chỉnh chi phí đã giữ theo usage thật (None = bị huỷ, giữ nguyên)."""
+        if provider in FREE_PROVIDERS or actual is None:
+            return
+        with self._lock:
+            self.extra_tokens += actual - reserved
+
+    def record_win(self) -> None:
+        """Bản sao trả về trước request chính."""
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Tổng hợp run hiện tại (log)."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "extra_tokens": self.extra_tokens,
+                "skipped_budget": self.skipped_budget,
+            }
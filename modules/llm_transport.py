@@ -0,0 +1,206 @@
+"""
+VE3 Tool - LLM HTTP Transport
+=============================
+Transport HTTP dùng chung cho mọi LLM provider (DeepSeek, Ollama, Groq,
+OpenRouter, Gemini).
+
+Tính năng:
+- Keep-alive connection pool theo endpoint (scheme://host:port) - không mở
+  TCP/TLS mới mỗi request
+- API async (apost) để hàng trăm request scene prompts chạy trên 1 event loop:
+  dùng httpx.AsyncClient nếu đã cài, không thì chạy request qua thread pool
+  trên cùng connection pool
+- Lỗi mạng của httpx được đổi sang requests.exceptions.* để code gọi xử lý
+  giống nhau ở cả sync và async
+
+Usage:
+    from modules.llm_transport import get_transport
+
+    transport = get_transport()
+    resp = transport.post(url, json=data, headers=headers, timeout=120)
+    resp = await transport.apost(url, json=data, headers=headers, timeout=120)
+"""
+
+import asyncio
+import threading
+import weakref
+from functools import partial
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# Connection giữ lại mỗi endpoint (đủ cho max_parallel_batches + hedging)
+DEFAULT_POOL_SIZE = 32
+
+# Thread chạy request async khi không có httpx
+DEFAULT_ASYNC_WORKERS = 32
+
+
+class LLMTransport:
+    """
+    Connection pool dùng chung cho các LLM client.
+
+    Thread-safe: mỗi endpoint 1 requests.Session (chỉ POST/GET, không đổi
+    headers/cookies sau khi tạo); mỗi event loop 1 httpx.AsyncClient.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, async_workers: int = DEFAULT_ASYNC_WORKERS):
+        """
+        Args:
+            pool_size: Số connection keep-alive tối đa mỗi endpoint
+            async_workers: Số thread cho apost khi không có httpx
+        """
+        self.pool_size = pool_size
+        self.async_workers = async_workers
+        self._sessions: Dict[str, requests.Session] = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    # =========================================================================
+    # SYNC
+    # =========================================================================
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def session(self, url: str) -> requests.Session:
+        """Session keep-alive cho endpoint của url (tạo khi dùng lần đầu)."""
+        origin = self._origin(url)
+        session = self._sessions.get(origin)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(origin)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount(origin, adapter)
+                    self._sessions[origin] = session
+        return session
+
+    def post(
+        self,
+        url: str,
+        json: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 120
+    ) -> requests.Response:
+        """POST qua connection pool của endpoint."""
+        return self.session(url).post(url, json=json, headers=headers, timeout=timeout)
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 10) -> requests.Response:
+        """GET qua connection pool của endpoint."""
+        return self.session(url).get(url, headers=headers, timeout=timeout)
+
+    # =========================================================================
+    # ASYNC
+    # =========================================================================
+
+    def _async_client(self):
+        """httpx.AsyncClient của event loop hiện tại (client không dùng chung giữa các loop)."""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=None, max_keepalive_connections=self.pool_size)
+            client = httpx.AsyncClient(limits=limits)
+            self._async_clients[loop] = client
+        return client
+
+    def _thread_pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.async_workers, thread_name_prefix="llm_transport"
+                    )
+        return self._executor
+
+    async def apost(
+        self,
+        url: str,
+        json: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 120
+    ):
+        """
+        POST async. Response có status_code / text / json() như requests.Response.
+
+        Raises:
+            requests.exceptions.ConnectionError / Timeout / RequestException
+        """
+        if httpx is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._thread_pool(), partial(self.post, url, json=json, headers=headers, timeout=timeout)
+            )
+
+        try:
+            return await self._async_client().post(url, json=json, headers=headers, timeout=timeout)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.exceptions.RequestException(str(e)) from e
+
+    async def aclose(self):
+        """Đóng httpx.AsyncClient của event loop hiện tại (gọi trước khi loop kết thúc)."""
+        if httpx is None:
+            return
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def close(self):
+        """Đóng mọi session sync + thread pool."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+# ============================================================================
+# SINGLETON
+# ============================================================================
+
+_transport: Optional[LLMTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> LLMTransport:
+    """Transport dùng chung cho cả process."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = LLMTransport()
+    return _transport
+
+
+def run_async(coro):
+    """
+    Chạy coroutine từ code sync (không có event loop đang chạy trong thread này).
+
+    Đóng httpx client của loop trước khi loop kết thúc.
+    """
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await get_transport().aclose()
+
+    return asyncio.run(_main())
@@ -0,0 +1,347 @@
+"""
+VE3 Tool - Media Probe Service
+==============================
+Lấy metadata (duration, kích thước, stream) của voice/video bằng ffprobe
+một lần cho cả project, thay vì spawn ffprobe tuần tự trong vòng render.
+
+Tính năng:
+- Probe song song nhiều file (ThreadPoolExecutor)
+- Cache theo path + size + mtime trong thư mục project (.media_probe.json)
+  → lần compose sau không phải probe lại file không đổi
+- Cache khả năng của ffmpeg (version, encoders) theo máy (~/.ve3/ffmpeg_caps.json)
+  → không chạy `ffmpeg -version` / `ffmpeg -encoders` mỗi lần compose
+
+Usage:
+    from modules.media_probe import MediaProbe, get_ffmpeg_capabilities
+
+    probe = MediaProbe(proj_dir / ".media_probe.json")
+    infos = probe.probe_many([voice_path, *video_paths])
+    duration = probe.duration(voice_path, default=60.0)
+
+    caps = get_ffmpeg_capabilities()
+    if caps.has_encoder("h264_nvenc"): ...
+"""
+
+import os
+import json
+import shutil
+import threading
+import subprocess
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Iterable, Union
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Số ffprobe chạy cùng lúc (I/O + process spawn, không nặng CPU)
+DEFAULT_PROBE_WORKERS = 8
+
+PROBE_TIMEOUT = 30
+
+# Bump khi đổi format cache
+CACHE_VERSION = 1
+
+PathLike = Union[str, Path]
+
+
+@dataclass
+class MediaInfo:
+    """Metadata của 1 file media."""
+    path: str
+    size: int = 0
+    mtime: float = 0.0
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    has_video: bool = False
+    has_audio: bool = False
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.duration is not None
+
+
+def _file_key(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+def _parse_probe_output(path: str, stdout: str) -> MediaInfo:
+    """Parse `ffprobe -of json` (fallback: chỉ có duration dạng số)."""
+    info = MediaInfo(path=path)
+    text = (stdout or "").strip()
+    if not text:
+        info.error = "empty ffprobe output"
+        return info
+    try:
+        data = json.loads(text)
+    except ValueError:
+        try:
+            info.duration = float(text.splitlines()[0])
+        except ValueError:
+            info.error = f"unparsable ffprobe output: {text[:80]}"
+        return info
+    if isinstance(data, (int, float)):
+        info.duration = float(data)
+        return info
+
+    fmt = data.get("format") or {}
+    try:
+        info.duration = float(fmt["duration"])
+    except (KeyError, TypeError, ValueError):
+        info.error = "no duration"
+    for stream in data.get("streams") or []:
+        kind = stream.get("codec_type")
+        if kind == "video":
+            info.has_video = True
+            info.width = info.width or stream.get("width")
+            info.height = info.height or stream.get("height")
+        elif kind == "audio":
+            info.has_audio = True
+    return info
+
+
+class MediaProbe:
+    """
+    ffprobe có cache theo project.
+
+    Thread-safe: cache được bảo vệ bởi lock, probe chạy ngoài lock.
+    """
+
+    def __init__(
+        self,
+        cache_path: Optional[PathLike] = None,
+        max_workers: int = DEFAULT_PROBE_WORKERS,
+        ffprobe: str = "ffprobe"
+    ):
+        """
+        Args:
+            cache_path: File JSON cache (None = chỉ cache trong RAM)
+            max_workers: Số ffprobe song song
+            ffprobe: Lệnh ffprobe
+        """
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.max_workers = max(1, max_workers)
+        self.ffprobe = ffprobe
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    # =========================================================================
+    # CACHE
+    # =========================================================================
+
+    def _load(self):
+        if not self.cache_path or not self.cache_path.exists():
+            return
+        try:
+            data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+            if data.get("version") == CACHE_VERSION:
+                self._cache = data.get("entries", {})
+        except (OSError, ValueError):
+            self._cache = {}
+
+    def save(self):
+        """Ghi cache ra file (atomic). Không làm gì nếu không có thay đổi."""
+        if not self.cache_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = {"version": CACHE_VERSION, "entries": dict(self._cache)}
+            self._dirty = False
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_suffix(self.cache_path.suffix + ".tmp")
+            tmp.write_text(json.dumps(payload, indent=1), encoding="utf-8")
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            pass
+
+    def _cached(self, key: str, stat: Dict[str, Any]) -> Optional[MediaInfo]:
+        entry = self._cache.get(key)
+        if entry and entry.get("size") == stat["size"] and entry.get("mtime") == stat["mtime"]:
+            return MediaInfo(**entry)
+        return None
+
+    # =========================================================================
+    # PROBE
+    # =========================================================================
+
+    def _run_ffprobe(self, path: Path) -> MediaInfo:
+        cmd = [
+            self.ffprobe, "-v", "error",
+            "-show_entries", "format=duration:stream=codec_type,width,height",
+            "-of", "json", str(path)
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return MediaInfo(path=str(path), error=str(e))
+        return _parse_probe_output(str(path), result.stdout)
+
+    def probe(self, path: PathLike) -> MediaInfo:
+        """Metadata 1 file (từ cache nếu file không đổi)."""
+        return self.probe_many([path])[str(Path(path).resolve())]
+
+    def probe_many(self, paths: Iterable[PathLike]) -> Dict[str, MediaInfo]:
+        """
+        Probe nhiều file song song, file nào đã có trong cache thì bỏ qua.
+
+        Returns:
+            Dict resolved path (str) -> MediaInfo
+        """
+        results: Dict[str, MediaInfo] = {}
+        todo: List[tuple] = []
+        seen = set()
+
+        with self._lock:
+            for p in paths:
+                path = Path(p).resolve()
+                key = str(path)
+                if key in seen:
+                    continue
+                seen.add(key)
+                stat = _file_key(path)
+                if stat is None:
+                    results[key] = MediaInfo(path=key, error="not found")
+                    continue
+                cached = self._cached(key, stat)
+                if cached:
+                    self.hits += 1
+                    results[key] = cached
+                else:
+                    self.misses += 1
+                    todo.append((key, path, stat))
+
+        if todo:
+            workers = min(self.max_workers, len(todo))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                probed = list(executor.map(lambda t: self._run_ffprobe(t[1]), todo))
+
+            with self._lock:
+                for (key, _, stat), info in zip(todo, probed):
+                    info.path = key
+                    info.size = stat["size"]
+                    info.mtime = stat["mtime"]
+                    results[key] = info
+                    # Không cache lỗi (ffprobe thiếu, file đang ghi dở...)
+                    if info.ok:
+                        self._cache[key] = asdict(info)
+                        self._dirty = True
+
+        return results
+
+    def duration(self, path: PathLike, default: Optional[float] = None) -> Optional[float]:
+        """Duration (giây) hoặc default nếu không probe được."""
+        info = self.probe(path)
+        return info.duration if info.ok else default
+
+
+# =============================================================================
+# FFMPEG CAPABILITIES (cache theo máy)
+# =============================================================================
+
+@dataclass
+class FFmpegCapabilities:
+    """Kết quả `ffmpeg -version` + `ffmpeg -encoders`."""
+    available: bool = False
+    path: str = ""
+    version: str = ""
+    encoders: List[str] = field(default_factory=list)
+
+    def has_encoder(self, name: str) -> bool:
+        return name in self.encoders
+
+
+def _default_caps_cache() -> Path:
+    return Path.home() / ".ve3" / "ffmpeg_caps.json"
+
+
+_caps_memo: Dict[str, FFmpegCapabilities] = {}
+_caps_lock = threading.Lock()
+
+
+def _detect_ffmpeg(binary: str) -> FFmpegCapabilities:
+    caps = FFmpegCapabilities(path=binary)
+    try:
+        result = subprocess.run([binary, "-version"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return caps
+    if result.returncode != 0:
+        return caps
+    caps.available = True
+    caps.version = (result.stdout.splitlines() or [""])[0].strip()
+
+    try:
+        result = subprocess.run([binary, "-hide_banner", "-encoders"],
+                                capture_output=True, text=True, timeout=10)
+        for line in result.stdout.splitlines():
+            parts = line.split()
+            # " V....D libx264   libx264 H.264 ..." - cột flags 6 ký tự rồi tên encoder
+            if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] in "VAS":
+                caps.encoders.append(parts[1])
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+    return caps
+
+
+def get_ffmpeg_capabilities(
+    ffmpeg: str = "ffmpeg",
+    cache_file: Optional[PathLike] = None,
+    refresh: bool = False
+) -> FFmpegCapabilities:
+    """
+    Khả năng của ffmpeg trên máy này (version, encoders).
+
+    Cache trong process và trong file theo máy, khóa theo đường dẫn + size +
+    mtime của binary → cài/cập nhật ffmpeg thì tự detect lại.
+
+    Args:
+        ffmpeg: Lệnh ffmpeg
+        cache_file: File cache (None = ~/.ve3/ffmpeg_caps.json)
+        refresh: Bỏ qua cache
+
+    Returns:
+        FFmpegCapabilities (available=False nếu không có ffmpeg)
+    """
+    binary = shutil.which(ffmpeg)
+    if not binary:
+        return FFmpegCapabilities()
+    binary = str(Path(binary).resolve())
+    stat = _file_key(Path(binary)) or {}
+    key = f"{binary}|{stat.get('size')}|{stat.get('mtime')}"
+
+    with _caps_lock:
+        if not refresh and key in _caps_memo:
+            return _caps_memo[key]
+
+        cache_path = Path(cache_file) if cache_file else _default_caps_cache()
+        stored: Dict[str, Any] = {}
+        try:
+            stored = json.loads(cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            stored = {}
+
+        if not refresh and key in stored:
+            caps = FFmpegCapabilities(**stored[key])
+        else:
+            caps = _detect_ffmpeg(binary)
+            if caps.available:
+                stored = {k: v for k, v in stored.items() if not k.startswith(binary + "|")}
+                stored[key] = asdict(caps)
+                try:
+                    cache_path.parent.mkdir(parents=True, exist_ok=True)
+                    cache_path.write_text(json.dumps(stored, indent=1), encoding="utf-8")
+                except OSError:
+                    pass
+
+        _caps_memo[key] = caps
+        return caps
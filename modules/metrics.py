@@ -0,0 +1,389 @@
+"""
+VE3 Tool - Pipeline Metrics
+===========================
+Đo thời gian từng bước (span), counter và histogram cho pipeline
+SmartEngine → PromptGenerator → BrowserFlowGenerator/DrissionFlowAPI → compose.
+
+Export:
+- JSON lines mỗi run: PROJECTS/<name>/logs/metrics_<name>.jsonl
+  (mỗi span/counter là 1 dòng, dòng cuối là "summary" với count/p50/p95/max)
+- Prometheus text format (tuỳ chọn): http://localhost:<port>/metrics
+
+Bật trong config/settings.yaml:
+    metrics_enabled: true
+    metrics_prometheus_port: 0      # 0 = tắt endpoint
+
+Usage:
+    from modules.metrics import span, timed, inc
+
+    with span("make_srt"):
+        ...
+
+    @timed("llm_call", provider="deepseek")
+    def _call_deepseek(...): ...
+
+    inc("llm_errors", provider="deepseek")
+
+Lưu ý: registry là global cho cả process. Sự kiện được gắn project theo
+thread đang chạy SmartEngine.run (bind_project). Thread nền không bind
+(video worker, character thread) ghi vào mọi run đang mở.
+"""
+
+import json
+import time
+import bisect
+import threading
+import inspect
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, List, Tuple, Any, Callable
+
+
+# Bucket (giây) cho histogram thời gian: từ 10ms tới 1 giờ
+DEFAULT_BUCKETS = (
+    0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600
+)
+
+# Số mẫu gần nhất giữ lại mỗi series để tính p50/p95 trong summary
+MAX_SAMPLES = 2000
+
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class _Histogram:
+    """Histogram với bucket cố định + mẫu gần nhất để tính percentile."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples: List[float] = []
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+        if len(self.samples) > MAX_SAMPLES:
+            del self.samples[:len(self.samples) - MAX_SAMPLES]
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _RunSink:
+    """File JSONL của một run (một voice/project)."""
+
+    def __init__(self, path: Path, project: str):
+        self.path = Path(path)
+        self.project = project
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.started = time.time()
+        # Histogram riêng của run để ghi summary
+        self.histograms: Dict[Tuple, _Histogram] = {}
+        self.counters: Dict[Tuple, float] = {}
+
+
+class MetricsRegistry:
+    """Registry counters/histograms + các sink JSONL đang mở. Thread-safe."""
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], _Histogram] = {}
+        self._sinks: Dict[str, _RunSink] = {}
+        self._local = threading.local()
+        self._http_server = None
+
+    # =========================================================================
+    # PROJECT BINDING
+    # =========================================================================
+
+    def bind_project(self, project: Optional[str]):
+        """Gắn project cho thread hiện tại (sự kiện sẽ ghi vào run của project đó)."""
+        self._local.project = project
+
+    def current_project(self) -> Optional[str]:
+        return getattr(self._local, "project", None)
+
+    # =========================================================================
+    # RECORDING
+    # =========================================================================
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Tăng counter."""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            for sink in self._target_sinks():
+                sink.counters[key] = sink.counters.get(key, 0) + value
+        self._emit({"type": "counter", "name": name, "value": value, "labels": labels})
+
+    def observe(self, name: str, value: float, **labels):
+        """Ghi một giá trị vào histogram."""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._histograms.setdefault(key, _Histogram()).observe(value)
+            for sink in self._target_sinks():
+                sink.histograms.setdefault(key, _Histogram()).observe(value)
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """
+        Đo thời gian một đoạn code.
+
+        Ghi histogram "<name>_seconds" và 1 dòng JSONL với duration + status.
+        """
+        if not self.enabled:
+            yield labels
+            return
+
+        start = time.time()
+        status = "ok"
+        try:
+            yield labels
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            duration = time.time() - start
+            # labels có thể được set thêm trong span (vd: labels["status"] = "fail")
+            status = labels.pop("status", status)
+            self.observe(f"{name}_seconds", duration, **labels)
+            self._emit({
+                "type": "span",
+                "name": name,
+                "start": datetime.fromtimestamp(start).isoformat(timespec="milliseconds"),
+                "duration_s": round(duration, 4),
+                "status": status,
+                "labels": labels,
+            })
+
+    def timed(self, name: str, ok: Optional[Callable[[Any], bool]] = None, **labels):
+        """
+        Decorator: bọc function (hoặc coroutine function) trong span.
+
+        Args:
+            name: Tên span
+            ok: Hàm nhận return value → False thì status="fail"
+                (cho các hàm trả về (success, ...) thay vì raise)
+        """
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(name, **labels) as span_labels:
+                        result = await func(*args, **kwargs)
+                        if ok is not None and not ok(result):
+                            span_labels["status"] = "fail"
+                        return result
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels) as span_labels:
+                    result = func(*args, **kwargs)
+                    if ok is not None and not ok(result):
+                        span_labels["status"] = "fail"
+                    return result
+            return wrapper
+        return decorator
+
+    def _target_sinks(self) -> List[_RunSink]:
+        """Sinks nhận sự kiện của thread hiện tại. Gọi khi đang giữ _lock."""
+        project = self.current_project()
+        if project and project in self._sinks:
+            return [self._sinks[project]]
+        return list(self._sinks.values())
+
+    def _emit(self, event: Dict[str, Any]):
+        if not self._sinks:
+            return
+        event["ts"] = round(time.time(), 3)
+        project = self.current_project()
+        if project:
+            event["project"] = project
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            for sink in self._target_sinks():
+                sink.file.write(line + "\n")
+                sink.file.flush()
+
+    # =========================================================================
+    # RUNS (JSONL)
+    # =========================================================================
+
+    def open_run(self, path: Path, project: str):
+        """Mở file JSONL cho một run và bind project vào thread hiện tại."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if project not in self._sinks:
+                self._sinks[project] = _RunSink(path, project)
+        self.bind_project(project)
+
+    def close_run(self, project: str) -> Optional[Dict[str, Any]]:
+        """
+        Ghi dòng summary và đóng file JSONL của run.
+
+        Returns:
+            Dict summary hoặc None nếu run không mở
+        """
+        with self._lock:
+            sink = self._sinks.pop(project, None)
+        if self.current_project() == project:
+            self.bind_project(None)
+        if sink is None:
+            return None
+
+        summary = {
+            "type": "summary",
+            "project": project,
+            "ts": round(time.time(), 3),
+            "duration_s": round(time.time() - sink.started, 3),
+            "histograms": [
+                {
+                    "name": name,
+                    "labels": dict(label_key),
+                    "count": h.count,
+                    "sum_s": round(h.sum, 3),
+                    "p50_s": round(h.percentile(0.5), 3),
+                    "p95_s": round(h.percentile(0.95), 3),
+                    "max_s": round(h.max, 3),
+                }
+                for (name, label_key), h in sorted(sink.histograms.items())
+            ],
+            "counters": [
+                {"name": name, "labels": dict(label_key), "value": value}
+                for (name, label_key), value in sorted(sink.counters.items())
+            ],
+        }
+        sink.file.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        sink.file.close()
+        return summary
+
+    # =========================================================================
+    # PROMETHEUS
+    # =========================================================================
+
+    def render_prometheus(self) -> str:
+        """Xuất toàn bộ counters/histograms theo Prometheus text format."""
+        def fmt_labels(label_key, extra=None):
+            items = list(label_key) + (extra or [])
+            if not items:
+                return ""
+            body = ",".join(
+                '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                for k, v in items
+            )
+            return "{" + body + "}"
+
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        seen = set()
+        for (name, label_key), value in counters:
+            metric = f"ve3_{name}_total"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{fmt_labels(label_key)} {value}")
+
+        for (name, label_key), h in histograms:
+            metric = f"ve3_{name}"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} histogram")
+                seen.add(metric)
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{fmt_labels(label_key, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_bucket{fmt_labels(label_key, [('le', '+Inf')])} {h.count}")
+            lines.append(f"{metric}_sum{fmt_labels(label_key)} {h.sum}")
+            lines.append(f"{metric}_count{fmt_labels(label_key)} {h.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def start_prometheus_server(self, port: int, host: str = "127.0.0.1") -> bool:
+        """
+        Chạy HTTP endpoint /metrics trong daemon thread (chỉ start 1 lần).
+
+        Returns:
+            True nếu server đang chạy
+        """
+        if self._http_server is not None:
+            return True
+
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._http_server = ThreadingHTTPServer((host, port), _Handler)
+        except OSError:
+            return False
+        threading.Thread(
+            target=self._http_server.serve_forever, name="metrics-http", daemon=True
+        ).start()
+        return True
+
+
+# =============================================================================
+# GLOBAL REGISTRY
+# =============================================================================
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Registry dùng chung cho toàn process."""
+    return _registry
+
+
+def span(name: str, **labels):
+    return _registry.span(name, **labels)
+
+
+def timed(name: str, ok: Optional[Callable[[Any], bool]] = None, **labels):
+    return _registry.timed(name, ok=ok, **labels)
+
+
+def inc(name: str, value: float = 1, **labels):
+    _registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    _registry.observe(name, value, **labels)
@@ -0,0 +1,374 @@
+"""
+VE3 Tool - Offline Prompt Analysis
+==================================
+Phân tích SRT không cần LLM (vài giây) cho chế độ prompt offline:
+
+- Nhân vật: người kể chuyện (nvc, + nvc1 nếu có đoạn hồi tưởng tuổi thơ),
+  quan hệ gia đình / vai (mother, husband, judge...) và tên riêng lặp lại
+- Bối cảnh: bảng từ khoá → loc_<slug> + location_lock mẫu
+- Mỗi scene: nhân vật / bối cảnh theo từ khoá (không thấy → giữ bối cảnh
+  scene trước), scene_type (hồi tưởng, cảm xúc, hiện tại)
+- prompt_change(): mức khác nhau giữa 2 prompt → lượt LLM refine chỉ đưa
+  lại scenes có prompt đổi đáng kể vào hàng đợi tạo ảnh
+
+Kết quả dùng chung Character / Location + _create_fallback_prompts của
+PromptGenerator (cùng format scenes_data).
+
+Usage:
+    from modules.offline_prompts import analyze_offline, assign_scenes
+
+    cast = analyze_offline(srt_entries)
+    scenes_data = assign_scenes(scenes_data, cast)  # + characters_in_scene, location_id, scene_type
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from modules.excel_manager import Character, Location
+
+
+# ============================================================================
+# TEMPLATES
+# ============================================================================
+
+PORTRAIT_TEMPLATE = (
+    "A cinematic portrait, straight-on medium close-up shot on 85mm lens. Subject is {lock}. "
+    "Looking directly at camera with neutral expression. Bright studio lighting. "
+    "Pure white studio background. 8K, sharp focus, photorealistic."
+)
+
+LOCATION_TEMPLATE = "{framing} wide shot of {lock}. Empty, no people. Cinematic, 4K photorealistic. 8K."
+
+
+@dataclass(frozen=True)
+class RoleKeyword:
+    """Vai / quan hệ nhận ra từ lời dẫn."""
+    slug: str
+    name: str
+    gender: str            # man / woman / person
+    age: int
+    pattern: str           # regex (lowercase, có \b)
+
+
+# Thứ tự = ưu tiên đặt ID nv1, nv2... khi số lần nhắc bằng nhau
+ROLE_KEYWORDS: Tuple[RoleKeyword, ...] = (
+    RoleKeyword("mother", "Mother", "woman", 55, r"\b(?:my |his |her )?(?:mother|mom|mum|mama)\b|\bmẹ\b"),
+    RoleKeyword("father", "Father", "man", 58, r"\b(?:my |his |her )?(?:father|dad|papa)\b|\b(?:bố|cha)\b"),
+    RoleKeyword("wife", "Wife", "woman", 30, r"\b(?:my |his )?(?:wife|ex-wife)\b|\bvợ\b"),
+    RoleKeyword("husband", "Husband", "man", 32, r"\b(?:my |her )?(?:husband|ex-husband)\b|\bchồng\b"),
+    RoleKeyword("son", "Son", "man", 20, r"\b(?:my |his |her )?son\b|\bcon trai\b"),
+    RoleKeyword("daughter", "Daughter", "woman", 20, r"\b(?:my |his |her )?daughter\b|\bcon gái\b"),
+    RoleKeyword("brother", "Brother", "man", 30, r"\b(?:my |his |her )?(?:brother|stepbrother)\b|\b(?:anh trai|em trai)\b"),
+    RoleKeyword("sister", "Sister", "woman", 28, r"\b(?:my |his |her )?(?:sister|stepsister)\b|\b(?:chị gái|em gái)\b"),
+    RoleKeyword("grandmother", "Grandmother", "woman", 75, r"\b(?:grandmother|grandma|granny)\b|\bbà (?:nội|ngoại)\b"),
+    RoleKeyword("grandfather", "Grandfather", "man", 78, r"\b(?:grandfather|grandpa)\b|\bông (?:nội|ngoại)\b"),
+    RoleKeyword("boss", "Boss", "man", 50, r"\b(?:my )?(?:boss|manager|supervisor)\b|\bsếp\b"),
+    RoleKeyword("friend", "Best Friend", "person", 30, r"\b(?:my )?(?:best friend|friend)\b|\bbạn thân\b"),
+    RoleKeyword("lawyer", "Lawyer", "man", 45, r"\b(?:lawyer|attorney)\b|\bluật sư\b"),
+    RoleKeyword("judge", "Judge", "man", 60, r"\bjudge\b|\bthẩm phán\b"),
+    RoleKeyword("doctor", "Doctor", "man", 45, r"\b(?:doctor|nurse)\b|\bbác sĩ\b"),
+    RoleKeyword("neighbor", "Neighbor", "woman", 50, r"\bneighbou?r\b|\bhàng xóm\b"),
+)
+
+# Quần áo mặc định theo vai (character_lock phải có CLOTHING)
+_ROLE_CLOTHING = {
+    "judge": "wearing black judicial robe",
+    "lawyer": "wearing dark tailored suit and tie",
+    "doctor": "wearing white medical coat over light blue scrubs",
+    "boss": "wearing navy business suit",
+}
+
+_CHILDHOOD_PATTERN = re.compile(
+    r"\bwhen i was (?:a )?(?:kid|child|little|boy|girl|young|[1-9]|1[0-2]|"
+    r"(?:three|four|five|six|seven|eight|nine|ten|eleven|twelve))\b|\bas a (?:kid|child|little)\b|"
+    r"\bkhi (?:tôi|tao|em) còn (?:nhỏ|bé)\b|\bhồi nhỏ\b"
+)
+_FLASHBACK_PATTERN = re.compile(
+    r"\b(?:years ago|back then|back in|i remember|used to|that day|in (?:19|20)\d\d)\b|"
+    r"\b(?:năm đó|ngày ấy|hồi đó|tôi nhớ)\b"
+)
+_EMOTION_PATTERN = re.compile(
+    r"\b(?:cried|tears|crying|heart|betray\w*|shock\w*|couldn't believe|broke down|hurt|angry|scream\w*)\b|"
+    r"\b(?:khóc|nước mắt|phản bội|đau lòng|sốc)\b"
+)
+
+# Giới tính người kể chuyện từ quan hệ (my wife → nam)
+_NARRATOR_MALE = re.compile(r"\bmy (?:wife|girlfriend|ex-wife)\b|\bvợ tôi\b")
+_NARRATOR_FEMALE = re.compile(r"\bmy (?:husband|boyfriend|ex-husband)\b|\bchồng tôi\b")
+
+
+@dataclass(frozen=True)
+class LocationKeyword:
+    """Bối cảnh nhận ra từ lời dẫn."""
+    id: str
+    name: str
+    framing: str           # Interior / Exterior
+    lock: str
+    lighting: str
+    pattern: str
+
+
+LOCATION_KEYWORDS: Tuple[LocationKeyword, ...] = (
+    LocationKeyword("loc_courthouse", "Courthouse", "Exterior",
+                    "Small town courthouse, gray stone steps, white columns", "Overcast natural daylight",
+                    r"\b(?:court(?:house|room)?|trial|tòa án)\b"),
+    LocationKeyword("loc_hospital", "Hospital Room", "Interior",
+                    "Hospital room, white walls, single bed, medical monitors", "Cool fluorescent light",
+                    r"\b(?:hospital|clinic|icu|bệnh viện)\b"),
+    LocationKeyword("loc_kitchen", "Kitchen", "Interior",
+                    "Modest family kitchen, worn wooden table, old appliances", "Warm tungsten light",
+                    r"\b(?:kitchen|dinner table|nhà bếp)\b"),
+    LocationKeyword("loc_bedroom", "Bedroom", "Interior",
+                    "Small bedroom, single bed with faded quilt, bedside lamp", "Dim warm lamp light",
+                    r"\b(?:bedroom|bed|phòng ngủ)\b"),
+    LocationKeyword("loc_living_room", "Living Room", "Interior",
+                    "Lived-in living room, old sofa, family photos on the wall", "Soft window daylight",
+                    r"\b(?:living room|couch|sofa|phòng khách)\b"),
+    LocationKeyword("loc_apartment", "Apartment", "Interior",
+                    "Cramped apartment, thin walls, small window", "Warm dim interior light",
+                    r"\b(?:apartment|flat|căn hộ)\b"),
+    LocationKeyword("loc_office", "Office", "Interior",
+                    "Corporate office, desks and computer screens, glass partitions", "Cool office lighting",
+                    r"\b(?:office|workplace|company|văn phòng|công ty)\b"),
+    LocationKeyword("loc_school", "School", "Interior",
+                    "School classroom, rows of desks, chalkboard", "Bright daylight through windows",
+                    r"\b(?:school|class(?:room)?|college|university|trường)\b"),
+    LocationKeyword("loc_church", "Church", "Interior",
+                    "Small church, wooden pews, stained glass windows", "Soft colored window light",
+                    r"\b(?:church|funeral|chapel|nhà thờ|đám tang)\b"),
+    LocationKeyword("loc_restaurant", "Restaurant", "Interior",
+                    "Family restaurant, booths and tables, warm decor", "Warm ambient light",
+                    r"\b(?:restaurant|diner|cafe|coffee shop|nhà hàng|quán)\b"),
+    LocationKeyword("loc_car", "Car Interior", "Interior",
+                    "Inside an old sedan, worn seats, dashboard", "Natural daylight through windshield",
+                    r"\b(?:car|truck|drove|driving|xe hơi|ô tô)\b"),
+    LocationKeyword("loc_street", "City Street", "Exterior",
+                    "Quiet town street, sidewalks, parked cars, storefronts", "Natural daylight",
+                    r"\b(?:street|road|sidewalk|đường phố)\b"),
+    LocationKeyword("loc_house", "Family House", "Exterior",
+                    "Modest suburban house, front porch, small yard", "Golden hour sunlight",
+                    r"\b(?:house|home|porch|yard|ngôi nhà|về nhà)\b"),
+)
+
+# Từ viết hoa không phải tên người
+_NOT_NAMES = {
+    "I", "I'm", "I'd", "I'll", "I've", "The", "A", "An", "And", "But", "So", "Then", "When", "What", "That",
+    "This", "It", "He", "She", "They", "We", "You", "My", "His", "Her", "Our", "Their", "Mom", "Dad",
+    "Mother", "Father", "God", "Christmas", "Thanksgiving", "Easter", "Monday", "Tuesday", "Wednesday",
+    "Thursday", "Friday", "Saturday", "Sunday", "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December", "Mr", "Mrs", "Ms", "Dr", "Oh",
+    "Yes", "No", "Okay", "OK", "Why", "How", "Where", "Who", "If", "Now", "Even", "Just", "After",
+    "Before", "Because", "There", "Here", "One", "Two", "Not", "All", "For", "With",
+}
+
+# Tên lặp ít nhất bấy nhiêu lần mới thành nhân vật
+MIN_NAME_MENTIONS = 3
+
+# Số nhân vật / bối cảnh tối đa
+MAX_CHARACTERS = 8
+MAX_LOCATIONS = 6
+
+
+# ============================================================================
+# NHÂN VẬT + BỐI CẢNH
+# ============================================================================
+
+def _lock(age: int, gender: str, extra: str = "", clothing: str = "") -> str:
+    who = {"man": "man", "woman": "woman"}.get(gender, "person")
+    parts = [f"{age}-year-old {who}", extra or "natural look, neutral expression",
+             clothing or "wearing simple casual clothes"]
+    return ", ".join(p for p in parts if p)
+
+
+def _character(char_id: str, name: str, role: str, lock: str, is_child: bool = False) -> Character:
+    return Character(
+        id=char_id,
+        role=role,
+        name=name,
+        english_prompt="DO_NOT_GENERATE" if is_child else PORTRAIT_TEMPLATE.format(lock=lock),
+        character_lock=lock,
+        vietnamese_prompt=lock,
+        is_child=is_child,
+    )
+
+
+def _proper_names(texts: Sequence[str]) -> Counter:
+    """Từ viết hoa giữa câu (không đứng đầu câu) → số lần nhắc."""
+    counts: Counter = Counter()
+    for text in texts:
+        for sentence in re.split(r"(?<=[.!?])\s+", text):
+            words = re.findall(r"[A-Za-z][\w'-]*", sentence)
+            for word in words[1:]:
+                if word[0].isupper() and word not in _NOT_NAMES and len(word) > 2:
+                    counts[word] += 1
+    return counts
+
+
+def _name_gender(name: str, texts: Sequence[str]) -> str:
+    """Đoán giới tính theo đại từ trong câu nhắc tên."""
+    he = she = 0
+    for text in texts:
+        if name in text:
+            low = text.lower()
+            he += len(re.findall(r"\b(?:he|him|his)\b", low))
+            she += len(re.findall(r"\b(?:she|her|hers)\b", low))
+    if he == she:
+        return "person"
+    return "man" if he > she else "woman"
+
+
+@dataclass
+class OfflineCast:
+    """Kết quả phân tích offline + từ khoá nhận diện mỗi entity trong scene."""
+    characters: List[Character] = field(default_factory=list)
+    locations: List[Location] = field(default_factory=list)
+    patterns: Dict[str, re.Pattern] = field(default_factory=dict)  # id → regex
+
+
+def analyze_offline(srt_entries: List) -> OfflineCast:
+    """
+    Nhân vật + bối cảnh từ SRT bằng từ khoá (không gọi LLM).
+
+    Luôn có nvc (người kể chuyện) và ít nhất 1 bối cảnh.
+    """
+    texts = [e.text for e in srt_entries]
+    story = " ".join(texts)
+    low = story.lower()
+    cast = OfflineCast()
+
+    # Người kể chuyện (+ bản trẻ em nếu kể lại tuổi thơ)
+    gender = "person"
+    if len(_NARRATOR_MALE.findall(low)) > len(_NARRATOR_FEMALE.findall(low)):
+        gender = "man"
+    elif _NARRATOR_FEMALE.search(low):
+        gender = "woman"
+    cast.characters.append(_character("nvc", "Narrator", "main", _lock(30, gender)))
+    if _CHILDHOOD_PATTERN.search(low):
+        child = {"man": "boy", "woman": "girl"}.get(gender, "child")
+        cast.characters.append(_character(
+            "nvc1", "Narrator - Child", "supporting",
+            f"8-year-old {child}, messy hair, wearing worn t-shirt", is_child=True
+        ))
+        cast.patterns["nvc1"] = _CHILDHOOD_PATTERN
+
+    # Vai / quan hệ + tên riêng → nv1, nv2... theo số lần nhắc
+    # "my mother Gloria" → tên gắn vào vai (1 nhân vật, nhận cả 2 từ khoá)
+    found: List[Dict] = []
+    for order, role in enumerate(ROLE_KEYWORDS):
+        mentions = len(re.findall(role.pattern, low))
+        if mentions:
+            lock = _lock(role.age, role.gender, clothing=_ROLE_CLOTHING.get(role.slug, ""))
+            found.append({"mentions": mentions, "order": order, "name": role.name,
+                          "lock": lock, "pattern": role.pattern})
+    for name, mentions in _proper_names(texts).items():
+        if mentions < MIN_NAME_MENTIONS:
+            continue
+        name_pattern = rf"\b{re.escape(name.lower())}\b"
+        role_entry = next(
+            (f for f in found if "order" in f and re.search(rf"(?:{f['pattern']})[ ,]+{name_pattern}", low)),
+            None
+        )
+        if role_entry:
+            role_entry["name"] = f"{name} ({role_entry['name']})"
+            role_entry["pattern"] = f"{role_entry['pattern']}|{name_pattern}"
+            role_entry["mentions"] += mentions
+            continue
+        found.append({"mentions": mentions, "order": len(ROLE_KEYWORDS), "name": name,
+                      "lock": _lock(35, _name_gender(name, texts)), "pattern": name_pattern})
+
+    found.sort(key=lambda f: (-f["mentions"], f["order"]))
+    for i, entry in enumerate(found[:MAX_CHARACTERS - len(cast.characters)]):
+        char_id = f"nv{i + 1}"
+        role = "supporting" if entry["mentions"] >= MIN_NAME_MENTIONS else "minor"
+        cast.characters.append(_character(char_id, entry["name"], role, entry["lock"]))
+        cast.patterns[char_id] = re.compile(entry["pattern"])
+
+    # Bối cảnh theo số lần nhắc
+    loc_found = []
+    for order, loc in enumerate(LOCATION_KEYWORDS):
+        pattern = re.compile(loc.pattern)
+        mentions = len(pattern.findall(low))
+        if mentions:
+            loc_found.append((mentions, -order, loc, pattern))
+    loc_found.sort(key=lambda f: (f[0], f[1]), reverse=True)
+    if not loc_found:
+        loc_found = [(0, 0, LOCATION_KEYWORDS[-1], re.compile(LOCATION_KEYWORDS[-1].pattern))]
+    for _, _, loc, pattern in loc_found[:MAX_LOCATIONS]:
+        cast.locations.append(Location(
+            id=loc.id,
+            name=loc.name,
+            english_prompt=LOCATION_TEMPLATE.format(framing=loc.framing, lock=loc.lock),
+            location_lock=loc.lock,
+            lighting_default=loc.lighting,
+            image_file=f"{loc.id}.png",
+        ))
+        cast.patterns[loc.id] = pattern
+    return cast
+
+
+# ============================================================================
+# SCENES
+# ============================================================================
+
+def scene_type(text: str) -> str:
+    """FRAME_PRESENT / CHILDHOOD_FLASHBACK / ADULT_FLASHBACK / EMOTIONAL_BEAT (như _create_fallback_prompts)."""
+    low = text.lower()
+    if _CHILDHOOD_PATTERN.search(low):
+        return "CHILDHOOD_FLASHBACK"
+    if _FLASHBACK_PATTERN.search(low):
+        return "ADULT_FLASHBACK"
+    if _EMOTION_PATTERN.search(low):
+        return "EMOTIONAL_BEAT"
+    return "FRAME_PRESENT"
+
+
+def assign_scenes(scenes_data: List[Dict], cast: OfflineCast) -> List[Dict]:
+    """
+    Gán characters_in_scene / location_id / scene_type cho từng scene (in-place).
+
+    Bối cảnh không nhắc trong scene → giữ bối cảnh scene trước (liền mạch).
+    """
+    char_ids = [c.id for c in cast.characters if c.id in cast.patterns]
+    loc_ids = [loc.id for loc in cast.locations]
+    current_loc: Optional[str] = loc_ids[0] if loc_ids else ""
+
+    for scene in scenes_data:
+        low = scene.get("text", "").lower()
+        kind = scene_type(low)
+        chars = [cid for cid in char_ids if cast.patterns[cid].search(low)]
+        if kind == "CHILDHOOD_FLASHBACK" and "nvc1" in char_ids:
+            chars = ["nvc1"] + [c for c in chars if c != "nvc1"]
+        elif re.search(r"\b(?:i|me|my|myself)\b|\b(?:tôi|mình)\b", low) or not chars:
+            chars = ["nvc"] + chars
+        # Nhiều bối cảnh trong scene → bối cảnh nhắc đến đầu tiên
+        hits = [(m.start(), loc_id) for loc_id in loc_ids for m in [cast.patterns[loc_id].search(low)] if m]
+        if hits:
+            current_loc = min(hits)[1]
+        scene["characters_in_scene"] = chars[:3]
+        scene["location_id"] = current_loc
+        scene["scene_type"] = kind
+    return scenes_data
+
+
+# ============================================================================
+# REFINE
+# ============================================================================
+
+def _words(text: str) -> List[str]:
+    # Bỏ annotation "(nvc.png)" - refs so sánh riêng
+    text = re.sub(r"\([\w.-]+\.png\)", " ", str(text or "").lower())
+    return re.findall(r"[a-z0-9à-ỹ]+", text)
+
+
+def prompt_change(old: str, new: str) -> float:
+    """
+    Mức thay đổi giữa 2 prompt: 0 (giống) → 1 (khác hoàn toàn).
+
+    1 - Jaccard trên tập từ (bỏ qua thứ tự, dấu câu, annotation file ảnh).
+    """
+    a, b = set(_words(old)), set(_words(new))
+    if not a and not b:
+        return 0.0
+    return 1.0 - len(a & b) / len(a | b)
@@ -0,0 +1,328 @@
+"""
+VE3 Tool - Ollama Manager
+=========================
+Quản lý model Ollama local trong 1 lần chạy pipeline:
+
+- Warm-up: load model (đúng num_ctx + keep_alive) ngay khi pipeline bắt đầu,
+  chạy nền → request đầu tiên không phải chờ load model
+- keep_alive: giữ model + KV cache trong VRAM suốt lần chạy
+- Slots: số request song song theo OLLAMA_NUM_PARALLEL của server (thay vì 1)
+- num_ctx theo request: ước lượng prompt + num_predict, làm tròn lên bậc
+  (4K/8K/16K/32K). Bậc chỉ tăng, không giảm trong 1 lần chạy: đổi num_ctx
+  = Ollama load lại model + mất KV prefix
+- Tokens/giây mỗi request (eval_count / eval_duration) → metrics + stats
+
+Usage:
+    from modules.ollama_manager import get_ollama_manager
+
+    manager = get_ollama_manager("http://localhost:11434", "qwen2.5:14b")
+    manager.warm_up()
+    with manager.slot():
+        data["options"]["num_ctx"] = manager.num_ctx_for(prompt, max_tokens)
+        resp = transport.post(...)
+    speed = manager.record(resp.json())
+"""
+
+import os
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+from modules.utils import get_logger
+from modules.metrics import inc, observe
+from modules.llm_transport import get_transport
+from modules.token_budget import estimate_tokens
+
+
+# Bậc num_ctx (làm tròn lên) - ít bậc = ít lần reload model
+CTX_STEPS = (4096, 8192, 16384, 32768, 65536, 131072)
+
+# Trần num_ctx mặc định (prompt + output chung 1 context)
+DEFAULT_MAX_CTX = 32768
+
+# num_ctx khi warm-up (request đầu thường là phân tích nhân vật / batch nhỏ)
+DEFAULT_WARMUP_CTX = 8192
+
+# Token chừa thêm cho template chat / system prompt của model
+CTX_MARGIN_TOKENS = 256
+
+# Load model lâu hơn mức này → tính là cold load (model bị unload giữa chừng)
+COLD_LOAD_SECONDS = 1.0
+
+# Warm-up: model 14B load từ disk có thể mất vài phút
+WARMUP_TIMEOUT = 300
+
+
+def resolve_num_parallel(num_parallel: int = 0) -> int:
+    """
+    Số slot song song của server Ollama.
+
+    num_parallel > 0: theo cấu hình; 0: đọc OLLAMA_NUM_PARALLEL (cùng máy
+    với server), không có thì 1.
+    """
+    if num_parallel and num_parallel > 0:
+        return int(num_parallel)
+    try:
+        return max(1, int(os.environ.get("OLLAMA_NUM_PARALLEL", "1")))
+    except ValueError:
+        return 1
+
+
+class OllamaManager:
+    """
+    Trạng thái dùng chung của 1 model Ollama (warm-up, num_ctx, slots, tốc độ).
+
+    Thread-safe; slot() và aslot() chia chung 1 semaphore (sync + async cộng
+    lại không vượt num_parallel).
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        model: str,
+        keep_alive: str = "30m",
+        num_parallel: int = 0,
+        max_ctx: int = DEFAULT_MAX_CTX,
+        warmup_ctx: int = DEFAULT_WARMUP_CTX
+    ):
+        """
+        Args:
+            endpoint: http://host:11434
+            model: Tên model (qwen2.5:14b)
+            keep_alive: Thời gian Ollama giữ model sau request cuối
+            num_parallel: Số request song song (0 = theo OLLAMA_NUM_PARALLEL)
+            max_ctx: Trần num_ctx
+            warmup_ctx: num_ctx khi warm-up
+        """
+        self.endpoint = endpoint.rstrip("/")
+        self.model = model
+        self.keep_alive = keep_alive
+        self.num_parallel = resolve_num_parallel(num_parallel)
+        self.max_ctx = max_ctx
+        self.warmup_ctx = min(warmup_ctx, max_ctx)
+        self.logger = get_logger("ollama_manager")
+
+        self._slots = threading.BoundedSemaphore(self.num_parallel)
+        self._lock = threading.Lock()
+        self._ctx = 0  # num_ctx model đang load (0 = chưa biết)
+        self._warm_thread: Optional[threading.Thread] = None
+        self._warm_ok = False
+
+        self.requests = 0
+        self.cold_loads = 0
+        self.ctx_changes = 0
+        self._eval_tokens = 0
+        self._eval_seconds = 0.0
+        self._prompt_tokens = 0
+        self._prompt_seconds = 0.0
+
+    @property
+    def generate_url(self) -> str:
+        return f"{self.endpoint}/api/generate"
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.endpoint}/api/chat"
+
+    # =========================================================================
+    # NUM_CTX
+    # =========================================================================
+
+    def _step(self, tokens: int) -> int:
+        for step in CTX_STEPS:
+            if step >= tokens:
+                return min(step, self.max_ctx)
+        return self.max_ctx
+
+    def num_ctx_for(self, prompt: str, max_tokens: int) -> int:
+        """
+        num_ctx cho request: bậc nhỏ nhất chứa prompt + max_tokens.
+
+        Không nhỏ hơn num_ctx đang load (giảm cũng làm Ollama load lại model).
+        """
+        needed = estimate_tokens(prompt) + (max_tokens or 0) + CTX_MARGIN_TOKENS
+        ctx = self._step(needed)
+        with self._lock:
+            if ctx > self._ctx:
+                if self._ctx:
+                    self.ctx_changes += 1
+                    self.logger.info(f"[Ollama] num_ctx {self._ctx} → {ctx} (prompt ~{needed} tokens)")
+                self._ctx = ctx
+            return self._ctx
+
+    # =========================================================================
+    # WARM-UP
+    # =========================================================================
+
+    def warm_up(self, background: bool = True, timeout: float = WARMUP_TIMEOUT) -> bool:
+        """
+        Load model vào VRAM (prompt rỗng = Ollama chỉ load, không sinh token).
+
+        Gọi lại khi model đã load với cùng num_ctx gần như không tốn gì.
+
+        Args:
+            background: Chạy trên thread nền (không chặn pipeline)
+
+        Returns:
+            background: True nếu đã bắt đầu; ngược lại: load thành công
+        """
+        if background:
+            with self._lock:
+                if self._warm_thread and self._warm_thread.is_alive():
+                    return True
+                self._warm_thread = threading.Thread(
+                    target=self._warm_up, args=(timeout,), name="ollama_warmup", daemon=True
+                )
+                self._warm_thread.start()
+            return True
+        return self._warm_up(timeout)
+
+    def _warm_up(self, timeout: float) -> bool:
+        with self._lock:
+            ctx = max(self._ctx, self.warmup_ctx)
+            self._ctx = ctx
+        data = {
+            "model": self.model,
+            "prompt": "",
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": ctx},
+        }
+        try:
+            resp = get_transport().post(self.generate_url, json=data, timeout=timeout)
+        except requests.RequestException as e:
+            self.logger.warning(f"[Ollama] Warm-up lỗi: {e}")
+            return False
+        if resp.status_code != 200:
+            self.logger.warning(f"[Ollama] Warm-up HTTP {resp.status_code}: {resp.text[:200]}")
+            return False
+
+        load_s = (resp.json().get("load_duration") or 0) / 1e9
+        self._warm_ok = True
+        self.logger.info(
+            f"[Ollama] Warm-up {self.model} (num_ctx={ctx}, keep_alive={self.keep_alive}, "
+            f"slots={self.num_parallel}): load {load_s:.1f}s"
+        )
+        observe("ollama_load_seconds", load_s, phase="warmup")
+        return True
+
+    def wait_warm(self, timeout: Optional[float] = None) -> bool:
+        """Chờ warm-up nền xong (True nếu model đã load OK)."""
+        thread = self._warm_thread
+        if thread:
+            thread.join(timeout)
+        return self._warm_ok
+
+    # =========================================================================
+    # SLOTS
+    # =========================================================================
+
+    @contextmanager
+    def slot(self):
+        """Giữ 1 slot của server trong lúc request (sync)."""
+        with self._slots:
+            yield
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Giữ 1 slot của server trong lúc request (async) - cùng semaphore với slot()."""
+        if not self._slots.acquire(blocking=False):
+            # Chờ slot trên thread executor, không chặn event loop
+            future = asyncio.get_running_loop().run_in_executor(None, self._slots.acquire)
+            try:
+                await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Thread chờ vẫn sẽ lấy được slot → trả lại ngay khi lấy xong
+                future.add_done_callback(lambda _: self._slots.release())
+                raise
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    # =========================================================================
+    # SPEED
+    # =========================================================================
+
+    def record(self, result: Dict[str, Any]) -> Dict[str, float]:
+        """
+        Ghi tốc độ 1 response (/api/generate hoặc /api/chat, stream=false).
+
+        Returns:
+            {"tokens_per_s", "prompt_tokens_per_s", "load_s"}
+        """
+        eval_count = result.get("eval_count") or 0
+        eval_s = (result.get("eval_duration") or 0) / 1e9
+        prompt_count = result.get("prompt_eval_count") or 0
+        prompt_s = (result.get("prompt_eval_duration") or 0) / 1e9
+        load_s = (result.get("load_duration") or 0) / 1e9
+
+        speed = {
+            "tokens_per_s": round(eval_count / eval_s, 1) if eval_s > 0 else 0.0,
+            "prompt_tokens_per_s": round(prompt_count / prompt_s, 1) if prompt_s > 0 else 0.0,
+            "load_s": round(load_s, 2),
+        }
+
+        with self._lock:
+            self.requests += 1
+            self._eval_tokens += eval_count
+            self._eval_seconds += eval_s
+            self._prompt_tokens += prompt_count
+            self._prompt_seconds += prompt_s
+            if load_s >= COLD_LOAD_SECONDS:
+                self.cold_loads += 1
+
+        if speed["tokens_per_s"]:
+            observe("ollama_tokens_per_s", speed["tokens_per_s"], model=self.model)
+        if speed["prompt_tokens_per_s"]:
+            observe("ollama_prompt_tokens_per_s", speed["prompt_tokens_per_s"], model=self.model)
+        if load_s >= COLD_LOAD_SECONDS:
+            inc("ollama_cold_loads", model=self.model)
+            self.logger.warning(f"[Ollama] Request phải load lại model ({load_s:.1f}s)")
+        return speed
+
+    def stats(self) -> Dict[str, Any]:
+        """Tổng hợp cho log/benchmark."""
+        with self._lock:
+            return {
+                "model": self.model,
+                "requests": self.requests,
+                "num_parallel": self.num_parallel,
+                "num_ctx": self._ctx,
+                "ctx_changes": self.ctx_changes,
+                "cold_loads": self.cold_loads,
+                "tokens_per_s": round(self._eval_tokens / self._eval_seconds, 1) if self._eval_seconds else 0.0,
+                "prompt_tokens_per_s": (
+                    round(self._prompt_tokens / self._prompt_seconds, 1) if self._prompt_seconds else 0.0
+                ),
+            }
+
+
+# ============================================================================
+# REGISTRY
+# ============================================================================
+
+_managers: Dict[Tuple[str, str], OllamaManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_ollama_manager(endpoint: str, model: str, **config) -> OllamaManager:
+    """
+    Manager dùng chung theo (endpoint, model) cho cả process.
+
+    config (keep_alive, num_parallel, max_ctx, warmup_ctx) chỉ áp dụng khi
+    tạo lần đầu - mọi client cùng model chia chung slots + num_ctx.
+    """
+    key = (endpoint.rstrip("/"), model)
+    manager = _managers.get(key)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(key)
+            if manager is None:
+                config = {k: v for k, v in config.items() if v is not None}
+                manager = OllamaManager(endpoint, model, **config)
+                _managers[key] = manager
+    return manager
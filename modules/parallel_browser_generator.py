@@ -7,6 +7,8 @@ Features:
 - Headless mode: Chay an khong hien UI
 - Parallel processing: Nhieu browser cung luc
 - Session isolation: Moi project/voice 1 browser rieng
+- Project affinity: Worker uu tien task cua project dang mo, chi "steal"
+  task project khac khi project minh het task (tranh dong/mo lai browser)
 - Auto retry: Tu dong thu lai khi loi
 """
 
@@ -21,9 +23,11 @@ from typing import Optional, List, Dict, Any, Tuple, Callable
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
-from queue import Queue
+from collections import deque, OrderedDict
 import uuid
 
+from modules.metrics import inc
+
 # Browser driver imports - prefer undetected-chromedriver
 DRIVER_TYPE = None  # "undetected", "selenium", or None
 
@@ -79,6 +83,7 @@ class GenerationTask:
     output_dir: Path
     prefix: str = "ve3"
     priority: int = 0
+    created_seq: int = 0  # Thu tu them vao queue (de so sanh voi FIFO)
 
 
 @dataclass
@@ -93,6 +98,129 @@ class GenerationResult:
     duration_seconds: float = 0.0
 
 
+class ProjectAffinityQueue:
+    """
+    Task queue chia theo project (moi project 1 sub-queue FIFO).
+
+    get(preferred_project):
+    - Con task cua preferred_project -> lay task do (giu session dang mo)
+    - Het -> steal: uu tien project chua co worker nao dang giu,
+      sau do project co nhieu task cho nhat
+
+    API giong queue.Queue (put/get/task_done/join/qsize),
+    put(None) = shutdown signal cho 1 worker.
+    """
+
+    def __init__(self):
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._owners: Dict[str, int] = {}  # project -> so worker dang giu session
+        self._shutdown = 0
+        self._size = 0
+        self._unfinished = 0
+        self._cond = threading.Condition()
+        self._all_done = threading.Condition(self._cond)
+
+    def put(self, task: Optional[GenerationTask]) -> None:
+        with self._cond:
+            if task is None:
+                self._shutdown += 1
+            else:
+                self._queues.setdefault(task.project_name, deque()).append(task)
+                self._size += 1
+                self._unfinished += 1
+            self._cond.notify_all()
+
+    def get(
+        self,
+        preferred_project: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Tuple[Optional[GenerationTask], bool]:
+        """
+        Lay task tiep theo.
+
+        Returns:
+            (task, affinity_hit). task=None khi shutdown hoac het timeout.
+            affinity_hit=True neu FIFO thuong se tra task cua project khac
+            (tuc la da tranh duoc 1 lan dong/mo session).
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while not self._shutdown and not self._size:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None, False
+                self._cond.wait(remaining)
+
+            if self._shutdown:
+                self._shutdown -= 1
+                return None, False
+
+            head_project = self._fifo_head_project()
+            if preferred_project and self._queues.get(preferred_project):
+                project = preferred_project
+            else:
+                project = self._steal_project()
+
+            task = self._queues[project].popleft()
+            if not self._queues[project]:
+                del self._queues[project]
+            self._size -= 1
+
+            if project != preferred_project:
+                if preferred_project:
+                    self._release_locked(preferred_project)
+                self._owners[project] = self._owners.get(project, 0) + 1
+
+            return task, bool(preferred_project) and project == preferred_project != head_project
+
+    def release(self, project: Optional[str]) -> None:
+        """Worker dong session cua project (thoat / loi)."""
+        if project:
+            with self._cond:
+                self._release_locked(project)
+
+    def _release_locked(self, project: str) -> None:
+        count = self._owners.get(project, 0) - 1
+        if count > 0:
+            self._owners[project] = count
+        else:
+            self._owners.pop(project, None)
+
+    def _fifo_head_project(self) -> Optional[str]:
+        """Project ma FIFO don se tra ve (task cu nhat theo thu tu them)."""
+        heads = [(q[0], name) for name, q in self._queues.items() if q]
+        if not heads:
+            return None
+        return min(heads, key=lambda h: h[0].created_seq)[1]
+
+    def _steal_project(self) -> str:
+        candidates = [name for name, q in self._queues.items() if q]
+        return min(
+            candidates,
+            key=lambda name: (self._owners.get(name, 0), -len(self._queues[name]))
+        )
+
+    def task_done(self) -> None:
+        with self._cond:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._unfinished = 0
+                self._all_done.notify_all()
+
+    def join(self) -> None:
+        with self._cond:
+            while self._unfinished:
+                self._all_done.wait()
+
+    def qsize(self) -> int:
+        with self._cond:
+            return self._size
+
+    def pending_by_project(self) -> Dict[str, int]:
+        with self._cond:
+            return {name: len(q) for name, q in self._queues.items() if q}
+
+
 class ParallelBrowserGenerator:
     """
     Quan ly nhieu browser de tao anh song song.
@@ -157,7 +285,10 @@ class ParallelBrowserGenerator:
 
         # State
         self.sessions: Dict[str, BrowserSession] = {}
-        self.task_queue: Queue = Queue()
+        self.task_queue = ProjectAffinityQueue()
+        self._task_seq = 0
+        self.session_inits = 0
+        self.reinits_avoided = 0
         self.results: Dict[str, GenerationResult] = {}
         self.is_running = False
         self._lock = threading.Lock()
@@ -440,18 +571,32 @@ class ParallelBrowserGenerator:
         """Worker thread xu ly tasks."""
         session: Optional[BrowserSession] = None
 
+        # Project cua session dang mo (hoac vua duoc gan), giu ca khi init loi
+        current_project: Optional[str] = None
+
         while self.is_running:
-            try:
-                # Lay task tu queue
-                task = self.task_queue.get(timeout=1)
+            # Lay task, uu tien project dang mo
+            task, affinity_hit = self.task_queue.get(current_project, timeout=1)
 
-                if task is None:  # Shutdown signal
-                    break
+            if task is None:
+                # Het timeout -> thu lai; shutdown -> is_running da False
+                continue
+
+            current_project = task.project_name
+            if affinity_hit:
+                with self._lock:
+                    self.reinits_avoided += 1
+                inc("browser_session_reinit_avoided")
 
+            try:
                 # Init session neu chua co
                 if session is None or session.project_name != task.project_name:
                     if session:
                         self._close_session(session)
+                        session = None
+                    with self._lock:
+                        self.session_inits += 1
+                    inc("browser_session_init")
                     session = self._init_session(task.project_name)
 
                 # Generate images
@@ -465,13 +610,14 @@ class ParallelBrowserGenerator:
                 if self.on_task_complete:
                     self.on_task_complete(result)
 
-                self.task_queue.task_done()
-
             except Exception as e:
-                if "Empty" not in str(type(e).__name__):
-                    self._log(f"Worker error: {e}")
+                self._log(f"Worker error: {e}")
+
+            finally:
+                self.task_queue.task_done()
 
         # Cleanup
+        self.task_queue.release(current_project)
         if session:
             self._close_session(session)
 
@@ -552,13 +698,18 @@ class ParallelBrowserGenerator:
         """
         task_id = f"{project}_{uuid.uuid4().hex[:8]}"
 
+        with self._lock:
+            self._task_seq += 1
+            seq = self._task_seq
+
         task = GenerationTask(
             task_id=task_id,
             project_name=project,
             prompts=prompts,
             output_dir=output_dir or (self.download_base_dir / project),
             prefix=prefix,
-            priority=priority
+            priority=priority,
+            created_seq=seq
         )
 
         self.task_queue.put(task)
@@ -587,7 +738,10 @@ class ParallelBrowserGenerator:
                 "is_running": self.is_running,
                 "active_sessions": len(self.sessions),
                 "pending_tasks": self.task_queue.qsize(),
+                "pending_by_project": self.task_queue.pending_by_project(),
                 "completed_tasks": len(self.results),
+                "session_inits": self.session_inits,
+                "reinits_avoided": self.reinits_avoided,
                 "sessions": [
                     {
                         "id": s.session_id,
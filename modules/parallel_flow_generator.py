@@ -7,9 +7,11 @@ Tạo ảnh song song với workflow 2 bước:
 
 Features:
 - Multiple browsers chạy song song
-- 2-step workflow đảm bảo có ảnh ref trước khi tạo scenes
+- Lập lịch DAG: mỗi scene chỉ đợi đúng các ref trong reference_files của nó,
+  scene chạy chồng với phần còn lại của bước 1
 - Auto upload reference từ thư mục nv/
-- Chia đều prompts cho các browsers
+- Hàng đợi chung: browser rảnh lấy prompt tiếp theo (browser chậm/lỗi không
+  giữ cả phần prompts của mình), prompt đang chạy của browser hỏng được trả lại
 """
 
 import os
@@ -18,8 +20,9 @@ import json
 import base64
 import threading
 from pathlib import Path
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Tuple, Set
 from datetime import datetime
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, wait, ALL_COMPLETED
 from dataclasses import dataclass, field
 
@@ -40,27 +43,162 @@ class ParallelStats:
     browsers_used: int = 0
     step1_time: float = 0.0
     step2_time: float = 0.0
+    overlap_time: float = 0.0  # Scene chạy song song với ref (DAG)
     total_time: float = 0.0
 
 
+# Browser lỗi liên tiếp N prompt → coi như hỏng, trả prompt cho browser khác
+MAX_CONSECUTIVE_ERRORS = 3
+# Số lần tối đa 1 prompt được giao (tính cả lần đầu)
+MAX_PROMPT_ATTEMPTS = 2
+
+
+def is_reference_id(pid: str) -> bool:
+    """Ảnh tham chiếu: nvc, nv*, loc*."""
+    pid = str(pid)
+    return pid.startswith('nv') or pid.startswith('loc')
+
+
+def parse_reference_files(ref_files: Any) -> List[str]:
+    """reference_files trong Excel: JSON list hoặc chuỗi phân cách dấu phẩy."""
+    if not ref_files:
+        return []
+    if isinstance(ref_files, str):
+        try:
+            ref_files = json.loads(ref_files)
+        except:
+            ref_files = [f.strip() for f in ref_files.split(',') if f.strip()]
+    if isinstance(ref_files, str):
+        ref_files = [ref_files]
+    return [str(f) for f in ref_files]
+
+
+def reference_id(ref_file: str) -> str:
+    """'nvc.png' → 'nvc'."""
+    return Path(ref_file).stem if Path(ref_file).suffix else ref_file
+
+
+class PromptWorkQueue:
+    """
+    Hàng đợi prompts dùng chung cho các browser (DAG ref → scene).
+
+    - Prompt có depends (id các ảnh tham chiếu chưa xong) nằm chờ, được đưa
+      vào hàng đợi ngay khi tất cả ref của nó xong - không đợi cả bước 1
+    - take(): lấy prompt sẵn sàng tiếp theo; block khi chưa có nhưng còn prompt
+      đang chạy ở browser khác (có thể bị trả lại/mở khóa scene), None khi hết
+    - done(): prompt đã xử lý xong (thành công hoặc thất bại) → mở khóa scene
+    - requeue(): trả prompt về cuối hàng đợi (browser lỗi/hỏng); take() của
+      browser đó bỏ qua prompt này khi còn prompt khác.
+      Quá MAX_PROMPT_ATTEMPTS lần → coi như thất bại
+    """
+
+    def __init__(self, prompts: List[Dict], depends: Optional[Dict[str, Set[str]]] = None):
+        depends = depends or {}
+        self._pending = deque()
+        self._blocked: Dict[str, Tuple[Dict, Set[str]]] = {}
+        self._dependents: Dict[str, List[str]] = {}
+        for p in prompts:
+            pid = str(p.get('id', ''))
+            deps = set(depends.get(pid, ()))
+            if deps:
+                self._blocked[pid] = (p, deps)
+                for dep in deps:
+                    self._dependents.setdefault(dep, []).append(pid)
+            else:
+                self._pending.append(p)
+        self._in_flight = 0
+        self._attempts: Dict[str, int] = {}
+        self._failed_on: Dict[str, Set[Any]] = {}  # pid → workers đã lỗi với prompt
+        self._abandoned: List[Dict] = []
+        self.started_at: Dict[str, float] = {}  # pid → lần take đầu tiên
+        self.finished_at: Dict[str, float] = {}  # pid → lúc done/bỏ
+        self._cond = threading.Condition()
+
+    def take(self, worker: Any = None) -> Optional[Dict]:
+        """Prompt sẵn sàng tiếp theo; ưu tiên prompt chưa từng lỗi ở worker này."""
+        with self._cond:
+            while not self._pending and self._in_flight:
+                self._cond.wait()
+            if not self._pending and self._blocked:
+                # Ref không có trong hàng đợi (không thể xong) → chạy luôn
+                self._release_all_locked()
+            if not self._pending:
+                return None
+            p = next(
+                (q for q in self._pending
+                 if worker not in self._failed_on.get(str(q.get('id', '')), ())),
+                self._pending[0]
+            )
+            self._pending.remove(p)
+            pid = str(p.get('id', ''))
+            self._attempts[pid] = self._attempts.get(pid, 0) + 1
+            self.started_at.setdefault(pid, time.time())
+            self._in_flight += 1
+            return p
+
+    def done(self, p: Dict) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._resolve_locked(str(p.get('id', '')))
+            self._cond.notify_all()
+
+    def requeue(self, p: Dict, worker: Any = None) -> bool:
+        """Trả prompt lại (cuối hàng đợi). Returns False nếu đã hết lượt thử (tính là failed)."""
+        with self._cond:
+            self._in_flight -= 1
+            pid = str(p.get('id', ''))
+            if worker is not None:
+                self._failed_on.setdefault(pid, set()).add(worker)
+            retry = self._attempts.get(pid, 0) < MAX_PROMPT_ATTEMPTS
+            if retry:
+                self._pending.append(p)
+            else:
+                self._abandoned.append(p)
+                self._resolve_locked(pid)
+            self._cond.notify_all()
+            return retry
+
+    def _resolve_locked(self, pid: str) -> None:
+        """Ref pid đã xong: scene nào hết phụ thuộc thì đưa vào hàng đợi."""
+        self.finished_at[pid] = time.time()
+        for dependent in self._dependents.pop(pid, []):
+            entry = self._blocked.get(dependent)
+            if not entry:
+                continue
+            entry[1].discard(pid)
+            if not entry[1]:
+                del self._blocked[dependent]
+                self._pending.append(entry[0])
+
+    def _release_all_locked(self) -> None:
+        for p, _ in self._blocked.values():
+            self._pending.append(p)
+        self._blocked.clear()
+        self._dependents.clear()
+
+    def remaining(self) -> List[Dict]:
+        """Prompts chưa browser nào xử lý xong (vd: mọi browser đều hỏng)."""
+        with self._cond:
+            return list(self._pending) + [p for p, _ in self._blocked.values()]
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._pending) + len(self._blocked)
+
+
 class ParallelFlowGenerator:
     """
-    Tạo ảnh song song với nhiều browser, workflow 2 bước.
+    Tạo ảnh song song với nhiều browser, workflow 2 bước (lập lịch DAG).
 
     Workflow:
     ```
-    BƯỚC 1: Tạo ảnh tham chiếu (song song)
-    ├── Browser 1 → nvc, nv1, nv2
-    ├── Browser 2 → nv3, nv4, loc1
-    └── Browser 3 → loc2, loc3
-         ↓
-    [Đợi tất cả xong, lưu vào nv/]
-         ↓
-    BƯỚC 2: Tạo ảnh phân cảnh (song song)
-    ├── Browser 1 → Scene 1, 4, 7... (upload ref từ nv/)
-    ├── Browser 2 → Scene 2, 5, 8...
-    └── Browser 3 → Scene 3, 6, 9...
+    [Hàng đợi: nvc, nv1, loc1, ... | scenes chờ ref] ← Browser 1, 2, 3 lấy khi rảnh
+    nvc xong ──→ Scene 1 (refs: nvc) vào hàng đợi
+    nv1 xong ──→ Scene 2 (refs: nvc, nv1) vào hàng đợi
+    ...
     ```
+    Scene bắt đầu ngay khi các ảnh tham chiếu trong reference_files của nó
+    đã có media name (không đợi toàn bộ bước 1).
     """
 
     def __init__(
@@ -129,6 +267,10 @@ class ParallelFlowGenerator:
         self._lock = threading.Lock()
         self._results: Dict[str, Any] = {}
 
+        # Media names dùng chung giữa các browser (ref xong ở browser này,
+        # scene chạy ở browser khác vẫn dùng được)
+        self._media_names: Dict[str, Any] = {}
+
         # QUAN TRỌNG: Lock cho download - chỉ 1 browser download tại 1 thời điểm
         # Tránh nhầm lẫn ảnh khi nhiều browser cùng download
         self._download_lock = threading.Lock()
@@ -179,26 +321,6 @@ class ParallelFlowGenerator:
 
         return ref_prompts, scene_prompts
 
-    def _chunk_prompts(self, prompts: List[Dict], n_chunks: int) -> List[List[Dict]]:
-        """
-        Chia đều prompts cho n browsers.
-
-        Args:
-            prompts: List prompts
-            n_chunks: Số phần cần chia
-
-        Returns:
-            List các chunks
-        """
-        if not prompts:
-            return [[] for _ in range(n_chunks)]
-
-        chunks = [[] for _ in range(n_chunks)]
-        for i, p in enumerate(prompts):
-            chunks[i % n_chunks].append(p)
-
-        return chunks
-
     def _get_profile_name(self, browser_idx: int) -> str:
         """
         Lấy tên profile cho browser từ danh sách đã đăng nhập.
@@ -220,29 +342,34 @@ class ParallelFlowGenerator:
     def _worker_generate(
         self,
         browser_idx: int,
-        prompts: List[Dict],
-        phase: str,  # "ref" hoặc "scene"
+        work: PromptWorkQueue,
         excel_path: Optional[Path] = None
     ) -> Dict[str, Any]:
         """
         Worker function cho mỗi browser thread.
 
+        Lấy prompt từ hàng đợi chung cho đến khi hết. Browser không khởi động
+        được thì thoát ngay (prompts vẫn trong hàng đợi cho browser khác);
+        lỗi liên tiếp MAX_CONSECUTIVE_ERRORS lần thì trả prompt đang chạy và dừng.
+
         Args:
             browser_idx: Index của browser (0, 1, 2...)
-            prompts: Prompts cần xử lý
-            phase: "ref" (bước 1) hoặc "scene" (bước 2)
+            work: Hàng đợi prompts dùng chung (ref + scenes)
             excel_path: Đường dẫn Excel
 
         Returns:
             Dict với kết quả
         """
         thread_name = f"Browser-{browser_idx}"
-        self._log(f"[{thread_name}] Bắt đầu {phase}: {len(prompts)} prompts")
+        self._log(f"[{thread_name}] Bắt đầu: {len(work)} prompts trong hàng đợi")
 
-        if not prompts:
+        if not len(work):
             return {"success": 0, "failed": 0, "browser": browser_idx}
 
         profile_name = self._get_profile_name(browser_idx)
+        success = 0
+        failed = 0
+        requeued = 0
 
         try:
             # Tạo generator cho browser này
@@ -257,49 +384,54 @@ class ParallelFlowGenerator:
             # Start browser
             if not generator.start_browser():
                 self._log(f"[{thread_name}] Không khởi động được browser", "error")
-                return {"success": 0, "failed": len(prompts), "browser": browser_idx, "error": "Browser start failed"}
+                return {"success": 0, "failed": 0, "browser": browser_idx, "error": "Browser start failed"}
 
             # Wait for login
             if not generator.wait_for_login(timeout=120):
                 generator.stop_browser()
                 self._log(f"[{thread_name}] Chưa đăng nhập", "error")
-                return {"success": 0, "failed": len(prompts), "browser": browser_idx, "error": "Login timeout"}
+                return {"success": 0, "failed": 0, "browser": browser_idx, "error": "Login timeout"}
 
             # Inject JS
             if not generator._inject_js():
                 generator.stop_browser()
-                return {"success": 0, "failed": len(prompts), "browser": browser_idx, "error": "JS inject failed"}
+                return {"success": 0, "failed": 0, "browser": browser_idx, "error": "JS inject failed"}
 
-            # Load media cache (cho bước 2 - scene)
-            if phase == "scene":
-                cached = generator._load_media_cache()
-                if cached:
-                    generator._load_media_names_to_js(cached)
-                    self._log(f"[{thread_name}] Loaded {len(cached)} media references")
+            # Load media cache (ref đã tạo từ lần chạy trước)
+            cached = generator._load_media_cache()
+            with self._lock:
+                for key, value in cached.items():
+                    self._media_names.setdefault(key, value)
+            pushed_media = self._sync_media_names(generator, set())
+            if pushed_media:
+                self._log(f"[{thread_name}] Loaded {len(pushed_media)} media references")
 
             # Generate từng prompt
-            success = 0
-            failed = 0
-
-            for i, p in enumerate(prompts):
+            consecutive_errors = 0
+            processed = 0
+
+            while True:
+                p = work.take(browser_idx)
+                if p is None:
+                    break
+                processed += 1
                 pid = str(p.get('id', ''))
                 prompt_text = p.get('prompt', '')
-                ref_files = p.get('reference_files', [])
+                is_ref = is_reference_id(pid)
+                ref_files = [] if is_ref else parse_reference_files(p.get('reference_files'))
 
-                self._log(f"[{thread_name}] [{i+1}/{len(prompts)}] {pid}")
+                self._log(f"[{thread_name}] [#{processed}, còn {len(work)}] {pid}")
 
                 if not prompt_text:
                     failed += 1
+                    work.done(p)
                     continue
 
                 try:
                     # Upload reference nếu có (cho scenes)
-                    if phase == "scene" and ref_files:
-                        if isinstance(ref_files, str):
-                            try:
-                                ref_files = json.loads(ref_files)
-                            except:
-                                ref_files = [f.strip() for f in ref_files.split(',') if f.strip()]
+                    if ref_files:
+                        # Media name của ref vừa tạo ở browser khác
+                        pushed_media = self._sync_media_names(generator, pushed_media)
                         generator._upload_reference_images(ref_files)
 
                     # =========================================================
@@ -338,13 +470,18 @@ class ParallelFlowGenerator:
                                 self._log(f"[{thread_name}] ✅ OK: {pid} -> {img_file.name}", "success")
 
                                 # Save media name (cho ref)
-                                if phase == "ref":
+                                if is_ref:
                                     js_result = result.get("result", {})
                                     js_images = js_result.get("images", []) if isinstance(js_result, dict) else []
                                     if js_images and js_images[0].get("mediaName"):
                                         generator.driver.execute_script(
                                             f"VE3.setMediaName('{pid}', '{js_images[0]['mediaName']}', {js_images[0].get('seed', 'null')});"
                                         )
+                                        self._publish_media_name(generator, pid, {
+                                            "mediaName": js_images[0]["mediaName"],
+                                            "seed": js_images[0].get("seed")
+                                        })
+                                        pushed_media.add(pid)
                             else:
                                 failed += 1
                                 self._log(f"[{thread_name}] ❌ Không tìm thấy file: {pid}", "error")
@@ -354,19 +491,31 @@ class ParallelFlowGenerator:
 
                         self._log(f"[{thread_name}] 🔓 Xong download: {pid}")
 
+                    work.done(p)
+                    consecutive_errors = 0
+
                     # Delay
                     time.sleep(2)
 
                 except Exception as e:
-                    failed += 1
+                    consecutive_errors += 1
                     self._log(f"[{thread_name}] Error {pid}: {e}", "error")
-
-            # Lưu media cache (sau bước ref)
-            if phase == "ref":
-                media_names = generator._get_media_names_from_js()
-                if media_names:
-                    generator._save_media_cache(media_names)
-                    self._log(f"[{thread_name}] Saved {len(media_names)} media names")
+                    # Trả prompt cho browser khác (nếu còn lượt thử)
+                    if work.requeue(p, browser_idx):
+                        requeued += 1
+                    else:
+                        failed += 1
+                    if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                        self._log(f"[{thread_name}] Lỗi {consecutive_errors} lần liên tiếp - dừng browser", "error")
+                        break
+
+            # Lưu media cache (gộp với media names của các browser khác)
+            media_names = generator._get_media_names_from_js()
+            if media_names:
+                with self._lock:
+                    self._media_names.update(media_names)
+                    generator._save_media_cache(dict(self._media_names))
+                self._log(f"[{thread_name}] Saved {len(media_names)} media names")
 
             # Đóng browser
             generator.stop_browser()
@@ -374,6 +523,7 @@ class ParallelFlowGenerator:
             return {
                 "success": success,
                 "failed": failed,
+                "requeued": requeued,
                 "browser": browser_idx
             }
 
@@ -382,12 +532,78 @@ class ParallelFlowGenerator:
             import traceback
             traceback.print_exc()
             return {
-                "success": 0,
-                "failed": len(prompts),
+                "success": success,
+                "failed": failed,
+                "requeued": requeued,
                 "browser": browser_idx,
                 "error": str(e)
             }
 
+    def _publish_media_name(self, generator: BrowserFlowGenerator, pid: str, media: Dict[str, Any]) -> None:
+        """Ref vừa xong: chia sẻ media name cho các browser khác + lưu cache ngay."""
+        with self._lock:
+            self._media_names[pid] = media
+            generator._save_media_cache(dict(self._media_names))
+
+    def _sync_media_names(self, generator: BrowserFlowGenerator, pushed: Set[str]) -> Set[str]:
+        """Đẩy media names browser này chưa có vào JS. Returns tập id đã đẩy."""
+        with self._lock:
+            missing = {k: v for k, v in self._media_names.items() if k not in pushed}
+        if missing:
+            generator._load_media_names_to_js(missing)
+        return pushed | set(missing)
+
+    def _build_dependencies(self, ref_prompts: List[Dict], scene_prompts: List[Dict]) -> Dict[str, Set[str]]:
+        """
+        Scene id → các ref id (trong lần chạy này) cần xong trước.
+
+        Ref đã xong từ trước (không có trong ref_prompts) không chặn scene.
+        """
+        pending_refs = {str(p.get('id', '')) for p in ref_prompts}
+        depends = {}
+        for p in scene_prompts:
+            refs = {reference_id(f) for f in parse_reference_files(p.get('reference_files'))}
+            refs &= pending_refs
+            if refs:
+                depends[str(p.get('id', ''))] = refs
+        return depends
+
+    def _run_queue(self, work: PromptWorkQueue, excel_path: Optional[Path]) -> None:
+        """
+        Các browser cùng lấy prompts từ 1 hàng đợi chung cho đến khi hết.
+
+        Args:
+            work: Hàng đợi (ref trước, scene mở khóa theo DAG)
+            excel_path: Đường dẫn Excel
+        """
+        n_workers = min(self.num_browsers, len(work))
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(self._worker_generate, i, work, excel_path)
+                for i in range(n_workers)
+            ]
+
+            # Đợi tất cả xong
+            done, _ = wait(futures, return_when=ALL_COMPLETED)
+
+            # Thu thập kết quả
+            for future in done:
+                try:
+                    result = future.result()
+                    self.stats.success += result.get("success", 0)
+                    self.stats.failed += result.get("failed", 0)
+                    if result.get("requeued"):
+                        self._log(f"  Browser {result.get('browser')}: trả lại {result['requeued']} prompts")
+                except Exception as e:
+                    self._log(f"Worker error: {e}", "error")
+
+        # Không browser nào xử lý được (vd: tất cả không khởi động được)
+        leftover = work.remaining()
+        if leftover:
+            self.stats.failed += len(leftover)
+            self._log(f"  {len(leftover)} prompts không được xử lý: {[p['id'] for p in leftover]}", "error")
+
     def generate_parallel(
         self,
         excel_path: Optional[Path] = None,
@@ -470,86 +686,30 @@ class ParallelFlowGenerator:
         self.stats.browsers_used = self.num_browsers
 
         # =====================================================================
-        # BƯỚC 1: Tạo ảnh tham chiếu song song
+        # DAG: ref chạy trước, scene vào hàng đợi ngay khi ref của nó xong
         # =====================================================================
-        if ref_prompts:
-            step1_start = time.time()
-            self._log("\n" + "=" * 60)
-            self._log("BƯỚC 1: TẠO ẢNH THAM CHIẾU (SONG SONG)")
-            self._log("=" * 60)
-
-            # Chia prompts cho các browsers
-            ref_chunks = self._chunk_prompts(ref_prompts, self.num_browsers)
-
-            for i, chunk in enumerate(ref_chunks):
-                if chunk:
-                    self._log(f"  Browser {i}: {len(chunk)} prompts ({[p['id'] for p in chunk]})")
-
-            # Chạy song song
-            with ThreadPoolExecutor(max_workers=self.num_browsers) as executor:
-                futures = []
-                for i, chunk in enumerate(ref_chunks):
-                    if chunk:
-                        future = executor.submit(
-                            self._worker_generate,
-                            i, chunk, "ref", excel_path
-                        )
-                        futures.append(future)
-
-                # Đợi tất cả xong
-                done, _ = wait(futures, return_when=ALL_COMPLETED)
-
-                # Thu thập kết quả
-                for future in done:
-                    try:
-                        result = future.result()
-                        self.stats.success += result.get("success", 0)
-                        self.stats.failed += result.get("failed", 0)
-                    except Exception as e:
-                        self._log(f"Worker error: {e}", "error")
-
-            self.stats.step1_time = time.time() - step1_start
-            self._log(f"\nBước 1 hoàn thành: {self.stats.step1_time:.1f}s")
+        depends = self._build_dependencies(ref_prompts, scene_prompts)
+        work = PromptWorkQueue(ref_prompts + scene_prompts, depends)
 
-        # =====================================================================
-        # BƯỚC 2: Tạo ảnh phân cảnh song song
-        # =====================================================================
-        if scene_prompts:
-            step2_start = time.time()
-            self._log("\n" + "=" * 60)
-            self._log("BƯỚC 2: TẠO ẢNH PHÂN CẢNH (SONG SONG)")
-            self._log("=" * 60)
-
-            # Chia prompts
-            scene_chunks = self._chunk_prompts(scene_prompts, self.num_browsers)
-
-            for i, chunk in enumerate(scene_chunks):
-                if chunk:
-                    self._log(f"  Browser {i}: {len(chunk)} scenes")
-
-            # Chạy song song
-            with ThreadPoolExecutor(max_workers=self.num_browsers) as executor:
-                futures = []
-                for i, chunk in enumerate(scene_chunks):
-                    if chunk:
-                        future = executor.submit(
-                            self._worker_generate,
-                            i, chunk, "scene", excel_path
-                        )
-                        futures.append(future)
-
-                done, _ = wait(futures, return_when=ALL_COMPLETED)
-
-                for future in done:
-                    try:
-                        result = future.result()
-                        self.stats.success += result.get("success", 0)
-                        self.stats.failed += result.get("failed", 0)
-                    except Exception as e:
-                        self._log(f"Worker error: {e}", "error")
-
-            self.stats.step2_time = time.time() - step2_start
-            self._log(f"\nBước 2 hoàn thành: {self.stats.step2_time:.1f}s")
+        self._log("\n" + "=" * 60)
+        self._log("TẠO ẢNH THAM CHIẾU + PHÂN CẢNH (SONG SONG, THEO DAG)")
+        self._log("=" * 60)
+        self._log(f"  Ref: {[p['id'] for p in ref_prompts]}")
+        self._log(f"  Scenes chờ ref: {len(depends)}/{len(scene_prompts)}")
+
+        self._run_queue(work, excel_path)
+
+        # Bước 1 = đến khi ref cuối xong; Bước 2 = từ scene đầu tiên đến hết
+        ref_ids = {str(p.get('id', '')) for p in ref_prompts}
+        ref_end = max((t for pid, t in work.finished_at.items() if pid in ref_ids), default=None)
+        scene_start = min((t for pid, t in work.started_at.items() if pid not in ref_ids), default=None)
+        run_end = time.time()
+        if ref_end is not None:
+            self.stats.step1_time = ref_end - total_start
+        if scene_start is not None:
+            self.stats.step2_time = run_end - scene_start
+        if ref_end is not None and scene_start is not None:
+            self.stats.overlap_time = max(0.0, ref_end - scene_start)
 
         # Summary
         self.stats.total_time = time.time() - total_start
@@ -560,6 +720,7 @@ class ParallelFlowGenerator:
         self._log(f"Tổng thời gian: {self.stats.total_time:.1f}s")
         self._log(f"  - Bước 1 (ref): {self.stats.step1_time:.1f}s")
         self._log(f"  - Bước 2 (scene): {self.stats.step2_time:.1f}s")
+        self._log(f"  - Chạy chồng (scene trong lúc tạo ref): {self.stats.overlap_time:.1f}s")
         self._log(f"Kết quả: {self.stats.success} thành công, {self.stats.failed} thất bại")
 
         # So sánh với chạy tuần tự
@@ -576,6 +737,7 @@ class ParallelFlowGenerator:
                 "time": self.stats.total_time,
                 "step1_time": self.stats.step1_time,
                 "step2_time": self.stats.step2_time,
+                "overlap_time": self.stats.overlap_time,
                 "browsers": self.stats.browsers_used,
                 "speedup": speedup
             }
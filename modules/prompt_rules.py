@@ -0,0 +1,435 @@
+"""
+VE3 Tool - Prompt Rules Engine
+==============================
+Hậu xử lý img_prompt/video_prompt sau khi AI trả về:
+- Sửa location mâu thuẫn với hành động ("lying in bed ... hallway")
+- Xoá lời dẫn/thoại lọt vào prompt
+- Nhận diện text giống lời dẫn
+- Lọc nhân vật trẻ em khỏi reference_files + mô tả inline
+- Gắn annotation (nvc.png) / (loc_x.png) cho Flow
+
+Tất cả bảng keyword/regex được compile 1 lần khi import: keyword của mọi
+rule gộp thành 1 tập (quét text 1 lần), regex thay câu compile sẵn.
+Map nhân vật/bối cảnh được dựng 1 lần cho mỗi project (ProjectPromptRules)
+thay vì dựng lại ở mỗi scene.
+
+Usage:
+    from modules.prompt_rules import ProjectPromptRules, fix_location, clean_narration
+
+    rules = ProjectPromptRules(characters, locations, logger=logger)
+    img, video, refs = rules.finalize(img_prompt, video_prompt, ref_files)
+
+    img = fix_location(img, srt_text, logger=logger)
+    img = clean_narration(img, scene_text, logger=logger)
+"""
+
+import re
+from typing import Optional, List, Dict, Tuple, Iterable, Set, Any
+
+
+# =============================================================================
+# KEYWORD MATCHER
+# =============================================================================
+
+class KeywordSet:
+    """
+    Tập keyword so khớp kiểu substring (`kw in text`), gộp từ nhiều bảng.
+
+    Keyword trùng giữa các bảng/rule chỉ quét 1 lần; rule dùng phép giao
+    tập hợp trên kết quả thay vì quét lại text. Với bảng cỡ vài chục keyword,
+    `in` của CPython (C, two-way search) nhanh hơn regex alternation hay
+    Aho-Corasick viết bằng Python (đo bằng benchmark prompt_rules).
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: Tuple[str, ...] = tuple(dict.fromkeys(k for k in keywords if k))
+
+    def find(self, text: str) -> Set[str]:
+        """Tập keyword có mặt trong text (text đã lower nếu bảng là lowercase)."""
+        return {k for k in self.keywords if k in text}
+
+    def any(self, text: str) -> bool:
+        """Có ít nhất 1 keyword trong text."""
+        return any(k in text for k in self.keywords)
+
+
+# =============================================================================
+# LOCATION RULES
+# =============================================================================
+
+# action → location: prompt có action nhưng lại nhắc location sai → thay câu đó
+ACTION_LOCATION_RULES = [
+    # BED actions → must be bedroom
+    {
+        "actions": ["lying in bed", "on the bed", "in bed", "bedroom", "on bed", "fell off the bed", "jumped up from bed"],
+        "wrong_locations": ["hallway", "corridor", "street", "outdoor", "kitchen", "office", "restaurant"],
+        "correct_location": "master bedroom, king-sized bed with silk sheets, elegant furniture, soft ambient lighting"
+    },
+    # KITCHEN actions → must be kitchen
+    {
+        "actions": ["cooking", "in the kitchen", "at the stove", "preparing food"],
+        "wrong_locations": ["bedroom", "hallway", "office", "outdoor", "street"],
+        "correct_location": "modern kitchen interior, stove, countertops, cooking utensils, warm lighting"
+    },
+    # BATHROOM actions
+    {
+        "actions": ["shower", "bathtub", "bathroom", "brushing teeth", "mirror"],
+        "wrong_locations": ["bedroom", "kitchen", "office", "outdoor", "hallway"],
+        "correct_location": "elegant bathroom, marble tiles, mirror, soft lighting"
+    },
+    # OUTDOOR actions
+    {
+        "actions": ["walking on street", "driving", "in the car", "outdoor", "park", "garden"],
+        "wrong_locations": ["bedroom", "kitchen", "bathroom", "office interior"],
+        "correct_location": "outdoor scene, natural daylight"
+    },
+    # RESTAURANT actions
+    {
+        "actions": ["dining", "at restaurant", "eating dinner", "at the table"],
+        "wrong_locations": ["bedroom", "bathroom", "street", "office"],
+        "correct_location": "elegant restaurant interior, dining tables, ambient lighting"
+    },
+]
+
+# Gợi ý location từ SRT (thứ tự = ưu tiên)
+SRT_LOCATION_HINTS = {
+    "bed": "bedroom",
+    "bedroom": "bedroom",
+    "master bedroom": "master bedroom",
+    "kitchen": "kitchen",
+    "bathroom": "bathroom",
+    "restaurant": "restaurant",
+    "office": "office",
+    "car": "car interior",
+    "street": "street",
+    "courthouse": "courthouse",
+    "hospital": "hospital",
+}
+
+# Location cụ thể hơn khi SRT nói rõ
+SRT_LOCATION_OVERRIDES = {
+    "bedroom": "master bedroom, king-sized bed with silk sheets, elegant nightstands, soft warm lighting",
+    "master bedroom": "master bedroom, king-sized bed with silk sheets, elegant nightstands, soft warm lighting",
+    "kitchen": "modern kitchen, marble countertops, stainless steel appliances, warm lighting",
+}
+
+_RULE_ACTIONS = [frozenset(rule["actions"]) for rule in ACTION_LOCATION_RULES]
+
+_PROMPT_KEYWORDS = KeywordSet(
+    kw for rule in ACTION_LOCATION_RULES for kw in rule["actions"] + rule["wrong_locations"]
+)
+
+# Câu chứa location sai (compile sẵn cho từng location)
+_WRONG_LOCATION_SENTENCE = {
+    loc: re.compile(r'[^.]*' + re.escape(loc) + r'[^.]*\.?', re.IGNORECASE)
+    for rule in ACTION_LOCATION_RULES for loc in rule["wrong_locations"]
+}
+
+_MULTI_SPACE = re.compile(r'\s+')
+_MULTI_DOT = re.compile(r'\.\.+')
+
+
+def fix_location(img_prompt: str, srt_text: str, logger=None) -> str:
+    """
+    Sửa location mâu thuẫn với hành động trong img_prompt.
+
+    Ví dụ lỗi: "LYING IN BED... hotel hallway" → thay câu chứa "hallway"
+    bằng location đúng (ưu tiên location SRT nhắc tới).
+
+    Args:
+        img_prompt: Prompt từ AI
+        srt_text: Text gốc từ SRT
+        logger: Logger (tuỳ chọn)
+
+    Returns:
+        Prompt đã sửa (hoặc nguyên bản nếu không có mâu thuẫn)
+    """
+    if not img_prompt:
+        return img_prompt
+
+    hits = _PROMPT_KEYWORDS.find(img_prompt.lower())
+    if not hits:
+        return img_prompt
+
+    for rule, actions in zip(ACTION_LOCATION_RULES, _RULE_ACTIONS):
+        if actions.isdisjoint(hits):
+            continue
+        for wrong_loc in rule["wrong_locations"]:
+            if wrong_loc not in hits:
+                continue
+            if logger:
+                logger.warning(f"[Validation] Action/Location mismatch: action implies {rule['actions'][0]} but found '{wrong_loc}'")
+
+            # Ưu tiên location SRT nhắc tới, không có thì dùng location của rule
+            correct_loc = SRT_LOCATION_OVERRIDES.get(_srt_location(srt_text), rule["correct_location"])
+
+            fixed = _WRONG_LOCATION_SENTENCE[wrong_loc].sub(correct_loc + '. ', img_prompt)
+            fixed = _MULTI_SPACE.sub(' ', fixed)
+            fixed = _MULTI_DOT.sub('.', fixed)
+            return fixed.strip()
+
+    return img_prompt
+
+
+def _srt_location(srt_text: str) -> Optional[str]:
+    """Location đầu tiên (theo thứ tự SRT_LOCATION_HINTS) mà SRT nhắc tới."""
+    if not srt_text:
+        return None
+    srt_lower = srt_text.lower()
+    for hint, loc in SRT_LOCATION_HINTS.items():
+        if hint in srt_lower:
+            return loc
+    return None
+
+
+# =============================================================================
+# NARRATION
+# =============================================================================
+
+# Lời dẫn/thoại hay bị AI chép vào prompt (áp dụng tuần tự)
+NARRATION_PATTERNS = [
+    r'By the time I was \d+ years old[^.]*\.?',
+    r'I had saved[^.]*\.?',
+    r'I decided to[^.]*\.?',
+    r'It cost me[^.]*\.?',
+    r'I remember[^.]*\.?',
+    r'She (told|said|asked)[^.]*\.?',
+    r'He (told|said|asked)[^.]*\.?',
+    r'"[^"]*"',  # Remove quoted dialogue
+]
+
+_NARRATION_SUBS = [(p, re.compile(p, re.IGNORECASE)) for p in NARRATION_PATTERNS]
+# 1 lần search để bỏ qua prompt sạch (đa số)
+_NARRATION_ANY = re.compile("|".join(f"(?:{p})" for p in NARRATION_PATTERNS), re.IGNORECASE)
+
+# Text trông giống lời dẫn (first person, thoại, CTA YouTube)
+_NARRATION_START = ("i ", "i'", "my ", "we ", "she ", "he ", "they ")
+_NARRATION_WORDS = KeywordSet([
+    "said", "told", "asked",
+    "i was", "i had", "i remember", "by the time", "years old",
+    "subscribe", "like button", "comment",
+])
+
+
+def looks_like_narration(text: str) -> bool:
+    """Text giống lời dẫn/thoại hơn là mô tả hình ảnh."""
+    if not text:
+        return True
+    if '"' in text:
+        return True
+    text_lower = text.lower().strip()
+    if text_lower.startswith(_NARRATION_START):
+        return True
+    return _NARRATION_WORDS.any(text_lower)
+
+
+def clean_narration(img_prompt: str, scene_text: str, logger=None) -> str:
+    """
+    Xoá lời dẫn/thoại bị chép vào img_prompt (image generator sẽ vẽ chữ lên ảnh).
+
+    Args:
+        img_prompt: Prompt từ AI
+        scene_text: Lời dẫn của scene (khoảng 100 ký tự đầu)
+        logger: Logger (tuỳ chọn)
+
+    Returns:
+        Prompt đã làm sạch
+    """
+    if not img_prompt or not scene_text:
+        return img_prompt
+
+    # 1. Cụm 5 từ liên tiếp của lời dẫn xuất hiện trong prompt → xoá cả câu
+    words = scene_text.split()
+    if len(words) >= 5:
+        prompt_lower = img_prompt.lower()
+        for i in range(len(words) - 4):
+            if words[i].lower() not in prompt_lower:
+                continue
+            phrase = " ".join(words[i:i + 5])
+            if phrase.lower() in prompt_lower:
+                pattern = re.compile(r'[^.]*' + re.escape(phrase) + r'[^.]*\.?', re.IGNORECASE)
+                img_prompt = pattern.sub('', img_prompt)
+                prompt_lower = img_prompt.lower()
+                if logger:
+                    logger.debug(f"[Clean] Removed narration phrase: '{phrase[:30]}...'")
+
+    # 2. Pattern lời dẫn thường gặp
+    if _NARRATION_ANY.search(img_prompt):
+        for source, pattern in _NARRATION_SUBS:
+            img_prompt, count = pattern.subn('', img_prompt)
+            if count and logger:
+                logger.debug(f"[Clean] Removed pattern: {source[:30]}...")
+
+    # 3. Dọn dấu chấm/khoảng trắng thừa
+    img_prompt = _MULTI_DOT.sub('.', img_prompt)
+    img_prompt = _MULTI_SPACE.sub(' ', img_prompt)
+    img_prompt = img_prompt.strip().strip('.')
+
+    if len(img_prompt) < 30 and logger:
+        logger.warning("[Clean] Prompt too short after cleaning, may need manual review")
+
+    return img_prompt
+
+
+# =============================================================================
+# REFERENCES (children + filename annotations)
+# =============================================================================
+
+# Nhân vật trẻ em không được dùng ảnh tham chiếu (vi phạm policy API)
+_CHILD_PATTERN = re.compile("nvc1|nv1c|child")
+
+_IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# Độ dài đoạn mô tả dùng để tìm vị trí chèn annotation
+CHAR_MATCH_LEN = 30
+LOC_MATCH_LEN = 20
+
+
+def is_child_ref(ref: str) -> bool:
+    """Reference (nvc1.png, nv1c, child_x...) là nhân vật trẻ em."""
+    if not ref:
+        return False
+    return bool(_CHILD_PATTERN.search(ref.replace('.png', '').lower()))
+
+
+def split_children(ref_files: List[str], logger=None) -> Tuple[List[str], List[str]]:
+    """Tách reference_files thành (refs giữ lại, refs trẻ em)."""
+    kept: List[str] = []
+    children: List[str] = []
+    for ref in ref_files or []:
+        if is_child_ref(ref):
+            if logger:
+                logger.info(f"  -> Filtered out child character from references: {ref}")
+            children.append(ref)
+        else:
+            kept.append(ref)
+    return kept, children
+
+
+def _normalize_ref(ref: str) -> str:
+    return ref if ref.endswith(_IMAGE_EXTS) else f"{ref}.png"
+
+
+def _ref_id(ref_file: str) -> str:
+    return ref_file.replace('.png', '').replace('.jpg', '').replace('.jpeg', '').replace('.webp', '')
+
+
+class ProjectPromptRules:
+    """
+    Map nhân vật/bối cảnh của 1 project, dựng 1 lần và dùng cho mọi scene.
+
+    - children: id → "(Child: character_lock)"
+    - anchors: id → đoạn đầu của character_lock/location_lock để tìm vị trí
+      chèn annotation, kèm các dấu kết thúc mệnh đề và khoảng tìm tối đa
+    """
+
+    CHAR_END_MARKERS = (',', '.', ' in ', ' at ', ' with ', ' and ')
+    LOC_END_MARKERS = (',', '.', ' with ', ' and ')
+
+    def __init__(self, characters: Optional[List[Any]] = None,
+                 locations: Optional[List[Any]] = None, logger=None):
+        self.logger = logger
+        self.child_descriptions: Dict[str, str] = {}
+        self.char_anchors: Dict[str, str] = {}
+        self.loc_anchors: Dict[str, str] = {}
+
+        for char in characters or []:
+            lock = getattr(char, 'character_lock', '') or ''
+            if lock and char.id not in self.child_descriptions:
+                self.child_descriptions[char.id] = f"(Child: {lock})"
+            desc = lock or getattr(char, 'vietnamese_prompt', '') or getattr(char, 'name', '')
+            anchor = (desc or '')[:CHAR_MATCH_LEN]
+            self.char_anchors[char.id] = anchor if len(anchor) > 5 else ""
+
+        for loc in locations or []:
+            desc = getattr(loc, 'location_lock', '') or getattr(loc, 'name', '')
+            anchor = (desc or '')[:LOC_MATCH_LEN]
+            self.loc_anchors[loc.id] = anchor if len(anchor) > 5 else ""
+
+    # -------------------------------------------------------------------------
+
+    def child_description(self, child_ref: str) -> str:
+        """Mô tả inline cho nhân vật trẻ em (rỗng nếu không có character_lock)."""
+        return self.child_descriptions.get(child_ref.replace(".png", ""), "")
+
+    def inline_children(self, prompt: str, children: List[str]) -> str:
+        """Chèn mô tả trẻ em lên đầu prompt (thay cho ảnh tham chiếu)."""
+        if not prompt or not children or not self.child_descriptions:
+            return prompt
+        descs = []
+        for child_ref in children:
+            desc = self.child_description(child_ref)
+            if desc:
+                descs.append(desc)
+                if self.logger:
+                    self.logger.info(f"  -> Added inline description for {child_ref}: {desc[:50]}...")
+        if descs:
+            prompt = f"{', '.join(descs)} - {prompt}"
+        return prompt
+
+    @staticmethod
+    def _insert_after(result: str, anchor: str, annotation: str,
+                      markers: Tuple[str, ...], window: int) -> Optional[str]:
+        idx = result.find(anchor)
+        if idx < 0:
+            return None
+        end_idx = idx + len(anchor)
+        for marker in markers:
+            pos = result.find(marker, end_idx)
+            if 0 < pos < end_idx + window:
+                end_idx = pos
+                break
+        return result[:end_idx] + f" {annotation}" + result[end_idx:]
+
+    def annotate(self, prompt: str, reference_files: List[str]) -> str:
+        """
+        Gắn tên file tham chiếu vào prompt để Flow khớp ảnh upload.
+
+        "A 30-year-old man walking in the living room"
+        → "A 30-year-old man (nvc.png) walking in the living room (loc_apartment.png)"
+
+        Ref không tìm được chỗ chèn → gom lại cuối prompt "(reference: ...)".
+        """
+        if not prompt or not reference_files:
+            return prompt
+
+        result = prompt
+        for ref in reference_files:
+            ref_file = _normalize_ref(ref)
+            annotation = f"({ref_file})"
+            if annotation in result:
+                continue
+            ref_id = _ref_id(ref_file)
+
+            inserted = None
+            anchor = self.char_anchors.get(ref_id)
+            if anchor:
+                inserted = self._insert_after(result, anchor, annotation, self.CHAR_END_MARKERS, 100)
+            if inserted is None:
+                anchor = self.loc_anchors.get(ref_id)
+                if anchor:
+                    inserted = self._insert_after(result, anchor, annotation, self.LOC_END_MARKERS, 80)
+            if inserted is not None:
+                result = inserted
+
+        missing = [r for r in map(_normalize_ref, reference_files) if f"({r})" not in result]
+        if missing:
+            result = f"{result.rstrip('. ')} (reference: {', '.join(missing)})."
+        return result
+
+    def finalize(self, img_prompt: str, video_prompt: str,
+                 ref_files: List[str]) -> Tuple[str, str, List[str]]:
+        """
+        Toàn bộ xử lý reference cho 1 scene: lọc trẻ em → mô tả inline → annotation.
+
+        Returns:
+            (img_prompt, video_prompt, ref_files đã lọc)
+        """
+        ref_files, children = split_children(ref_files, self.logger)
+        if children:
+            img_prompt = self.inline_children(img_prompt, children)
+            video_prompt = self.inline_children(video_prompt, children)
+        if ref_files:
+            img_prompt = self.annotate(img_prompt, ref_files)
+            video_prompt = self.annotate(video_prompt, ref_files)
+        return img_prompt, video_prompt, ref_files
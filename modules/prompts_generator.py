@@ -5,9 +5,14 @@ Sử dụng AI API để phân tích SRT và tạo prompts cho ảnh/video.
 Hỗ trợ: DeepSeek (primary), Ollama (local fallback)
 """
 
+import re
 import json
 import time
+import bisect
+import asyncio
+import hashlib
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextvars import ContextVar
 from datetime import timedelta
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple, Callable
@@ -25,14 +30,86 @@ from modules.excel_manager import (
     PromptWorkbook,
     Character,
     Location,
-    Scene
+    Scene,
+    workbook_lock
 )
 from modules.prompts_loader import (
     get_analyze_story_prompt,
     get_generate_scenes_prompt,
     get_smart_divide_scenes_prompt,
-    get_global_style
+    get_global_style,
+    assemble_prefix_prompt
 )
+from modules.metrics import timed, inc
+from modules.llm_transport import get_transport, run_async
+from modules.prompt_rules import (
+    ProjectPromptRules,
+    is_child_ref,
+    split_children,
+    fix_location,
+    clean_narration,
+    looks_like_narration
+)
+from modules.token_budget import TokenBudget, ProviderBudget, PROVIDER_BUDGETS, estimate_tokens
+from modules.ollama_manager import get_ollama_manager
+from modules.llm_hedging import HedgePolicy
+from modules.structured_output import (
+    SCENE_PROMPTS_SCHEMA, SHOOTING_PLAN_SCHEMA, STORY_CHUNK_SCHEMA, STORY_REDUCE_SCHEMA,
+    parse_structured, schema_instruction, validate_json
+)
+from modules.offline_prompts import analyze_offline, assign_scenes, prompt_change
+from modules.story_map_reduce import (
+    chunk_entries, chunk_time_range, format_chunk, merge_chunks, reduce_inputs, apply_groups, story_outline
+)
+from modules.scene_prompt_cache import SceneKey, get_scene_prompt_cache
+
+
+def _timestamp_seconds(value) -> Optional[float]:
+    """Timestamp (timedelta, số giây, "HH:MM:SS,mmm", "HH:MM:SS", "MM:SS") → giây."""
+    if value is None or value == "":
+        return None
+    if hasattr(value, "total_seconds"):
+        return value.total_seconds()
+    if isinstance(value, (int, float)):
+        return float(value)
+    parts = str(value).strip().replace(",", ".").split(":")
+    try:
+        if len(parts) == 3:
+            return int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2])
+        if len(parts) == 2:
+            return int(parts[0]) * 60 + float(parts[1])
+        return float(parts[0])
+    except ValueError:
+        return None
+
+
+def _normalize_narration(text: str) -> str:
+    """So sánh lời dẫn bỏ qua khác biệt khoảng trắng/xuống dòng/hoa thường."""
+    return " ".join(str(text or "").split()).lower()
+
+
+def _narration_index(srt_entries: List) -> Callable[[float, float], str]:
+    """
+    Lời dẫn SRT nguyên văn trong khoảng [start, end) giây - entry tính theo
+    điểm giữa của nó.
+    """
+    timeline = sorted(
+        ((e.start_time.total_seconds() + e.end_time.total_seconds()) / 2, e.text)
+        for e in srt_entries
+    )
+    mids = [m for m, _ in timeline]
+
+    def narration_between(start: float, end: float) -> str:
+        lo = bisect.bisect_left(mids, start)
+        hi = bisect.bisect_left(mids, end)
+        return " ".join(text for _, text in timeline[lo:hi])
+
+    return narration_between
+
+
+def _narration_hash(text: str) -> str:
+    """Hash lời dẫn (đã normalize) - baseline để phát hiện SRT bị sửa."""
+    return hashlib.sha1(_normalize_narration(text).encode("utf-8")).hexdigest()[:16]
 
 
 # ============================================================================
@@ -68,6 +145,28 @@ class MultiAIClient:
         self.ollama_endpoint = config.get("ollama_endpoint", "http://localhost:11434")
         self.OLLAMA_URL = f"{self.ollama_endpoint}/api/generate"
         self.ollama_available = False
+        # Giữ model + KV cache trong VRAM giữa các batch (prefix prompt dùng lại được)
+        self.ollama_keep_alive = config.get("ollama_keep_alive", "30m")
+        # Warm-up, slots song song, num_ctx theo request, tokens/s (dùng chung theo model)
+        self.ollama = get_ollama_manager(
+            self.ollama_endpoint, self.ollama_model,
+            keep_alive=self.ollama_keep_alive,
+            num_parallel=config.get("ollama_num_parallel", 0),
+            max_ctx=config.get("ollama_max_ctx"),
+            warmup_ctx=config.get("ollama_warmup_ctx"),
+        )
+        # "auto" = warm-up khi Ollama là provider chính (không có DeepSeek key), "always", "off"
+        self.ollama_warmup = str(config.get("ollama_warmup", "auto")).lower()
+
+        # Hedging: request chậm hơn latency đã học → gửi bản sao sang key/provider khác
+        self.hedging: Optional[HedgePolicy] = None
+        if config.get("llm_hedging", False):
+            self.hedging = HedgePolicy(
+                percentile=config.get("llm_hedge_percentile", 0.9),
+                default_after=config.get("llm_hedge_after_s", 120),
+                max_extra_tokens=config.get("llm_hedge_max_extra_tokens", 300000),
+                max_hedge_ratio=config.get("llm_hedge_max_ratio", 0.2),
+            )
 
         self.deepseek_index = 0
 
@@ -76,11 +175,27 @@ class MultiAIClient:
         self.parallel_enabled = config.get("parallel_enabled", True)
         self._request_lock = threading.Lock()
 
+        # Usage của request gần nhất (theo thread / asyncio task - batch chạy song song)
+        self._usage: ContextVar = ContextVar(f"llm_usage_{id(self)}", default=None)
+        # Tổng token theo provider (prompt cached/uncached + completion)
+        self.usage_totals: Dict[str, Dict[str, int]] = {}
+        self._usage_lock = threading.Lock()
+
         self.logger = get_logger("multi_ai")
 
         # Auto filter exhausted APIs at startup
         if auto_filter:
             self._filter_working_apis()
+            if self.ollama_available and self._should_warm_up_ollama():
+                self.ollama.warm_up()
+
+    def _should_warm_up_ollama(self) -> bool:
+        """Theo ollama_warmup: auto = chỉ khi Ollama là provider chính."""
+        if self.ollama_warmup in ("off", "false", "0"):
+            return False
+        if self.ollama_warmup in ("always", "true", "1"):
+            return True
+        return not self.deepseek_keys
 
     def _filter_working_apis(self):
         """Test và loại bỏ API keys không hoạt động - PARALLEL VERSION."""
@@ -161,23 +276,28 @@ class MultiAIClient:
                 "messages": [{"role": "user", "content": "Say OK"}],
                 "max_tokens": 5
             }
-            resp = requests.post(self.DEEPSEEK_URL, headers=headers, json=data, timeout=15)
+            resp = get_transport().post(self.DEEPSEEK_URL, headers=headers, json=data, timeout=15)
             return resp.status_code == 200
         except:
             return False
 
     def _test_ollama(self) -> bool:
-        """Test Ollama local server."""
+        """
+        Test Ollama local server: server chạy + model đã pull.
+
+        Không gửi prompt thử - request thử load model với num_ctx/keep_alive
+        mặc định, request thật sau đó phải load lại. Load model do warm-up lo.
+        """
         try:
-            data = {
-                "model": self.ollama_model,
-                "prompt": "Say OK",
-                "stream": False
-            }
-            resp = requests.post(self.OLLAMA_URL, json=data, timeout=30)
+            resp = get_transport().get(f"{self.ollama_endpoint}/api/tags", timeout=10)
             if resp.status_code != 200:
                 print(f"  [Ollama] Error: HTTP {resp.status_code} - {resp.text[:100]}")
-            return resp.status_code == 200
+                return False
+            models = [m.get("name", "") for m in resp.json().get("models", [])]
+            if self.ollama_model not in models and f"{self.ollama_model}:latest" not in models:
+                print(f"  [Ollama] Chua co model '{self.ollama_model}' - chay 'ollama pull {self.ollama_model}'")
+                return False
+            return True
         except requests.exceptions.ConnectionError:
             print(f"  [Ollama] Không kết nối được - chạy 'ollama serve' trước")
             return False
@@ -185,73 +305,363 @@ class MultiAIClient:
             print(f"  [Ollama] Error: {e}")
             return False
 
+    def last_usage(self) -> Dict[str, Any]:
+        """
+        Usage của request gần nhất trong thread hiện tại.
+
+        Returns:
+            {"provider", "prompt_tokens", "cached_tokens", "completion_tokens", "finish_reason",
+             "structured" (provider đã ép JSON theo schema / JSON mode)}
+            (+ "tokens_per_s", "prompt_tokens_per_s", "load_s" với Ollama)
+            hoặc {} nếu chưa gọi / provider không trả usage
+        """
+        return self._usage.get() or {}
+
+    def _set_usage(self, provider: str, prompt_tokens, completion_tokens, finish_reason,
+                   cached_tokens: int = 0, structured: bool = False) -> None:
+        usage = {
+            "provider": provider,
+            "prompt_tokens": prompt_tokens or 0,
+            "cached_tokens": cached_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "finish_reason": finish_reason or "",
+            "structured": structured,
+        }
+        self._usage.set(usage)
+
+        with self._usage_lock:
+            totals = self.usage_totals.setdefault(provider, {
+                "requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0
+            })
+            totals["requests"] += 1
+            for key in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+                totals[key] += usage[key]
+
+        inc("llm_prompt_tokens", usage["cached_tokens"], provider=provider, cache="hit")
+        inc("llm_prompt_tokens", usage["prompt_tokens"] - usage["cached_tokens"], provider=provider, cache="miss")
+        inc("llm_completion_tokens", usage["completion_tokens"], provider=provider)
+
+    def usage_snapshot(self) -> Dict[str, Dict[str, int]]:
+        """Bản sao usage_totals (để tính chênh lệch cho 1 run)."""
+        with self._usage_lock:
+            return {provider: dict(totals) for provider, totals in self.usage_totals.items()}
+
     def generate_content(
         self,
         prompt: str,
         temperature: float = 0.7,
         max_tokens: int = 8192,
-        max_retries: int = 3
+        max_retries: int = 3,
+        schema: Optional[Dict] = None
     ) -> str:
         """Generate content using available AI providers.
         Priority: DeepSeek (primary) > Ollama (local fallback)
 
         Chi thu cac API da duoc filter la hoat dong.
+
+        schema: JSON schema của response → DeepSeek JSON mode / Ollama format
+        (last_usage()["structured"] cho biết provider đã ép JSON hay chưa)
         """
 
         last_error = None
+        self._usage.set(None)
+
+        # 0. Lần gọi đầu có hedge (lỗi / không có response → retry tuần tự như cũ)
+        if self._can_hedge(in_loop=False):
+            try:
+                # asyncio.run chạy coroutine trong context copy → set usage ở thread này
+                result, usage = run_async(self._ahedged(prompt, temperature, max_tokens, schema))
+                self._usage.set(usage)
+                if result:
+                    return result
+            except Exception as e:
+                last_error = e
+                self.logger.warning(f"[Hedge] {e}")
 
         # 1. Try DeepSeek first (primary)
-        if self.deepseek_keys:
+        for attempt in range(max_retries):
+            if not self.deepseek_keys:
+                break
+            try:
+                result = self._call_deepseek(prompt, temperature, max_tokens, schema)
+                if result:
+                    return result
+            except Exception as e:
+                last_error = e
+                wait = self._on_deepseek_error(e)
+                if wait is None:
+                    break
+                time.sleep(wait)
+
+        # 2. Fallback to Ollama (local, free, offline)
+        if self.ollama_available:
             for attempt in range(max_retries):
                 try:
-                    result = self._call_deepseek(prompt, temperature, max_tokens)
+                    print(f"[Ollama] Dang goi local model ({self.ollama_model})...")
+                    result = self._call_ollama(prompt, temperature, max_tokens, schema)
                     if result:
+                        print(f"[Ollama] Thanh cong!")
                         return result
                 except Exception as e:
                     last_error = e
-                    error_str = str(e).lower()
+                    self.logger.error(f"Ollama error: {e}")
+                    if attempt < max_retries - 1:
+                        time.sleep(2)
+                    continue
 
-                    if "rate" in error_str or "429" in error_str:
-                        self.logger.warning("DeepSeek rate limit, trying next key...")
-                        self.deepseek_index = (self.deepseek_index + 1) % len(self.deepseek_keys)
-                        time.sleep(3)
-                        continue
-                    elif "invalid" in error_str or "unauthorized" in error_str:
-                        self.logger.warning("DeepSeek key invalid, removing...")
-                        if self.deepseek_keys:
-                            self.deepseek_keys.pop(self.deepseek_index)
-                            if self.deepseek_keys:
-                                self.deepseek_index = self.deepseek_index % len(self.deepseek_keys)
-                            else:
-                                break
-                        continue
-                    else:
-                        self.logger.error(f"DeepSeek error: {e}")
-                        break
+        if last_error:
+            raise last_error
+        raise RuntimeError("Khong co API provider nao hoat dong! Cai Ollama: ollama pull qwen2.5:7b")
+
+    async def agenerate(
+        self,
+        prompt: str,
+        temperature: float = 0.7,
+        max_tokens: int = 8192,
+        max_retries: int = 3,
+        schema: Optional[Dict] = None
+    ) -> str:
+        """generate_content() bản async - cùng thứ tự provider/retry, không chiếm thread khi chờ."""
+        last_error = None
+        self._usage.set(None)
+
+        if self._can_hedge(in_loop=True):
+            try:
+                result, usage = await self._ahedged(prompt, temperature, max_tokens, schema)
+                self._usage.set(usage)
+                if result:
+                    return result
+            except Exception as e:
+                last_error = e
+                self.logger.warning(f"[Hedge] {e}")
+
+        for attempt in range(max_retries):
+            if not self.deepseek_keys:
+                break
+            try:
+                result = await self._acall_deepseek(prompt, temperature, max_tokens, schema)
+                if result:
+                    return result
+            except Exception as e:
+                last_error = e
+                wait = self._on_deepseek_error(e)
+                if wait is None:
+                    break
+                await asyncio.sleep(wait)
 
-        # 2. Fallback to Ollama (local, free, offline)
         if self.ollama_available:
             for attempt in range(max_retries):
                 try:
-                    print(f"[Ollama] Dang goi local model ({self.ollama_model})...")
-                    result = self._call_ollama(prompt, temperature, max_tokens)
+                    result = await self._acall_ollama(prompt, temperature, max_tokens, schema)
                     if result:
-                        print(f"[Ollama] Thanh cong!")
                         return result
                 except Exception as e:
                     last_error = e
                     self.logger.error(f"Ollama error: {e}")
                     if attempt < max_retries - 1:
-                        time.sleep(2)
-                    continue
+                        await asyncio.sleep(2)
 
         if last_error:
             raise last_error
         raise RuntimeError("Khong co API provider nao hoat dong! Cai Ollama: ollama pull qwen2.5:7b")
 
-    def _call_deepseek(self, prompt: str, temperature: float, max_tokens: int) -> str:
+    async def agenerate_many(
+        self,
+        prompts: List[str],
+        temperature: float = 0.7,
+        max_tokens: int = 8192,
+        concurrency: int = None,
+        schema: Optional[Dict] = None,
+        with_usage: bool = False
+    ) -> List[Any]:
+        """
+        Generate nhiều prompts trên 1 event loop (giữ thứ tự).
+
+        Args:
+            concurrency: Số request đang bay tối đa (None = max_parallel_requests)
+            schema: JSON schema chung cho mọi prompt (structured output)
+            with_usage: Trả (response, usage) - usage của từng prompt (task
+                chạy trong context riêng, last_usage() của caller không thấy)
+
+        Returns:
+            List responses (hoặc (response, usage)), prompt lỗi → ""
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency or self.max_parallel_requests))
+
+        async def one(idx: int, prompt: str) -> Any:
+            async with semaphore:
+                try:
+                    response = await self.agenerate(prompt, temperature, max_tokens, schema=schema)
+                except Exception as e:
+                    self.logger.warning(f"Prompt {idx+1} failed: {e}")
+                    response = ""
+                return (response, self._usage.get() or {}) if with_usage else response
+
+        return list(await asyncio.gather(*(one(i, p) for i, p in enumerate(prompts))))
+
+    # =========================================================================
+    # HEDGING
+    # =========================================================================
+
+    def _hedge_targets(self) -> List[Tuple[str, Optional[str]]]:
+        """(provider, api_key) theo thứ tự ưu tiên: key DeepSeek hiện tại, các key khác, Ollama."""
+        keys = list(self.deepseek_keys)
+        targets: List[Tuple[str, Optional[str]]] = []
+        if keys:
+            start = self.deepseek_index % len(keys)
+            targets.extend(("deepseek", key) for key in keys[start:] + keys[:start])
+        if self.ollama_available:
+            targets.append(("ollama", None))
+        return targets
+
+    def _can_hedge(self, in_loop: bool) -> bool:
+        """Hedging bật + có provider/key dự phòng (+ bản sync: thread không có event loop chạy)."""
+        if self.hedging is None or len(self._hedge_targets()) < 2:
+            return False
+        if in_loop:
+            return True
+        try:
+            asyncio.get_running_loop()
+            return False
+        except RuntimeError:
+            return True
+
+    @staticmethod
+    def _usable_response(result: str, schema: Optional[Dict], usage: Dict[str, Any]) -> bool:
+        """Response dùng được ngay (structured: JSON đủ, không bị cắt)."""
+        if not result:
+            return False
+        if schema is None or not usage.get("structured"):
+            return True
+        return usage.get("finish_reason") != "length" and isinstance(parse_structured(result, schema)[0], dict)
+
+    async def _ahedged(
+        self,
+        prompt: str,
+        temperature: float,
+        max_tokens: int,
+        schema: Optional[Dict] = None
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        1 lần gọi có hedge.
+
+        Gửi tới target đầu; quá ngưỡng latency (percentile đã học theo cỡ prompt)
+        mà chưa xong → gửi bản sao tới target kế (nếu còn trong trần chi phí run).
+        Response dùng được đến trước thắng, request còn lại bị huỷ.
+
+        Returns:
+            (response, usage) - caller set usage (coroutine có thể chạy trong
+            context copy, vd run_async); response None nếu mọi request lỗi /
+            rỗng (caller retry tuần tự)
+        """
+        targets = self._hedge_targets()
+        primary, backup = targets[0], targets[1]
+        prompt_tokens = estimate_tokens(prompt)
+        self.hedging.count_request()
+
+        async def run(target):
+            provider, api_key = target
+            start = time.time()
+            if provider == "deepseek":
+                result = await self._acall_deepseek(prompt, temperature, max_tokens, schema, api_key=api_key)
+            else:
+                result = await self._acall_ollama(prompt, temperature, max_tokens, schema)
+            # Usage ghi trong context của task → trả về để set lại ở caller
+            usage = self._usage.get() or {}
+            self.hedging.record_latency(provider, prompt_tokens, time.time() - start)
+            return result, usage
+
+        tasks = {asyncio.ensure_future(run(primary)): primary}
+        reserved = prompt_tokens + max_tokens
+        delay = self.hedging.hedge_delay(primary[0], prompt_tokens)
+        done, _ = await asyncio.wait(list(tasks), timeout=delay)
+        if not done:
+            if self.hedging.try_reserve(backup[0], reserved):
+                self.logger.warning(
+                    f"[Hedge] {primary[0]} chưa xong sau {delay:.0f}s (prompt ~{prompt_tokens} tokens) "
+                    f"→ gửi bản sao tới {backup[0]}"
+                )
+                inc("llm_hedges", provider=backup[0])
+                tasks[asyncio.ensure_future(run(backup))] = backup
+            else:
+                backup = None
+
+        fallback = None
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    target = tasks[task]
+                    if task.exception() is not None:
+                        self.logger.warning(f"[Hedge] {target[0]} lỗi: {task.exception()}")
+                        continue
+                    result, usage = task.result()
+                    if target is backup:
+                        actual = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+                        self.hedging.settle(backup[0], reserved, actual)
+                    if self._usable_response(result, schema, usage):
+                        if target is backup:
+                            self.hedging.record_win()
+                            inc("llm_hedge_wins", provider=backup[0])
+                            self.logger.info(f"[Hedge] {backup[0]} trả về trước {primary[0]}")
+                        return result, usage
+                    if result and fallback is None:
+                        fallback = (result, usage)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        if fallback:
+            # Không có response "sạch" → trả response đầu tiên để caller repair
+            return fallback
+        return None, None
+
+    def _on_deepseek_error(self, error: Exception) -> Optional[float]:
+        """Xử lý lỗi DeepSeek: số giây chờ trước khi thử lại, None = bỏ DeepSeek."""
+        error_str = str(error).lower()
+
+        if "rate" in error_str or "429" in error_str:
+            self.logger.warning("DeepSeek rate limit, trying next key...")
+            self.deepseek_index = (self.deepseek_index + 1) % len(self.deepseek_keys)
+            return 3
+        elif "invalid" in error_str or "unauthorized" in error_str:
+            self.logger.warning("DeepSeek key invalid, removing...")
+            with self._request_lock:
+                if self.deepseek_keys:
+                    self.deepseek_keys.pop(self.deepseek_index % len(self.deepseek_keys))
+                if not self.deepseek_keys:
+                    return None
+                self.deepseek_index = self.deepseek_index % len(self.deepseek_keys)
+            return 0
+        self.logger.error(f"DeepSeek error: {error}")
+        return None
+
+    @timed("llm_call", provider="deepseek")
+    def _call_deepseek(self, prompt: str, temperature: float, max_tokens: int, schema: Optional[Dict] = None) -> str:
         """Call DeepSeek API."""
-        api_key = self.deepseek_keys[self.deepseek_index]
+        headers, data = self._deepseek_request(prompt, temperature, max_tokens, schema)
+        resp = get_transport().post(self.DEEPSEEK_URL, headers=headers, json=data, timeout=180)
+        return self._deepseek_content(resp, structured="response_format" in data)
+
+    @timed("llm_call", provider="deepseek")
+    async def _acall_deepseek(self, prompt: str, temperature: float, max_tokens: int,
+                              schema: Optional[Dict] = None, api_key: str = None) -> str:
+        """Call DeepSeek API (async). api_key: key cụ thể (hedge sang key khác)."""
+        headers, data = self._deepseek_request(prompt, temperature, max_tokens, schema, api_key)
+        resp = await get_transport().apost(self.DEEPSEEK_URL, headers=headers, json=data, timeout=180)
+        return self._deepseek_content(resp, structured="response_format" in data)
+
+    def _deepseek_request(self, prompt: str, temperature: float, max_tokens: int,
+                          schema: Optional[Dict] = None, api_key: str = None) -> Tuple[Dict, Dict]:
+        """
+        (headers, body) cho DeepSeek chat completions.
+
+        DeepSeek chỉ có JSON mode (json_object, không nhận json_schema) →
+        có schema thì bật JSON mode + đưa schema vào system prompt.
+        """
+        api_key = api_key or self.deepseek_keys[self.deepseek_index % len(self.deepseek_keys)]
 
         headers = {
             "Authorization": f"Bearer {api_key}",
@@ -259,7 +669,11 @@ class MultiAIClient:
         }
 
         # Determine if prompt expects JSON response
-        expects_json = any(kw in prompt.lower() for kw in ['json', 'output format', '{"', "{'"])
+        expects_json = schema is not None or any(kw in prompt.lower() for kw in ['json', 'output format', '{"', "{'"])
+
+        system_prompt = "You are a helpful assistant. When asked to output JSON, respond ONLY with valid JSON, no markdown code blocks, no explanations before or after the JSON."
+        if schema is not None:
+            system_prompt += " " + schema_instruction(schema)
 
         # DeepSeek API giới hạn max_tokens = 8192
         deepseek_max_tokens = min(max_tokens, 8192)
@@ -267,10 +681,7 @@ class MultiAIClient:
         data = {
             "model": "deepseek-chat",
             "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant. When asked to output JSON, respond ONLY with valid JSON, no markdown code blocks, no explanations before or after the JSON."
-                },
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
             "temperature": temperature,
@@ -282,12 +693,18 @@ class MultiAIClient:
             data["response_format"] = {"type": "json_object"}
 
         print(f"[DeepSeek] Dang goi API... (prompt: {len(prompt)} ky tu, json_mode={expects_json}, max_tokens={deepseek_max_tokens}, cho 60-180s)")
+        return headers, data
 
-        resp = requests.post(self.DEEPSEEK_URL, headers=headers, json=data, timeout=180)
-
+    def _deepseek_content(self, resp, structured: bool = False) -> str:
+        """Response DeepSeek → content (ghi usage); lỗi HTTP → raise."""
         if resp.status_code == 200:
             result = resp.json()
-            content = result["choices"][0]["message"]["content"]
+            choice = result["choices"][0]
+            content = choice["message"]["content"]
+            usage = result.get("usage") or {}
+            self._set_usage("deepseek", usage.get("prompt_tokens"),
+                            usage.get("completion_tokens"), choice.get("finish_reason"),
+                            cached_tokens=usage.get("prompt_cache_hit_tokens"), structured=structured)
             print(f"[DeepSeek] Thanh cong! Response: {len(content)} ky tu")
 
             # Log preview for debugging
@@ -301,34 +718,77 @@ class MultiAIClient:
             print(f"[DeepSeek] Error {resp.status_code}: {error_text}")
             raise requests.RequestException(f"DeepSeek API error {resp.status_code}: {error_text}")
 
-    def _call_ollama(self, prompt: str, temperature: float, max_tokens: int = 16000) -> str:
+    @timed("llm_call", provider="ollama")
+    def _call_ollama(self, prompt: str, temperature: float, max_tokens: int = 16000,
+                     schema: Optional[Dict] = None) -> str:
         """Call Ollama local API.
 
         Args:
             prompt: The prompt to send
             temperature: Temperature for generation
             max_tokens: Max output tokens (default 16000 for large responses like Director's Shooting Plan)
+            schema: JSON schema → Ollama format (grammar ép đúng cấu trúc)
         """
+        data = self._ollama_request(prompt, temperature, max_tokens, schema)
+        # Ollama can be slow, increase timeout (tính cả thời gian chờ slot phía server)
+        with self.ollama.slot():
+            resp = get_transport().post(self.OLLAMA_URL, json=data, timeout=600)
+        return self._ollama_content(resp, prompt, structured="format" in data)
+
+    @timed("llm_call", provider="ollama")
+    async def _acall_ollama(self, prompt: str, temperature: float, max_tokens: int = 16000,
+                            schema: Optional[Dict] = None) -> str:
+        """Call Ollama local API (async)."""
+        data = self._ollama_request(prompt, temperature, max_tokens, schema)
+        async with self.ollama.aslot():
+            resp = await get_transport().apost(self.OLLAMA_URL, json=data, timeout=600)
+        return self._ollama_content(resp, prompt, structured="format" in data)
+
+    def _ollama_request(self, prompt: str, temperature: float, max_tokens: int,
+                        schema: Optional[Dict] = None) -> Dict:
+        """Body cho Ollama /api/generate."""
         data = {
             "model": self.ollama_model,
             "prompt": prompt,
             "stream": False,
+            "keep_alive": self.ollama_keep_alive,
             "options": {
                 "temperature": temperature,
                 "num_predict": max_tokens,  # Higher for Director's Shooting Plan
-                "num_ctx": 32768,  # Context window - qwen2.5:7b supports up to 128k
+                # Context window theo prompt + num_predict (bậc 4K..ollama_max_ctx).
+                # Chỉ tăng, không giảm: đổi num_ctx = Ollama load lại model, mất KV cache của prefix
+                "num_ctx": self.ollama.num_ctx_for(prompt, max_tokens),
             }
         }
 
-        self.logger.debug(f"Calling Ollama API: model={self.ollama_model}, max_tokens={max_tokens}")
+        if schema is not None:
+            data["format"] = schema
+
+        self.logger.debug(
+            f"Calling Ollama API: model={self.ollama_model}, max_tokens={max_tokens}, "
+            f"num_ctx={data['options']['num_ctx']}"
+        )
         print(f"[Ollama] Dang xu ly voi {self.ollama_model}... (co the mat 2-5 phut)")
+        return data
 
-        # Ollama can be slow, increase timeout
-        resp = requests.post(self.OLLAMA_URL, json=data, timeout=600)
+    def _ollama_content(self, resp, prompt: str = "", structured: bool = False) -> str:
+        """
+        Response Ollama → text (ghi usage); lỗi HTTP / rỗng → raise.
 
+        prompt_eval_count chỉ đếm token phải eval lại - phần prefix lấy từ KV
+        cache không tính → cached ≈ ước lượng token prompt - prompt_eval_count.
+        """
         if resp.status_code == 200:
             result = resp.json()
             response_text = result.get("response", "")
+            evaluated = result.get("prompt_eval_count") or 0
+            total = max(evaluated, estimate_tokens(prompt))
+            self._set_usage("ollama", total, result.get("eval_count"), result.get("done_reason"),
+                            cached_tokens=total - evaluated if evaluated else 0, structured=structured)
+            speed = self.ollama.record(result)
+            self._usage.get().update(speed)
+            if speed["tokens_per_s"]:
+                print(f"[Ollama] {result.get('eval_count', 0)} tokens, {speed['tokens_per_s']} tokens/s")
             if not response_text or not response_text.strip():
                 self.logger.warning(f"[Ollama] Returned empty response. Full result: {result}")
                 raise ValueError("Ollama returned empty response")
@@ -341,16 +801,24 @@ class MultiAIClient:
         prompts: List[str],
         temperature: float = 0.7,
         max_tokens: int = 8192,
-        max_workers: int = None
-    ) -> List[str]:
+        max_workers: int = None,
+        schema: Optional[Dict] = None,
+        with_usage: bool = False
+    ) -> List[Any]:
         """
         Generate content for multiple prompts in parallel.
 
+        Chạy agenerate_many trên 1 event loop (connection pool dùng chung),
+        không dùng thread pool. Không gọi từ trong event loop đang chạy -
+        khi đó dùng thẳng `await agenerate_many(...)`.
+
         Args:
             prompts: List of prompts to process
             temperature: Temperature for generation
             max_tokens: Max tokens per response
-            max_workers: Max parallel workers (None = auto)
+            max_workers: Max request song song (None = auto)
+            schema: JSON schema chung cho mọi prompt (structured output)
+            with_usage: Trả (response, usage) theo từng prompt thay vì response
 
         Returns:
             List of responses in same order as prompts
@@ -360,70 +828,38 @@ class MultiAIClient:
 
         # Single prompt - no parallelization needed
         if len(prompts) == 1:
-            return [self.generate_content(prompts[0], temperature, max_tokens)]
+            response = self.generate_content(prompts[0], temperature, max_tokens, schema=schema)
+            return [(response, self.last_usage())] if with_usage else [response]
 
-        # Determine worker count
+        # Determine concurrency
         if max_workers is None:
             # Use total available API keys as max workers
             total_keys = len(self.deepseek_keys)
             if self.ollama_available:
-                total_keys += 1  # Ollama can handle 1 at a time
+                total_keys += self.ollama.num_parallel  # Slots song song của server (OLLAMA_NUM_PARALLEL)
             max_workers = min(self.max_parallel_requests, max(1, total_keys))
 
-        print(f"[Parallel] Xu ly {len(prompts)} prompts voi {max_workers} workers...")
-
-        # Results placeholder (preserve order)
-        results = [None] * len(prompts)
-        errors = []
-
-        def process_prompt(idx_prompt: Tuple[int, str]) -> Tuple[int, str, Exception]:
-            """Process single prompt and return (index, result, error)."""
-            idx, prompt = idx_prompt
-            try:
-                # Thread-safe API selection
-                with self._request_lock:
-                    pass  # Lock just to serialize index updates
-
-                result = self.generate_content(prompt, temperature, max_tokens)
-                return (idx, result, None)
-            except Exception as e:
-                return (idx, "", e)
-
-        # Execute in parallel
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [
-                executor.submit(process_prompt, (i, p))
-                for i, p in enumerate(prompts)
-            ]
-
-            # Process as completed with progress
-            completed = 0
-            for future in as_completed(futures):
-                idx, result, error = future.result()
-                completed += 1
-
-                if error:
-                    errors.append((idx, error))
-                    self.logger.warning(f"Prompt {idx+1} failed: {error}")
-                    results[idx] = ""  # Empty result for failed
-                else:
-                    results[idx] = result
+        print(f"[Parallel] Xu ly {len(prompts)} prompts, toi da {max_workers} request song song...")
 
-                print(f"[Parallel] Hoan thanh {completed}/{len(prompts)}...", end="\r")
+        results = run_async(self.agenerate_many(
+            prompts, temperature, max_tokens, concurrency=max_workers, schema=schema, with_usage=True
+        ))
+        failed = [i for i, (r, _) in enumerate(results) if not r]
 
-        print(f"[Parallel] Hoan thanh {len(prompts)} prompts, {len(errors)} loi")
+        print(f"[Parallel] Hoan thanh {len(prompts)} prompts, {len(failed)} loi")
 
         # Retry failed prompts sequentially
-        if errors:
-            print(f"[Parallel] Retry {len(errors)} prompts that bi loi...")
-            for idx, _ in errors:
+        if failed:
+            print(f"[Parallel] Retry {len(failed)} prompts that bi loi...")
+            for idx in failed:
                 try:
-                    results[idx] = self.generate_content(prompts[idx], temperature, max_tokens)
+                    response = self.generate_content(prompts[idx], temperature, max_tokens, schema=schema)
+                    results[idx] = (response, self.last_usage())
                 except Exception as e:
                     self.logger.error(f"Retry failed for prompt {idx+1}: {e}")
-                    results[idx] = ""
+                    results[idx] = ("", {})
 
-        return results
+        return results if with_usage else [r for r, _ in results]
 
 
 # ============================================================================
@@ -557,7 +993,7 @@ class GeminiClient:
         
         self.logger.debug(f"Calling API: model={self.current_model}, key=#{self.current_key_index + 1}")
         
-        response = requests.post(
+        response = get_transport().session(url).post(
             url,
             headers=headers,
             params=params,
@@ -623,30 +1059,77 @@ class PromptGenerator:
         self.max_parallel_batches = settings.get("max_parallel_batches", 3)  # Parallel batch processing
         self.batch_size = settings.get("prompt_batch_size", 10)  # Scenes per batch
 
+        # Token batching: chia batch/chunk theo ngân sách token của provider
+        self.token_batching = settings.get("prompt_token_batching", True)
+        # Structured output: DeepSeek JSON mode / Ollama format schema cho shooting plan + scene prompts
+        self.structured_output = settings.get("llm_structured_output", True)
+        # Trần scenes/batch khi token batching (mặc định = 2 × prompt_batch_size)
+        self.batch_max_scenes = settings.get("prompt_batch_max_scenes") or 2 * self.batch_size
+        if self.ai_client.deepseek_keys:
+            self.token_budget = TokenBudget("deepseek")
+        else:
+            # Context Ollama = trần num_ctx (ollama_max_ctx)
+            self.token_budget = TokenBudget("ollama", ProviderBudget(
+                context_tokens=self.ai_client.ollama.max_ctx,
+                max_output_tokens=PROVIDER_BUDGETS["ollama"].max_output_tokens,
+            ))
+
+        # Incremental: SRT sửa sau khi tạo prompts → chỉ tạo lại đoạn thay đổi
+        self.incremental_srt = settings.get("prompt_incremental_srt", True)
+        self.incremental_neighbors = settings.get("prompt_incremental_neighbors", 1)  # Scenes lân cận làm context
+
+        # Truyện dài: phân tích nhân vật/bối cảnh theo đoạn song song (map) + gộp (reduce)
+        # "auto" = khi truyện vượt story_map_reduce_tokens, "always", "off"
+        self.story_map_reduce = str(settings.get("story_map_reduce", "auto")).lower()
+        self.story_map_reduce_tokens = settings.get("story_map_reduce_tokens", 7000)
+        self.story_chunk_tokens = settings.get("story_chunk_tokens", 3000)
+        self._story_outline = ""  # Tóm tắt theo đoạn (map-reduce) → Director's Treatment
+
+        # Offline mode: refine bằng LLM chỉ đưa lại scene có prompt đổi >= ngưỡng này (0-1)
+        self.offline_refine_min_change = settings.get("offline_refine_min_change", 0.35)
+        self.offline_refine_characters = settings.get("offline_refine_characters", True)
+
+        # Semantic cache: scene gần trùng (lời dẫn + nhân vật + bối cảnh) dùng lại prompt cũ
+        self.scene_cache = None
+        if settings.get("scene_prompt_cache", True):
+            self.scene_cache = get_scene_prompt_cache(
+                settings.get("scene_prompt_cache_path") or None,
+                threshold=settings.get("scene_prompt_cache_threshold", 0.82),
+                max_entries=settings.get("scene_prompt_cache_max_entries"),
+            )
+
+        # Số lần gọi LLM (để báo cáo số call tiết kiệm được)
+        self.llm_calls = 0
+
+        # Map nhân vật/bối cảnh đã dựng sẵn cho hậu xử lý prompt (theo project)
+        self._rules_cache: Dict[tuple, Tuple[list, list, ProjectPromptRules]] = {}
+
+    def _project_rules(self, characters: list = None, locations: list = None) -> ProjectPromptRules:
+        """
+        ProjectPromptRules cho bộ characters/locations hiện tại (dựng 1 lần, dùng cho mọi scene).
+
+        Khoá theo identity + độ dài list → list của project khác hoặc list
+        được append thêm sẽ dựng lại.
+        """
+        key = (id(characters), len(characters or ()), id(locations), len(locations or ()))
+        cached = self._rules_cache.get(key)
+        # Cache giữ tham chiếu list → id() không bị tái sử dụng khi còn trong cache
+        if cached and cached[0] is characters and cached[1] is locations:
+            return cached[2]
+        if len(self._rules_cache) >= 8:
+            self._rules_cache.clear()
+        rules = ProjectPromptRules(characters, locations, logger=self.logger)
+        self._rules_cache[key] = (characters, locations, rules)
+        return rules
+
     def _is_child_character(self, char_id: str) -> bool:
         """
         Check if a character ID represents a child (cannot use reference image).
         Children cause API policy violations when used as reference images.
 
-        Child patterns:
-        - nvc1: narrator as child
-        - IDs ending with numbers that indicate child versions
-        - Or any ID marked with is_child=true in analyze_story
+        Child patterns: nvc1 (narrator as child), nv1c, child
         """
-        if not char_id:
-            return False
-
-        # Remove .png extension if present
-        char_id_clean = char_id.replace('.png', '').lower()
-
-        # Known child character patterns
-        child_patterns = ['nvc1', 'nv1c', 'child']
-
-        for pattern in child_patterns:
-            if pattern in char_id_clean:
-                return True
-
-        return False
+        return is_child_ref(char_id)
 
     def _filter_children_from_refs(self, ref_files: list, return_filtered: bool = False) -> list:
         """
@@ -660,18 +1143,7 @@ class PromptGenerator:
         Returns:
             Filtered list without child characters, or tuple if return_filtered=True
         """
-        if not ref_files:
-            return ([], []) if return_filtered else []
-
-        filtered = []
-        children = []
-        for ref in ref_files:
-            if self._is_child_character(ref):
-                self.logger.info(f"  -> Filtered out child character from references: {ref}")
-                children.append(ref)
-                continue
-            filtered.append(ref)
-
+        filtered, children = split_children(ref_files, self.logger)
         if return_filtered:
             return filtered, children
         return filtered
@@ -687,20 +1159,7 @@ class PromptGenerator:
         Returns:
             Inline description like "(Child: 8-year-old boy, messy brown hair...)"
         """
-        if not characters:
-            return ""
-
-        # Extract character ID from filename (remove .png extension)
-        char_id = child_ref.replace(".png", "")
-
-        # Find matching character
-        for char in characters:
-            if char.id == char_id:
-                # Use character_lock for inline description
-                char_lock = getattr(char, 'character_lock', '')
-                if char_lock:
-                    return f"(Child: {char_lock})"
-        return ""
+        return self._project_rules(characters).child_description(child_ref)
 
     def _add_children_inline_to_prompt(
         self,
@@ -721,22 +1180,7 @@ class PromptGenerator:
         """
         if not img_prompt or not filtered_children or not characters:
             return img_prompt
-
-        # Collect inline descriptions
-        inline_descs = []
-        for child_ref in filtered_children:
-            desc = self._get_child_inline_description(child_ref, characters)
-            if desc:
-                inline_descs.append(desc)
-                self.logger.info(f"  -> Added inline description for {child_ref}: {desc[:50]}...")
-
-        if inline_descs:
-            # Add at the beginning or end of prompt
-            inline_text = ", ".join(inline_descs)
-            # Add to prompt - prepend to make children visible in the scene
-            img_prompt = f"{inline_text} - {img_prompt}"
-
-        return img_prompt
+        return self._project_rules(characters).inline_children(img_prompt, filtered_children)
 
     def _add_filename_annotations_to_prompt(
         self,
@@ -763,108 +1207,16 @@ class PromptGenerator:
         """
         if not img_prompt or not reference_files:
             return img_prompt
+        return self._project_rules(characters, locations).annotate(img_prompt, reference_files)
 
-        result = img_prompt
-        annotations_added = []
-
-        # Build lookup maps
-        char_map = {}  # id -> character_lock
-        loc_map = {}   # id -> location_lock
-
-        if characters:
-            for c in characters:
-                char_map[c.id] = c.character_lock or c.vietnamese_prompt or c.name
-
-        if locations:
-            for loc in locations:
-                loc_map[loc.id] = loc.location_lock or loc.name
-
-        # Add annotations for each reference file
-        for ref_file in reference_files:
-            # Ensure filename has extension
-            if not any(ref_file.endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.webp']):
-                ref_file = f"{ref_file}.png"
-
-            ref_id = ref_file.replace('.png', '').replace('.jpg', '').replace('.jpeg', '').replace('.webp', '')
-            annotation = f"({ref_file})"
-
-            # Check if annotation already exists
-            if annotation in result:
-                annotations_added.append(ref_file)
-                continue
-
-            # Try to find where to insert annotation
-            inserted = False
-
-            # Method 1: Match character_lock/location_lock in prompt
-            if ref_id in char_map and char_map[ref_id]:
-                desc = char_map[ref_id]
-                # Try to find description in prompt and add annotation after
-                match_len = min(30, len(desc))
-                if match_len > 5 and desc[:match_len] in result:
-                    # Find end of description (next comma, period, or clause)
-                    idx = result.find(desc[:match_len])
-                    if idx >= 0:
-                        # Find the end of this character description
-                        end_idx = idx + match_len
-                        for end_char in [',', '.', ' in ', ' at ', ' with ', ' and ']:
-                            pos = result.find(end_char, end_idx)
-                            if pos > 0 and pos < end_idx + 100:
-                                end_idx = pos
-                                break
-                        # Insert annotation
-                        result = result[:end_idx] + f" {annotation}" + result[end_idx:]
-                        inserted = True
-                        annotations_added.append(ref_file)
-
-            if not inserted and ref_id in loc_map and loc_map[ref_id]:
-                desc = loc_map[ref_id]
-                match_len = min(20, len(desc))
-                if match_len > 5 and desc[:match_len] in result:
-                    idx = result.find(desc[:match_len])
-                    if idx >= 0:
-                        end_idx = idx + match_len
-                        for end_char in [',', '.', ' with ', ' and ']:
-                            pos = result.find(end_char, end_idx)
-                            if pos > 0 and pos < end_idx + 80:
-                                end_idx = pos
-                                break
-                        result = result[:end_idx] + f" {annotation}" + result[end_idx:]
-                        inserted = True
-                        annotations_added.append(ref_file)
-
-            # Method 2: If not inserted, will be added at the end as consolidated annotation
-            if not inserted:
-                annotations_added.append(ref_file)
-
-        # Method 3: Add consolidated reference annotation at the end
-        # This ensures ALL reference files are mentioned even if not inserted inline
-        missing_annotations = [f for f in reference_files if f"({f}" not in result and f not in [a for a in annotations_added if f"({a})" in result]]
-
-        # Ensure all refs have .png extension for checking
-        all_refs_normalized = []
-        for ref in reference_files:
-            if not any(ref.endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.webp']):
-                ref = f"{ref}.png"
-            all_refs_normalized.append(ref)
-
-        # Check which refs are NOT yet in the result
-        refs_not_in_result = [ref for ref in all_refs_normalized if f"({ref})" not in result]
-
-        if refs_not_in_result:
-            # Add as consolidated annotation at end
-            refs_str = ", ".join(refs_not_in_result)
-            # Clean up ending
-            result = result.rstrip('. ')
-            result = f"{result} (reference: {refs_str})."
-
-        return result
-
-    def _generate_content(self, prompt: str, temperature: float = 0.7, max_tokens: int = 8192) -> str:
+    def _generate_content(self, prompt: str, temperature: float = 0.7, max_tokens: int = 8192,
+                          schema: Optional[Dict] = None) -> str:
         """Generate content using available AI providers (DeepSeek + Ollama)."""
-        return self.ai_client.generate_content(prompt, temperature, max_tokens)
+        self.llm_calls += 1
+        return self.ai_client.generate_content(prompt, temperature, max_tokens, schema=schema)
 
-    def _generate_content_large(self, prompt: str, temperature: float = 0.7, max_tokens: int = 8192) -> str:
+    def _generate_content_large(self, prompt: str, temperature: float = 0.7, max_tokens: int = 8192,
+                                schema: Optional[Dict] = None) -> str:
         """
         Generate content dùng DeepSeek (ưu tiên) hoặc Ollama (fallback).
 
@@ -872,8 +1224,9 @@ class PromptGenerator:
         để trigger retry logic ở layer trên (chunk sẽ được chia nhỏ hơn).
         """
         print(f"[Director] Dùng DeepSeek (max_tokens={min(max_tokens, 8192)})")
+        self.llm_calls += 1
         try:
-            result = self.ai_client.generate_content(prompt, temperature, max_tokens)
+            result = self.ai_client.generate_content(prompt, temperature, max_tokens, schema=schema)
             if result:
                 print(f"[Director] DeepSeek trả về {len(result)} ký tự")
 
@@ -898,6 +1251,7 @@ class PromptGenerator:
 
         return ""
 
+    @timed("prompts_project", ok=bool)
     def generate_for_project(
         self,
         project_dir: Path,
@@ -927,6 +1281,61 @@ class PromptGenerator:
         Returns:
             True nếu thành công
         """
+        usage_before = self.ai_client.usage_snapshot()
+        hedging = self.ai_client.hedging
+        if hedging:
+            hedging.reset_run()
+        if self.scene_cache:
+            self.scene_cache.reset_run()
+        try:
+            return self._generate_for_project(
+                project_dir, code, overwrite,
+                on_characters_ready, on_scenes_batch_ready, total_scenes_callback
+            )
+        finally:
+            self._log_prompt_cache_report(usage_before)
+            if hedging and hedging.requests:
+                stats = hedging.stats()
+                self.logger.info(
+                    f"[Hedge] {stats['hedges']}/{stats['requests']} requests hedged, "
+                    f"{stats['hedge_wins']} bản sao thắng, ~{stats['extra_tokens']} tokens thêm, "
+                    f"{stats['skipped_budget']} lần bỏ qua do trần chi phí"
+                )
+            if self.scene_cache and (self.scene_cache.hits or self.scene_cache.misses):
+                stats = self.scene_cache.stats()
+                self.logger.info(
+                    f"[Scene Cache] {stats['hits']}/{stats['hits'] + stats['misses']} scenes dùng lại prompt "
+                    f"({stats['hit_rate']:.0%} hit), +{stats['added']} entries (tổng {stats['entries']})"
+                )
+
+    def _log_prompt_cache_report(self, usage_before: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+        """Log token prompt cached/uncached theo provider cho run vừa xong."""
+        report = {}
+        for provider, totals in self.ai_client.usage_snapshot().items():
+            before = usage_before.get(provider, {})
+            delta = {key: value - before.get(key, 0) for key, value in totals.items()}
+            if not delta["requests"]:
+                continue
+            report[provider] = delta
+            uncached = delta["prompt_tokens"] - delta["cached_tokens"]
+            ratio = delta["cached_tokens"] / delta["prompt_tokens"] if delta["prompt_tokens"] else 0
+            self.logger.info(
+                f"[Prompt Cache] {provider}: {delta['requests']} requests, prompt tokens "
+                f"{delta['cached_tokens']} cached / {uncached} uncached ({ratio:.0%} hit), "
+                f"completion {delta['completion_tokens']}"
+            )
+        return report
+
+    def _generate_for_project(
+        self,
+        project_dir: Path,
+        code: str,
+        overwrite: bool = False,
+        on_characters_ready: Callable = None,
+        on_scenes_batch_ready: Callable = None,
+        total_scenes_callback: Callable = None
+    ) -> bool:
+        """Thân generate_for_project (wrapper ngoài log báo cáo prompt cache)."""
         project_dir = Path(project_dir)
         
         # Paths
@@ -948,6 +1357,12 @@ class PromptGenerator:
         total_scenes = stats.get('total_scenes', 0)
         scenes_with_prompts = stats.get('scenes_with_prompts', 0)
 
+        # === INCREMENTAL: SRT đã sửa sau khi tạo prompts → chỉ tạo lại đoạn thay đổi ===
+        if self.incremental_srt and not overwrite and total_scenes > 0:
+            report = self.update_for_edited_srt(project_dir, code, workbook=workbook)
+            if report and report["changed"] and scenes_with_prompts >= total_scenes:
+                return True
+
         # Đã có đầy đủ scenes với prompts → skip
         if workbook.has_prompts() and not overwrite:
             if total_scenes > 0 and scenes_with_prompts >= total_scenes:
@@ -984,7 +1399,7 @@ class PromptGenerator:
         # Step 1: Phân tích nhân vật + bối cảnh
         # (Luôn phân tích để có context, nhưng chỉ lưu vào Excel nếu chưa có)
         self.logger.info("Phân tích nhân vật và bối cảnh...")
-        characters, locations, context_lock, global_style = self._analyze_characters(full_story)
+        characters, locations, context_lock, global_style = self._analyze_characters(full_story, srt_entries)
 
         if not characters:
             self.logger.error("Không thể phân tích nhân vật")
@@ -1258,7 +1673,7 @@ Trả về JSON:"""
             existing_plan = workbook.get_director_plan()
             if not existing_plan:
                 self.logger.info(f"[BACKUP] Lưu {len(backup_scenes_data)} backup scenes vào Excel...")
-                workbook.save_director_plan(backup_scenes_data)
+                workbook.save_director_plan(self._snapshot_plan_rows(backup_scenes_data, srt_entries))
                 workbook.save()
                 self.logger.info(f"[BACKUP] ✓ Đã lưu backup với character/location mapping!")
             else:
@@ -1270,7 +1685,8 @@ Trả về JSON:"""
         self.logger.info("=" * 50)
         self.logger.info("Step 2: Tạo DIRECTOR'S TREATMENT (Kịch bản đạo diễn)...")
         self.logger.info("=" * 50)
-        directors_treatment = self._create_directors_treatment(full_story)
+        # Map-reduce đã chạy → tóm tắt theo đoạn thay cho truyện bị cắt 30000 ký tự
+        directors_treatment = self._create_directors_treatment(self._story_outline or full_story)
         if directors_treatment:
             self.logger.info(f"[Director's Treatment] Story parts: {len(directors_treatment.get('story_parts', []))}")
 
@@ -1347,7 +1763,7 @@ Trả về JSON:"""
             existing_plan = workbook.get_director_plan()
             if not existing_plan or len(existing_plan) < len(scenes_data):
                 self.logger.info(f"[DIRECTOR PLAN] Lưu {len(scenes_data)} scenes vào director_plan...")
-                workbook.save_director_plan(scenes_data)
+                workbook.save_director_plan(self._snapshot_plan_rows(scenes_data, srt_entries))
         except Exception as e:
             self.logger.warning(f"[DIRECTOR PLAN] Lỗi lưu: {e}")
 
@@ -1438,14 +1854,11 @@ Trả về JSON:"""
             # === FLOW CŨ: Gọi AI tạo prompts ===
             self.logger.info("[Legacy Flow] Tạo prompts bằng AI...")
 
-            # Chia scenes thành batches để tránh vượt quá context limit
-            batch_size = self.batch_size
-            batches = []
-            for i in range(0, len(scenes_data), batch_size):
-                batches.append(scenes_data[i:i + batch_size])
+            # Chia scenes thành batches để tránh vượt quá context/output limit
+            batches = self._scene_batches(scenes_data, characters, locations)
 
             total_batches = len(batches)
-            self.logger.info(f"Chia thanh {total_batches} batches, moi batch {batch_size} scenes")
+            self.logger.info(f"Chia thanh {total_batches} batches, {[len(b) for b in batches]} scenes/batch")
 
             if self.parallel_enabled and total_batches > 1:
                 # PARALLEL PROCESSING: Process multiple batches concurrently
@@ -1725,7 +2138,12 @@ Trả về JSON:"""
 
             # === QUAN TRỌNG: Filter children từ reference_files (API policy violation) ===
             # Children phải được mô tả trong img_prompt, không dùng reference image
-            ref_files, filtered_children = self._filter_children_from_refs(ref_files, return_filtered=True)
+            # + thêm filename annotations vào prompt
+            # Format: "A 30-year-old man (nvc.png) walking in the park (loc_park.png)"
+            # Giúp Flow match uploaded images với prompt
+            img_prompt, video_prompt, ref_files = self._project_rules(characters, locations).finalize(
+                prompts.get("img_prompt", ""), prompts.get("video_prompt", ""), ref_files
+            )
 
             chars_str = json.dumps(chars_used) if isinstance(chars_used, list) else str(chars_used)
             refs_str = json.dumps(ref_files) if isinstance(ref_files, list) else str(ref_files)
@@ -1735,26 +2153,6 @@ Trả về JSON:"""
             end_time = scene_data.get("end_time", "")
             duration = scene_data.get("duration_seconds", 0)
 
-            # === QUAN TRỌNG: Thêm filename annotations vào prompt ===
-            # Format: "A 30-year-old man (nvc.png) walking in the park (loc_park.png)"
-            # Giúp Flow match uploaded images với prompt
-            img_prompt = prompts.get("img_prompt", "")
-            video_prompt = prompts.get("video_prompt", "")
-
-            # === ADD INLINE CHILD DESCRIPTIONS ===
-            # Children must be described inline since they can't use reference images
-            if filtered_children:
-                img_prompt = self._add_children_inline_to_prompt(img_prompt, filtered_children, characters)
-                video_prompt = self._add_children_inline_to_prompt(video_prompt, filtered_children, characters)
-
-            if ref_files:
-                img_prompt = self._add_filename_annotations_to_prompt(
-                    img_prompt, ref_files, characters, locations
-                )
-                video_prompt = self._add_filename_annotations_to_prompt(
-                    video_prompt, ref_files, characters, locations
-                )
-
             # QUAN TRONG: srt_start/srt_end la timestamps chinh
             # Fallback sang start_time/end_time neu khong co
             srt_start_val = scene_data.get("srt_start") or start_time or "00:00:00,000"
@@ -2013,116 +2411,936 @@ Trả về JSON:"""
                         workbook.add_scene(new_scene)
                         total_new_scenes += 1
 
-                workbook.save()
-                self.logger.info(f"[TIMELINE RETRY] ✓ Đã tạo thêm {total_new_scenes} scenes cho gaps")
+                workbook.save()
+                self.logger.info(f"[TIMELINE RETRY] ✓ Đã tạo thêm {total_new_scenes} scenes cho gaps")
+
+                # Delay trước retry tiếp theo
+                if retry_round < max_gap_retries - 1:
+                    time.sleep(2)
+
+            except Exception as e:
+                self.logger.error(f"[TIMELINE RETRY] Lỗi: {e}")
+                import traceback
+                self.logger.debug(traceback.format_exc())
+                break
+
+        # Final check - force fill nếu vẫn còn gaps
+        try:
+            final_gaps = workbook.detect_timeline_gaps(video_duration_seconds)
+            if final_gaps:
+                total_missing = sum(g['duration'] for g in final_gaps)
+                self.logger.warning(
+                    f"[FINAL] Còn {len(final_gaps)} gaps ({total_missing:.0f}s) - FORCE FILL từ backup..."
+                )
+
+                # === FORCE FILL: Tạo scenes cho TẤT CẢ gaps còn lại ===
+                backup_plans = workbook.get_director_plan()
+                existing_scenes = workbook.get_scenes()
+                next_scene_id = max([s.scene_id for s in existing_scenes], default=0) + 1
+                force_filled = 0
+
+                for gap in final_gaps:
+                    gap_start = gap['start_seconds']
+                    gap_end = gap['end_seconds']
+                    gap_duration = gap['duration']
+
+                    # Tìm backup scenes trong khoảng gap
+                    relevant_backups = []
+                    for bp in backup_plans:
+                        bp_start = bp.get("srt_start", "")
+                        if bp_start:
+                            try:
+                                ts = bp_start.replace(',', '.')
+                                parts = ts.split(':')
+                                if len(parts) == 3:
+                                    bp_secs = int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2])
+                                    if gap_start - 5 <= bp_secs <= gap_end + 5:
+                                        relevant_backups.append(bp)
+                            except:
+                                pass
+
+                    if relevant_backups:
+                        # Dùng backup scenes
+                        for bp in relevant_backups:
+                            new_scene = Scene(
+                                scene_id=next_scene_id,
+                                srt_start=bp.get("srt_start", gap['start_time']),
+                                srt_end=bp.get("srt_end", gap['end_time']),
+                                duration=bp.get("duration", gap_duration),
+                                planned_duration=bp.get("duration", 5.0),
+                                srt_text=bp.get("srt_text", "")[:500],
+                                img_prompt=bp.get("img_prompt", "Cinematic scene, 4K photorealistic"),
+                                video_prompt=bp.get("img_prompt", "Cinematic scene"),
+                                status_img="pending",
+                                status_vid="pending",
+                                characters_used=bp.get("characters_used", "[]"),
+                                location_used=bp.get("location_used", ""),
+                                reference_files=bp.get("reference_files", "[]")
+                            )
+                            workbook.add_scene(new_scene)
+                            next_scene_id += 1
+                            force_filled += 1
+                    else:
+                        # Không có backup → tạo scene placeholder với thông tin từ gap
+                        new_scene = Scene(
+                            scene_id=next_scene_id,
+                            srt_start=gap['start_time'],
+                            srt_end=gap['end_time'],
+                            duration=gap_duration,
+                            planned_duration=min(gap_duration, 8.0),
+                            srt_text=f"[Gap {gap['start_time']} - {gap['end_time']}]",
+                            img_prompt="Cinematic illustration, atmospheric scene, 4K photorealistic, dramatic lighting",
+                            video_prompt="Cinematic scene with smooth camera movement",
+                            status_img="pending",
+                            status_vid="pending",
+                            characters_used="[]",
+                            location_used="",
+                            reference_files="[]"
+                        )
+                        workbook.add_scene(new_scene)
+                        next_scene_id += 1
+                        force_filled += 1
+
+                if force_filled > 0:
+                    workbook.save()
+                    self.logger.info(f"[FINAL] ✓ Force filled {force_filled} scenes cho gaps còn lại!")
+            else:
+                self.logger.info("[FINAL] ✓ Timeline đầy đủ - không còn gaps!")
+        except Exception as e:
+            self.logger.error(f"[FINAL] Lỗi force fill: {e}")
+
+        return True
+
+    # =========================================================================
+    # TOKEN BUDGET BATCHING
+    # =========================================================================
+
+    # Ước lượng ban đầu (token) - TokenBudget tự hiệu chỉnh theo usage thật
+    SCENE_INPUT_TOKENS = 60            # Nhãn mỗi scene trong pacing_script (ngoài lời dẫn)
+    SCENE_OUTPUT_BASE_TOKENS = 160     # 1 scene JSON ngoài phần chép lại: hành động/camera, video_prompt, refs
+    SCENE_CHAR_LOCK_TOKENS = 40        # Lock nhân vật không tra được (ID generic)
+    DIRECTOR_ENTRY_INPUT_TOKENS = 15   # Timestamp mỗi dòng SRT trong srt_segments
+    DIRECTOR_SHOT_OUTPUT_TOKENS = 280  # 1 shot JSON (purpose, camera, img_prompt...)
+    DIRECTOR_CONTEXT_TOKENS = 600      # chunk_context + continuity_context
+
+    def _scene_batches(
+        self,
+        scenes_data: List[Dict[str, Any]],
+        characters: List[Character] = None,
+        locations: List[Location] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Chia scenes thành batch cho _generate_scene_prompts.
+
+        Token batching: đóng gói theo output budget của provider với completion
+        ước lượng riêng từng scene (_scene_completion_estimator: nhân vật/bối
+        cảnh đông + lời dẫn dài → batch ít scene hơn, scene thưa → nhiều hơn),
+        tối đa prompt_batch_max_scenes scene/batch (không đặt → 2 ×
+        prompt_batch_size). Tắt → batch cố định prompt_batch_size.
+        """
+        if not self.token_batching:
+            return [scenes_data[i:i + self.batch_size] for i in range(0, len(scenes_data), self.batch_size)]
+
+        tokens = self.token_budget.tokens
+        fixed = tokens(get_generate_scenes_prompt())
+        fixed += sum(tokens(c.character_lock or c.english_prompt or "") + 30 for c in characters or [])
+        fixed += sum(tokens(loc.location_lock or "") + 30 for loc in locations or [])
+        return self.token_budget.pack(
+            scenes_data,
+            kind="scene_prompts",
+            prompt_tokens=lambda s: tokens(s.get("text", "")) + self.SCENE_INPUT_TOKENS,
+            completion_tokens=self._scene_completion_estimator(characters, locations),
+            fixed_prompt_tokens=fixed,
+            max_output_tokens=8192,
+            max_items=self.batch_max_scenes
+        )
+
+    def _scene_completion_estimator(
+        self,
+        characters: List[Character] = None,
+        locations: List[Location] = None
+    ) -> Callable[[Dict[str, Any]], int]:
+        """
+        Completion ước lượng cho 1 scene: img_prompt chép nguyên lock nhân vật +
+        lock bối cảnh + global_style, phần hành động dài theo lời dẫn.
+        """
+        tokens = self.token_budget.tokens
+        char_tokens = {c.id: tokens(c.character_lock or c.english_prompt or "") for c in characters or []}
+        loc_tokens = {loc.id: tokens(loc.location_lock or "") for loc in locations or []}
+        style_tokens = tokens(get_global_style())
+
+        def estimate(scene: Dict[str, Any]) -> int:
+            chars = self._json_list(scene.get("characters_in_scene"))
+            return (self.SCENE_OUTPUT_BASE_TOKENS + style_tokens
+                    + sum(char_tokens.get(cid, self.SCENE_CHAR_LOCK_TOKENS) for cid in chars)
+                    + loc_tokens.get(scene.get("location_id") or "", 0)
+                    + tokens(scene.get("text", "")) // 2)
+
+        return estimate
+
+    def _director_entry_completion(self, entry) -> int:
+        """Output ước lượng cho 1 dòng SRT: số shot theo thời lượng + srt_text được chép lại."""
+        duration = (entry.end_time - entry.start_time).total_seconds()
+        avg_shot = (self.min_scene_duration + self.max_scene_duration) / 2 or 1
+        shots = max(duration / avg_shot, 0.5)
+        return int(shots * self.DIRECTOR_SHOT_OUTPUT_TOKENS) + self.token_budget.tokens(entry.text[:200])
+
+    def _director_chunks(self, srt_entries: list, fixed_prompt_tokens: int) -> List[list]:
+        """Chia SRT entries thành chunk theo output budget (max_tokens=8192 của TIER 1)."""
+        tokens = self.token_budget.tokens
+        return self.token_budget.pack(
+            srt_entries,
+            kind="director",
+            prompt_tokens=lambda e: tokens(e.text[:200]) + self.DIRECTOR_ENTRY_INPUT_TOKENS,
+            completion_tokens=self._director_entry_completion,
+            fixed_prompt_tokens=fixed_prompt_tokens,
+            max_output_tokens=8192
+        )
+
+    def _observe_tokens(self, kind: str, estimated: int, prompt: str, response: str, truncated: bool = False):
+        """Ghi usage request vừa gọi (cùng thread) vào TokenBudget."""
+        usage = self.ai_client.last_usage()
+        self.token_budget.observe(kind, estimated, response or "", usage,
+                                  truncated=truncated, prompt_text=prompt)
+        if truncated or usage.get("finish_reason") == "length":
+            self.logger.info(f"[Token Budget] {kind} bị truncate → thu nhỏ batch sau: {self.token_budget.stats()}")
+
+    # =========================================================================
+    # INCREMENTAL SRT UPDATE
+    # =========================================================================
+
+    # Sheet director_plan lưu srt_text cắt 500 ký tự
+    PLAN_TEXT_LIMIT = 500
+
+    @timed("prompts_incremental_srt")
+    def update_for_edited_srt(
+        self,
+        project_dir: Path,
+        code: str,
+        workbook: PromptWorkbook = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Cập nhật prompts sau khi SRT bị sửa mà không chạy lại toàn bộ pipeline
+        (phân tích nhân vật, director's treatment, shooting plan, scene prompts).
+
+        So sánh SRT mới với srt_text đã ghi trong sheet director_plan theo từng
+        khoảng thời gian:
+        - Khoảng có lời dẫn thay đổi → scenes giao với khoảng đó được tạo lại
+          prompt (lời dẫn scene lân cận đưa vào làm context), ảnh cũ chuyển
+          sang img/_replaced/ để bước tạo ảnh chạy lại đúng scenes đó
+        - SRT dài thêm ở cuối → thêm scenes mới (scene_id tiếp theo)
+        - Scenes khác giữ nguyên scene_id, prompt, ảnh và media_id
+
+        Args:
+            project_dir: Thư mục project
+            code: Mã project
+            workbook: PromptWorkbook đã load (None = tự load)
+
+        Returns:
+            Report dict (changed, changed_ranges, scenes_regenerated, scenes_added,
+            scenes_kept, llm_calls, llm_calls_full_estimate, llm_calls_saved),
+            hoặc None nếu chưa có director_plan/scenes (cần chạy full)
+        """
+        project_dir = Path(project_dir)
+        srt_path = project_dir / "srt" / f"{code}.srt"
+        excel_path = project_dir / "prompts" / f"{code}_prompts.xlsx"
+        if not srt_path.exists() or not excel_path.exists():
+            return None
+
+        workbook = workbook or PromptWorkbook(excel_path).load_or_create()
+        plan = workbook.get_director_plan()
+        scenes = workbook.get_scenes()
+        if not plan or not scenes:
+            return None
+
+        srt_entries = parse_srt_file(srt_path)
+        if not srt_entries:
+            return None
+
+        # === DIFF: hash lời dẫn SRT nguyên văn đã lưu (srt_hash) với SRT mới ===
+        # srt_text của dòng đạo diễn là text LLM chép lại (rút gọn/viết lại) → không
+        # dùng làm baseline; dòng chưa có srt_hash (Excel cũ) bỏ qua, không coi là sửa
+        narration_between = _narration_index(srt_entries)
+        changed_windows = []
+        changed_plan_ids = {}
+        unverified = 0
+        plan_end = 0.0
+        for row in plan:
+            start = _timestamp_seconds(row.get("srt_start"))
+            end = _timestamp_seconds(row.get("srt_end"))
+            if start is None or end is None or end <= start:
+                continue
+            plan_end = max(plan_end, end)
+            if not row.get("srt_hash"):
+                unverified += 1
+                continue
+            current = narration_between(start, end)
+            if _narration_hash(current) != row["srt_hash"]:
+                changed_windows.append((start, end))
+                changed_plan_ids[row["plan_id"]] = current
+        if unverified:
+            self.logger.info(
+                f"[INCREMENTAL] {unverified} dòng director_plan chưa có srt_hash → bỏ qua, "
+                f"lấy SRT hiện tại làm baseline"
+            )
+
+        scene_end = max((_timestamp_seconds(sc.srt_end) or 0.0 for sc in scenes), default=0.0)
+        covered_end = max(plan_end, scene_end)
+        tail_entries = [
+            e for e in srt_entries
+            if (e.start_time.total_seconds() + e.end_time.total_seconds()) / 2 >= covered_end
+        ]
+
+        report = {
+            "changed": bool(changed_windows or tail_entries),
+            "changed_ranges": [],
+            "scenes_regenerated": 0,
+            "scenes_added": 0,
+            "scenes_kept": len(scenes),
+            "llm_calls": 0,
+            "llm_calls_full_estimate": 0,
+            "llm_calls_saved": 0,
+        }
+        if not report["changed"]:
+            if unverified:
+                workbook.save_director_plan(self._snapshot_plan_rows(self._plan_rows(plan), srt_entries))
+                workbook.save()
+            return report
+
+        # Gộp các khoảng liền nhau
+        merged: List[List[float]] = []
+        for start, end in sorted(changed_windows):
+            if merged and start <= merged[-1][1] + 0.5:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        report["changed_ranges"] = [
+            f"{self._format_timedelta_simple(a)} → {self._format_timedelta_simple(b)}" for a, b in merged
+        ]
+        self.logger.info(
+            f"[INCREMENTAL] SRT thay đổi: {len(changed_plan_ids)} đoạn director_plan, "
+            f"{len(tail_entries)} dòng mới ở cuối → {', '.join(report['changed_ranges']) or 'chỉ phần cuối'}"
+        )
+
+        characters, locations = self._characters_from_workbook(workbook)
+        calls_before = self.llm_calls
+
+        # === SCENES TRONG KHOẢNG THAY ĐỔI ===
+        timed_scenes = []
+        for sc in scenes:
+            start = _timestamp_seconds(sc.srt_start)
+            end = _timestamp_seconds(sc.srt_end)
+            if start is not None and end is not None:
+                timed_scenes.append((start, end, sc))
+        timed_scenes.sort(key=lambda t: t[0])
+
+        regenerated = 0
+        for range_start, range_end in merged:
+            idxs = [i for i, (a, b, _) in enumerate(timed_scenes) if a < range_end and b > range_start]
+            if not idxs:
+                continue
+            before = timed_scenes[max(0, idxs[0] - self.incremental_neighbors):idxs[0]]
+            after = timed_scenes[idxs[-1] + 1:idxs[-1] + 1 + self.incremental_neighbors]
+            context = self._neighbor_context(
+                [narration_between(a, b) for a, b, _ in before],
+                [narration_between(a, b) for a, b, _ in after]
+            )
+
+            scenes_data = []
+            for i in idxs:
+                start, end, sc = timed_scenes[i]
+                scenes_data.append({
+                    "scene_id": sc.scene_id,
+                    "srt_start": sc.srt_start,
+                    "srt_end": sc.srt_end,
+                    "duration": sc.duration or round(end - start, 2),
+                    "text": narration_between(start, end),
+                    "characters_in_scene": self._json_list(sc.characters_used),
+                    "location_id": sc.location_used or "",
+                })
+
+            for scene_data, scene_prompts in self._incremental_prompts(characters, locations, scenes_data, context):
+                fields = self._incremental_scene_fields(scene_data, scene_prompts, characters, locations)
+                workbook.update_scene(scene_data["scene_id"], **fields)
+                self._retire_scene_media(project_dir, scene_data["scene_id"])
+                regenerated += 1
+
+        # === PHẦN SRT DÀI THÊM Ở CUỐI → SCENES MỚI ===
+        added_plan_rows = []
+        if tail_entries:
+            next_id = max((sc.scene_id for sc in scenes), default=0) + 1
+            tail_scenes = group_srt_into_scenes(
+                tail_entries,
+                min_duration=self.min_scene_duration,
+                max_duration=self.max_scene_duration
+            )
+            tail_data = []
+            for i, grouped in enumerate(tail_scenes):
+                start, end = grouped["start_time"], grouped["end_time"]
+                tail_data.append({
+                    "scene_id": next_id + i,
+                    "srt_start": format_srt_time(start),
+                    "srt_end": format_srt_time(end),
+                    "duration": round((end - start).total_seconds(), 2),
+                    "text": grouped.get("text", ""),
+                })
+            context = self._neighbor_context(
+                [narration_between(a, b) for a, b, _ in timed_scenes[-self.incremental_neighbors:]]
+                if self.incremental_neighbors else [],
+                []
+            )
+            for scene_data, scene_prompts in self._incremental_prompts(characters, locations, tail_data, context):
+                fields = self._incremental_scene_fields(scene_data, scene_prompts, characters, locations)
+                workbook.add_scene(Scene(
+                    scene_id=scene_data["scene_id"],
+                    srt_start=scene_data["srt_start"],
+                    srt_end=scene_data["srt_end"],
+                    duration=scene_data["duration"],
+                    planned_duration=scene_data["duration"],
+                    **fields
+                ))
+                added_plan_rows.append({**scene_data, **fields, "status": "done"})
+            report["scenes_added"] = len(tail_data)
+
+        # === GHI LẠI DIRECTOR_PLAN THEO SRT MỚI (lần sau diff từ đây) ===
+        new_plan = self._plan_rows(plan, texts=changed_plan_ids)
+        for row in added_plan_rows:
+            new_plan.append({
+                "scene_id": row["scene_id"],
+                "srt_start": row["srt_start"],
+                "srt_end": row["srt_end"],
+                "duration": row["duration"],
+                "text": row["text"],
+                "characters_used": row["characters_used"],
+                "location_used": row["location_used"],
+                "reference_files": row["reference_files"],
+                "img_prompt": row["img_prompt"],
+                "status": row["status"],
+            })
+        workbook.save_director_plan(self._snapshot_plan_rows(new_plan, srt_entries))
+        workbook.save()
+
+        report["scenes_regenerated"] = regenerated
+        report["scenes_kept"] = len(scenes) - regenerated
+        report["llm_calls"] = self.llm_calls - calls_before
+        report["llm_calls_full_estimate"] = self._estimate_full_llm_calls(srt_entries)
+        report["llm_calls_saved"] = max(0, report["llm_calls_full_estimate"] - report["llm_calls"])
+
+        self.logger.info(
+            f"[INCREMENTAL] ✓ Tạo lại {regenerated} scenes, thêm {report['scenes_added']}, "
+            f"giữ nguyên {report['scenes_kept']} | LLM calls: {report['llm_calls']} "
+            f"(full ~{report['llm_calls_full_estimate']}, tiết kiệm ~{report['llm_calls_saved']})"
+        )
+        return report
+
+    @staticmethod
+    def _plan_rows(plan: List[Dict], texts: Dict[Any, str] = None,
+                   overrides: Dict[Any, Dict] = None) -> List[Dict]:
+        """Dòng get_director_plan() → dict cho save_director_plan (giữ srt_hash)."""
+        texts = texts or {}
+        overrides = overrides or {}
+        rows = []
+        for row in plan:
+            rows.append({
+                "scene_id": row["plan_id"],
+                "srt_start": row["srt_start"],
+                "srt_end": row["srt_end"],
+                "duration": row["duration"],
+                "text": texts.get(row["plan_id"], row["srt_text"]),
+                "characters_used": row["characters_used"],
+                "location_used": row["location_used"],
+                "reference_files": row["reference_files"],
+                "img_prompt": row["img_prompt"] or "",
+                "status": row["status"],
+                "srt_hash": row.get("srt_hash", ""),
+                **overrides.get(row["plan_id"], {}),
+            })
+        return rows
+
+    @staticmethod
+    def _snapshot_plan_rows(rows: List[Dict], srt_entries: List) -> List[Dict]:
+        """
+        Gắn srt_hash = hash lời dẫn SRT nguyên văn trong khoảng srt_start → srt_end
+        của mỗi dòng (baseline cho update_for_edited_srt). Dòng không có timestamp
+        hợp lệ để trống.
+        """
+        narration_between = _narration_index(srt_entries)
+        for row in rows:
+            start = _timestamp_seconds(row.get("srt_start"))
+            end = _timestamp_seconds(row.get("srt_end"))
+            if start is not None and end is not None and end > start:
+                row["srt_hash"] = _narration_hash(narration_between(start, end))
+        return rows
+
+    def _characters_from_workbook(self, workbook: PromptWorkbook) -> Tuple[List[Character], List[Location]]:
+        """Characters + Locations đã lưu trong Excel (location lưu dạng Character role=location)."""
+        characters, locations = [], []
+        for c in workbook.get_characters():
+            if c.role == "location":
+                locations.append(Location(
+                    id=c.id,
+                    name=c.name,
+                    english_prompt=c.english_prompt,
+                    location_lock=c.character_lock or c.vietnamese_prompt,
+                    image_file=c.image_file,
+                    status=c.status,
+                    media_id=c.media_id
+                ))
+            else:
+                characters.append(c)
+        return characters, locations
+
+    @staticmethod
+    def _json_list(value) -> List[str]:
+        """Cột JSON list trong Excel (hoặc chuỗi phân cách bằng dấu phẩy) → list."""
+        if isinstance(value, list):
+            return value
+        if not value:
+            return []
+        try:
+            parsed = json.loads(value)
+            return parsed if isinstance(parsed, list) else [str(parsed)]
+        except (ValueError, TypeError):
+            return [v.strip() for v in str(value).split(",") if v.strip()]
+
+    def _incremental_prompts(
+        self,
+        characters: List[Character],
+        locations: List[Location],
+        scenes_data: List[Dict[str, Any]],
+        context: str
+    ):
+        """(scene_data, prompts) theo batch; AI trả thiếu → fallback prompt (không để scene cũ lệch lời dẫn)."""
+        for batch in self._scene_batches(scenes_data, characters, locations):
+            prompts = self._generate_scene_prompts(characters, batch, context, locations=locations) or []
+            if len(prompts) < len(batch):
+                prompts = list(prompts) + self._create_fallback_prompts(
+                    batch[len(prompts):], characters, locations, get_global_style()
+                )
+            yield from zip(batch, prompts)
+
+    @staticmethod
+    def _neighbor_context(before: List[str], after: List[str]) -> str:
+        """Lời dẫn scenes lân cận (giữ mạch hình ảnh, không tạo prompt cho chúng)."""
+        parts = []
+        if before:
+            parts.append("PREVIOUS SCENES (context only): " + " | ".join(t[:300] for t in before if t))
+        if after:
+            parts.append("NEXT SCENES (context only): " + " | ".join(t[:300] for t in after if t))
+        return "\n".join(parts)
+
+    def _incremental_scene_fields(
+        self,
+        scene_data: Dict[str, Any],
+        prompts: Dict[str, Any],
+        characters: List[Character],
+        locations: List[Location]
+    ) -> Dict[str, Any]:
+        """Các cột Scene cần ghi cho scene được tạo lại (ảnh/video/media_id reset)."""
+        chars_used = self._json_list(prompts.get("characters_used") or scene_data.get("characters_in_scene"))
+        location_used = prompts.get("location_used") or scene_data.get("location_id", "")
+        ref_files = self._json_list(prompts.get("reference_files"))
+        if not ref_files:
+            ref_files = [c if c.endswith(".png") else f"{c}.png" for c in chars_used if c]
+            if location_used:
+                ref_files.append(location_used if location_used.endswith(".png") else f"{location_used}.png")
+
+        img_prompt, video_prompt, ref_files = self._project_rules(characters, locations).finalize(
+            prompts.get("img_prompt", ""), prompts.get("video_prompt", "") or prompts.get("img_prompt", ""), ref_files
+        )
+        return {
+            "srt_text": scene_data.get("text", "")[:self.PLAN_TEXT_LIMIT],
+            "img_prompt": img_prompt,
+            "video_prompt": video_prompt,
+            "prompt_json": "",
+            "img_path": "",
+            "video_path": "",
+            "status_img": "pending",
+            "status_vid": "pending",
+            "characters_used": json.dumps(chars_used),
+            "location_used": location_used,
+            "reference_files": json.dumps(ref_files),
+            "media_id": "",
+        }
+
+    def _retire_scene_media(self, project_dir: Path, scene_id: int) -> None:
+        """Chuyển ảnh/video cũ của scene sang img/_replaced/ → bước tạo ảnh sẽ tạo lại."""
+        img_dir = project_dir / "img"
+        replaced_dir = img_dir / "_replaced"
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        for suffix in (".png", ".jpg", ".mp4"):
+            path = img_dir / f"{scene_id}{suffix}"
+            if path.exists():
+                replaced_dir.mkdir(parents=True, exist_ok=True)
+                try:
+                    path.replace(replaced_dir / f"{scene_id}_{stamp}{suffix}")
+                except OSError as e:
+                    self.logger.warning(f"[INCREMENTAL] Không chuyển được {path.name}: {e}")
+
+    def _estimate_full_llm_calls(self, srt_entries: List) -> int:
+        """
+        Ước lượng số LLM call nếu chạy lại full pipeline: phân tích nhân vật
+        (truyện dài: 1 call mỗi đoạn + 1 reduce) + backup scenes (15 scenes/call) + director's treatment + shooting plan
+        (video > 5 phút: 1 call cấu trúc + 1 call mỗi chunk 5 phút).
+        """
+        if not srt_entries:
+            return 0
+        backup_scenes = group_srt_into_scenes(
+            srt_entries,
+            min_duration=self.min_scene_duration,
+            max_duration=self.max_scene_duration
+        )
+        backup_calls = (len(backup_scenes) + 14) // 15
+        duration = srt_entries[-1].end_time.total_seconds()
+        plan_calls = 1 if duration <= 300 else 1 + int((duration + 299) // 300)
+        analyze_calls = 1
+        if self._use_story_map_reduce(" ".join(e.text for e in srt_entries)):
+            analyze_calls = len(chunk_entries(srt_entries, self.story_chunk_tokens)) + 1  # map + reduce
+        return analyze_calls + backup_calls + 1 + plan_calls
+
+    # =========================================================================
+    # OFFLINE MODE: Excel đầy đủ trong vài giây, LLM refine chạy nền
+    # =========================================================================
+
+    OFFLINE_STATUS = "offline"  # Cột status director_plan: prompt offline chưa refine
+
+    @timed("prompts_offline")
+    def generate_offline(
+        self,
+        project_dir: Path,
+        code: str,
+        on_characters_ready: Callable = None,
+        on_scenes_batch_ready: Callable = None,
+        total_scenes_callback: Callable = None
+    ) -> bool:
+        """
+        Tạo Excel đầy đủ (nhân vật, bối cảnh, scenes, reference files) từ SRT
+        không gọi LLM: từ khoá (modules.offline_prompts) + _create_fallback_prompts.
+
+        Bước tạo ảnh bắt đầu được ngay; refine_offline_prompts() nâng cấp prompts
+        sau (director_plan status = "offline" đánh dấu scene chưa refine).
+        Callbacks giống generate_for_project.
+
+        Returns:
+            True nếu đã ghi Excel
+        """
+        project_dir = Path(project_dir)
+        srt_path = project_dir / "srt" / f"{code}.srt"
+        excel_path = project_dir / "prompts" / f"{code}_prompts.xlsx"
+        if not srt_path.exists():
+            self.logger.error(f"SRT file không tồn tại: {srt_path}")
+            return False
+        srt_entries = parse_srt_file(srt_path)
+        if not srt_entries:
+            self.logger.error("Không tìm thấy entries trong SRT file")
+            return False
+
+        cast = analyze_offline(srt_entries)
+        characters, locations = cast.characters, cast.locations
+        self.logger.info(f"[OFFLINE] {len(characters)} nhân vật, {len(locations)} bối cảnh (từ khoá)")
+
+        workbook = PromptWorkbook(excel_path).load_or_create()
+        workbook.clear_characters()
+        workbook.clear_scenes()
+        for char in characters:
+            if char.is_child:
+                char.image_file = "NONE"
+                char.status = "skip"
+            else:
+                char.image_file = f"{char.id}.png"
+                char.status = "pending"
+            workbook.add_character(char)
+        for loc in locations:
+            workbook.add_character(Character(
+                id=loc.id,
+                role="location",
+                name=loc.name,
+                english_prompt=loc.english_prompt,
+                character_lock=loc.location_lock,
+                vietnamese_prompt=loc.location_lock,
+                image_file=f"{loc.id}.png",
+                status="pending"
+            ))
+        workbook.save()
+        if on_characters_ready:
+            try:
+                on_characters_ready(excel_path, project_dir)
+            except Exception as e:
+                self.logger.warning(f"[OFFLINE] Callback error (non-fatal): {e}")
+
+        scenes_data = []
+        for i, grouped in enumerate(group_srt_into_scenes(
+            srt_entries, min_duration=self.min_scene_duration, max_duration=self.max_scene_duration
+        )):
+            start, end = grouped["start_time"], grouped["end_time"]
+            scenes_data.append({
+                "scene_id": i + 1,
+                "srt_start": format_srt_time(start),
+                "srt_end": format_srt_time(end),
+                "duration": round((end - start).total_seconds(), 2),
+                "text": grouped.get("text", ""),
+            })
+        assign_scenes(scenes_data, cast)
+        if total_scenes_callback:
+            total_scenes_callback(len(scenes_data))
+
+        prompts = self._create_fallback_prompts(scenes_data, characters, locations, get_global_style())
+        plan_rows = []
+        for scene_data, scene_prompts in zip(scenes_data, prompts):
+            fields = self._incremental_scene_fields(scene_data, scene_prompts, characters, locations)
+            workbook.add_scene(Scene(
+                scene_id=scene_data["scene_id"],
+                srt_start=scene_data["srt_start"],
+                srt_end=scene_data["srt_end"],
+                duration=scene_data["duration"],
+                planned_duration=min(scene_data["duration"], self.max_scene_duration),
+                **fields
+            ))
+            plan_rows.append({**scene_data, **fields, "status": self.OFFLINE_STATUS})
+        workbook.save_director_plan(self._snapshot_plan_rows(plan_rows, srt_entries))
+        workbook.save()
+        self.logger.info(f"[OFFLINE] ✓ Đã lưu {len(plan_rows)} scenes (chưa refine bằng LLM)")
+
+        if on_scenes_batch_ready:
+            try:
+                on_scenes_batch_ready(excel_path, project_dir, len(plan_rows), len(plan_rows))
+            except Exception as e:
+                self.logger.warning(f"[OFFLINE] Callback error: {e}")
+        return True
+
+    @timed("prompts_offline_refine")
+    def refine_offline_prompts(self, project_dir: Path, code: str, apply: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Nâng cấp prompts offline bằng LLM; chỉ scene có prompt đổi đáng kể
+        (prompt_change >= offline_refine_min_change, hoặc đổi reference files)
+        mới bị ghi đè + chuyển ảnh cũ sang img/_replaced/ để tạo lại. Scene
+        khác giữ prompt + ảnh đã tạo.
+
+        Nhân vật/bối cảnh: phân tích LLM thay mô tả từ khoá, chỉ với entity
+        chưa có ảnh reference (ảnh đã tạo giữ mô tả cũ cho khớp ảnh).
+
+        Args:
+            apply: False → chỉ tính (chạy nền song song bước tạo ảnh); gọi
+                apply_offline_refinement(report) sau khi tạo ảnh xong
+
+        Returns:
+            Report (scenes_checked, scenes_requeued, scenes_kept,
+            entities_upgraded, llm_calls, scene_ids, updates), None nếu không
+            có scene offline
+        """
+        project_dir = Path(project_dir)
+        srt_path = project_dir / "srt" / f"{code}.srt"
+        excel_path = project_dir / "prompts" / f"{code}_prompts.xlsx"
+        if not srt_path.exists() or not excel_path.exists():
+            return None
+
+        workbook = PromptWorkbook(excel_path).load_or_create()
+        offline_ids = {row["plan_id"] for row in workbook.get_director_plan()
+                       if row.get("status") == self.OFFLINE_STATUS}
+        scenes = [sc for sc in workbook.get_scenes() if sc.scene_id in offline_ids]
+        if not scenes:
+            return None
+
+        calls_before = self.llm_calls
+        characters, locations = self._characters_from_workbook(workbook)
+        upgrades: Dict[str, Dict[str, str]] = {}
+        if self.offline_refine_characters:
+            srt_entries = parse_srt_file(srt_path)
+            full_story = " ".join(e.text for e in srt_entries)
+            llm_chars, llm_locs, _, _ = self._analyze_characters(full_story, srt_entries)
+            upgrades = self._offline_entity_upgrades(project_dir, characters, locations, llm_chars, llm_locs)
+
+        scenes_data = [{
+            "scene_id": sc.scene_id,
+            "srt_start": sc.srt_start,
+            "srt_end": sc.srt_end,
+            "duration": sc.duration,
+            "text": sc.srt_text or "",
+            "characters_in_scene": self._json_list(sc.characters_used),
+            "location_id": sc.location_used or "",
+        } for sc in scenes]
+        old = {sc.scene_id: sc for sc in scenes}
+
+        changed: Dict[int, Dict[str, Any]] = {}
+        for scene_data, scene_prompts in self._incremental_prompts(characters, locations, scenes_data, ""):
+            fields = self._incremental_scene_fields(scene_data, scene_prompts, characters, locations)
+            sc = old[scene_data["scene_id"]]
+            change = prompt_change(sc.img_prompt, fields["img_prompt"])
+            refs_changed = set(self._json_list(sc.reference_files)) != set(self._json_list(fields["reference_files"]))
+            if change >= self.offline_refine_min_change or refs_changed:
+                changed[sc.scene_id] = fields
+
+        report = {
+            "scenes_checked": len(scenes),
+            "scenes_requeued": len(changed),
+            "scenes_kept": len(scenes) - len(changed),
+            "entities_upgraded": len(upgrades),
+            "llm_calls": self.llm_calls - calls_before,
+            "scene_ids": sorted(changed),
+            "updates": {"scenes": changed, "entities": upgrades, "offline_ids": sorted(offline_ids)},
+        }
+        inc("offline_refine_scenes", report["scenes_requeued"], result="requeued")
+        inc("offline_refine_scenes", report["scenes_kept"], result="kept")
+        self.logger.info(
+            f"[OFFLINE] ✓ Refine {report['scenes_checked']} scenes: tạo lại ảnh {report['scenes_requeued']}, "
+            f"giữ {report['scenes_kept']} | nâng cấp {report['entities_upgraded']} nhân vật/bối cảnh | "
+            f"LLM calls: {report['llm_calls']}"
+        )
+        if apply:
+            self.apply_offline_refinement(project_dir, code, report)
+        return report
+
+    def apply_offline_refinement(self, project_dir: Path, code: str, report: Dict[str, Any]) -> List[int]:
+        """
+        Ghi kết quả refine_offline_prompts() vào Excel + chuyển ảnh cũ của các
+        scene đổi prompt sang img/_replaced/.
 
-                # Delay trước retry tiếp theo
-                if retry_round < max_gap_retries - 1:
-                    time.sleep(2)
+        Gọi khi bước tạo ảnh đã xong (thread tạo ảnh giữ workbook trong bộ nhớ,
+        save sau sẽ đè lên). Load → ghi → save giữ workbook_lock.
+
+        Returns:
+            scene_ids cần tạo lại ảnh
+        """
+        project_dir = Path(project_dir)
+        excel_path = project_dir / "prompts" / f"{code}_prompts.xlsx"
+        updates = report.get("updates") or {}
+        changed = updates.get("scenes", {})
+        upgrades = updates.get("entities", {})
+        offline_ids = set(updates.get("offline_ids", []))
+
+        with workbook_lock(excel_path):
+            workbook = PromptWorkbook(excel_path).load_or_create()
+            for entity_id, fields in upgrades.items():
+                workbook.update_character(entity_id, **fields)
+            for scene_id, fields in changed.items():
+                workbook.update_scene(scene_id, **fields)
+            plan = workbook.get_director_plan()
+            workbook.save_director_plan(self._plan_rows(plan, overrides={
+                row["plan_id"]: {
+                    **{k: changed.get(row["plan_id"], row)[k] or "" for k in
+                       ("characters_used", "location_used", "reference_files", "img_prompt")},
+                    "status": "done" if row["plan_id"] in offline_ids else row["status"],
+                } for row in plan
+            }))
+            workbook.save()
 
+        for scene_id in changed:
+            self._retire_scene_media(project_dir, scene_id)
+        return sorted(changed)
+
+    def refine_in_background(
+        self,
+        project_dir: Path,
+        code: str,
+        on_done: Callable = None,
+        apply: bool = True
+    ) -> threading.Thread:
+        """
+        refine_offline_prompts() trên thread nền.
+
+        on_done(report): gọi khi xong (report None nếu lỗi / không có gì để refine).
+        apply=False: chưa ghi Excel - caller gọi apply_offline_refinement(report).
+        """
+        def _worker():
+            report = None
+            try:
+                report = self.refine_offline_prompts(project_dir, code, apply=apply)
             except Exception as e:
-                self.logger.error(f"[TIMELINE RETRY] Lỗi: {e}")
-                import traceback
-                self.logger.debug(traceback.format_exc())
-                break
+                self.logger.error(f"[OFFLINE] Refine lỗi: {e}")
+            if on_done:
+                on_done(report)
 
-        # Final check - force fill nếu vẫn còn gaps
-        try:
-            final_gaps = workbook.detect_timeline_gaps(video_duration_seconds)
-            if final_gaps:
-                total_missing = sum(g['duration'] for g in final_gaps)
-                self.logger.warning(
-                    f"[FINAL] Còn {len(final_gaps)} gaps ({total_missing:.0f}s) - FORCE FILL từ backup..."
-                )
+        thread = threading.Thread(target=_worker, name="prompt_refine", daemon=True)
+        thread.start()
+        return thread
 
-                # === FORCE FILL: Tạo scenes cho TẤT CẢ gaps còn lại ===
-                backup_plans = workbook.get_director_plan()
-                existing_scenes = workbook.get_scenes()
-                next_scene_id = max([s.scene_id for s in existing_scenes], default=0) + 1
-                force_filled = 0
+    def _offline_entity_upgrades(
+        self,
+        project_dir: Path,
+        characters: List[Character],
+        locations: List[Location],
+        llm_chars: List[Character],
+        llm_locs: List[Location]
+    ) -> Dict[str, Dict[str, str]]:
+        """
+        Mô tả LLM cho nhân vật/bối cảnh offline.
 
-                for gap in final_gaps:
-                    gap_start = gap['start_seconds']
-                    gap_end = gap['end_seconds']
-                    gap_duration = gap['duration']
+        Ghép theo id chỉ với nvc (người kể chuyện - id chung 2 bên); entity
+        khác ghép theo từ trong tên/vai ("Gloria (Mother)" ↔ "Gloria", "Mom
+        (Mother)"...) vì nv1/loc_* offline không cùng nghĩa với id LLM. Không
+        khớp → giữ nguyên mô tả offline.
 
-                    # Tìm backup scenes trong khoảng gap
-                    relevant_backups = []
-                    for bp in backup_plans:
-                        bp_start = bp.get("srt_start", "")
-                        if bp_start:
-                            try:
-                                ts = bp_start.replace(',', '.')
-                                parts = ts.split(':')
-                                if len(parts) == 3:
-                                    bp_secs = int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2])
-                                    if gap_start - 5 <= bp_secs <= gap_end + 5:
-                                        relevant_backups.append(bp)
-                            except:
-                                pass
+        Cập nhật in-place characters/locations (dùng cho prompts scene); trả về
+        các cột Excel cần ghi. Entity đã có ảnh reference (nv/<id>.png hoặc
+        media_id) giữ nguyên.
+        """
+        shared_ids = {"nvc"}
 
-                    if relevant_backups:
-                        # Dùng backup scenes
-                        for bp in relevant_backups:
-                            new_scene = Scene(
-                                scene_id=next_scene_id,
-                                srt_start=bp.get("srt_start", gap['start_time']),
-                                srt_end=bp.get("srt_end", gap['end_time']),
-                                duration=bp.get("duration", gap_duration),
-                                planned_duration=bp.get("duration", 5.0),
-                                srt_text=bp.get("srt_text", "")[:500],
-                                img_prompt=bp.get("img_prompt", "Cinematic scene, 4K photorealistic"),
-                                video_prompt=bp.get("img_prompt", "Cinematic scene"),
-                                status_img="pending",
-                                status_vid="pending",
-                                characters_used=bp.get("characters_used", "[]"),
-                                location_used=bp.get("location_used", ""),
-                                reference_files=bp.get("reference_files", "[]")
-                            )
-                            workbook.add_scene(new_scene)
-                            next_scene_id += 1
-                            force_filled += 1
-                    else:
-                        # Không có backup → tạo scene placeholder với thông tin từ gap
-                        new_scene = Scene(
-                            scene_id=next_scene_id,
-                            srt_start=gap['start_time'],
-                            srt_end=gap['end_time'],
-                            duration=gap_duration,
-                            planned_duration=min(gap_duration, 8.0),
-                            srt_text=f"[Gap {gap['start_time']} - {gap['end_time']}]",
-                            img_prompt="Cinematic illustration, atmospheric scene, 4K photorealistic, dramatic lighting",
-                            video_prompt="Cinematic scene with smooth camera movement",
-                            status_img="pending",
-                            status_vid="pending",
-                            characters_used="[]",
-                            location_used="",
-                            reference_files="[]"
-                        )
-                        workbook.add_scene(new_scene)
-                        next_scene_id += 1
-                        force_filled += 1
+        def name_words(name: str) -> set:
+            words = set(re.findall(r"[a-z]+", (name or "").lower()))
+            return words - {"narrator", "the", "present", "young", "child", "room", "loc"}
 
-                if force_filled > 0:
-                    workbook.save()
-                    self.logger.info(f"[FINAL] ✓ Force filled {force_filled} scenes cho gaps còn lại!")
-            else:
-                self.logger.info("[FINAL] ✓ Timeline đầy đủ - không còn gaps!")
-        except Exception as e:
-            self.logger.error(f"[FINAL] Lỗi force fill: {e}")
+        def best_match(entity_id: str, name: str, candidates: list, used: set):
+            if entity_id in shared_ids:
+                return next((c for c in candidates if c.id == entity_id and c.id not in used), None)
+            words = name_words(name)
+            if not words:
+                return None
+            for cand in candidates:
+                if cand.id not in used and cand.id not in shared_ids and words & name_words(cand.name):
+                    return cand
+            return None
 
-        return True
-    
-    def _analyze_characters(self, story_text: str) -> tuple:
+        def has_image(entity) -> bool:
+            media_id = str(entity.media_id or "").strip()
+            return media_id not in ("", "None") or (project_dir / "nv" / f"{entity.id}.png").exists()
+
+        upgrades: Dict[str, Dict[str, str]] = {}
+        used: set = set()
+        for char in characters:
+            match = best_match(char.id, char.name, llm_chars, used)
+            if not match or not match.character_lock or has_image(char):
+                continue
+            used.add(match.id)
+            char.character_lock = match.character_lock
+            fields = {"character_lock": match.character_lock, "vietnamese_prompt": match.character_lock}
+            if not char.is_child and match.english_prompt and match.english_prompt != "DO_NOT_GENERATE":
+                char.english_prompt = match.english_prompt
+                fields["english_prompt"] = match.english_prompt
+            upgrades[char.id] = fields
+        used = set()
+        for loc in locations:
+            match = best_match(loc.id, loc.name, llm_locs, used)
+            if not match or not match.location_lock or has_image(loc):
+                continue
+            used.add(match.id)
+            loc.location_lock = match.location_lock
+            upgrades[loc.id] = {"character_lock": match.location_lock, "vietnamese_prompt": match.location_lock}
+            if match.english_prompt:
+                loc.english_prompt = match.english_prompt
+                upgrades[loc.id]["english_prompt"] = match.english_prompt
+        return upgrades
+
+    @timed("prompts_analyze_characters")
+    def _analyze_characters(self, story_text: str, srt_entries: List = None) -> tuple:
         """
         Phân tích truyện và trích xuất nhân vật + bối cảnh.
 
         Args:
             story_text: Toàn bộ nội dung truyện
+            srt_entries: SRT entries (có → truyện dài phân tích map-reduce theo đoạn)
 
         Returns:
             Tuple (List[Character], List[Location], context_lock: str, global_style: str)
         """
+        self._story_outline = ""
+        if srt_entries and self._use_story_map_reduce(story_text):
+            result = self._analyze_characters_map_reduce(srt_entries)
+            if result[0]:
+                return result
+            self.logger.warning("[Map-Reduce] Không ra nhân vật → phân tích 1 request")
+            self._story_outline = ""
+
         # Load prompt từ config/prompts.yaml
         prompt_template = get_analyze_story_prompt()
         # Increased limit for longer stories (30+ min videos)
@@ -2140,6 +3358,103 @@ Trả về JSON:"""
                 self.logger.error(f"Invalid characters response: {response[:500]}")
                 return [], [], "", ""
 
+            return self._characters_from_json(json_data)
+
+        except Exception as e:
+            self.logger.error(f"Failed to analyze characters: {e}")
+            return [], [], "", ""
+
+    def _use_story_map_reduce(self, story_text: str) -> bool:
+        """auto: truyện dài hơn story_map_reduce_tokens (hoặc bị cắt 30000 ký tự)."""
+        if self.story_map_reduce in ("always", "true", "on"):
+            return True
+        if self.story_map_reduce != "auto":
+            return False
+        return len(story_text) > 30000 or estimate_tokens(story_text) > self.story_map_reduce_tokens
+
+    def _analyze_characters_map_reduce(self, srt_entries: List) -> tuple:
+        """
+        Phân tích nhân vật/bối cảnh theo đoạn SRT (map, song song) + gộp (reduce).
+
+        MAP: mỗi đoạn ~story_chunk_tokens 1 request (analyze_story_chunk).
+        REDUCE: 1 request nhỏ chỉ gồm danh sách entity rút gọn (merge_story_entities)
+        → nhóm entity trùng + ID cuối; lỗi → gộp + đặt ID bằng code.
+
+        Returns:
+            Cùng format _analyze_characters
+        """
+        map_template = self._load_prompt_template("analyze_story_chunk")
+        reduce_template = self._load_prompt_template("merge_story_entities")
+        if not map_template:
+            self.logger.warning("[Map-Reduce] Không tìm thấy prompt analyze_story_chunk")
+            return [], [], "", ""
+
+        chunks = chunk_entries(srt_entries, self.story_chunk_tokens)
+        self.logger.info(f"[Map-Reduce] MAP: {len(chunks)} đoạn (~{self.story_chunk_tokens} tokens/đoạn)")
+        prompts = [
+            map_template.format(
+                chunk_number=i + 1,
+                total_chunks=len(chunks),
+                time_range=chunk_time_range(chunk),
+                chunk_text=format_chunk(chunk),
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+
+        try:
+            self.llm_calls += len(prompts)
+            # Usage riêng từng đoạn (last_usage() ở đây là của request khác)
+            responses = self.ai_client.generate_batch_parallel(
+                prompts, temperature=0.5, max_tokens=4096, schema=self._structured(STORY_CHUNK_SCHEMA),
+                with_usage=True
+            )
+        except Exception as e:
+            self.logger.error(f"[Map-Reduce] MAP lỗi: {e}")
+            return [], [], "", ""
+
+        chunk_results = []
+        for i, (response, usage) in enumerate(responses):
+            json_data = self._parse_llm_json(response, STORY_CHUNK_SCHEMA, "story_chunk", usage=usage) if response else None
+            if not json_data or "characters" not in json_data:
+                self.logger.warning(f"[Map-Reduce] Đoạn {i + 1}/{len(chunks)} không có JSON hợp lệ, bỏ qua")
+                json_data = None
+            chunk_results.append(json_data)
+        inc("story_map_chunks", len(chunks), result="total")
+        inc("story_map_chunks", sum(1 for r in chunk_results if r is None), result="failed")
+
+        merged = merge_chunks(chunk_results, chunks)
+        if not merged.characters:
+            return [], [], "", ""
+        self._story_outline = story_outline(merged)
+
+        reduce_data = None
+        if reduce_template:
+            self.logger.info(
+                f"[Map-Reduce] REDUCE: {len(merged.characters)} nhân vật, "
+                f"{len(merged.locations)} bối cảnh (trước khi gộp)"
+            )
+            prompt = reduce_template.format(**reduce_inputs(merged))
+            try:
+                response = self._generate_content(
+                    prompt, temperature=0.2, max_tokens=2048, schema=self._structured(STORY_REDUCE_SCHEMA)
+                )
+                reduce_data = self._parse_llm_json(response, STORY_REDUCE_SCHEMA, "story_reduce")
+            except Exception as e:
+                self.logger.warning(f"[Map-Reduce] REDUCE lỗi: {e}")
+        if reduce_data is None:
+            self.logger.warning("[Map-Reduce] REDUCE không dùng được → gộp theo id/tên + đặt ID bằng code")
+        inc("story_reduce", result="llm" if reduce_data else "fallback")
+
+        return self._characters_from_json(apply_groups(merged, reduce_data))
+
+    def _characters_from_json(self, json_data: Dict) -> tuple:
+        """
+        JSON analyze_story (hoặc kết quả map-reduce) → Character / Location.
+
+        Returns:
+            Tuple (List[Character], List[Location], context_lock: str, global_style: str)
+        """
+        try:
             # Extract context_lock and global_style (v5.0 format)
             context_lock = json_data.get("context_lock", "")
             global_style = json_data.get("global_style", "")
@@ -2201,6 +3516,7 @@ Trả về JSON:"""
             self.logger.error(f"Failed to analyze characters: {e}")
             return [], [], "", ""
 
+    @timed("prompts_directors_treatment", ok=bool)
     def _create_directors_treatment(self, story_text: str) -> Optional[Dict]:
         """
         Tạo Director's Treatment - Kịch bản đạo diễn phân tích cấu trúc câu chuyện.
@@ -2246,6 +3562,7 @@ Trả về JSON:"""
             self.logger.error(f"[Director's Treatment] Failed: {e}")
             return None
 
+    @timed("prompts_shooting_plan", ok=bool)
     def _create_directors_shooting_plan(
         self,
         story_text: str,
@@ -2350,13 +3667,14 @@ Trả về JSON:"""
         self.logger.info("[Director's Shooting Plan] Đạo diễn đang lên kế hoạch quay...")
         self.logger.info("=" * 50)
 
-        response = self._generate_content_large(prompt, temperature=0.4, max_tokens=8192)
+        response = self._generate_content_large(prompt, temperature=0.4, max_tokens=8192,
+                                                schema=self._structured(SHOOTING_PLAN_SCHEMA))
 
         self.logger.info(f"[Director's Shooting Plan] Response length: {len(response) if response else 0}")
         if response:
             self.logger.info(f"[Director's Shooting Plan] Response preview: {response[:500]}...")
 
-        json_data = self._extract_json(response)
+        json_data = self._parse_llm_json(response, SHOOTING_PLAN_SCHEMA, "shooting_plan")
 
         if json_data:
             self.logger.info(f"[Director's Shooting Plan] JSON keys: {list(json_data.keys())}")
@@ -2557,10 +3875,11 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
                     import time
                     time.sleep(2)
 
-                response = self._generate_content_large(pass2_prompt, temperature=0.4, max_tokens=8000)
+                response = self._generate_content_large(pass2_prompt, temperature=0.4, max_tokens=8000,
+                                                        schema=self._structured(SHOOTING_PLAN_SCHEMA))
 
                 if response:
-                    json_data = self._extract_json(response)
+                    json_data = self._parse_llm_json(response, SHOOTING_PLAN_SCHEMA, "shooting_plan")
                     if json_data and "shooting_plan" in json_data:
                         part_data = json_data["shooting_plan"]
                         break
@@ -2694,32 +4013,6 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
                         f"(gap: {gap:.0f}s = {gap/60:.1f} phút)"
                     )
 
-        # Split SRT entries into chunks based on time
-        chunks = []
-        current_chunk = []
-        chunk_start_time = 0
-
-        for entry in srt_entries:
-            entry_start = entry.start_time.total_seconds()
-
-            # Check if this entry belongs to current chunk or next
-            if entry_start >= chunk_start_time + chunk_duration and current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = []
-                chunk_start_time = entry_start
-
-            current_chunk.append(entry)
-
-        # Don't forget the last chunk
-        if current_chunk:
-            chunks.append(current_chunk)
-
-        self.logger.info(f"[Director CHUNKING] Chia thành {len(chunks)} phần:")
-        for i, chunk in enumerate(chunks):
-            chunk_start = self._format_timedelta(chunk[0].start_time)
-            chunk_end = self._format_timedelta(chunk[-1].end_time)
-            self.logger.info(f"  Chunk {i+1}: {chunk_start} - {chunk_end} ({len(chunk)} segments)")
-
         # Format shared info (characters, locations)
         chars_info = "NHÂN VẬT:\n" + "\n".join([
             f"- {c.id}: {c.name} - {c.character_lock or ''}"
@@ -2731,6 +4024,43 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
             for loc in locations
         ]) if locations else "Không có thông tin bối cảnh"
 
+        # Phần prompt lặp lại ở mọi chunk (template + story + nhân vật/bối cảnh)
+        tokens = self.token_budget.tokens
+        fixed_prompt_tokens = (
+            tokens(prompt_template) + tokens(story_text[:20000]) + tokens(chars_info)
+            + tokens(locs_info) + self.DIRECTOR_CONTEXT_TOKENS
+        )
+
+        if self.token_batching:
+            # Split SRT entries into chunks based on token budget (lời dẫn dày → chunk ngắn hơn)
+            chunks = self._director_chunks(srt_entries, fixed_prompt_tokens)
+        else:
+            # Split SRT entries into chunks based on time
+            chunks = []
+            current_chunk = []
+            chunk_start_time = 0
+
+            for entry in srt_entries:
+                entry_start = entry.start_time.total_seconds()
+
+                # Check if this entry belongs to current chunk or next
+                if entry_start >= chunk_start_time + chunk_duration and current_chunk:
+                    chunks.append(current_chunk)
+                    current_chunk = []
+                    chunk_start_time = entry_start
+
+                current_chunk.append(entry)
+
+            # Don't forget the last chunk
+            if current_chunk:
+                chunks.append(current_chunk)
+
+        self.logger.info(f"[Director CHUNKING] Chia thành {len(chunks)} phần:")
+        for i, chunk in enumerate(chunks):
+            chunk_start = self._format_timedelta(chunk[0].start_time)
+            chunk_end = self._format_timedelta(chunk[-1].end_time)
+            self.logger.info(f"  Chunk {i+1}: {chunk_start} - {chunk_end} ({len(chunk)} segments)")
+
         # Process each chunk with RETRY logic
         all_parts = []
         part_number_offset = 0
@@ -2741,7 +4071,9 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
         previous_chunk_summary = ""
         previous_last_shots = []
 
-        for chunk_idx, chunk_entries in enumerate(chunks):
+        chunk_idx = 0
+        while chunk_idx < len(chunks):
+            chunk_entries = chunks[chunk_idx]
             chunk_num = chunk_idx + 1
             chunk_start = self._format_timedelta(chunk_entries[0].start_time)
             chunk_end = self._format_timedelta(chunk_entries[-1].end_time)
@@ -2784,12 +4116,18 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
 {continuity_context}
 """
 
-            prompt = prompt_template.format(
-                story_text=chunk_context + story_text[:20000],  # Shorter story for chunks
-                srt_segments=srt_segments,
-                characters_info=chars_info,
-                locations_info=locs_info,
-                global_style=global_style or get_global_style()
+            # Story/nhân vật/bối cảnh/style giống hệt mọi chunk → prefix cache;
+            # thông tin chunk + SRT của chunk nối cuối prompt
+            prompt = assemble_prefix_prompt(
+                prompt_template,
+                constants={
+                    "story_text": story_text[:20000],  # Shorter story for chunks
+                    "characters_info": chars_info,
+                    "locations_info": locs_info,
+                    "global_style": global_style or get_global_style(),
+                },
+                variables={"chunk_context": chunk_context.strip(), "srt_segments": srt_segments},
+                labels={"chunk_context": "PHAN HIEN TAI", "srt_segments": "SRT SEGMENTS CUA PHAN NAY"}
             )
 
             # ============================================================
@@ -2799,6 +4137,8 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
             # 3. SRT Fallback (cuối cùng - luôn hoạt động)
             # ============================================================
             chunk_parts = None
+            resplit = False
+            estimated_completion = sum(self._director_entry_completion(e) for e in chunk_entries)
 
             # === TIER 1: DeepSeek (3 retries) ===
             self.logger.info(f"[TIER 1] DeepSeek cho chunk {chunk_num}...")
@@ -2808,13 +4148,32 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
                     import time
                     time.sleep(2)
 
-                response = self._generate_content_large(prompt, temperature=0.4, max_tokens=8192)
+                response = self._generate_content_large(prompt, temperature=0.4, max_tokens=8192,
+                                                        schema=self._structured(SHOOTING_PLAN_SCHEMA))
+
+                # Có usage mà không có response = JSON bị truncate (lỗi mạng/API thì không có usage)
+                truncated = not response and bool(self.ai_client.last_usage())
+                self._observe_tokens("director", estimated_completion, prompt, response, truncated=truncated)
+
+                if truncated and self.token_batching and len(chunk_entries) > 1:
+                    # Chia lại chunk này + các chunk sau theo hệ số vừa học, xử lý lại từ chunk này
+                    repacked = self._director_chunks(
+                        [e for chunk in chunks[chunk_idx:] for e in chunk], fixed_prompt_tokens
+                    )
+                    if len(repacked[0]) < len(chunk_entries):
+                        self.logger.warning(
+                            f"[Director CHUNKING] Chunk {chunk_num} truncate → chia lại: "
+                            f"{len(chunk_entries)} → {len(repacked[0])} segments"
+                        )
+                        chunks[chunk_idx:] = repacked
+                        resplit = True
+                        break
 
                 if not response:
                     self.logger.error(f"[TIER 1] Chunk {chunk_num} attempt {attempt+1} - no response")
                     continue
 
-                json_data = self._extract_json(response)
+                json_data = self._parse_llm_json(response, SHOOTING_PLAN_SCHEMA, "shooting_plan")
 
                 if not json_data or "shooting_plan" not in json_data:
                     self.logger.error(f"[TIER 1] Chunk {chunk_num} attempt {attempt+1} - no shooting_plan")
@@ -2829,6 +4188,9 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
                 else:
                     self.logger.error(f"[TIER 1] Chunk {chunk_num} attempt {attempt+1} - empty story_parts")
 
+            if resplit:
+                continue
+
             # === TIER 2: Ollama với timeout dài (nếu DeepSeek fail) ===
             if not chunk_parts:
                 self.logger.warning(f"[TIER 2] DeepSeek failed, trying Ollama for chunk {chunk_num}...")
@@ -2837,11 +4199,12 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
                     try:
                         self.logger.info(f"[TIER 2] Gọi Ollama {self.ai_client.ollama_model} (timeout 10 phút)...")
                         # Ollama có timeout mặc định 600s (10 phút) - đủ cho chunk lớn
-                        response = self.ai_client._call_ollama(prompt, temperature=0.4, max_tokens=32000)
+                        response = self.ai_client._call_ollama(prompt, temperature=0.4, max_tokens=32000,
+                                                               schema=self._structured(SHOOTING_PLAN_SCHEMA))
 
                         if response:
                             self.logger.info(f"[TIER 2] Ollama trả về {len(response)} ký tự")
-                            json_data = self._extract_json(response)
+                            json_data = self._parse_llm_json(response, SHOOTING_PLAN_SCHEMA, "shooting_plan")
 
                             if json_data and "shooting_plan" in json_data:
                                 chunk_plan = json_data["shooting_plan"]
@@ -2980,6 +4343,8 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
 
                 self.logger.info(f"[CONTINUITY] Saved context for next chunk: {len(previous_last_shots)} shots, summary ready")
 
+            chunk_idx += 1
+
         if not all_parts:
             self.logger.error("[Director CHUNKING] Không có parts nào được tạo!")
             return None
@@ -3476,6 +4841,7 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
         Validate và fix location mismatch trong img_prompt.
 
         Ví dụ lỗi: "LYING IN BED... hotel hallway" → Sửa thành "LYING IN BED... bedroom"
+        Bảng action → location: modules/prompt_rules.py (ACTION_LOCATION_RULES).
 
         Args:
             img_prompt: Prompt từ AI
@@ -3484,100 +4850,7 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
         Returns:
             Fixed img_prompt
         """
-        if not img_prompt:
-            return img_prompt
-
-        import re
-        prompt_lower = img_prompt.lower()
-        srt_lower = srt_text.lower() if srt_text else ""
-
-        # Định nghĩa các action → location mappings
-        action_location_rules = [
-            # BED actions → must be bedroom
-            {
-                "actions": ["lying in bed", "on the bed", "in bed", "bedroom", "on bed", "fell off the bed", "jumped up from bed"],
-                "wrong_locations": ["hallway", "corridor", "street", "outdoor", "kitchen", "office", "restaurant"],
-                "correct_location": "master bedroom, king-sized bed with silk sheets, elegant furniture, soft ambient lighting"
-            },
-            # KITCHEN actions → must be kitchen
-            {
-                "actions": ["cooking", "in the kitchen", "at the stove", "preparing food"],
-                "wrong_locations": ["bedroom", "hallway", "office", "outdoor", "street"],
-                "correct_location": "modern kitchen interior, stove, countertops, cooking utensils, warm lighting"
-            },
-            # BATHROOM actions
-            {
-                "actions": ["shower", "bathtub", "bathroom", "brushing teeth", "mirror"],
-                "wrong_locations": ["bedroom", "kitchen", "office", "outdoor", "hallway"],
-                "correct_location": "elegant bathroom, marble tiles, mirror, soft lighting"
-            },
-            # OUTDOOR actions
-            {
-                "actions": ["walking on street", "driving", "in the car", "outdoor", "park", "garden"],
-                "wrong_locations": ["bedroom", "kitchen", "bathroom", "office interior"],
-                "correct_location": "outdoor scene, natural daylight"
-            },
-            # RESTAURANT actions
-            {
-                "actions": ["dining", "at restaurant", "eating dinner", "at the table"],
-                "wrong_locations": ["bedroom", "bathroom", "street", "office"],
-                "correct_location": "elegant restaurant interior, dining tables, ambient lighting"
-            },
-        ]
-
-        # Check SRT text for location hints
-        srt_location_hints = {
-            "bed": "bedroom",
-            "bedroom": "bedroom",
-            "master bedroom": "master bedroom",
-            "kitchen": "kitchen",
-            "bathroom": "bathroom",
-            "restaurant": "restaurant",
-            "office": "office",
-            "car": "car interior",
-            "street": "street",
-            "courthouse": "courthouse",
-            "hospital": "hospital",
-        }
-
-        # Find if SRT mentions a specific location
-        srt_location = None
-        for hint, loc in srt_location_hints.items():
-            if hint in srt_lower:
-                srt_location = loc
-                break
-
-        # Check each rule
-        for rule in action_location_rules:
-            # Check if any action is in the prompt
-            action_found = any(action in prompt_lower for action in rule["actions"])
-
-            if action_found:
-                # Check if wrong location is in the prompt
-                for wrong_loc in rule["wrong_locations"]:
-                    if wrong_loc in prompt_lower:
-                        self.logger.warning(f"[Validation] Action/Location mismatch: action implies {rule['actions'][0]} but found '{wrong_loc}'")
-
-                        # Use SRT location if available, otherwise use rule's correct location
-                        correct_loc = rule["correct_location"]
-                        if srt_location:
-                            if srt_location == "bedroom" or srt_location == "master bedroom":
-                                correct_loc = "master bedroom, king-sized bed with silk sheets, elegant nightstands, soft warm lighting"
-                            elif srt_location == "kitchen":
-                                correct_loc = "modern kitchen, marble countertops, stainless steel appliances, warm lighting"
-
-                        # Replace the wrong location with correct one
-                        # Find the sentence containing the wrong location and replace
-                        pattern = re.compile(r'[^.]*' + re.escape(wrong_loc) + r'[^.]*\.?', re.IGNORECASE)
-                        fixed = pattern.sub(correct_loc + '. ', img_prompt)
-
-                        # Clean up double spaces/periods
-                        fixed = re.sub(r'\s+', ' ', fixed)
-                        fixed = re.sub(r'\.\.+', '.', fixed)
-
-                        return fixed.strip()
-
-        return img_prompt
+        return fix_location(img_prompt, srt_text, logger=self.logger)
 
     def _load_prompt_template(self, prompt_name: str) -> Optional[str]:
         """Load a specific prompt template from prompts.yaml"""
@@ -4036,13 +5309,15 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
             max_duration=self.max_scene_duration
         )
 
+    @timed("prompts_scene_batch")
     def _generate_scene_prompts(
         self,
         characters: List[Character],
         scenes_data: List[Dict[str, Any]],
         context_lock: str = "",
         locations: List[Location] = None,
-        global_style_override: str = ""
+        global_style_override: str = "",
+        use_cache: bool = True
     ) -> List[Dict[str, str]]:
         """
         Tạo prompts cho một batch scenes.
@@ -4053,6 +5328,7 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
             context_lock: Context lock string từ phân tích nhân vật
             locations: Danh sách locations
             global_style_override: Global style từ AI (nếu có)
+            use_cache: Tra semantic cache trước khi gọi LLM (prompt AI trả về luôn được lưu)
 
         Returns:
             List các dict chứa img_prompt và video_prompt
@@ -4118,6 +5394,29 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
                 })
             return result
 
+        # Semantic cache: scene gần trùng đã có prompt → dùng lại, chỉ gửi LLM phần còn lại
+        cache_keys = {}
+        if self.scene_cache:
+            cache_keys = self._scene_cache_keys(
+                scenes_data, characters, locations, get_char_lock,
+                style=global_style_override or get_global_style(), context=context_lock or ""
+            )
+        if use_cache and cache_keys:
+            cached = [
+                self.scene_cache.lookup(cache_keys[s["scene_id"]]) if s["scene_id"] in cache_keys else None
+                for s in scenes_data
+            ]
+            if any(cached):
+                misses = [s for s, hit in zip(scenes_data, cached) if hit is None]
+                self.logger.info(
+                    f"[Scene Cache] {len(scenes_data) - len(misses)}/{len(scenes_data)} scenes dùng lại prompt từ cache"
+                )
+                fresh = iter(self._generate_scene_prompts(
+                    characters, misses, context_lock, locations=locations,
+                    global_style_override=global_style_override, use_cache=False
+                ) if misses else [])
+                return [hit or next(fresh) for hit in cached]
+
         # Format thông tin scenes (include location_id, story_beat, shot_type and visual_moment)
         # KHÔNG dùng s['text'] làm fallback cho visual_moment!
         pacing_script = "\n".join([
@@ -4137,14 +5436,21 @@ Estimated Shots: {part_info.get('estimated_shots', 5)}
         prompt_template = get_generate_scenes_prompt()
 
         # Try to format with all variables (v5.0 format)
+        # Phần hằng (template + style + nhân vật + bối cảnh) là prefix giống hệt mọi batch
+        # → DeepSeek prefix cache / Ollama KV cache; scenes (+ context) nối cuối prompt
+        variables = {"scenes_info": pacing_script, "pacing_script": pacing_script}
+        if context_lock:
+            variables["context_lock"] = context_lock
         try:
-            prompt = prompt_template.format(
-                characters_info=characters_info,
-                scenes_info=pacing_script,  # for backwards compat
-                pacing_script=pacing_script,
-                context_lock=context_lock or "Modern setting, natural lighting",
-                global_style=global_style,
-                locations_info=locations_info
+            prompt = assemble_prefix_prompt(
+                prompt_template,
+                constants={
+                    "characters_info": characters_info,
+                    "global_style": global_style,
+                    "locations_info": locations_info,
+                },
+                variables=variables,
+                labels={"scenes_info": "SCENES", "pacing_script": "SCENES", "context_lock": "CONTEXT"}
             )
         except KeyError as e:
             # Fallback to simpler format
@@ -4167,10 +5473,21 @@ Return JSON: {{"scenes": [{{"scene_id": 1, "img_prompt": "...", "video_prompt":
         
         try:
             self.logger.info(f"[Scene Prompts] Generating for {len(scenes_data)} scenes...")
-            response = self._generate_content(prompt, temperature=0.6)
-
-            # Parse JSON
-            json_data = self._extract_json(response)
+            response = self._generate_content(prompt, temperature=0.6, schema=self._structured(SCENE_PROMPTS_SCHEMA))
+
+            # Parse JSON (structured output → validate; không hỗ trợ → repair)
+            json_data = self._parse_llm_json(response, SCENE_PROMPTS_SCHEMA, "scene_prompts")
+
+            # finish_reason=length / JSON trả về thiếu scenes = batch quá lớn với output
+            # budget → học để thu nhỏ (lỗi mạng/response rỗng không tính)
+            got = len(json_data.get("scenes") or []) if isinstance(json_data, dict) else 0
+            truncated = (self.ai_client.last_usage().get("finish_reason") == "length"
+                         or (bool(response) and got < len(scenes_data)))
+            estimate = self._scene_completion_estimator(characters, locations)
+            self._observe_tokens(
+                "scene_prompts", sum(estimate(s) for s in scenes_data), prompt, response,
+                truncated=truncated
+            )
 
             if not json_data or "scenes" not in json_data:
                 self.logger.warning(f"[Scene Prompts] Invalid response - no 'scenes' key in JSON")
@@ -4206,6 +5523,7 @@ Return JSON: {{"scenes": [{{"scene_id": 1, "img_prompt": "...", "video_prompt":
                         "location_used": scene_result.get("location_used", ""),
                         "reference_files": scene_result.get("reference_files", [])
                     })
+                    self._remember_scene_prompt(cache_keys.get(scene_id), result[-1], characters)
                 else:
                     # Scene không có prompt từ AI - dùng fallback THÔNG MINH
                     missing_scenes.append(scene_id)
@@ -4236,6 +5554,61 @@ Return JSON: {{"scenes": [{{"scene_id": 1, "img_prompt": "...", "video_prompt":
             # Return FALLBACK prompts (không để trống!)
             return self._create_fallback_prompts(scenes_data, characters, locations, global_style)
 
+    def _scene_cache_keys(
+        self,
+        scenes_data: List[Dict[str, Any]],
+        characters: List[Character],
+        locations: List[Location],
+        get_char_lock: Callable,
+        style: str = "",
+        context: str = ""
+    ) -> Dict[Any, SceneKey]:
+        """
+        SceneKey cho từng scene (theo scene_id). Scene có nhân vật/bối cảnh không
+        tra được lock (ID generic, lock trống) không dùng cache.
+
+        style: global_style của batch (slot ⟦S⟧ trong template)
+        context: context_lock (chỉ dùng lại entry cùng context)
+        """
+        char_index = {c.id: (c.id, get_char_lock(c), c.role or "") for c in characters}
+        loc_index = {loc.id: (loc.id, loc.location_lock, loc.name or "") for loc in locations if loc.location_lock}
+        keys = {}
+        for scene in scenes_data:
+            char_ids = self._json_list(scene.get("characters_in_scene"))
+            location_id = scene.get("location_id") or ""
+            if any(cid not in char_index for cid in char_ids) or (location_id and location_id not in loc_index):
+                continue
+            keys[scene["scene_id"]] = SceneKey(
+                text=scene.get("text") or scene.get("srt_text") or "",
+                scene_type=scene.get("scene_type", ""),
+                characters=[char_index[cid] for cid in char_ids],
+                location=loc_index.get(location_id),
+                style=style,
+                context=context,
+            )
+        return keys
+
+    def _remember_scene_prompt(
+        self,
+        key: Optional[SceneKey],
+        prompts: Dict[str, Any],
+        characters: List[Character]
+    ) -> None:
+        """Lưu prompt AI vừa tạo vào semantic cache (nếu chỉ dùng nhân vật/bối cảnh của scene)."""
+        if not key or not self.scene_cache:
+            return
+        used_chars = self._json_list(prompts.get("characters_used"))
+        scene_chars = {cid for cid, _, _ in key.characters}
+        location_used = prompts.get("location_used") or ""
+        if any(cid not in scene_chars for cid in used_chars):
+            return
+        if location_used and (not key.location or location_used != key.location[0]):
+            return
+        self.scene_cache.add(
+            key, prompts.get("img_prompt", ""), prompts.get("video_prompt", ""),
+            project_names=[c.name for c in characters if c.name]
+        )
+
     def _create_fallback_prompts(
         self,
         scenes_data: List[Dict],
@@ -4483,40 +5856,7 @@ Return JSON: {{"scenes": [{{"scene_id": 1, "img_prompt": "...", "video_prompt":
         - Starts with "I ", "My ", "We ", "She ", "He "
         - Contains past tense narrative phrases
         """
-        if not text:
-            return True
-
-        text_lower = text.lower().strip()
-
-        # Narration indicators
-        narration_patterns = [
-            # First person narrative
-            text_lower.startswith("i "),
-            text_lower.startswith("i'"),
-            text_lower.startswith("my "),
-            text_lower.startswith("we "),
-            # Third person narrative
-            text_lower.startswith("she "),
-            text_lower.startswith("he "),
-            text_lower.startswith("they "),
-            # Contains dialogue markers
-            '"' in text,
-            "said" in text_lower,
-            "told" in text_lower,
-            "asked" in text_lower,
-            # Past tense narrative
-            "i was" in text_lower,
-            "i had" in text_lower,
-            "i remember" in text_lower,
-            "by the time" in text_lower,
-            "years old" in text_lower,
-            # YouTube CTA
-            "subscribe" in text_lower,
-            "like button" in text_lower,
-            "comment" in text_lower,
-        ]
-
-        return any(narration_patterns)
+        return looks_like_narration(text)
 
     def _create_hook_visual(self, scene_idx: int, scene_text: str, char_parts: List[str], loc_part: str) -> str:
         """Create dramatic HOOK visual for scenes 1-3 (idx 0-2).
@@ -4596,53 +5936,47 @@ Return JSON: {{"scenes": [{{"scene_id": 1, "img_prompt": "...", "video_prompt":
         Returns:
             Cleaned img_prompt without narration text
         """
-        if not img_prompt or not scene_text:
-            return img_prompt
+        return clean_narration(img_prompt, scene_text, logger=self.logger)
 
-        import re
+    def _structured(self, schema: Dict) -> Optional[Dict]:
+        """Schema gửi provider (None khi tắt llm_structured_output)."""
+        return schema if self.structured_output else None
 
-        # 1. Remove exact match of scene_text (or significant portion)
-        # Try to match phrases that are clearly from the narration
-        words = scene_text.split()
-        if len(words) >= 5:
-            # Try to match 5+ consecutive words from narration
-            for i in range(len(words) - 4):
-                phrase = " ".join(words[i:i+5])
-                if phrase.lower() in img_prompt.lower():
-                    # Found narration in prompt - try to remove it
-                    # Find and remove the sentence containing this phrase
-                    pattern = re.compile(r'[^.]*' + re.escape(phrase) + r'[^.]*\.?', re.IGNORECASE)
-                    img_prompt = pattern.sub('', img_prompt)
-                    self.logger.debug(f"[Clean] Removed narration phrase: '{phrase[:30]}...'")
-
-        # 2. Remove common narration patterns
-        narration_patterns = [
-            r'By the time I was \d+ years old[^.]*\.?',
-            r'I had saved[^.]*\.?',
-            r'I decided to[^.]*\.?',
-            r'It cost me[^.]*\.?',
-            r'I remember[^.]*\.?',
-            r'She (told|said|asked)[^.]*\.?',
-            r'He (told|said|asked)[^.]*\.?',
-            r'"[^"]*"',  # Remove quoted dialogue
-        ]
+    def _parse_llm_json(self, response: str, schema: Dict, kind: str,
+                        usage: Optional[Dict[str, Any]] = None) -> Optional[Dict]:
+        """
+        JSON từ response theo schema.
 
-        for pattern in narration_patterns:
-            if re.search(pattern, img_prompt, re.IGNORECASE):
-                img_prompt = re.sub(pattern, '', img_prompt, flags=re.IGNORECASE)
-                self.logger.debug(f"[Clean] Removed pattern: {pattern[:30]}...")
+        usage: usage của đúng request sinh ra response (None = last_usage() -
+        chỉ đúng khi vừa gọi generate_content trên thread này).
 
-        # 3. Clean up: remove double periods, extra spaces
-        img_prompt = re.sub(r'\.\.+', '.', img_prompt)
-        img_prompt = re.sub(r'\s+', ' ', img_prompt)
-        img_prompt = img_prompt.strip()
-        img_prompt = img_prompt.strip('.')
+        Provider đã ép JSON (DeepSeek JSON mode / Ollama format) và không bị
+        truncate → json.loads + validate, không repair. Còn lại (provider không
+        hỗ trợ, finish_reason=length, JSON hỏng) → _extract_json.
 
-        # 4. If prompt is now too short, return original (something went wrong)
-        if len(img_prompt) < 30:
-            self.logger.warning(f"[Clean] Prompt too short after cleaning, may need manual review")
+        Counter llm_json_parse{kind, result}: valid / invalid (JSON đúng, sai
+        schema) / repaired (qua _extract_json) / failed.
+        """
+        if usage is None:
+            usage = self.ai_client.last_usage()
+        if usage.get("structured") and usage.get("finish_reason") != "length":
+            json_data, errors = parse_structured(response, schema)
+            if isinstance(json_data, dict):
+                if errors:
+                    self.logger.warning(f"[JSON] {kind}: sai schema ({len(errors)} lỗi): {'; '.join(errors[:3])}")
+                inc("llm_json_parse", kind=kind, result="invalid" if errors else "valid")
+                return json_data
+            self.logger.warning(f"[JSON] {kind}: structured response không dùng được ({errors[0]}) → repair")
 
-        return img_prompt
+        json_data = self._extract_json(response)
+        if json_data is None:
+            inc("llm_json_parse", kind=kind, result="failed")
+            return None
+        inc("llm_json_parse", kind=kind, result="repaired")
+        errors = validate_json(json_data, schema)
+        if errors:
+            self.logger.warning(f"[JSON] {kind}: sai schema sau repair ({len(errors)} lỗi): {'; '.join(errors[:3])}")
+        return json_data
 
     def _extract_json(self, text: str) -> Optional[Dict]:
         """
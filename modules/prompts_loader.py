@@ -81,3 +81,32 @@ def get_visual_clarity() -> str:
     """Get the visual clarity string."""
     prompts = _get_prompts()
     return prompts.get("visual_clarity_string", "Face illuminated by soft volumetric light")
+
+
+def assemble_prefix_prompt(template: str, constants: dict, variables: dict, labels: dict = None) -> str:
+    """
+    Ghep prompt sao cho phan hang cua project la PREFIX giong het tung byte
+    qua moi lan goi (DeepSeek prefix cache / Ollama KV cache dung lai duoc).
+
+    - constants: placeholder khong doi trong ca project (global style,
+      character/location locks, story...) → format thang vao template
+    - variables: placeholder thay doi moi batch (SRT, scenes...) → trong template
+      thay bang chi dan co dinh, noi dung that noi vao CUOI prompt theo thu tu
+
+    Args:
+        template: Template tu prompts.yaml (co {placeholder}, {{ }} escape)
+        constants: {placeholder: value} hang cua project
+        variables: {placeholder: value} thay doi moi lan goi
+        labels: {placeholder: tieu de} cho phan noi cuoi (mac dinh: placeholder viet hoa).
+                Cac placeholder cung tieu de (alias) chi noi 1 lan.
+    """
+    labels = labels or {}
+    titles = {key: labels.get(key, key.upper()) for key in variables}
+    pointers = {key: f"(Xem phan {title} o cuoi prompt)" for key, title in titles.items()}
+    prefix = template.format(**constants, **pointers).rstrip()
+
+    sections = {}
+    for key, value in variables.items():
+        sections.setdefault(titles[key], value)
+    suffix = "\n\n".join(f"## {title}:\n{value}" for title, value in sections.items())
+    return f"{prefix}\n\n{suffix}\n"
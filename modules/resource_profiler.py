@@ -0,0 +1,328 @@
+"""
+VE3 Tool - Resource Profiler
+============================
+Đo memory/CPU theo từng stage của pipeline để tìm chỗ leak/phình RAM
+khi chạy batch dài (run_batch_parallel qua đêm).
+
+Tính năng:
+- RSS trước/sau mỗi stage (psutil nếu có, fallback /proc hoặc Win32 API)
+- CPU time (user+sys) và wall time mỗi stage
+- tracemalloc (tuỳ chọn): peak mỗi stage + top allocation sites,
+  so sánh với snapshot trước để thấy chỗ tăng
+- Report JSON cho mỗi voice: PROJECTS/<name>/logs/resources_<name>.json
+
+Bật trong config/settings.yaml:
+    resource_profiling: true
+    resource_profiling_tracemalloc: true   # chậm hơn, chỉ bật khi debug
+
+Lưu ý: RSS và tracemalloc là số liệu của CẢ process. Khi chạy nhiều voice
+song song, delta của một stage bao gồm cả allocation của các voice khác.
+
+Usage:
+    profiler = ResourceProfiler(enabled=True, label="voice1")
+    with profiler.stage("make_srt"):
+        engine.make_srt(...)
+    profiler.take_snapshot("after_images")   # on demand
+    profiler.dump(Path("logs/resources_voice1.json"))
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+# psutil là optional - fallback đọc RSS trực tiếp từ OS
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    psutil = None
+    PSUTIL_AVAILABLE = False
+
+
+# tracemalloc là global cho cả process - đếm số profiler đang dùng
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+def get_rss_bytes() -> Optional[int]:
+    """
+    RSS hiện tại của process (bytes).
+
+    Returns:
+        RSS hoặc None nếu không đo được trên OS này
+    """
+    if PSUTIL_AVAILABLE:
+        try:
+            return psutil.Process().memory_info().rss
+        except Exception:
+            pass
+
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/statm", "r") as f:
+                pages = int(f.read().split()[1])
+            return pages * os.sysconf("SC_PAGE_SIZE")
+        except Exception:
+            return None
+
+    if sys.platform == "win32":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [
+                    ("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(
+                handle, ctypes.byref(counters), counters.cb
+            ):
+                return counters.WorkingSetSize
+        except Exception:
+            return None
+
+    return None
+
+
+def _mb(value: Optional[int]) -> Optional[float]:
+    return round(value / (1024 * 1024), 2) if value is not None else None
+
+
+class ResourceProfiler:
+    """
+    Đo tài nguyên theo stage. Khi enabled=False mọi method là no-op
+    để có thể gọi thẳng trong pipeline không cần if.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        label: str = "",
+        use_tracemalloc: bool = False,
+        top_n: int = 15,
+        trace_frames: int = 5
+    ):
+        """
+        Args:
+            enabled: Bật đo
+            label: Tên voice/project (ghi vào report)
+            use_tracemalloc: Bật tracemalloc để lấy allocation sites
+            top_n: Số allocation sites ghi vào mỗi snapshot
+            trace_frames: Số frame traceback tracemalloc lưu
+        """
+        self.enabled = enabled
+        self.label = label
+        self.use_tracemalloc = enabled and use_tracemalloc
+        self.top_n = top_n
+        self.trace_frames = trace_frames
+
+        self.stages: List[Dict[str, Any]] = []
+        self.snapshots: List[Dict[str, Any]] = []
+        self._last_snapshot = None
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._start_rss = get_rss_bytes() if enabled else None
+        self._tracing = False
+
+        if self.use_tracemalloc:
+            self._start_tracemalloc()
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any], label: str = "") -> "ResourceProfiler":
+        """Tạo profiler từ dict settings.yaml."""
+        return cls(
+            enabled=bool(settings.get("resource_profiling", False)),
+            label=label,
+            use_tracemalloc=bool(settings.get("resource_profiling_tracemalloc", False)),
+            top_n=int(settings.get("resource_profiling_top", 15)),
+        )
+
+    def _start_tracemalloc(self):
+        global _tracemalloc_users
+        with _tracemalloc_lock:
+            if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(self.trace_frames)
+            _tracemalloc_users += 1
+        self._tracing = True
+
+    def _stop_tracemalloc(self):
+        global _tracemalloc_users
+        if not self._tracing:
+            return
+        with _tracemalloc_lock:
+            _tracemalloc_users -= 1
+            if _tracemalloc_users == 0 and tracemalloc.is_tracing():
+                tracemalloc.stop()
+        self._tracing = False
+
+    # =========================================================================
+    # STAGES
+    # =========================================================================
+
+    @contextmanager
+    def stage(self, name: str):
+        """Đo RSS/CPU/wall time (và tracemalloc peak) cho một stage."""
+        if not self.enabled:
+            yield
+            return
+
+        rss_before = get_rss_bytes()
+        cpu_before = time.process_time()
+        wall_before = time.time()
+        traced_before = None
+        if self._tracing:
+            traced_before = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, "reset_peak"):  # Python 3.9+
+                tracemalloc.reset_peak()
+
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            rss_after = get_rss_bytes()
+            record = {
+                "stage": name,
+                "started": datetime.fromtimestamp(wall_before).strftime("%H:%M:%S"),
+                "wall_s": round(time.time() - wall_before, 3),
+                "cpu_s": round(time.process_time() - cpu_before, 3),
+                "rss_before_mb": _mb(rss_before),
+                "rss_after_mb": _mb(rss_after),
+                "rss_delta_mb": _mb(rss_after - rss_before)
+                if rss_before is not None and rss_after is not None else None,
+            }
+            if traced_before is not None:
+                current, peak = tracemalloc.get_traced_memory()
+                record["traced_delta_mb"] = _mb(current - traced_before)
+                record["traced_peak_mb"] = _mb(peak)
+            if error:
+                record["error"] = error
+
+            with self._lock:
+                self.stages.append(record)
+
+            if self._tracing:
+                self.take_snapshot(f"after:{name}")
+
+    # =========================================================================
+    # TRACEMALLOC SNAPSHOTS
+    # =========================================================================
+
+    def take_snapshot(self, label: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Chụp tracemalloc snapshot (on demand).
+
+        Ghi top allocation sites hiện tại và top chỗ TĂNG so với snapshot trước.
+
+        Returns:
+            Dict snapshot hoặc None nếu tracemalloc không bật
+        """
+        if not self._tracing or not tracemalloc.is_tracing():
+            return None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+        entry = {
+            "label": label or f"snapshot_{len(self.snapshots) + 1}",
+            "time": datetime.now().strftime("%H:%M:%S"),
+            "rss_mb": _mb(get_rss_bytes()),
+            "traced_mb": _mb(tracemalloc.get_traced_memory()[0]),
+            "top": [
+                {
+                    "site": str(stat.traceback[0]) if stat.traceback else "?",
+                    "size_mb": _mb(stat.size),
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[:self.top_n]
+            ],
+        }
+
+        with self._lock:
+            if self._last_snapshot is not None:
+                diff = snapshot.compare_to(self._last_snapshot, "lineno")
+                entry["growth"] = [
+                    {
+                        "site": str(stat.traceback[0]) if stat.traceback else "?",
+                        "size_diff_mb": _mb(stat.size_diff),
+                        "count_diff": stat.count_diff,
+                    }
+                    for stat in diff[:self.top_n] if stat.size_diff > 0
+                ]
+            self._last_snapshot = snapshot
+            self.snapshots.append(entry)
+
+        return entry
+
+    # =========================================================================
+    # REPORT
+    # =========================================================================
+
+    def report(self) -> Dict[str, Any]:
+        """Tổng hợp report (stages + snapshots)."""
+        rss_now = get_rss_bytes() if self.enabled else None
+        with self._lock:
+            stages = list(self.stages)
+            snapshots = list(self.snapshots)
+        return {
+            "label": self.label,
+            "pid": os.getpid(),
+            "started": datetime.fromtimestamp(self._started_at).isoformat(timespec="seconds"),
+            "duration_s": round(time.time() - self._started_at, 1),
+            "rss_start_mb": _mb(self._start_rss),
+            "rss_end_mb": _mb(rss_now),
+            "tracemalloc": self._tracing,
+            "stages": stages,
+            "snapshots": snapshots,
+        }
+
+    def dump(self, path: Path) -> Optional[Path]:
+        """
+        Ghi report JSON và dừng tracemalloc (nếu profiler này đã bật).
+
+        Returns:
+            Path file report hoặc None nếu profiler tắt
+        """
+        if not self.enabled:
+            return None
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        self._stop_tracemalloc()
+        return path
+
+    def summary_lines(self) -> List[str]:
+        """Các dòng tóm tắt ngắn để log ra GUI."""
+        lines = []
+        for s in self.stages:
+            delta = s.get("rss_delta_mb")
+            delta_str = f"{delta:+.1f}MB" if delta is not None else "n/a"
+            lines.append(
+                f"{s['stage']}: {s['wall_s']:.1f}s wall, {s['cpu_s']:.1f}s cpu, RSS {delta_str}"
+            )
+        return lines
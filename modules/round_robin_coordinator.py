@@ -13,6 +13,15 @@ Quản lý nhiều "voice" (folder) chạy xếp hàng luân phiên:
 2. Tự động giãn cách API - không cần thêm delay thủ công
 3. Proxy rõ ràng - mỗi Chrome có proxy riêng, không nhầm lẫn
 4. Đơn giản hóa - không có race condition, không focus sai Chrome
+
+Lập lịch (weighted fair queuing, start-time fair queuing):
+- Mỗi lúc chỉ 1 voice giữ lượt (giữ nguyên giãn cách API như round-robin)
+- Voice có virtual_time; chọn voice đang chờ có (priority, deadline, virtual_time)
+  nhỏ nhất. Xong task: virtual_time += thời gian xử lý / weight
+- Priority: ảnh tham chiếu (nv*/loc*) trước scenes
+- Deadline hint: voice sắp trễ deadline (ước lượng theo thời gian TB mỗi task)
+  được ưu tiên theo Earliest-Deadline-First
+- Voice chờ lượt block trên Condition (0% CPU), chuyển lượt bằng notify_all
 """
 
 import threading
@@ -22,6 +31,26 @@ from pathlib import Path
 from typing import Dict, List, Optional, Callable, Any
 from dataclasses import dataclass, field
 
+from modules.metrics import observe
+
+
+# Hệ số EWMA cho thời gian xử lý trung bình mỗi task (ước lượng deadline)
+SERVICE_EWMA_ALPHA = 0.3
+
+# Priority mặc định: số nhỏ được phục vụ trước
+PRIORITY_REFERENCE = 0  # nvc, nv*, loc*
+PRIORITY_SCENE = 1
+
+
+def task_priority(prompt_data: Dict[str, Any]) -> int:
+    """Priority của prompt: 'priority' nếu có, nếu không ảnh tham chiếu trước scenes."""
+    if prompt_data.get('priority') is not None:
+        return int(prompt_data['priority'])
+    pid = str(prompt_data.get('id', '')).lower()
+    if pid.startswith('nv') or pid.startswith('loc'):
+        return PRIORITY_REFERENCE
+    return PRIORITY_SCENE
+
 
 @dataclass
 class VoiceTask:
@@ -49,6 +78,17 @@ class VoiceState:
     chrome_ready: bool = False
     last_error: Optional[str] = None
     failed_tasks: List[Any] = field(default_factory=list)  # Tasks cần retry
+    # Weighted fair queuing
+    weight: float = 1.0  # Voice weight 2.0 nhận ~gấp đôi thời gian xử lý
+    deadline: Optional[float] = None  # Epoch seconds (hint), None = không có
+    virtual_time: float = 0.0  # Tổng thời gian đã phục vụ / weight
+    avg_service: Optional[float] = None  # EWMA thời gian xử lý 1 task (giây)
+    turns: int = 0  # Số lượt đã nhận
+
+    def next_priority(self) -> int:
+        if self.current_index < len(self.prompts):
+            return task_priority(self.prompts[self.current_index])
+        return PRIORITY_SCENE
 
 
 class RoundRobinCoordinator:
@@ -82,10 +122,15 @@ class RoundRobinCoordinator:
         # Voice states
         self.voices: Dict[int, VoiceState] = {}
 
-        # Turn management
-        self._current_turn = 0
+        # Turn management: 1 voice giữ lượt tại một thời điểm
+        self._current_turn = 0  # Tổng số lượt đã cấp
         self._turn_lock = threading.Lock()
-        self._turn_event = threading.Event()
+        self._turn_cond = threading.Condition(self._turn_lock)
+        self._turn_holder: Optional[int] = None
+        self._turn_started = 0.0
+        self._turn_released = 0.0
+        self._virtual_clock = 0.0  # Virtual start time của lượt gần nhất
+        self._waiting: Dict[int, float] = {}  # voice_id -> thời điểm bắt đầu chờ
 
         # Completion tracking
         self._all_done = False
@@ -104,7 +149,9 @@ class RoundRobinCoordinator:
         voice_id: int,
         folder_path: Path,
         prompts: List[Dict],
-        excel_path: Optional[Path] = None
+        excel_path: Optional[Path] = None,
+        weight: float = 1.0,
+        deadline_s: Optional[float] = None
     ) -> bool:
         """
         Thêm một voice vào coordinator.
@@ -114,6 +161,8 @@ class RoundRobinCoordinator:
             folder_path: Đường dẫn folder project
             prompts: Danh sách prompts cần xử lý
             excel_path: Đường dẫn Excel file (optional)
+            weight: Tỉ trọng thời gian xử lý so với voice khác (> 0)
+            deadline_s: Hint - muốn xong sau bao nhiêu giây kể từ bây giờ
 
         Returns:
             True nếu thành công
@@ -122,14 +171,20 @@ class RoundRobinCoordinator:
             self._log(f"Voice {voice_id} vượt quá giới hạn ({self.num_voices})", "ERROR")
             return False
 
-        self.voices[voice_id] = VoiceState(
-            voice_id=voice_id,
-            folder_path=Path(folder_path),
-            excel_path=Path(excel_path) if excel_path else None,
-            prompts=prompts,
-            current_index=0,
-            is_done=len(prompts) == 0
-        )
+        with self._turn_cond:
+            self.voices[voice_id] = VoiceState(
+                voice_id=voice_id,
+                folder_path=Path(folder_path),
+                excel_path=Path(excel_path) if excel_path else None,
+                prompts=prompts,
+                current_index=0,
+                is_done=len(prompts) == 0,
+                weight=max(float(weight), 1e-3),
+                deadline=time.time() + deadline_s if deadline_s else None,
+                # Voice mới không được "nợ" lượt của quá khứ
+                virtual_time=self._virtual_clock
+            )
+            self._turn_cond.notify_all()
 
         self._log(f"Voice {voice_id}: Added {len(prompts)} prompts from {folder_path.name}")
         return True
@@ -162,7 +217,7 @@ class RoundRobinCoordinator:
         # Lấy prompt tiếp theo
         if voice.current_index >= len(voice.prompts):
             voice.is_done = True
-            self._advance_turn()
+            self._advance_turn(voice_id)
             return None
 
         prompt_data = voice.prompts[voice.current_index]
@@ -228,7 +283,7 @@ class RoundRobinCoordinator:
             self._log(f"Voice {voice_id}: DONE! Success={voice.success_count}, Failed={voice.failed_count}, Pending retries={pending_retries}")
 
         # Chuyển lượt cho voice tiếp theo
-        self._advance_turn()
+        self._advance_turn(voice_id)
 
     def add_to_retry_queue(self, voice_id: int, task: VoiceTask):
         """Thêm task vào retry queue."""
@@ -264,41 +319,109 @@ class RoundRobinCoordinator:
 
         if voice.current_index >= len(voice.prompts):
             voice.is_done = True
+            # Hết task khi đang giữ lượt → trả lượt
+            self._advance_turn(voice_id)
 
         # Không chuyển lượt khi skip - voice tiếp tục ngay
 
     def _wait_for_turn(self, voice_id: int):
-        """Đợi đến lượt của voice."""
-        while not self._stop_flag:
-            with self._turn_lock:
-                # Tìm voice tiếp theo chưa done
-                active_voices = [vid for vid, v in self.voices.items() if not v.is_done]
+        """
+        Đợi đến lượt của voice (block trên Condition, không polling).
 
-                if not active_voices:
-                    self._all_done = True
-                    return
+        Voice đang giữ lượt (vd: sau skip_task) nhận lại ngay.
+        """
+        with self._turn_cond:
+            if self._turn_holder == voice_id:
+                return
 
-                # Xác định voice hiện tại (round-robin)
-                current_voice = active_voices[self._current_turn % len(active_voices)]
+            wait_start = time.time()
+            granted = False
+            self._waiting[voice_id] = wait_start
+            try:
+                while not self._stop_flag:
+                    if not any(not v.is_done for v in self.voices.values()):
+                        self._all_done = True
+                        return
+
+                    if self._turn_holder is None and self._pick_next_locked() == voice_id:
+                        self._grant_locked(voice_id)
+                        granted = True
+                        break
 
-                if current_voice == voice_id:
-                    return  # Đến lượt của voice này
+                    self._turn_cond.wait()
+            finally:
+                self._waiting.pop(voice_id, None)
 
-            # Chưa đến lượt, đợi
-            time.sleep(0.1)
+        if granted:
+            observe("rr_turn_wait_seconds", time.time() - wait_start)
 
-    def _advance_turn(self):
-        """Chuyển sang lượt tiếp theo."""
-        with self._turn_lock:
-            self._current_turn += 1
+    def _schedule_key(self, voice: VoiceState, now: float):
+        """
+        Key sắp xếp (nhỏ = được phục vụ trước):
+        (priority, không gấp, deadline nếu gấp, virtual start time, voice_id)
+        """
+        urgent = False
+        if voice.deadline is not None:
+            remaining = len(voice.prompts) - voice.current_index
+            per_task = voice.avg_service if voice.avg_service is not None else self._mean_service()
+            urgent = voice.deadline - now <= remaining * per_task
+        virtual_start = max(voice.virtual_time, self._virtual_clock)
+        return (
+            voice.next_priority(),
+            0 if urgent else 1,
+            voice.deadline if urgent else 0.0,
+            virtual_start,
+            voice.voice_id,
+        )
+
+    def _mean_service(self) -> float:
+        samples = [v.avg_service for v in self.voices.values() if v.avg_service is not None]
+        return sum(samples) / len(samples) if samples else 1.0
+
+    def _pick_next_locked(self) -> Optional[int]:
+        """Voice đang chờ được nhận lượt tiếp theo. Gọi khi đang giữ _turn_lock."""
+        candidates = [
+            v for vid, v in self.voices.items()
+            if vid in self._waiting and not v.is_done
+        ]
+        if not candidates:
+            return None
+        now = time.time()
+        return min(candidates, key=lambda v: self._schedule_key(v, now)).voice_id
+
+    def _grant_locked(self, voice_id: int):
+        voice = self.voices[voice_id]
+        self._turn_holder = voice_id
+        self._turn_started = time.time()
+        self._virtual_clock = max(voice.virtual_time, self._virtual_clock)
+        voice.virtual_time = self._virtual_clock
+        voice.turns += 1
+        self._current_turn += 1
+        if self._turn_released:
+            observe("rr_handoff_seconds", self._turn_started - self._turn_released)
+
+    def _advance_turn(self, voice_id: Optional[int] = None):
+        """Trả lượt: cập nhật virtual time của voice vừa xong và đánh thức voice chờ."""
+        with self._turn_cond:
+            holder = self._turn_holder if voice_id is None else voice_id
+            if holder is not None and holder == self._turn_holder:
+                now = time.time()
+                service = now - self._turn_started
+                voice = self.voices.get(holder)
+                if voice is not None:
+                    voice.virtual_time += service / voice.weight
+                    if voice.avg_service is None:
+                        voice.avg_service = service
+                    else:
+                        voice.avg_service += SERVICE_EWMA_ALPHA * (service - voice.avg_service)
+                self._turn_holder = None
+                self._turn_released = now
 
             # Kiểm tra tất cả đã done chưa
-            active_voices = [vid for vid, v in self.voices.items() if not v.is_done]
-            if not active_voices:
+            if not any(not v.is_done for v in self.voices.values()):
                 self._all_done = True
 
-            self._turn_event.set()
-            self._turn_event.clear()
+            self._turn_cond.notify_all()
 
     def is_all_done(self) -> bool:
         """Kiểm tra tất cả voice đã hoàn thành chưa."""
@@ -306,8 +429,9 @@ class RoundRobinCoordinator:
 
     def stop(self):
         """Dừng coordinator."""
-        self._stop_flag = True
-        self._turn_event.set()
+        with self._turn_cond:
+            self._stop_flag = True
+            self._turn_cond.notify_all()
 
     def get_stats(self) -> Dict[str, Any]:
         """Lấy thống kê."""
@@ -322,6 +446,7 @@ class RoundRobinCoordinator:
             "success": total_success,
             "failed": total_failed,
             "skipped": total_skipped,
+            "turns": self._current_turn,
             "voices": {
                 vid: {
                     "folder": str(v.folder_path.name),
@@ -330,7 +455,10 @@ class RoundRobinCoordinator:
                     "success": v.success_count,
                     "failed": v.failed_count,
                     "skipped": v.skipped_count,
-                    "is_done": v.is_done
+                    "is_done": v.is_done,
+                    "weight": v.weight,
+                    "turns": v.turns,
+                    "avg_service_s": round(v.avg_service, 3) if v.avg_service is not None else None
                 }
                 for vid, v in self.voices.items()
             }
@@ -450,7 +578,9 @@ def run_round_robin(
     process_callback: Callable[[int, VoiceTask], bool],
     setup_callback: Optional[Callable[[int], bool]] = None,
     num_workers: int = 2,
-    log_callback: Optional[Callable] = None
+    log_callback: Optional[Callable] = None,
+    weights: Optional[Dict[int, float]] = None,
+    deadlines: Optional[Dict[int, float]] = None
 ) -> Dict[str, Any]:
     """
     Convenience function để chạy Round-Robin processing.
@@ -462,6 +592,8 @@ def run_round_robin(
         setup_callback: Callback setup Chrome
         num_workers: Số workers
         log_callback: Log callback
+        weights: Dict folder_index -> weight (mặc định 1.0)
+        deadlines: Dict folder_index -> deadline hint (giây kể từ lúc bắt đầu)
 
     Returns:
         Stats dict
@@ -474,7 +606,11 @@ def run_round_robin(
     # Add voices
     for i, folder in enumerate(folders[:num_workers]):
         prompts = prompts_per_folder.get(i, [])
-        coordinator.add_voice(i, folder, prompts)
+        coordinator.add_voice(
+            i, folder, prompts,
+            weight=(weights or {}).get(i, 1.0),
+            deadline_s=(deadlines or {}).get(i)
+        )
 
     # Start worker threads
     threads = []
@@ -0,0 +1,421 @@
+"""
+VE3 Tool - Scene Prompt Semantic Cache
+======================================
+Cache local (không gọi mạng) các kết quả img_prompt/video_prompt đã tạo, tra
+theo độ giống lời dẫn (TF-IDF + cosine) để scene gần trùng - trong cùng
+project (câu lặp lại) hay giữa các project (truyện cùng thể loại) - dùng lại
+prompt cũ thay vì gọi LLM.
+
+- Vector TF-IDF thuần Python trên từ + bigram của lời dẫn, kèm feature
+  scene_type / vai nhân vật / tên bối cảnh; inverted index → chỉ so với
+  entry có chung token
+- Prompt lưu dạng template: character_lock của nhân vật thứ i trong scene
+  → ⟦C1⟧, ⟦C2⟧..., location_lock → ⟦L⟧, global_style → ⟦S⟧, bỏ annotation
+  (x.png). Dùng lại = thay lock + style của project hiện tại (chỉ khi cùng số
+  nhân vật + cùng có/không bối cảnh + cùng context_lock). Prompt mà lock/style
+  bị AI viết lại (không thay được) không được lưu
+- Ngưỡng similarity + thống kê hit/miss mỗi run (log + metrics)
+- Lưu JSONL append-only, giữ tối đa max_entries entry mới nhất
+
+Usage:
+    from modules.scene_prompt_cache import SceneKey, get_scene_prompt_cache
+
+    cache = get_scene_prompt_cache(path, threshold=0.82)
+    key = SceneKey(text, scene_type, characters=[(id, lock, role)], location=(id, lock, name),
+                   style=global_style, context=context_lock)
+    hit = cache.lookup(key)            # dict prompts hoặc None
+    cache.add(key, img_prompt, video_prompt)
+"""
+
+import re
+import json
+import math
+import time
+import threading
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from modules.utils import get_logger
+from modules.metrics import inc
+
+
+# Vị trí mặc định: <tool>/cache/scene_prompts.jsonl
+DEFAULT_CACHE_PATH = Path(__file__).parent.parent / "cache" / "scene_prompts.jsonl"
+
+# Placeholder trong template (ký tự hiếm → không đụng với text prompt)
+CHAR_SLOT = "⟦C{}⟧"
+LOC_SLOT = "⟦L⟧"
+STYLE_SLOT = "⟦S⟧"
+SLOT_RE = re.compile(r"⟦(C\d+|L|S)⟧")
+
+WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+ANNOTATION_RE = re.compile(r"\s*\([\w\-]+\.(?:png|jpg|jpeg)\)", re.IGNORECASE)
+# ID nhân vật / bối cảnh còn sót trong prompt → prompt gắn với project cũ
+ID_RE = re.compile(r"\b(?:nvc?\d*(?:_\w+)?|loc_\w+)\b")
+
+STOPWORDS = frozenset(
+    "a an the and or but of to in on at for with from by as is was were be been are am "
+    "it its this that these those i me my we our you your he him his she her they them their "
+    "so then than there here not no do did does had has have will would could should just "
+    "và là của có không những các một được cho với trong này đó thì mà như khi đã đang sẽ "
+    "tôi ta mình nó họ anh chị em ông bà".split()
+)
+
+# Rebuild IDF + norm khi số entry tăng thêm bấy nhiêu phần kể từ lần build trước
+REBUILD_GROWTH = 0.25
+
+
+@dataclass
+class SceneKey:
+    """
+    Những gì xác định prompt của 1 scene: lời dẫn + nhân vật + bối cảnh + style.
+
+    characters: [(id, character_lock, role)] theo thứ tự trong scene
+    location: (id, location_lock, name) hoặc None
+    style: global_style của project (img_prompt kết thúc bằng chuỗi này)
+    context: context_lock (thời đại/bối cảnh truyện - AI đưa vào prompt tự do,
+        không templatize được → phải trùng mới dùng lại)
+    """
+    text: str
+    scene_type: str = ""
+    characters: List[Tuple[str, str, str]] = field(default_factory=list)
+    location: Optional[Tuple[str, str, str]] = None
+    style: str = ""
+    context: str = ""
+
+    @property
+    def shape(self) -> Tuple[int, bool, str]:
+        """(số nhân vật, có bối cảnh, context) - chỉ dùng lại entry cùng shape."""
+        return (len(self.characters), self.location is not None, _normalize(self.context))
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").split()).lower()
+
+
+def _words(text: str) -> List[str]:
+    return [w for w in WORD_RE.findall((text or "").lower()) if len(w) > 1 and w not in STOPWORDS]
+
+
+def scene_features(key: SceneKey) -> Dict[str, int]:
+    """Token (tf) của scene: từ + bigram lời dẫn, scene_type, vai, tên bối cảnh."""
+    words = _words(key.text)
+    tokens = words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+    if key.scene_type:
+        tokens.append(f"#type:{key.scene_type.lower()}")
+    for _, _, role in key.characters:
+        tokens.extend(f"#role:{w}" for w in _words(role))
+    if key.location:
+        tokens.extend(f"#loc:{w}" for w in _words(key.location[2]))
+    counts: Dict[str, int] = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+def make_template(prompt: str, key: SceneKey, project_names: List[str] = (),
+                  require_style: bool = True) -> Optional[str]:
+    """
+    Prompt → template (lock/style → placeholder). None nếu prompt còn chi tiết
+    riêng của project (lock bị viết lại, thiếu global_style, ID hay tên nhân
+    vật còn sót).
+
+    require_style=False: style chỉ thay nếu có (video_prompt không bắt buộc
+    kết thúc bằng global_style).
+    """
+    text = ANNOTATION_RE.sub("", prompt or "").strip()
+    if not text:
+        return None
+    if key.style and key.style in text:
+        text = text.replace(key.style, STYLE_SLOT)
+    elif require_style:
+        return None
+    # Lock dài thay trước (lock này có thể chứa lock khác)
+    slots = [(CHAR_SLOT.format(i + 1), lock) for i, (_, lock, _) in enumerate(key.characters)]
+    if key.location:
+        slots.append((LOC_SLOT, key.location[1]))
+    for slot, lock in sorted(slots, key=lambda s: -len(s[1] or "")):
+        if not lock or lock not in text:
+            return None
+        text = text.replace(lock, slot)
+    if ID_RE.search(text):
+        return None
+    for name in project_names:
+        if name and len(name) >= 3 and re.search(rf"\b{re.escape(name)}\b", text):
+            return None
+    return " ".join(text.split())
+
+
+def fill_template(template: str, key: SceneKey) -> str:
+    """Thay placeholder bằng lock + style của scene hiện tại."""
+    def repl(match: re.Match) -> str:
+        slot = match.group(1)
+        if slot == "S":
+            return key.style
+        if slot == "L":
+            return key.location[1] if key.location else ""
+        idx = int(slot[1:]) - 1
+        return key.characters[idx][1] if idx < len(key.characters) else ""
+    return SLOT_RE.sub(repl, template)
+
+
+class ScenePromptCache:
+    """
+    Index TF-IDF các scene đã có prompt → tra scene gần trùng.
+
+    Thread-safe (batch scene prompts chạy song song).
+    """
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, threshold: float = 0.82,
+                 max_entries: int = 20000):
+        """
+        Args:
+            path: File JSONL lưu entries (None = chỉ trong bộ nhớ)
+            threshold: Cosine tối thiểu để dùng lại (0-1)
+            max_entries: Số entry giữ lại (cũ nhất bị bỏ)
+        """
+        self.path = Path(path) if path else None
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.logger = get_logger("scene_prompt_cache")
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}  # token → {entry_id: tf}
+        self._next_id = 0
+        self._idf: Dict[str, float] = {}
+        self._norms: Dict[int, float] = {}
+        self._built_n = 0
+        self._file_lines = 0
+        self._load()
+        self.reset_run()
+
+    def reset_run(self) -> None:
+        """Bắt đầu run mới (hit/miss tính lại từ 0)."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.added = 0
+
+    # =========================================================================
+    # INDEX
+    # =========================================================================
+
+    def _index(self, record: Dict[str, Any]) -> None:
+        """Thêm 1 record vào index (gọi khi đang giữ lock hoặc lúc load)."""
+        key = SceneKey(record["text"], record.get("scene_type", ""),
+                       [("", "", role) for role in record.get("roles", [])],
+                       ("", "", record.get("location_name", "")) if record.get("has_location") else None,
+                       context=record.get("context", ""))
+        entry_id = self._next_id
+        self._next_id += 1
+        record["_tf"] = scene_features(key)
+        record["_shape"] = key.shape
+        self._entries[entry_id] = record
+        for token, tf in record["_tf"].items():
+            self._postings.setdefault(token, {})[entry_id] = tf
+        # Giới hạn số entry: bỏ entry cũ nhất
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            for token in self._entries.pop(oldest)["_tf"]:
+                posting = self._postings.get(token)
+                if posting is not None:
+                    posting.pop(oldest, None)
+                    if not posting:
+                        del self._postings[token]
+            self._norms.pop(oldest, None)
+
+    def _rebuild(self) -> None:
+        """Tính lại IDF + norm mọi entry khi index tăng đáng kể."""
+        n = len(self._entries)
+        self._idf = {token: math.log((n + 1) / (len(posting) + 1)) + 1.0
+                     for token, posting in self._postings.items()}
+        self._norms = {entry_id: self._norm(entry["_tf"]) for entry_id, entry in self._entries.items()}
+        self._built_n = n
+
+    def _weight(self, token: str, tf: int) -> float:
+        # Token mới chưa có trong IDF (sau lần build) → coi như hiếm nhất
+        idf = self._idf.get(token)
+        if idf is None:
+            idf = math.log(len(self._entries) + 1) + 1.0
+        return (1.0 + math.log(tf)) * idf
+
+    def _norm(self, tf: Dict[str, int]) -> float:
+        return math.sqrt(sum(self._weight(t, c) ** 2 for t, c in tf.items())) or 1.0
+
+    # =========================================================================
+    # LOOKUP / ADD
+    # =========================================================================
+
+    def best_match(self, key: SceneKey) -> Tuple[Optional[Dict[str, Any]], float]:
+        """Entry cùng shape giống nhất + cosine (không áp ngưỡng)."""
+        query = scene_features(key)
+        shape = key.shape
+        with self._lock:
+            if not self._entries or not query:
+                return None, 0.0
+            if len(self._entries) > self._built_n * (1 + REBUILD_GROWTH):
+                self._rebuild()
+            weights = {t: self._weight(t, c) for t, c in query.items()}
+            q_norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            dots: Dict[int, float] = {}
+            for token, q_weight in weights.items():
+                for entry_id, tf in self._postings.get(token, {}).items():
+                    if self._entries[entry_id]["_shape"] != shape:
+                        continue
+                    dots[entry_id] = dots.get(entry_id, 0.0) + q_weight * self._weight(token, tf)
+            if not dots:
+                return None, 0.0
+            best_score, best_id = 0.0, None
+            for entry_id, dot in dots.items():
+                norm = self._norms.get(entry_id)
+                if norm is None:
+                    norm = self._norms[entry_id] = self._norm(self._entries[entry_id]["_tf"])
+                score = dot / (q_norm * norm)
+                if score > best_score:
+                    best_score, best_id = score, entry_id
+            return self._entries[best_id], min(best_score, 1.0)
+
+    def lookup(self, key: SceneKey) -> Optional[Dict[str, Any]]:
+        """
+        Prompts dùng lại cho scene (img_prompt, video_prompt, characters_used,
+        location_used, reference_files, cache_score) hoặc None nếu không đủ giống.
+        """
+        entry, score = self.best_match(key)
+        hit = entry is not None and score >= self.threshold
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        inc("scene_prompt_cache", result="hit" if hit else "miss")
+        if not hit:
+            return None
+        img_prompt = fill_template(entry["img_template"], key)
+        refs = [f"{cid}.png" for cid, _, _ in key.characters]
+        if key.location:
+            refs.append(f"{key.location[0]}.png")
+        return {
+            "img_prompt": img_prompt,
+            "video_prompt": fill_template(entry.get("video_template") or entry["img_template"], key),
+            "characters_used": [cid for cid, _, _ in key.characters],
+            "location_used": key.location[0] if key.location else "",
+            "reference_files": refs,
+            "cache_score": round(score, 3),
+        }
+
+    def add(self, key: SceneKey, img_prompt: str, video_prompt: str = "",
+            project_names: List[str] = ()) -> bool:
+        """Lưu prompt của scene (False nếu prompt không templatize được)."""
+        img_template = make_template(img_prompt, key, project_names)
+        if not img_template or len(_words(key.text)) < 3:
+            return False
+        video_template = make_template(video_prompt, key, project_names, require_style=False) if video_prompt else ""
+        record = {
+            "text": key.text,
+            "scene_type": key.scene_type,
+            "roles": [role for _, _, role in key.characters],
+            "has_location": key.location is not None,
+            "location_name": key.location[2] if key.location else "",
+            "context": _normalize(key.context),
+            "img_template": img_template,
+            "video_template": video_template or "",
+            "ts": int(time.time()),
+        }
+        with self._lock:
+            self._index(record)
+            self.added += 1
+            self._append(record)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Tổng hợp run hiện tại (log / benchmark)."""
+        with self._lock:
+            looked = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "added": self.added,
+                "hit_rate": round(self.hits / looked, 3) if looked else 0.0,
+            }
+
+    # =========================================================================
+    # PERSISTENCE
+    # =========================================================================
+
+    def _load(self) -> None:
+        if not self.path or not self.path.exists():
+            return
+        records = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # Dòng ghi dở (process bị kill)
+        except OSError as e:
+            self.logger.warning(f"[Scene Cache] Không đọc được {self.path}: {e}")
+            return
+        self._file_lines = len(records)
+        for record in records[-self.max_entries:]:
+            # Template chưa có ⟦S⟧ (bản cũ) còn style của project khác → bỏ
+            if record.get("text") and STYLE_SLOT in record.get("img_template", ""):
+                self._index(record)
+        self._rebuild()
+        # File dài gấp đôi giới hạn → ghi lại chỉ phần còn giữ
+        if self._file_lines > 2 * self.max_entries:
+            self._compact()
+
+    def _public(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in record.items() if not k.startswith("_")}
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        if not self.path:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self._public(record), ensure_ascii=False) + "\n")
+            self._file_lines += 1
+        except OSError as e:
+            self.logger.warning(f"[Scene Cache] Không ghi được {self.path}: {e}")
+
+    def _compact(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for record in self._entries.values():
+                    f.write(json.dumps(self._public(record), ensure_ascii=False) + "\n")
+            tmp.replace(self.path)
+            self._file_lines = len(self._entries)
+        except OSError as e:
+            self.logger.warning(f"[Scene Cache] Không compact được {self.path}: {e}")
+
+
+# ============================================================================
+# REGISTRY
+# ============================================================================
+
+_caches: Dict[str, ScenePromptCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_scene_prompt_cache(path: Optional[Path] = None, **config) -> ScenePromptCache:
+    """
+    Cache dùng chung theo file cho cả process (nhiều PromptGenerator / batch
+    song song cùng đọc-ghi 1 index). config (threshold, max_entries) chỉ áp
+    dụng khi tạo lần đầu.
+    """
+    path = Path(path) if path else DEFAULT_CACHE_PATH
+    key = str(path.resolve())
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(key)
+            if cache is None:
+                config = {k: v for k, v in config.items() if v is not None}
+                cache = ScenePromptCache(path, **config)
+                _caches[key] = cache
+    return cache
@@ -21,12 +21,22 @@ import threading
 from pathlib import Path
 from typing import List, Dict, Optional, Callable, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import datetime
 
 # Ken Burns effects for static images
 from .ken_burns import KenBurnsGenerator, KenBurnsEffect, KenBurnsIntensity, get_ken_burns_filter
 
+# Memory/CPU profiling per stage (toggle qua settings.yaml)
+from .resource_profiler import ResourceProfiler
+
+# Per-stage timing / counters (JSONL mỗi run + Prometheus tuỳ chọn)
+from .metrics import get_metrics, span, timed, inc
+
+# ffprobe metadata cache theo project + ffmpeg capabilities theo máy
+from .media_probe import MediaProbe, get_ffmpeg_capabilities
+
 
 # ============================================================================
 # GLOBAL TOKEN EXTRACTION LOCK
@@ -173,6 +183,11 @@ class SmartEngine:
         self._prompts_gen_error = None
         self._expected_scene_count = 0  # Tổng số scenes cần tạo (từ callback)
 
+        # Offline prompt mode: LLM refine prompts chạy nền trong lúc tạo ảnh
+        self._prompt_refine_thread = None
+        self._prompt_refine_report = None
+        self._prompt_refine_gen = None
+
         # Browser generator - reuse cho ca characters va scenes
         self._browser_generator = None
 
@@ -191,6 +206,22 @@ class SmartEngine:
         # Log verbosity: set from settings.yaml (verbose_log: true/false)
         self.verbose_log = False
 
+        # Resource profiling (RSS/CPU/tracemalloc mỗi stage): settings.yaml resource_profiling*
+        self.profiling_settings = {}
+        self.profiler = ResourceProfiler()
+
+        # Metrics (span/counter): settings.yaml metrics_enabled, metrics_prometheus_port
+        self.metrics_enabled = True
+        self.metrics_prometheus_port = 0
+
+        # Draft preview 480p sau bước ảnh: settings.yaml video_draft_preview
+        self.draft_preview = False
+
+        # Voice → SRT: settings.yaml whisper_* (model, language, backend, compute_type...)
+        # + forced_align* (căn kịch bản có sẵn vào voice thay vì nhận dạng)
+        self.whisper_settings = {}
+        self._forced_aligner = None
+
         self.load_config()
         self.load_cached_tokens()  # Load tokens da luu
         self.load_media_name_cache()  # Load media_name cache
@@ -226,6 +257,15 @@ class SmartEngine:
                 with open(settings_path, 'r', encoding='utf-8') as f:
                     settings = yaml.safe_load(f) or {}
                 self.verbose_log = settings.get('verbose_log', False)
+                self.profiling_settings = {
+                    k: v for k, v in settings.items() if k.startswith('resource_profiling')
+                }
+                self.metrics_enabled = settings.get('metrics_enabled', True)
+                self.metrics_prometheus_port = int(settings.get('metrics_prometheus_port', 0) or 0)
+                self.draft_preview = bool(settings.get('video_draft_preview', False))
+                self.whisper_settings = {
+                    k: v for k, v in settings.items() if k.startswith(('whisper_', 'forced_align'))
+                }
             except:
                 pass
 
@@ -842,24 +882,79 @@ class SmartEngine:
 
     # ========== SRT PROCESSING ==========
 
-    def make_srt(self, voice_path: Path, srt_path: Path) -> bool:
-        """Tao SRT tu voice."""
+    def make_srt(self, voice_path: Path, srt_path: Path, source_voice: Optional[Path] = None) -> bool:
+        """
+        Tao SRT tu voice.
+
+        Co file kich ban canh voice goc (<ten>.txt, <ten>_script.txt) → forced
+        alignment kich ban vao voice; do tin cay thap / chua cai torchaudio → Whisper.
+        """
         if srt_path.exists():
             self.log(f"SRT da ton tai: {srt_path.name}")
             return True
 
+        if self._align_script_srt(voice_path, srt_path, source_voice):
+            return True
+
         self.log("Transcribe voice -> SRT...")
 
         try:
             from modules.voice_to_srt import VoiceToSrt
-            conv = VoiceToSrt(model_name="base", language="vi")
-            conv.transcribe(voice_path, srt_path)
-            self.log(f"OK: {srt_path.name}", "OK")
+            ws = self.whisper_settings
+            conv = VoiceToSrt(
+                model_name=ws.get('whisper_model', 'base'),
+                language=ws.get('whisper_language', 'vi') or None,
+                backend=ws.get('whisper_backend', 'auto'),
+                compute_type=ws.get('whisper_compute_type', 'int8'),
+                cpu_threads=int(ws.get('whisper_cpu_threads', 0) or 0),
+                vad=bool(ws.get('whisper_vad', True)),
+            )
+            with self._stage("make_srt"):
+                result = conv.transcribe(voice_path, srt_path)
+            rtf = f", RTF {result['rtf']:.2f}" if result.get('rtf') else ""
+            self.log(f"OK: {srt_path.name} ({conv.backend}/{conv.model_name}{rtf})", "OK")
             return True
         except Exception as e:
             self.log(f"SRT error: {e}", "ERROR")
             return False
 
+    def _align_script_srt(self, voice_path: Path, srt_path: Path, source_voice: Optional[Path]) -> bool:
+        """Forced alignment kich ban → SRT. False = khong co kich ban / khong dung duoc → Whisper."""
+        ws = self.whisper_settings
+        if not ws.get('forced_align', True):
+            return False
+        from modules.forced_align import find_script, FORCED_ALIGN_AVAILABLE, ForcedAligner
+        script_path = (find_script(source_voice) if source_voice else None) or find_script(voice_path)
+        if not script_path:
+            return False
+        if not FORCED_ALIGN_AVAILABLE:
+            self.log(f"Co kich ban {script_path.name} nhung chua cai torchaudio - dung Whisper", "WARN")
+            return False
+
+        self.log(f"Forced alignment kich ban {script_path.name} -> SRT...")
+        try:
+            from modules.voice_to_srt import write_transcript
+            if self._forced_aligner is None:
+                self._forced_aligner = ForcedAligner(
+                    min_score=float(ws.get('forced_align_min_score', 0.45)),
+                    max_low_words=float(ws.get('forced_align_max_low_words', 0.2)),
+                )
+            script_text = script_path.read_text(encoding='utf-8', errors='ignore')
+            with self._stage("make_srt", source="forced_align"):
+                result = self._forced_aligner.align(voice_path, script_text)
+            if not result:
+                self.log("Kich ban khong khop voice (do tin cay thap) - dung Whisper", "WARN")
+                return False
+            write_transcript(result, srt_path)
+            self.log(
+                f"OK: {srt_path.name} (forced alignment, {len(result['segments'])} dong, "
+                f"score {result['alignment_score']:.2f}, RTF {result['rtf']:.2f})", "OK"
+            )
+            return True
+        except Exception as e:
+            self.log(f"Forced alignment error: {e} - dung Whisper", "WARN")
+            return False
+
     # ========== PROMPT GENERATION ==========
 
     def make_prompts(self, proj_dir: Path, name: str, excel_path: Path) -> bool:
@@ -875,6 +970,11 @@ class SmartEngine:
 
                 if total_scenes > 0 and scenes_with_prompts >= total_scenes:
                     self.log(f"Prompts da ton tai: {excel_path.name} ({scenes_with_prompts}/{total_scenes} scenes)")
+                    cfg = self._prompt_generator_config()
+                    if cfg.get("prompt_mode") == "offline":
+                        # Resume: scenes offline chưa refine (không có → thread kết thúc ngay)
+                        from modules.prompts_generator import PromptGenerator
+                        self._start_prompt_refinement(PromptGenerator(cfg), proj_dir, name)
                     return True
                 elif total_scenes > 0 and scenes_with_prompts < total_scenes:
                     missing = total_scenes - scenes_with_prompts
@@ -888,27 +988,27 @@ class SmartEngine:
                 # Tiếp tục generate nếu có lỗi đọc Excel
 
         self.log("Generate prompts...")
+        cfg = self._prompt_generator_config()
 
-        # Load config
-        import yaml
-        cfg = {}
-        cfg_file = Path("config/settings.yaml")
-        if cfg_file.exists():
-            with open(cfg_file, "r", encoding="utf-8") as f:
-                cfg = yaml.safe_load(f) or {}
-
-        # Add API keys (thu tu uu tien: Gemini > Groq > DeepSeek > Ollama)
-        cfg['gemini_api_keys'] = [k.value for k in self.gemini_keys if k.status != 'exhausted']
-        cfg['groq_api_keys'] = [k.value for k in self.groq_keys if k.status != 'exhausted']
-        cfg['deepseek_api_keys'] = [k.value for k in self.deepseek_keys if k.status != 'exhausted']
-        cfg['preferred_provider'] = 'gemini' if self.gemini_keys else ('groq' if self.groq_keys else 'deepseek')
-
-        # Ollama local model (fallback khi tat ca API fail)
-        # Ưu tiên từ settings.yaml, fallback từ self (accounts.json)
-        if not cfg.get('ollama_model'):
-            cfg['ollama_model'] = self.ollama_model
-        if not cfg.get('ollama_endpoint'):
-            cfg['ollama_endpoint'] = self.ollama_endpoint
+        # Offline mode: Excel từ SRT trong vài giây (không chờ LLM), LLM refine chạy nền
+        if cfg.get("prompt_mode") == "offline":
+            try:
+                from modules.prompts_generator import PromptGenerator
+                gen = PromptGenerator(cfg)
+                with self._stage("make_prompts", mode="offline"):
+                    generated = gen.generate_offline(
+                        proj_dir, name,
+                        on_characters_ready=lambda ep, pd: self._on_characters_ready(ep, pd),
+                        on_scenes_batch_ready=lambda ep, pd, saved, total: self._on_scenes_batch_ready(ep, pd, saved, total),
+                        total_scenes_callback=lambda total: self._on_total_scenes_known(total)
+                    )
+                if generated:
+                    self.log(f"OK (offline): {excel_path.name}", "OK")
+                    self._start_prompt_refinement(gen, proj_dir, name)
+                    return True
+            except Exception as e:
+                self.log(f"Offline prompts loi: {e}", "ERROR")
+            self.log("Offline prompts that bai - dung LLM", "WARN")
 
         # Retry with different keys
         for attempt in range(self.max_retries):
@@ -927,12 +1027,14 @@ class SmartEngine:
                 gen = PromptGenerator(cfg)
 
                 # Pass callbacks để chạy song song
-                if gen.generate_for_project(
-                    proj_dir, name,
-                    on_characters_ready=lambda ep, pd: self._on_characters_ready(ep, pd),
-                    on_scenes_batch_ready=lambda ep, pd, saved, total: self._on_scenes_batch_ready(ep, pd, saved, total),
-                    total_scenes_callback=lambda total: self._on_total_scenes_known(total)
-                ):
+                with self._stage("make_prompts"):
+                    generated = gen.generate_for_project(
+                        proj_dir, name,
+                        on_characters_ready=lambda ep, pd: self._on_characters_ready(ep, pd),
+                        on_scenes_batch_ready=lambda ep, pd, saved, total: self._on_scenes_batch_ready(ep, pd, saved, total),
+                        total_scenes_callback=lambda total: self._on_total_scenes_known(total)
+                    )
+                if generated:
                     self.mark_resource_used(ai_key, True)
                     self.log(f"OK: {excel_path.name}", "OK")
                     return True
@@ -945,6 +1047,85 @@ class SmartEngine:
 
         return False
 
+    def _prompt_generator_config(self) -> Dict:
+        """settings.yaml + AI keys hiện có (config cho PromptGenerator)."""
+        import yaml
+        cfg = {}
+        cfg_file = Path("config/settings.yaml")
+        if cfg_file.exists():
+            with open(cfg_file, "r", encoding="utf-8") as f:
+                cfg = yaml.safe_load(f) or {}
+
+        # Add API keys (thu tu uu tien: Gemini > Groq > DeepSeek > Ollama)
+        cfg['gemini_api_keys'] = [k.value for k in self.gemini_keys if k.status != 'exhausted']
+        cfg['groq_api_keys'] = [k.value for k in self.groq_keys if k.status != 'exhausted']
+        cfg['deepseek_api_keys'] = [k.value for k in self.deepseek_keys if k.status != 'exhausted']
+        cfg['preferred_provider'] = 'gemini' if self.gemini_keys else ('groq' if self.groq_keys else 'deepseek')
+
+        # Ollama local model (fallback khi tat ca API fail)
+        # Ưu tiên từ settings.yaml, fallback từ self (accounts.json)
+        if not cfg.get('ollama_model'):
+            cfg['ollama_model'] = self.ollama_model
+        if not cfg.get('ollama_endpoint'):
+            cfg['ollama_endpoint'] = self.ollama_endpoint
+        return cfg
+
+    def _start_prompt_refinement(self, gen, proj_dir: Path, name: str):
+        """
+        LLM refine prompts offline trên thread nền (đợi ở _wait_for_prompt_refinement).
+
+        Thread chỉ tính; ghi Excel + tạo lại ảnh ở _apply_prompt_refinement sau
+        bước tạo ảnh.
+        """
+        if self._prompt_refine_thread is not None and self._prompt_refine_thread.is_alive():
+            return
+        self._prompt_refine_report = None
+        self._prompt_refine_gen = gen
+
+        def _done(report):
+            self._prompt_refine_report = report
+            if report:
+                self.log(
+                    f"[REFINE] Xong: {report['scenes_requeued']} scenes cần tạo lại ảnh, "
+                    f"{report['scenes_kept']} giữ nguyên"
+                )
+
+        self.log("[REFINE] LLM refine prompts chạy nền...")
+        self._prompt_refine_thread = gen.refine_in_background(proj_dir, name, on_done=_done, apply=False)
+
+    def _wait_for_prompt_refinement(self, timeout: float = 1800) -> Optional[Dict]:
+        """Đợi refine nền xong; trả report (None nếu không chạy / lỗi / quá timeout)."""
+        thread = self._prompt_refine_thread
+        if thread is None:
+            return None
+        if thread.is_alive():
+            self.log("[REFINE] Đợi LLM refine prompts hoàn thành...")
+            thread.join(timeout)
+            if thread.is_alive():
+                self.log("[REFINE] Quá thời gian chờ - giữ prompts offline cho lần chạy này", "WARN")
+                return None
+        self._prompt_refine_thread = None
+        return self._prompt_refine_report
+
+    def _apply_prompt_refinement(self, proj_dir: Path, name: str) -> List[int]:
+        """
+        Đợi refine nền, ghi prompts mới vào Excel + chuyển ảnh cũ sang img/_replaced/.
+        Gọi SAU bước tạo ảnh (thread tạo ảnh không còn ghi Excel).
+
+        Returns:
+            scene_ids cần tạo lại ảnh
+        """
+        report = self._wait_for_prompt_refinement()
+        gen = self._prompt_refine_gen
+        self._prompt_refine_gen = None
+        if not report or gen is None:
+            return []
+        try:
+            return gen.apply_offline_refinement(proj_dir, name, report)
+        except Exception as e:
+            self.log(f"[REFINE] Ghi kết quả refine lỗi: {e} - giữ prompts offline", "WARN")
+            return []
+
     # ========== EXCEL PROJECT_ID HELPERS ==========
 
     def _get_project_id_from_excel(self, excel_path: Path) -> str:
@@ -2145,6 +2326,48 @@ class SmartEngine:
         Returns:
             Dict with success/failed counts
         """
+        name = Path(input_path).stem
+        proj_dir = Path(output_dir) if output_dir else Path("PROJECTS") / name
+
+        # Resource profiling: report JSON mỗi voice (tắt = no-op)
+        self.profiler = ResourceProfiler.from_settings(self.profiling_settings, label=name)
+
+        # Metrics: JSONL mỗi voice + Prometheus endpoint (nếu cấu hình port)
+        metrics = get_metrics()
+        metrics.enabled = self.metrics_enabled
+        if self.metrics_enabled:
+            if self.metrics_prometheus_port:
+                metrics.start_prometheus_server(self.metrics_prometheus_port)
+            metrics.open_run(proj_dir / "logs" / f"metrics_{name}.jsonl", project=name)
+
+        try:
+            with self._stage("pipeline"):
+                return self._run_pipeline(input_path, output_dir, callback)
+        finally:
+            summary = metrics.close_run(name)
+            if summary:
+                for h in summary["histograms"]:
+                    if h["name"].startswith("stage_"):
+                        self.log(f"[METRICS] {h['name'][6:-8]}: {h['sum_s']:.1f}s", "DEBUG")
+            report_path = self.profiler.dump(proj_dir / "logs" / f"resources_{name}.json")
+            if report_path:
+                for line in self.profiler.summary_lines():
+                    self.log(f"[PROFILE] {line}")
+                self.log(f"[PROFILE] Report: {report_path}")
+
+    @contextmanager
+    def _stage(self, name: str, **labels):
+        """Một bước pipeline: đo thời gian (metrics) + tài nguyên (profiler)."""
+        with span(f"stage_{name}", **labels), self.profiler.stage(name):
+            yield
+
+    def _run_pipeline(
+        self,
+        input_path: str,
+        output_dir: str = None,
+        callback: Callable = None
+    ) -> Dict:
+        """Pipeline chính của run() (tách ra để run() bọc profiling)."""
         self.callback = callback
         self.stop_flag = False
 
@@ -2235,7 +2458,7 @@ class SmartEngine:
             if srt_path.exists():
                 self.log("  ⏭️ SRT đã tồn tại, skip!")
             else:
-                if not self.make_srt(voice_path, srt_path):
+                if not self.make_srt(voice_path, srt_path, source_voice=inp):
                     return {"error": "srt_failed"}
 
         # Tao Prompts (skip nếu đã có ĐẦY ĐỦ scenes)
@@ -2524,10 +2747,12 @@ class SmartEngine:
 
             if generation_mode == 'api':
                 self.log("[STEP 5] Tao images bang API MODE...")
-                scene_results = self.generate_images_api(prompts, proj_dir)
+                with self._stage("images", mode="api"):
+                    scene_results = self.generate_images_api(prompts, proj_dir)
             else:
                 self.log("[STEP 5] Tao images bang BROWSER MODE...")
-                scene_results = self.generate_images_browser(prompts, proj_dir)
+                with self._stage("images", mode="browser"):
+                    scene_results = self.generate_images_browser(prompts, proj_dir)
 
             # === RESTART VIDEO WORKER NẾU CHƯA CHẠY (sau DRISSION MODE đã lưu token) ===
             if not self._video_worker_running:
@@ -2649,26 +2874,35 @@ class SmartEngine:
         self.log("[STEP 7] Xuat TXT & SRT...")
         self._export_scenes(excel_path, proj_dir, name)
 
+        # === 7.5. DRAFT PREVIEW (trong lúc I2V còn chạy) ===
+        if self.draft_preview:
+            self.log("[STEP 7.5] Draft preview 480p...")
+            with self._stage("draft"):
+                draft_path = self._compose_draft_video(proj_dir, excel_path, name)
+            if draft_path:
+                results["draft"] = str(draft_path)
+
         # === 8. WAIT FOR VIDEO GENERATION (I2V) ===
         # Phải đợi tạo video từ ảnh xong trước khi compose
         if self._video_worker_running:
             self.log("[STEP 8] Doi tao video tu anh (I2V)...")
             # Wait for queue to empty (with timeout)
-            wait_start = time.time()
-            max_wait = 3600  # 60 minutes max (I2V mất thời gian)
-            while self._video_worker_running and time.time() - wait_start < max_wait:
-                with self._video_queue_lock:
-                    pending = len(self._video_queue)
-                    if not self._video_queue:
-                        break
-                # Log progress every 30 seconds
-                elapsed = int(time.time() - wait_start)
-                if elapsed > 0 and elapsed % 30 == 0:
-                    self.log(f"  -> Đang đợi I2V: {pending} pending, {self._video_results['success']} OK, {self._video_results['failed']} failed ({elapsed}s)")
-                time.sleep(2)
-
-            # Stop worker and get results
-            self._stop_video_worker()
+            with self._stage("videos_wait"):
+                wait_start = time.time()
+                max_wait = 3600  # 60 minutes max (I2V mất thời gian)
+                while self._video_worker_running and time.time() - wait_start < max_wait:
+                    with self._video_queue_lock:
+                        pending = len(self._video_queue)
+                        if not self._video_queue:
+                            break
+                    # Log progress every 30 seconds
+                    elapsed = int(time.time() - wait_start)
+                    if elapsed > 0 and elapsed % 30 == 0:
+                        self.log(f"  -> Đang đợi I2V: {pending} pending, {self._video_results['success']} OK, {self._video_results['failed']} failed ({elapsed}s)")
+                    time.sleep(2)
+
+                # Stop worker and get results
+                self._stop_video_worker()
             video_results = self.get_video_results()
             self.log(f"[VIDEO] Ket qua I2V: {video_results['success']} OK, {video_results['failed']} failed")
 
@@ -2717,6 +2951,12 @@ class SmartEngine:
         else:
             self.log("[STEP 8] Khong co I2V, skip...")
 
+        # === 8.5 OFFLINE PROMPTS: scenes có prompt đổi sau LLM refine → tạo lại ở bước retry ===
+        requeued_scenes = self._apply_prompt_refinement(proj_dir, name)
+        if requeued_scenes:
+            self.log(f"[REFINE] {len(requeued_scenes)} scenes tạo lại ảnh với prompt mới: {requeued_scenes}")
+            all_prompts = self._load_prompts(excel_path, proj_dir)
+
         # === 9. RETRY FAILED ITEMS ===
         # Thử lại các ảnh/video bị lỗi để có đủ nguyên liệu cho edit
         video_res = results.get("video_gen", {})
@@ -2735,7 +2975,8 @@ class SmartEngine:
         if results.get("failed", 0) > 0:
             self.log(f"  CANH BAO: {results['failed']} anh fail, nhung van ghep video voi anh co san!", "WARN")
 
-        video_path = self._compose_video(proj_dir, excel_path, name)
+        with self._stage("compose"):
+            video_path = self._compose_video(proj_dir, excel_path, name)
         if video_path:
             self.log(f"  -> Video: {video_path.name}", "OK")
             results["video"] = str(video_path)
@@ -3016,25 +3257,19 @@ class SmartEngine:
             self.log(f"  SRT process error: {e}", "WARN")
             return srt_path  # Return original if error
 
-    def _compose_video(self, proj_dir: Path, excel_path: Path, name: str) -> Optional[Path]:
-        """
-        Tự động ghép video từ ảnh + voice + SRT.
-        Đọc trực tiếp từ Excel format của prompts generator.
-        """
-        import subprocess
-        import openpyxl
-        import tempfile
-
-        # Check FFmpeg
-        try:
-            result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
-            if result.returncode != 0:
+    def _check_ffmpeg(self):
+        """FFmpegCapabilities nếu ffmpeg chạy được (cache theo máy), None nếu không."""
+        ffmpeg_caps = get_ffmpeg_capabilities()
+        if not ffmpeg_caps.available:
+            if shutil.which("ffmpeg"):
                 self.log("  FFmpeg khong hoat dong!", "ERROR")
-                return None
-        except FileNotFoundError:
-            self.log("  FFmpeg chua cai! https://ffmpeg.org/download.html", "ERROR")
+            else:
+                self.log("  FFmpeg chua cai! https://ffmpeg.org/download.html", "ERROR")
             return None
+        return ffmpeg_caps
 
+    def _find_compose_inputs(self, proj_dir: Path, name: str) -> Optional[Tuple[Path, Optional[Path]]]:
+        """Voice + SRT (đã tách dòng dài) của project. None nếu thiếu voice."""
         # Tìm voice file
         voice_files = list(proj_dir.glob("*.mp3")) + list(proj_dir.glob("*.wav"))
         if not voice_files:
@@ -3051,161 +3286,408 @@ class SmartEngine:
             processed_srt = proj_dir / f"{name}.srt"
             srt_path = self._process_srt_for_video(srt_path, processed_srt, max_chars=50)
 
-        output_path = proj_dir / f"{name}.mp4"
-        img_dir = proj_dir / "img"
+        return voice_path, srt_path
 
-        self.log(f"  Voice: {voice_path.name}")
-        self.log(f"  SRT: {srt_path.name if srt_path else 'None'}")
-        self.log(f"  Excel: {excel_path.name}")
+    def _build_compose_timeline(self, excel_path: Path, img_dir: Path, voice_path: Path,
+                                probe_cache: Optional[Path] = None,
+                                include_missing: bool = False) -> Optional[Dict]:
+        """
+        Timeline ghép video: media (video clip > ảnh) theo srt_start + duration.
 
-        try:
-            # 1. Load scenes từ Excel (Scenes sheet)
-            wb = openpyxl.load_workbook(excel_path)
+        Dùng chung cho bản final và bản draft để timing giống hệt nhau.
 
-            # Tìm sheet Scenes
-            scenes_sheet = None
-            for sheet_name in wb.sheetnames:
-                if 'scene' in sheet_name.lower():
-                    scenes_sheet = wb[sheet_name]
-                    break
+        Args:
+            excel_path: Excel prompts (sheet Scenes)
+            img_dir: Thư mục img/ chứa {scene_id}.mp4 / .png
+            voice_path: File voice (lấy tổng thời lượng)
+            probe_cache: File cache ffprobe của project
+            include_missing: Giữ chỗ cho scene chưa có media (draft)
 
-            if not scenes_sheet:
-                self.log("  Khong tim thay sheet 'Scenes' trong Excel!", "ERROR")
-                return None
+        Returns:
+            Dict items/total_duration/video_count/image_count/probe, None nếu lỗi
+        """
+        import openpyxl
 
-            # Đọc headers
-            headers = [cell.value for cell in scenes_sheet[1]]
-            self.log(f"  Headers: {headers[:5]}...")
+        # 1. Load scenes từ Excel (Scenes sheet)
+        wb = openpyxl.load_workbook(excel_path)
 
-            # Tìm cột cần thiết (ID và srt_start)
-            id_col = start_col = None
-            for i, h in enumerate(headers):
-                if h is None:
-                    continue
-                h_lower = str(h).lower().strip()
+        # Tìm sheet Scenes
+        scenes_sheet = None
+        for sheet_name in wb.sheetnames:
+            if 'scene' in sheet_name.lower():
+                scenes_sheet = wb[sheet_name]
+                break
 
-                # Tìm cột ID (scene_id hoặc id)
-                if h_lower in ['scene_id', 'id'] and id_col is None:
-                    id_col = i
+        if not scenes_sheet:
+            self.log("  Khong tim thay sheet 'Scenes' trong Excel!", "ERROR")
+            return None
 
-                # Tìm cột thời gian: ưu tiên srt_start, fallback start_time
-                if h_lower == 'srt_start':
-                    start_col = i
-                elif 'start' in h_lower and 'time' in h_lower and start_col is None:
-                    start_col = i
+        # Đọc headers
+        headers = [cell.value for cell in scenes_sheet[1]]
+        self.log(f"  Headers: {headers[:5]}...")
 
-            if id_col is None:
-                self.log("  Khong tim thay cot ID!", "ERROR")
-                return None
+        # Tìm cột cần thiết (ID và srt_start)
+        id_col = start_col = None
+        for i, h in enumerate(headers):
+            if h is None:
+                continue
+            h_lower = str(h).lower().strip()
 
-            # Log cột đã tìm thấy
-            id_header = headers[id_col] if id_col is not None else "N/A"
-            start_header = headers[start_col] if start_col is not None else "N/A"
-            self.log(f"  Columns: ID='{id_header}'(col {id_col}), Start='{start_header}'(col {start_col})")
+            # Tìm cột ID (scene_id hoặc id)
+            if h_lower in ['scene_id', 'id'] and id_col is None:
+                id_col = i
 
-            # 2. Load media (video clips hoặc images) với timestamps
-            # Ưu tiên: video clip (.mp4) > image (.png)
-            media_items = []
-            video_count = 0
-            image_count = 0
+            # Tìm cột thời gian: ưu tiên srt_start, fallback start_time
+            if h_lower == 'srt_start':
+                start_col = i
+            elif 'start' in h_lower and 'time' in h_lower and start_col is None:
+                start_col = i
 
-            for row in scenes_sheet.iter_rows(min_row=2, values_only=True):
-                if row[id_col] is None:
-                    continue
+        if id_col is None:
+            self.log("  Khong tim thay cot ID!", "ERROR")
+            return None
 
-                scene_id = str(row[id_col]).strip()
+        # Log cột đã tìm thấy
+        id_header = headers[id_col] if id_col is not None else "N/A"
+        start_header = headers[start_col] if start_col is not None else "N/A"
+        self.log(f"  Columns: ID='{id_header}'(col {id_col}), Start='{start_header}'(col {start_col})")
 
-                # Chỉ lấy scenes có số (1, 2, 3...), bỏ qua nv1, loc1
-                if not scene_id.isdigit():
-                    continue
+        # 2. Load media (video clips hoặc images) với timestamps
+        # Ưu tiên: video clip (.mp4) > image (.png)
+        media_items = []
+        video_count = 0
+        image_count = 0
+
+        for row in scenes_sheet.iter_rows(min_row=2, values_only=True):
+            if row[id_col] is None:
+                continue
 
-                # Ưu tiên video clip (.mp4), fallback to image (.png)
-                video_path = img_dir / f"{scene_id}.mp4"
-                img_path = img_dir / f"{scene_id}.png"
-
-                if video_path.exists():
-                    media_path = video_path
-                    is_video = True
-                    video_count += 1
-                elif img_path.exists():
-                    media_path = img_path
-                    is_video = False
-                    image_count += 1
+            scene_id = str(row[id_col]).strip()
+
+            # Chỉ lấy scenes có số (1, 2, 3...), bỏ qua nv1, loc1
+            if not scene_id.isdigit():
+                continue
+
+            # Ưu tiên video clip (.mp4), fallback to image (.png)
+            video_path = img_dir / f"{scene_id}.mp4"
+            img_path = img_dir / f"{scene_id}.png"
+
+            missing = False
+            if video_path.exists():
+                media_path = video_path
+                is_video = True
+                video_count += 1
+            elif img_path.exists():
+                media_path = img_path
+                is_video = False
+                image_count += 1
+            elif include_missing:
+                # Draft: giữ chỗ trên timeline cho ảnh chưa tạo xong
+                media_path = img_path
+                is_video = False
+                missing = True
+            else:
+                continue
+
+            # Parse start_time
+            start_time = 0.0
+            if start_col is not None and row[start_col]:
+                start_time = self._parse_timestamp(str(row[start_col]))
+
+            media_items.append({
+                'id': scene_id,
+                'path': str(media_path),
+                'start': start_time,
+                'is_video': is_video,
+                'missing': missing
+            })
+
+        if not media_items:
+            self.log("  Khong tim thay media nao trong img/ folder!", "ERROR")
+            return None
+
+        # Sắp xếp theo start_time
+        media_items.sort(key=lambda x: x['start'])
+        self.log(f"  Tim thay {len(media_items)} media: {video_count} video clips, {image_count} images")
+
+        # === FIX: Xử lý khi scene đầu tiên thiếu ảnh/video ===
+        # Nếu media đầu tiên có start > 0.5s, nghĩa là có gap ở đầu video
+        # Giải pháp: Duplicate media đầu tiên để fill gap từ 0:00
+        GAP_THRESHOLD = 0.5  # Nếu gap > 0.5s thì cần xử lý
+        first_start = media_items[0]['start']
+
+        if first_start > GAP_THRESHOLD:
+            # Có gap ở đầu - dùng media đầu tiên để fill
+            self.log(f"  ⚠️ Scene 1 thiếu ảnh/video! Gap từ 0:00 → {first_start:.1f}s")
+            self.log(f"  → Sử dụng {media_items[0]['id']} để fill gap đầu video")
+
+            # Thêm filler item ở đầu (duplicate media đầu tiên)
+            filler_item = {
+                'id': f"{media_items[0]['id']}_filler",
+                'path': media_items[0]['path'],
+                'start': 0.0,  # Bắt đầu từ 0:00
+                'is_video': media_items[0]['is_video'],
+                'missing': media_items[0]['missing'],
+                'is_filler': True  # Đánh dấu là filler
+            }
+            media_items.insert(0, filler_item)
+
+        # Probe voice + tất cả video clip 1 lần (song song, cache theo size+mtime)
+        media_probe = MediaProbe(probe_cache)
+        video_paths = {item['path'] for item in media_items if item['is_video']}
+        probed = media_probe.probe_many([voice_path, *video_paths])
+        media_probe.save()
+        self.log(f"  Probe: {len(probed)} files (cache hit {media_probe.hits}, probed {media_probe.misses})")
+
+        # 3. Tính duration cho mỗi media (CHỈ dựa vào start_time)
+        # Lấy tổng thời lượng từ voice
+        total_duration = media_probe.duration(voice_path, default=60.0)
+        self.log(f"  Voice duration: {total_duration:.1f}s")
+
+        # Tính duration mỗi media = start_time[i+1] - start_time[i]
+        # FIX: Media đầu tiên phải kéo dài từ 0:00 đến khi media kế tiếp bắt đầu
+        # Điều này đảm bảo ảnh/video xuất hiện đúng với timing srt_start trong Excel
+        for i, item in enumerate(media_items):
+            if i == 0:
+                # Media đầu tiên: bắt đầu từ 0:00, kéo dài đến khi media tiếp theo bắt đầu
+                if len(media_items) > 1:
+                    # Duration = next_item.start (không trừ item['start'])
+                    # Ví dụ: media 1 start=2.5s, media 2 start=5.5s
+                    # → media 1 duration = 5.5s (hiển thị từ 0:00 đến 5.5s)
+                    item['duration'] = media_items[1]['start']
                 else:
-                    continue
+                    # Chỉ có 1 media: kéo dài hết voice
+                    item['duration'] = total_duration
+            elif i < len(media_items) - 1:
+                item['duration'] = media_items[i + 1]['start'] - item['start']
+            else:
+                # Media cuối: kéo dài đến hết voice
+                item['duration'] = total_duration - item['start']
+
+            # Đảm bảo duration hợp lệ (tối thiểu 0.5s)
+            if item['duration'] <= 0:
+                item['duration'] = max(0.5, (total_duration - item['start']) / max(1, len(media_items) - i))
+
+        return {
+            'items': media_items,
+            'total_duration': total_duration,
+            'video_count': video_count,
+            'image_count': image_count,
+            'probe': media_probe,
+        }
 
-                # Parse start_time
-                start_time = 0.0
-                if start_col is not None and row[start_col]:
-                    start_time = self._parse_timestamp(str(row[start_col]))
+    def _subtitle_filters(self, srt_path: Path) -> Tuple[str, str]:
+        """Filter burn phụ đề: (font Anton, fallback font mặc định)."""
+        # Escape SRT path cho FFmpeg filter
+        srt_escaped = str(srt_path).replace('\\', '/').replace(':', '\\:')
+
+        # Font path - Anton Regular
+        font_dir = "C\\:/Users/admin/AppData/Local/Microsoft/Windows/Fonts"
+
+        # Style: Chữ trắng, viền đen, font Anton
+        # PrimaryColour format: &HAABBGGRR (Alpha, Blue, Green, Red)
+        # &H00FFFFFF = white, &H00000000 = black
+        subtitle_style = (
+            "FontName=Anton,"
+            "FontSize=32,"  # Vua phai, 1 dong ~ 50 ky tu
+            "PrimaryColour=&H00FFFFFF,"  # Trắng
+            "OutlineColour=&H00000000,"  # Đen
+            "BorderStyle=1,"
+            "Outline=2,"  # Vien mong
+            "Shadow=0,"
+            "MarginV=30,"
+            "Alignment=2"  # Bottom center
+        )
 
-                media_items.append({
-                    'id': scene_id,
-                    'path': str(media_path),
-                    'start': start_time,
-                    'is_video': is_video
-                })
+        vf_filter = f"subtitles='{srt_escaped}':fontsdir='{font_dir}':force_style='{subtitle_style}'"
+        vf_simple = f"subtitles='{srt_escaped}':force_style='FontSize=32,PrimaryColour=&H00FFFFFF,OutlineColour=&H00000000,BorderStyle=1,Outline=2'"
+        return vf_filter, vf_simple
 
-            if not media_items:
-                self.log("  Khong tim thay media nao trong img/ folder!", "ERROR")
-                return None
+    def _build_clip_command(self, item: Dict, i: int, clip_path: Path, ctx: Dict) -> List[str]:
+        """
+        Lệnh FFmpeg render 1 clip của timeline (video: cắt giữa + fade,
+        ảnh: Ken Burns hoặc scale + fade).
 
-            # Sắp xếp theo start_time
-            media_items.sort(key=lambda x: x['start'])
-            self.log(f"  Tim thay {len(media_items)} media: {video_count} video clips, {image_count} images")
-
-            # === FIX: Xử lý khi scene đầu tiên thiếu ảnh/video ===
-            # Nếu media đầu tiên có start > 0.5s, nghĩa là có gap ở đầu video
-            # Giải pháp: Duplicate media đầu tiên để fill gap từ 0:00
-            GAP_THRESHOLD = 0.5  # Nếu gap > 0.5s thì cần xử lý
-            first_start = media_items[0]['start']
-
-            if first_start > GAP_THRESHOLD:
-                # Có gap ở đầu - dùng media đầu tiên để fill
-                self.log(f"  ⚠️ Scene 1 thiếu ảnh/video! Gap từ 0:00 → {first_start:.1f}s")
-                self.log(f"  → Sử dụng {media_items[0]['id']} để fill gap đầu video")
-
-                # Thêm filler item ở đầu (duplicate media đầu tiên)
-                filler_item = {
-                    'id': f"{media_items[0]['id']}_filler",
-                    'path': media_items[0]['path'],
-                    'start': 0.0,  # Bắt đầu từ 0:00
-                    'is_video': media_items[0]['is_video'],
-                    'is_filler': True  # Đánh dấu là filler
-                }
-                media_items.insert(0, filler_item)
-
-            # 3. Tính duration cho mỗi media (CHỈ dựa vào start_time)
-            # Lấy tổng thời lượng từ voice
-            probe_cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration",
-                        "-of", "default=noprint_wrappers=1:nokey=1", str(voice_path)]
-            result = subprocess.run(probe_cmd, capture_output=True, text=True)
-            total_duration = float(result.stdout.strip()) if result.stdout.strip() else 60.0
-            self.log(f"  Voice duration: {total_duration:.1f}s")
-
-            # Tính duration mỗi media = start_time[i+1] - start_time[i]
-            # FIX: Media đầu tiên phải kéo dài từ 0:00 đến khi media kế tiếp bắt đầu
-            # Điều này đảm bảo ảnh/video xuất hiện đúng với timing srt_start trong Excel
-            for i, item in enumerate(media_items):
+        Args:
+            item: Media item từ _build_compose_timeline
+            i: Vị trí clip trong timeline
+            clip_path: File output
+            ctx: Cấu hình compose (compose_mode, kb_enabled, use_simple_kb, use_gpu,
+                 gpu_encoder, ken_burns, media_probe, fade_duration, rng) +
+                 state last_kb_effect
+        """
+        FADE_DURATION = ctx['fade_duration']
+        compose_mode = ctx['compose_mode']
+        kb_enabled = ctx['kb_enabled']
+        use_simple_kb = ctx['use_simple_kb']
+        use_gpu = ctx['use_gpu']
+        gpu_encoder = ctx['gpu_encoder']
+        ken_burns = ctx['ken_burns']
+        media_probe = ctx['media_probe']
+
+        abs_path = str(Path(item['path']).resolve()).replace('\\', '/')
+        target_duration = item['duration']
+
+        # === TRANSITION EFFECTS ===
+        # Random theo tỉ lệ: 20% none, 40% fade_black, 40% mix
+        rand_val = ctx['rng'].random()
+        if rand_val < 0.2:
+            transition_type = 'none'       # 20%
+        elif rand_val < 0.6:
+            transition_type = 'fade_black' # 40%
+        else:
+            transition_type = 'mix'        # 40%
+        fade_out_start = max(0, target_duration - FADE_DURATION)
+
+        if transition_type == 'none':
+            # Không có hiệu ứng chuyển cảnh
+            fade_filter = ""
+        elif transition_type == 'fade_black':
+            # Tối dần: fade in/out to black
+            fade_filter = f"fade=t=in:st=0:d={FADE_DURATION},fade=t=out:st={fade_out_start}:d={FADE_DURATION}"
+        else:
+            # Mix: fade với alpha (crossfade effect khi concat)
+            fade_filter = f"fade=t=in:st=0:d={FADE_DURATION}:alpha=1,fade=t=out:st={fade_out_start}:d={FADE_DURATION}:alpha=1"
+
+        if item['is_video']:
+            # === VIDEO CLIP: Cắt lấy phần giữa + thêm transitions ===
+            # Lấy duration của video gốc (đã probe trước vòng render)
+            video_duration = media_probe.duration(item['path'], default=8.0)
+
+            # Base filter: scale + pad + transitions (nếu có)
+            if fade_filter:
+                base_vf = f"scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2,{fade_filter}"
+            else:
+                base_vf = f"scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2"
+
+            encode_args = self._clip_encode_args(ctx, is_video=True)
+
+            if video_duration > target_duration:
+                # Cắt lấy phần giữa: bỏ đầu và cuối bằng nhau
+                trim_total = video_duration - target_duration
+                trim_start = trim_total / 2
+                cmd_clip = [
+                    "ffmpeg", "-y",
+                    "-ss", str(trim_start),
+                    "-i", abs_path,
+                    "-t", str(target_duration),
+                    "-vf", base_vf,
+                    "-an",  # Bỏ audio từ video clip
+                    *encode_args, str(clip_path)
+                ]
+            else:
+                # Video ngắn hơn target → dùng nguyên video
+                cmd_clip = [
+                    "ffmpeg", "-y",
+                    "-i", abs_path,
+                    "-t", str(target_duration),
+                    "-vf", base_vf,
+                    "-an",
+                    *encode_args, str(clip_path)
+                ]
+        else:
+            # === IMAGE: Tạo clip (với hoặc không có Ken Burns) ===
+            # SAFEGUARD: Clip > 20s thì skip zoompan để tránh timeout
+            MAX_KB_DURATION = 20
+            use_kb_for_this_clip = kb_enabled and target_duration <= MAX_KB_DURATION
+
+            if target_duration > MAX_KB_DURATION and kb_enabled:
+                self.log(f"  ⚠️ Clip {i}: {target_duration:.1f}s > {MAX_KB_DURATION}s, skip Ken Burns", "WARN")
+
+            if use_kb_for_this_clip:
+                # Ken Burns effect (zoom/pan mượt mà)
+                kb_effect = ken_burns.get_random_effect(exclude_last=ctx.get('last_kb_effect'))
+                ctx['last_kb_effect'] = kb_effect
+
+                # Tạo filter với Ken Burns + fade
+                # simple_mode=True cho balanced mode (no easing, nhanh hơn)
+                vf = ken_burns.generate_filter(
+                    kb_effect, target_duration, FADE_DURATION,
+                    simple_mode=use_simple_kb
+                )
+
+                # Log hiệu ứng đang dùng (mỗi 5 ảnh)
+                if i % 5 == 0:
+                    self.log(f"    #{item['id']}: {kb_effect.value} (mode={'balanced' if use_simple_kb else 'quality'})")
+
+                # Debug: Log filter cho clip đầu tiên
                 if i == 0:
-                    # Media đầu tiên: bắt đầu từ 0:00, kéo dài đến khi media tiếp theo bắt đầu
-                    if len(media_items) > 1:
-                        # Duration = next_item.start (không trừ item['start'])
-                        # Ví dụ: media 1 start=2.5s, media 2 start=5.5s
-                        # → media 1 duration = 5.5s (hiển thị từ 0:00 đến 5.5s)
-                        item['duration'] = media_items[1]['start']
-                    else:
-                        # Chỉ có 1 media: kéo dài hết voice
-                        item['duration'] = total_duration
-                elif i < len(media_items) - 1:
-                    item['duration'] = media_items[i + 1]['start'] - item['start']
+                    self.log(f"  [DEBUG] Filter clip 0: {vf[:150]}...")
+            else:
+                # FAST MODE: Chỉ scale giữ nguyên tỷ lệ, không crop
+                # Nhanh nhất - không có hiệu ứng gì
+                base_filter = "scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2"
+
+                # Thêm fade
+                if fade_filter:
+                    vf = f"{base_filter},{fade_filter}"
                 else:
-                    # Media cuối: kéo dài đến hết voice
-                    item['duration'] = total_duration - item['start']
+                    vf = base_filter
+
+            # Build FFmpeg command với GPU acceleration nếu có
+            # Fast mode dùng preset nhanh nhất
+            cmd_clip = [
+                "ffmpeg", "-y",
+                "-loop", "1", "-t", str(target_duration),
+                "-i", abs_path,
+                "-vf", vf,
+                *self._clip_encode_args(ctx), str(clip_path)
+            ]
+
+        return cmd_clip
 
-                # Đảm bảo duration hợp lệ (tối thiểu 0.5s)
-                if item['duration'] <= 0:
-                    item['duration'] = max(0.5, (total_duration - item['start']) / max(1, len(media_items) - i))
+    CLIP_FPS = 25
+
+    def _clip_encode_args(self, ctx: Dict, is_video: bool = False) -> List[str]:
+        """
+        Encoder/preset/fps của clip timeline: GPU (nvenc p1/p4) hoặc libx264
+        (ultrafast/fast); fast mode chỉ áp preset nhanh nhất cho clip ảnh.
+        """
+        fast = ctx['compose_mode'] == "fast" and not is_video
+        if ctx['use_gpu']:
+            encoder, preset = ctx['gpu_encoder'], ("p1" if fast else "p4")  # p1=fastest
+        else:
+            encoder, preset = "libx264", ("ultrafast" if fast else "fast")
+        return ["-c:v", encoder, "-preset", preset, "-pix_fmt", "yuv420p", "-r", str(self.CLIP_FPS)]
+
+    @timed("compose_video", ok=lambda path: path is not None)
+    def _compose_video(self, proj_dir: Path, excel_path: Path, name: str) -> Optional[Path]:
+        """
+        Tự động ghép video từ ảnh + voice + SRT.
+        Đọc trực tiếp từ Excel format của prompts generator.
+        """
+        import subprocess
+        import tempfile
+
+        # Check FFmpeg (cache theo máy - không chạy -version mỗi lần)
+        ffmpeg_caps = self._check_ffmpeg()
+        if not ffmpeg_caps:
+            return None
+
+        inputs = self._find_compose_inputs(proj_dir, name)
+        if not inputs:
+            return None
+        voice_path, srt_path = inputs
+
+        output_path = proj_dir / f"{name}.mp4"
+        img_dir = proj_dir / "img"
+
+        self.log(f"  Voice: {voice_path.name}")
+        self.log(f"  SRT: {srt_path.name if srt_path else 'None'}")
+        self.log(f"  Excel: {excel_path.name}")
+
+        try:
+            # 1-3. Timeline (media + duration theo srt_start)
+            timeline = self._build_compose_timeline(
+                excel_path, img_dir, voice_path, proj_dir / ".media_probe.json"
+            )
+            if not timeline:
+                return None
+            media_items = timeline['items']
+            total_duration = timeline['total_duration']
+            video_count = timeline['video_count']
+            image_count = timeline['image_count']
+            media_probe = timeline['probe']
 
             # 4. Tạo video với FFmpeg + Fade Transitions
             # Windows fix: Don't use context manager - manual cleanup with retry
@@ -3246,6 +3728,7 @@ class SmartEngine:
                 # Video composition mode: quality, balanced, fast
                 compose_mode = "fast"  # Default: fast (nhanh nhất, chỉ fade)
                 kb_intensity = "normal"   # Default: normal (zoom 12%, pan 8%)
+                segment_seconds = 0.0     # > 0: render theo đoạn + manifest
                 try:
                     import yaml
                     config_path = Path(__file__).parent.parent / "config" / "settings.yaml"
@@ -3254,6 +3737,7 @@ class SmartEngine:
                             config = yaml.safe_load(f) or {}
                         compose_mode = config.get('video_compose_mode', 'fast').lower()
                         kb_intensity = config.get('ken_burns_intensity', 'normal')
+                        segment_seconds = float(config.get('video_segment_seconds', 0) or 0)
                 except Exception:
                     pass
 
@@ -3267,21 +3751,13 @@ class SmartEngine:
                 # Detect GPU encoder (NVENC for NVIDIA)
                 use_gpu = False
                 gpu_encoder = "libx264"  # Default CPU
-                try:
-                    gpu_check = subprocess.run(
-                        ["ffmpeg", "-encoders"],
-                        capture_output=True, text=True, timeout=5
-                    )
-                    if "h264_nvenc" in gpu_check.stdout:
-                        use_gpu = True
-                        gpu_encoder = "h264_nvenc"
-                        self.log(f"  GPU Encoder: NVENC (RTX detected) ⚡")
-                except:
-                    pass
+                if ffmpeg_caps.has_encoder("h264_nvenc"):
+                    use_gpu = True
+                    gpu_encoder = "h264_nvenc"
+                    self.log(f"  GPU Encoder: NVENC (RTX detected) ⚡")
 
                 # Ken Burns generator cho ảnh tĩnh
                 ken_burns = KenBurnsGenerator(1920, 1080, intensity=kb_intensity)
-                last_kb_effect = None  # Tránh lặp hiệu ứng liền kề
 
                 # Log compose mode
                 mode_desc = {
@@ -3295,144 +3771,38 @@ class SmartEngine:
                 else:
                     self.log(f"  Ken Burns: OFF (ảnh tĩnh)")
 
+                clip_ctx = {
+                    'fade_duration': FADE_DURATION,
+                    'compose_mode': compose_mode,
+                    'kb_enabled': kb_enabled,
+                    'use_simple_kb': use_simple_kb,
+                    'use_gpu': use_gpu,
+                    'gpu_encoder': gpu_encoder,
+                    'ken_burns': ken_burns,
+                    'media_probe': media_probe,
+                    'rng': random,
+                    'last_kb_effect': None,  # Tránh lặp hiệu ứng liền kề
+                    'kb_intensity': kb_intensity,
+                }
+
+                # Segmented: mỗi đoạn 1-2 phút render riêng (có phụ đề),
+                # đoạn không đổi dùng lại, ghép bằng stream copy
+                if segment_seconds > 0:
+                    segmented = self._compose_segmented(
+                        proj_dir, media_items, voice_path, srt_path, output_path,
+                        clip_ctx, segment_seconds, Path(temp_dir)
+                    )
+                    if segmented:
+                        return segmented
+                    self.log("  [SEGMENT] That bai → render ca video 1 lan", "WARN")
+                    clip_ctx.update(rng=random, last_kb_effect=None)
+                    ken_burns.reset_pattern()
+
                 # Tạo từng clip
                 clip_paths = []
                 for i, item in enumerate(media_items):
                     clip_path = Path(temp_dir) / f"clip_{i:03d}.mp4"
-                    abs_path = str(Path(item['path']).resolve()).replace('\\', '/')
-                    target_duration = item['duration']
-
-                    # === TRANSITION EFFECTS ===
-                    # Random theo tỉ lệ: 20% none, 40% fade_black, 40% mix
-                    rand_val = random.random()
-                    if rand_val < 0.2:
-                        transition_type = 'none'       # 20%
-                    elif rand_val < 0.6:
-                        transition_type = 'fade_black' # 40%
-                    else:
-                        transition_type = 'mix'        # 40%
-                    fade_out_start = max(0, target_duration - FADE_DURATION)
-
-                    if transition_type == 'none':
-                        # Không có hiệu ứng chuyển cảnh
-                        fade_filter = ""
-                    elif transition_type == 'fade_black':
-                        # Tối dần: fade in/out to black
-                        fade_filter = f"fade=t=in:st=0:d={FADE_DURATION},fade=t=out:st={fade_out_start}:d={FADE_DURATION}"
-                    else:
-                        # Mix: fade với alpha (crossfade effect khi concat)
-                        fade_filter = f"fade=t=in:st=0:d={FADE_DURATION}:alpha=1,fade=t=out:st={fade_out_start}:d={FADE_DURATION}:alpha=1"
-
-                    if item['is_video']:
-                        # === VIDEO CLIP: Cắt lấy phần giữa + thêm transitions ===
-                        # Lấy duration của video gốc
-                        probe_cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration",
-                                    "-of", "default=noprint_wrappers=1:nokey=1", abs_path]
-                        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-                        video_duration = float(probe_result.stdout.strip()) if probe_result.stdout.strip() else 8.0
-
-                        # Base filter: scale + pad + transitions (nếu có)
-                        if fade_filter:
-                            base_vf = f"scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2,{fade_filter}"
-                        else:
-                            base_vf = f"scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2"
-
-                        # Video encoder settings
-                        v_encoder = gpu_encoder if use_gpu else "libx264"
-                        v_preset = ["-preset", "p4"] if use_gpu else ["-preset", "fast"]
-
-                        if video_duration > target_duration:
-                            # Cắt lấy phần giữa: bỏ đầu và cuối bằng nhau
-                            trim_total = video_duration - target_duration
-                            trim_start = trim_total / 2
-                            cmd_clip = [
-                                "ffmpeg", "-y",
-                                "-ss", str(trim_start),
-                                "-i", abs_path,
-                                "-t", str(target_duration),
-                                "-vf", base_vf,
-                                "-c:v", v_encoder, *v_preset,
-                                "-pix_fmt", "yuv420p",
-                                "-an",  # Bỏ audio từ video clip
-                                "-r", "25", str(clip_path)
-                            ]
-                        else:
-                            # Video ngắn hơn target → dùng nguyên video
-                            cmd_clip = [
-                                "ffmpeg", "-y",
-                                "-i", abs_path,
-                                "-t", str(target_duration),
-                                "-vf", base_vf,
-                                "-c:v", v_encoder, *v_preset,
-                                "-pix_fmt", "yuv420p",
-                                "-an",
-                                "-r", "25", str(clip_path)
-                            ]
-                    else:
-                        # === IMAGE: Tạo clip (với hoặc không có Ken Burns) ===
-                        # SAFEGUARD: Clip > 20s thì skip zoompan để tránh timeout
-                        MAX_KB_DURATION = 20
-                        use_kb_for_this_clip = kb_enabled and target_duration <= MAX_KB_DURATION
-
-                        if target_duration > MAX_KB_DURATION and kb_enabled:
-                            self.log(f"  ⚠️ Clip {i}: {target_duration:.1f}s > {MAX_KB_DURATION}s, skip Ken Burns", "WARN")
-
-                        if use_kb_for_this_clip:
-                            # Ken Burns effect (zoom/pan mượt mà)
-                            kb_effect = ken_burns.get_random_effect(exclude_last=last_kb_effect)
-                            last_kb_effect = kb_effect
-
-                            # Tạo filter với Ken Burns + fade
-                            # simple_mode=True cho balanced mode (no easing, nhanh hơn)
-                            vf = ken_burns.generate_filter(
-                                kb_effect, target_duration, FADE_DURATION,
-                                simple_mode=use_simple_kb
-                            )
-
-                            # Log hiệu ứng đang dùng (mỗi 5 ảnh)
-                            if i % 5 == 0:
-                                self.log(f"    #{item['id']}: {kb_effect.value} (mode={'balanced' if use_simple_kb else 'quality'})")
-
-                            # Debug: Log filter cho clip đầu tiên
-                            if i == 0:
-                                self.log(f"  [DEBUG] Filter clip 0: {vf[:150]}...")
-                        else:
-                            # FAST MODE: Chỉ scale giữ nguyên tỷ lệ, không crop
-                            # Nhanh nhất - không có hiệu ứng gì
-                            base_filter = "scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2"
-
-                            # Thêm fade
-                            if fade_filter:
-                                vf = f"{base_filter},{fade_filter}"
-                            else:
-                                vf = base_filter
-
-                        # Build FFmpeg command với GPU acceleration nếu có
-                        # Fast mode dùng preset nhanh nhất
-                        if use_gpu:
-                            nvenc_preset = "p1" if compose_mode == "fast" else "p4"  # p1=fastest
-                            cmd_clip = [
-                                "ffmpeg", "-y",
-                                "-loop", "1", "-t", str(target_duration),
-                                "-i", abs_path,
-                                "-vf", vf,
-                                "-c:v", gpu_encoder,  # h264_nvenc
-                                "-preset", nvenc_preset,
-                                "-pix_fmt", "yuv420p",
-                                "-r", "25", str(clip_path)
-                            ]
-                        else:
-                            cpu_preset = "ultrafast" if compose_mode == "fast" else "fast"
-                            cmd_clip = [
-                                "ffmpeg", "-y",
-                                "-loop", "1", "-t", str(target_duration),
-                                "-i", abs_path,
-                                "-vf", vf,
-                                "-c:v", "libx264",
-                                "-preset", cpu_preset,
-                                "-pix_fmt", "yuv420p",
-                                "-r", "25", str(clip_path)
-                            ]
+                    cmd_clip = self._build_clip_command(item, i, clip_path, clip_ctx)
 
                     result = subprocess.run(cmd_clip, capture_output=True, text=True, timeout=300)  # 5 phút cho zoompan
                     if result.returncode != 0:
@@ -3486,29 +3856,8 @@ class SmartEngine:
                 # Burn subtitles nếu có
                 if srt_path and srt_path.exists():
                     self.log("  Dang burn phu de...")
-                    # Escape SRT path cho FFmpeg filter
-                    srt_escaped = str(srt_path).replace('\\', '/').replace(':', '\\:')
-
-                    # Font path - Anton Regular
-                    font_dir = "C\\:/Users/admin/AppData/Local/Microsoft/Windows/Fonts"
-
-                    # Style: Chữ trắng, viền đen, font Anton
-                    # PrimaryColour format: &HAABBGGRR (Alpha, Blue, Green, Red)
-                    # &H00FFFFFF = white, &H00000000 = black
-                    subtitle_style = (
-                        "FontName=Anton,"
-                        "FontSize=32,"  # Vua phai, 1 dong ~ 50 ky tu
-                        "PrimaryColour=&H00FFFFFF,"  # Trắng
-                        "OutlineColour=&H00000000,"  # Đen
-                        "BorderStyle=1,"
-                        "Outline=2,"  # Vien mong
-                        "Shadow=0,"
-                        "MarginV=30,"
-                        "Alignment=2"  # Bottom center
-                    )
-
-                    # FFmpeg command với custom font
-                    vf_filter = f"subtitles='{srt_escaped}':fontsdir='{font_dir}':force_style='{subtitle_style}'"
+                    # FFmpeg command với custom font (fallback: font mặc định)
+                    vf_filter, vf_simple = self._subtitle_filters(srt_path)
 
                     cmd3 = [
                         "ffmpeg", "-y",
@@ -3521,7 +3870,6 @@ class SmartEngine:
                         self.log(f"  Subtitle burn failed: {result.stderr[-200:]}", "WARN")
                         # Fallback: thử không có custom font
                         self.log("  Thu lai voi font mac dinh...", "WARN")
-                        vf_simple = f"subtitles='{srt_escaped}':force_style='FontSize=32,PrimaryColour=&H00FFFFFF,OutlineColour=&H00000000,BorderStyle=1,Outline=2'"
                         cmd3_simple = [
                             "ffmpeg", "-y",
                             "-i", str(temp_with_audio),
@@ -3564,6 +3912,355 @@ class SmartEngine:
             traceback.print_exc()
             return None
 
+    SEGMENT_VERSION = 2  # Bump khi đổi cách render → render lại mọi đoạn
+
+    def _compose_segmented(self, proj_dir: Path, media_items: List[Dict], voice_path: Path,
+                           srt_path: Optional[Path], output_path: Path, clip_ctx: Dict,
+                           segment_seconds: float, temp_dir: Path) -> Optional[Path]:
+        """
+        Render final theo đoạn (segments/), chỉ render lại đoạn có thay đổi.
+
+        - Chia timeline tại ranh giới clip (mỗi clip bắt đầu bằng keyframe)
+          thành các đoạn ~segment_seconds; lần sau cắt lại tại scene mở đầu
+          các đoạn cũ (manifest) để sửa 1 scene chỉ render lại đoạn quanh nó
+        - Mỗi đoạn: render clips → concat → burn phụ đề của riêng đoạn đó
+        - Fingerprint đoạn = media (path/size/mtime/duration) + phụ đề trong đoạn
+          + settings compose; lưu ở segments/manifest.json
+        - Ghép: concat stream copy + voice (AAC) 1 lần, không encode lại video
+
+        Đoạn chỉ được lưu khi mọi clip + burn phụ đề thành công; lỗi bất kỳ →
+        None (caller render cả video 1 lần), không ghi manifest.
+
+        Returns:
+            output_path hoặc None nếu lỗi
+        """
+        import hashlib
+        import random
+        import subprocess
+        from .utils import parse_srt_file, format_srt_time
+        from datetime import timedelta
+
+        seg_dir = proj_dir / "segments"
+        seg_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = seg_dir / "manifest.json"
+
+        # Chia đoạn theo ranh giới clip. Có manifest cũ (cùng version/độ dài
+        # đoạn) → cắt lại tại scene mở đầu các đoạn cũ: thêm/bớt scene chỉ làm
+        # đổi đoạn chứa nó, đoạn sau giữ nguyên ranh giới (+ fingerprint)
+        old_starts = set()
+        try:
+            old_manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+            if (old_manifest.get('version') == self.SEGMENT_VERSION
+                    and old_manifest.get('segment_seconds') == segment_seconds):
+                old_starts = {seg['scenes'][0] for seg in old_manifest.get('segments', []) if seg.get('scenes')}
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        # Re-sync theo ranh giới cũ: đoạn chỉ tự cắt theo thời gian khi dài gấp đôi
+        max_seconds = segment_seconds * (2 if old_starts else 1)
+
+        segments = []
+        current = []
+        seg_start = 0.0
+        video_time = 0.0
+        for i, item in enumerate(media_items):
+            if current and (item['id'] in old_starts or video_time - seg_start >= max_seconds):
+                segments.append((seg_start, video_time, current))
+                current = []
+                seg_start = video_time
+            current.append((i, item))
+            video_time += item['duration']
+        if current:
+            segments.append((seg_start, video_time, current))
+
+        srt_entries = []
+        if srt_path and srt_path.exists():
+            try:
+                srt_entries = parse_srt_file(srt_path)
+            except Exception as e:
+                self.log(f"  [SEGMENT] Khong doc duoc SRT: {e}", "WARN")
+
+        encode_key = {
+            'version': self.SEGMENT_VERSION,
+            'compose_mode': clip_ctx['compose_mode'],
+            'kb_intensity': clip_ctx.get('kb_intensity'),
+            'encoder': clip_ctx['gpu_encoder'] if clip_ctx['use_gpu'] else "libx264",
+        }
+
+        plan = []
+        for k, (start, end, items) in enumerate(segments):
+            media_key = []
+            for i, item in items:
+                try:
+                    st = Path(item['path']).stat()
+                    stat_key = [st.st_size, st.st_mtime]
+                except OSError:
+                    stat_key = None
+                # Không gồm vị trí clip i (chỉ dùng để log) → thêm/bớt scene phía
+                # trước không đổi fingerprint các đoạn sau
+                media_key.append([item['id'], item['path'], stat_key,
+                                  round(item['duration'], 3), item['is_video']])
+            # Phụ đề giao với đoạn, dời về 0 theo đầu đoạn
+            subs = []
+            for e in srt_entries:
+                s_start = max(e.start_time.total_seconds(), start)
+                s_end = min(e.end_time.total_seconds(), end)
+                if s_end > s_start:
+                    subs.append([round(s_start - start, 3), round(s_end - start, 3), e.text])
+            fingerprint = hashlib.sha1(json.dumps(
+                {'encode': encode_key, 'media': media_key, 'subs': subs},
+                ensure_ascii=False, sort_keys=True
+            ).encode('utf-8')).hexdigest()
+            plan.append({
+                'index': k,
+                'start': round(start, 3),
+                'duration': round(end - start, 3),
+                'scenes': [item['id'] for _, item in items],
+                'fingerprint': fingerprint,
+                'file': f"seg_{fingerprint[:16]}.mp4",
+                '_items': items,
+                '_subs': subs,
+            })
+
+        to_render = [seg for seg in plan if not (seg_dir / seg['file']).exists()]
+        self.log(f"  [SEGMENT] {len(plan)} doan ~{segment_seconds:.0f}s: render {len(to_render)}, dung lai {len(plan) - len(to_render)}")
+
+        ken_burns = clip_ctx['ken_burns']
+        for seg in to_render:
+            k = seg['index']
+            work = temp_dir / f"seg_{k:04d}"
+            work.mkdir(parents=True, exist_ok=True)
+
+            # Render lại cùng input → cùng transition (random theo fingerprint)
+            seg_ctx = dict(clip_ctx, rng=random.Random(seg['fingerprint']), last_kb_effect=None)
+            ken_burns.reset_pattern()
+
+            clip_paths = []
+            for i, item in seg['_items']:
+                clip_path = work / f"clip_{i:04d}.mp4"
+                cmd_clip = self._build_clip_command(item, i, clip_path, seg_ctx)
+                result = subprocess.run(cmd_clip, capture_output=True, text=True, timeout=300)
+                if result.returncode != 0:
+                    # Đoạn thiếu clip lệch timeline với voice → không lưu
+                    self.log(f"  [SEGMENT] Doan {k}: clip {i} failed: {result.stderr[-200:]}", "ERROR")
+                    return None
+                clip_paths.append(clip_path)
+
+            list_file = work / "clips.txt"
+            with open(list_file, 'w', encoding='utf-8') as f:
+                for cp in clip_paths:
+                    f.write(f"file '{str(cp).replace(chr(92), '/')}'\n")
+            raw_video = work / "raw.mp4"
+            result = subprocess.run([
+                "ffmpeg", "-y", "-f", "concat", "-safe", "0",
+                "-i", str(list_file), "-c", "copy", str(raw_video)
+            ], capture_output=True, text=True)
+            if result.returncode != 0:
+                self.log(f"  [SEGMENT] Doan {k}: concat error {result.stderr[-200:]}", "ERROR")
+                return None
+
+            seg_out = work / "out.mp4"
+            burned = False
+            if seg['_subs']:
+                seg_srt = work / "subs.srt"
+                with open(seg_srt, 'w', encoding='utf-8') as f:
+                    for n, (a, b, text) in enumerate(seg['_subs'], 1):
+                        f.write(f"{n}\n{format_srt_time(timedelta(seconds=a))} --> "
+                                f"{format_srt_time(timedelta(seconds=b))}\n{text}\n\n")
+                # Cùng encoder/preset/fps với clip (_build_clip_command)
+                for vf in self._subtitle_filters(seg_srt):
+                    result = subprocess.run([
+                        "ffmpeg", "-y", "-i", str(raw_video), "-vf", vf, "-an",
+                        *self._clip_encode_args(seg_ctx), str(seg_out)
+                    ], capture_output=True, text=True)
+                    if result.returncode == 0:
+                        burned = True
+                        break
+                    self.log(f"  [SEGMENT] Doan {k}: subtitle burn failed: {result.stderr[-200:]}", "WARN")
+                if not burned:
+                    # Đoạn không phụ đề sẽ được dùng lại mãi → không lưu
+                    return None
+            else:
+                os.replace(raw_video, seg_out)
+
+            os.replace(seg_out, seg_dir / seg['file'])
+            self.log(f"  [SEGMENT] Doan {k + 1}/{len(plan)} xong ({seg['duration']:.0f}s, {len(clip_paths)} clips)")
+
+        inc("compose_segments_rendered", len(to_render))
+        inc("compose_segments_reused", len(plan) - len(to_render))
+
+        # Manifest + dọn đoạn cũ không còn dùng
+        manifest = {
+            'version': self.SEGMENT_VERSION,
+            'segment_seconds': segment_seconds,
+            'segments': [{k: v for k, v in seg.items() if not k.startswith('_')} for seg in plan],
+        }
+        manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding='utf-8')
+        used = {seg['file'] for seg in plan}
+        for old in seg_dir.glob("seg_*.mp4"):
+            if old.name not in used:
+                old.unlink(missing_ok=True)
+
+        # Ghép: video copy + voice
+        self.log("  [SEGMENT] Ghep doan + voice (stream copy)...")
+        list_file = temp_dir / "segments.txt"
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for seg in plan:
+                f.write(f"file '{str((seg_dir / seg['file']).resolve()).replace(chr(92), '/')}'\n")
+        result = subprocess.run([
+            "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", str(list_file),
+            "-i", str(voice_path), "-map", "0:v", "-map", "1:a",
+            "-c:v", "copy", "-c:a", "aac", "-b:a", "192k",
+            "-shortest", str(output_path)
+        ], capture_output=True, text=True)
+        if result.returncode != 0:
+            self.log(f"  [SEGMENT] Ghep that bai: {result.stderr[-200:]}", "ERROR")
+            return None
+
+        self.log(f"  Video hoan thanh: {output_path.name}", "OK")
+        return output_path
+
+    # Draft preview: 480p, fps thấp, không Ken Burns/transition, phụ đề mềm
+    DRAFT_WIDTH = 854
+    DRAFT_HEIGHT = 480
+    DRAFT_FPS = 12
+    DRAFT_VERSION = 1  # Bump khi đổi settings → render lại clip cache
+
+    @timed("compose_draft", ok=lambda path: path is not None)
+    def _compose_draft_video(self, proj_dir: Path, excel_path: Path, name: str) -> Optional[Path]:
+        """
+        Bản xem trước 480p để kiểm tra timing + chọn ảnh trước khi render final.
+
+        - Cùng timeline với _compose_video (_build_compose_timeline)
+        - Scene chưa có ảnh → khung xám giữ chỗ (chạy được khi ảnh đang tạo dở)
+        - Clip cache trong draft/clips/ theo file + mtime + duration → chạy lại
+          chỉ render clip mới/đổi, phần còn lại stream copy
+        - Ghép 1 lần: concat copy + audio + phụ đề mềm (mov_text), không encode lại
+
+        Returns:
+            Path {name}_draft.mp4 hoặc None nếu lỗi
+        """
+        import hashlib
+        import subprocess
+        import tempfile
+
+        if not self._check_ffmpeg():
+            return None
+
+        inputs = self._find_compose_inputs(proj_dir, name)
+        if not inputs:
+            return None
+        voice_path, srt_path = inputs
+
+        timeline = self._build_compose_timeline(
+            excel_path, proj_dir / "img", voice_path, proj_dir / ".media_probe.json",
+            include_missing=True
+        )
+        if not timeline:
+            return None
+        media_items = timeline['items']
+        media_probe = timeline['probe']
+
+        clips_dir = proj_dir / "draft" / "clips"
+        clips_dir.mkdir(parents=True, exist_ok=True)
+        w, h, fps = self.DRAFT_WIDTH, self.DRAFT_HEIGHT, self.DRAFT_FPS
+        encode_args = [
+            "-c:v", "libx264", "-preset", "ultrafast", "-crf", "32",
+            "-pix_fmt", "yuv420p", "-r", str(fps), "-g", str(fps * 2),
+            "-threads", "2", "-an"
+        ]
+        scale_vf = f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1"
+
+        # Lệnh render cho từng clip (key = nội dung clip)
+        jobs = []
+        clip_paths = []
+        missing_count = 0
+        for item in media_items:
+            duration = max(0.1, item['duration'])
+            src = Path(item['path'])
+            if item.get('missing'):
+                missing_count += 1
+                key_src = "missing"
+                cmd_input = ["-f", "lavfi", "-i", f"color=c=0x303030:s={w}x{h}:r={fps}", "-t", f"{duration:.3f}"]
+            else:
+                st = src.stat()
+                trim_start = 0.0
+                if item['is_video']:
+                    video_duration = media_probe.duration(src, default=8.0)
+                    trim_start = max(0.0, (video_duration - duration) / 2)
+                    cmd_input = ["-ss", f"{trim_start:.3f}", "-i", str(src), "-t", f"{duration:.3f}"]
+                else:
+                    cmd_input = ["-loop", "1", "-t", f"{duration:.3f}", "-i", str(src)]
+                key_src = f"{src.resolve()}|{st.st_size}|{st.st_mtime}|{trim_start:.3f}"
+
+            key = hashlib.sha1(
+                f"{self.DRAFT_VERSION}|{key_src}|{duration:.3f}|{w}x{h}@{fps}".encode("utf-8")
+            ).hexdigest()[:16]
+            clip_path = clips_dir / f"{key}.mp4"
+            clip_paths.append(clip_path)
+            if not clip_path.exists():
+                vf = scale_vf if not item.get('missing') else "setsar=1"
+                jobs.append((item['id'], clip_path,
+                             ["ffmpeg", "-y", *cmd_input, "-vf", vf, *encode_args, str(clip_path)]))
+
+        reused = len(clip_paths) - len(jobs)
+        self.log(f"  [DRAFT] {len(clip_paths)} clips: render {len(jobs)}, cache {reused}, giữ chỗ {missing_count}")
+
+        def render(job):
+            scene_id, clip_path, cmd = job
+            tmp_path = clip_path.with_suffix(".part.mp4")
+            cmd = cmd[:-1] + [str(tmp_path)]
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+            if result.returncode != 0 or not tmp_path.exists():
+                self.log(f"  [DRAFT] Clip {scene_id} failed: {result.stderr[-200:]}", "WARN")
+                tmp_path.unlink(missing_ok=True)
+                return False
+            os.replace(tmp_path, clip_path)
+            return True
+
+        if jobs:
+            workers = max(1, min(len(jobs), (os.cpu_count() or 2) // 2))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(render, jobs))
+
+        inc("draft_clips_rendered", len(jobs))
+        inc("draft_clips_reused", reused)
+
+        clip_paths = [cp for cp in clip_paths if cp.exists()]
+        if not clip_paths:
+            self.log("  [DRAFT] Khong tao duoc clip nao!", "ERROR")
+            return None
+
+        # Dọn clip cũ không còn dùng (ảnh đã đổi/xóa)
+        used = {cp.name for cp in clip_paths}
+        for old in clips_dir.glob("*.mp4"):
+            if old.name not in used:
+                old.unlink(missing_ok=True)
+
+        # Ghép: video stream copy + audio + phụ đề mềm trong 1 lệnh
+        output_path = proj_dir / f"{name}_draft.mp4"
+        fd, list_name = tempfile.mkstemp(suffix=".txt", dir=str(clips_dir.parent))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for cp in clip_paths:
+                    f.write(f"file '{str(cp.resolve()).replace(chr(92), '/')}'\n")
+
+            cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_name, "-i", str(voice_path)]
+            maps = ["-map", "0:v", "-map", "1:a"]
+            if srt_path and srt_path.exists():
+                cmd += ["-i", str(srt_path)]
+                maps += ["-map", "2:s", "-c:s", "mov_text"]
+            cmd += [*maps, "-c:v", "copy", "-c:a", "aac", "-b:a", "64k", "-shortest", str(output_path)]
+
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            if result.returncode != 0:
+                self.log(f"  [DRAFT] Ghep that bai: {result.stderr[-200:]}", "ERROR")
+                return None
+        finally:
+            Path(list_name).unlink(missing_ok=True)
+
+        self.log(f"  [DRAFT] Xem truoc: {output_path.name}", "OK")
+        return output_path
+
     def _parse_timestamp(self, timestamp: str) -> float:
         """Parse timestamp SRT format (00:01:23,456) sang giây."""
         if not timestamp:
@@ -3578,6 +4275,7 @@ class SmartEngine:
             return int(m) * 60 + float(s)
         return float(timestamp) if timestamp else 0.0
 
+    @timed("compose_video_simple", ok=lambda path: path is not None)
     def _compose_video_simple(self, proj_dir: Path, excel_path: Path, name: str,
                                images: list, voice_path: Path, srt_path: Path,
                                temp_dir: str) -> Optional[Path]:
@@ -4305,6 +5003,7 @@ class SmartEngine:
                         video_path = img_dir / f"{image_id}.mp4"
                         if self._download_video(video_url, video_path):
                             self._video_results['success'] += 1
+                            inc("videos", status="ok")
                             self.log(f"[VIDEO] OK: {image_id} -> {video_path.name}")
 
                             # Xóa ảnh gốc nếu cần
@@ -4325,6 +5024,7 @@ class SmartEngine:
                     if not success:
                         self._video_results['failed'] += 1
                         self._video_results['failed_items'].append(item)  # Track for retry
+                        inc("videos", status="failed")
                         self.log(f"[VIDEO] FAILED: {image_id} - {error}", "ERROR")
 
                 except Exception as e:
@@ -4345,16 +5045,15 @@ class SmartEngine:
 
         self.log(f"[VIDEO] Worker stopped. Results: {self._video_results['success']} OK, {self._video_results['failed']} failed")
 
+    @timed("video_download", ok=bool)
     def _download_video(self, url: str, save_path: Path) -> bool:
         """Download video từ URL và lưu vào file."""
         try:
-            import requests
-            resp = requests.get(url, timeout=120)
-            if resp.status_code == 200:
-                save_path.parent.mkdir(parents=True, exist_ok=True)
-                save_path.write_bytes(resp.content)
+            from .download_manager import get_download_manager
+            result = get_download_manager().download(url, save_path)
+            if result.success:
                 return True
-            self.log(f"[VIDEO] Download failed: {resp.status_code}", "ERROR")
+            self.log(f"[VIDEO] Download failed: {result.error}", "ERROR")
             return False
         except Exception as e:
             self.log(f"[VIDEO] Download error: {e}", "ERROR")
@@ -4437,7 +5136,7 @@ class SmartEngine:
 
                 # Create separate engine instance for this thread
                 # to avoid conflicts with shared state
-                engine = SmartEngine(config_dir=self.config_dir)
+                engine = SmartEngine(config_path=str(self.config_path))
                 engine.callback = lambda msg, lvl="INFO": thread_log(msg, lvl)
 
                 # Determine output dir
@@ -0,0 +1,383 @@
+"""
+VE3 Tool - Story Map-Reduce
+===========================
+Phân tích nhân vật / bối cảnh cho truyện dài theo kiểu map-reduce:
+
+- MAP: chia SRT thành các đoạn theo ngân sách token, mỗi đoạn 1 request
+  (chạy song song) → nhân vật, bối cảnh, thời điểm xuất hiện, tóm tắt đoạn
+- Gộp sơ bộ bằng code: cùng id / cùng tên → 1 entity (gộp appearances)
+- REDUCE: 1 request nhỏ chỉ gửi danh sách entity rút gọn (không gửi lại
+  truyện) → LLM nhóm các entity trùng (alias, id khác) + đặt ID cuối cùng.
+  Reduce lỗi → đặt ID bằng code (nvc giữ nguyên, còn lại nv1.. theo độ
+  quan trọng)
+- Kết quả cùng format JSON với analyze_story → cùng đường dựng
+  Character / Location như phân tích 1 request
+
+Usage:
+    from modules.story_map_reduce import chunk_entries, merge_chunks, apply_groups
+
+    chunks = chunk_entries(srt_entries, max_tokens=3000)
+    merged = merge_chunks([json_chunk_1, json_chunk_2, ...], chunks)
+    json_data = apply_groups(merged, reduce_json)  # reduce_json=None → ID bằng code
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from modules.token_budget import estimate_tokens
+
+
+# ID nhân vật kể chuyện (giữ nguyên khi gộp - prompt dùng trực tiếp)
+NARRATOR_IDS = ("nvc", "nvc_young", "nvc1")
+
+# Thứ tự vai (nhỏ = quan trọng hơn)
+ROLE_RANK = {"main": 0, "supporting": 1, "minor": 2}
+
+# Số appearances giữ lại mỗi entity sau khi gộp
+MAX_APPEARANCES = 20
+
+
+# ============================================================================
+# MAP: CHIA ĐOẠN
+# ============================================================================
+
+def _hms(td) -> str:
+    seconds = int(td.total_seconds())
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def chunk_entries(
+    entries: List,
+    max_tokens: int = 3000,
+    count_tokens: Callable[[str], int] = estimate_tokens
+) -> List[List]:
+    """
+    Chia SRT entries thành các đoạn liên tiếp, mỗi đoạn ~max_tokens.
+
+    Không cắt giữa 1 entry; entry dài hơn max_tokens đứng 1 mình 1 đoạn.
+    """
+    chunks: List[List] = []
+    current: List = []
+    used = 0
+    for entry in entries:
+        tokens = count_tokens(entry.text) + 8  # + timestamp mỗi dòng
+        if current and used + tokens > max_tokens:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(entry)
+        used += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_time_range(chunk: List) -> str:
+    """"HH:MM:SS - HH:MM:SS" của 1 đoạn."""
+    return f"{_hms(chunk[0].start_time)} - {_hms(chunk[-1].end_time)}"
+
+
+def format_chunk(chunk: List) -> str:
+    """Nội dung đoạn cho prompt MAP: mỗi dòng "[HH:MM:SS] lời dẫn"."""
+    return "\n".join(f"[{_hms(e.start_time)}] {e.text}" for e in chunk)
+
+
+# ============================================================================
+# GỘP SƠ BỘ (CODE)
+# ============================================================================
+
+def _norm(value: Any) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", str(value or "").lower()).strip("_")
+
+
+def _is_narrator(char_id: str) -> bool:
+    return char_id in NARRATOR_IDS or char_id.startswith("nvc")
+
+
+def _age_group(data: Dict) -> str:
+    """Cùng người khác tuổi (hiện tại / trẻ / trẻ em) = nhân vật riêng."""
+    char_id = _norm(data.get("id"))
+    if data.get("is_child") or char_id == "nvc1":
+        return "child"
+    return "young" if char_id.endswith("_young") else "adult"
+
+
+@dataclass
+class Entity:
+    """1 nhân vật / bối cảnh sau khi gộp sơ bộ (members = dữ liệu từng đoạn)."""
+    key: str                       # c1, c2.. / l1, l2.. (dùng trong prompt REDUCE)
+    id: str
+    members: List[Dict] = field(default_factory=list)
+    chunks: List[int] = field(default_factory=list)
+
+    def add(self, data: Dict, chunk_idx: int) -> None:
+        self.members.append(data)
+        if chunk_idx not in self.chunks:
+            self.chunks.append(chunk_idx)
+
+    @property
+    def names(self) -> List[str]:
+        seen: List[str] = []
+        for data in self.members:
+            for name in [data.get("name")] + list(data.get("aliases") or []):
+                if name and name not in seen:
+                    seen.append(str(name))
+        return seen
+
+
+@dataclass
+class MergedStory:
+    """Kết quả gộp sơ bộ các đoạn MAP."""
+    characters: List[Entity] = field(default_factory=list)
+    locations: List[Entity] = field(default_factory=list)
+    settings: List[Dict] = field(default_factory=list)
+    outline: List[str] = field(default_factory=list)
+
+
+def _find(entities: List[Entity], data: Dict, is_character: bool) -> Optional[Entity]:
+    """Entity đã có cùng id, hoặc cùng tên (nhân vật: cùng nhóm tuổi)."""
+    data_id = _norm(data.get("id"))
+    data_name = _norm(data.get("name"))
+    for entity in entities:
+        if data_id and entity.id == data_id:
+            return entity
+    if not data_name:
+        return None
+    for entity in entities:
+        first = entity.members[0]
+        if _norm(first.get("name")) != data_name:
+            continue
+        if not is_character or _age_group(first) == _age_group(data):
+            return entity
+    return None
+
+
+def merge_chunks(chunk_results: List[Optional[Dict]], chunks: List[List]) -> MergedStory:
+    """
+    Gộp JSON của các đoạn MAP theo id / tên.
+
+    Args:
+        chunk_results: JSON từng đoạn (None = đoạn lỗi, bỏ qua)
+        chunks: SRT entries từng đoạn (cùng thứ tự) - lấy khoảng thời gian
+    """
+    merged = MergedStory()
+    for idx, data in enumerate(chunk_results):
+        if not isinstance(data, dict):
+            continue
+        time_range = chunk_time_range(chunks[idx])
+        if data.get("summary"):
+            merged.outline.append(f"[{time_range}] {data['summary']}")
+        if isinstance(data.get("world_setting"), dict):
+            merged.settings.append(data["world_setting"])
+
+        for kind, entities, prefix in (
+            ("characters", merged.characters, "c"),
+            ("locations", merged.locations, "l"),
+        ):
+            for item in data.get(kind) or []:
+                if not isinstance(item, dict) or not (item.get("id") or item.get("name")):
+                    continue
+                if not item.get("appearances"):
+                    item = dict(item, appearances=[time_range])
+                entity = _find(entities, item, kind == "characters")
+                if entity is None:
+                    entity = Entity(
+                        key=f"{prefix}{len(entities) + 1}",
+                        id=_norm(item.get("id")) or _norm(item.get("name")),
+                    )
+                    entities.append(entity)
+                entity.add(item, idx)
+    return merged
+
+
+# ============================================================================
+# REDUCE
+# ============================================================================
+
+def _brief(text: str, limit: int = 140) -> str:
+    text = " ".join(str(text or "").split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def reduce_inputs(merged: MergedStory) -> Dict[str, str]:
+    """Tham số cho template merge_story_entities (danh sách rút gọn, không có truyện)."""
+    char_lines = []
+    for e in merged.characters:
+        best = _representative(e.members, "character_lock")
+        details = ", ".join(str(v) for v in (
+            best.get("role"), best.get("age"), best.get("gender"),
+            best.get("timeline"), "child" if any(m.get("is_child") for m in e.members) else "",
+        ) if v not in (None, ""))
+        char_lines.append(
+            f"- {e.key} | {e.id} | {' / '.join(e.names[:4])} | {details}; "
+            f"{_brief(best.get('character_lock'))} | {len(e.chunks)} doan"
+        )
+    loc_lines = [
+        f"- {e.key} | {e.id} | {' / '.join(e.names[:3])} | "
+        f"{_brief(_representative(e.members, 'location_lock').get('location_lock'))} | {len(e.chunks)} doan"
+        for e in merged.locations
+    ]
+    setting_lines = [
+        "- " + ", ".join(f"{k}: {v}" for k, v in s.items() if v)
+        for s in merged.settings
+    ]
+    return {
+        "characters_list": "\n".join(char_lines) or "(none)",
+        "locations_list": "\n".join(loc_lines) or "(none)",
+        "settings_list": "\n".join(setting_lines) or "(none)",
+    }
+
+
+def _representative(members: List[Dict], lock_key: str) -> Dict:
+    """Bản mô tả đầy đủ nhất (lock dài nhất) làm đại diện."""
+    return max(members, key=lambda m: len(str(m.get(lock_key) or "")))
+
+
+def _merge_world_setting(settings: List[Dict]) -> Dict[str, str]:
+    """Mỗi trường lấy giá trị xuất hiện nhiều nhất giữa các đoạn."""
+    merged: Dict[str, str] = {}
+    keys = {k for s in settings for k in s}
+    for key in sorted(keys):
+        values = Counter(str(s[key]) for s in settings if s.get(key))
+        if values:
+            merged[key] = values.most_common(1)[0][0]
+    return merged
+
+
+def _merge_character(final_id: str, entities: List[Entity]) -> Dict:
+    members = [m for e in entities for m in e.members]
+    best = dict(_representative(members, "character_lock"))
+    best["id"] = final_id
+    best["role"] = min(
+        (m.get("role") or "supporting" for m in members),
+        key=lambda r: ROLE_RANK.get(r, len(ROLE_RANK))
+    )
+    if any(m.get("is_child") or m.get("portrait_prompt") == "DO_NOT_GENERATE" for m in members):
+        best["is_child"] = True
+        best["portrait_prompt"] = "DO_NOT_GENERATE"
+    best["aliases"] = [n for e in entities for n in e.names][:10]
+    best["appearances"] = _merge_appearances(members)
+    return best
+
+
+def _merge_location(final_id: str, entities: List[Entity]) -> Dict:
+    members = [m for e in entities for m in e.members]
+    best = dict(_representative(members, "location_lock"))
+    best["id"] = final_id
+    best["appearances"] = _merge_appearances(members)
+    return best
+
+
+def _merge_appearances(members: List[Dict]) -> List[str]:
+    seen: List[str] = []
+    for m in members:
+        for item in m.get("appearances") or []:
+            if isinstance(item, str) and item not in seen:
+                seen.append(item)
+    return seen[:MAX_APPEARANCES]
+
+
+def _fallback_character_ids(entities: List[Entity]) -> Dict[str, str]:
+    """
+    ID khi không có kết quả REDUCE: narrator giữ id, nhân vật khác nv1, nv2..
+    theo vai + số đoạn xuất hiện; "<slug>_young" → "<nvN>_young".
+    """
+    ids: Dict[str, str] = {}
+    base_ids: Dict[str, str] = {}
+    others = []
+    for e in entities:
+        if _is_narrator(e.id):
+            ids[e.key] = e.id
+        else:
+            others.append(e)
+    others.sort(key=lambda e: (
+        min(ROLE_RANK.get(m.get("role"), len(ROLE_RANK)) for m in e.members),
+        -len(e.chunks),
+        e.key,
+    ))
+    for e in others:
+        base = e.id[:-len("_young")] if e.id.endswith("_young") else e.id
+        if base not in base_ids:
+            base_ids[base] = f"nv{len(base_ids) + 1}"
+        ids[e.key] = base_ids[base] + ("_young" if e.id.endswith("_young") else "")
+    return ids
+
+
+def _location_id(value: str) -> str:
+    slug = _norm(value)
+    return slug if slug.startswith("loc_") else f"loc_{slug or 'unknown'}"
+
+
+def _groups(
+    entities: List[Entity],
+    llm_groups: Any,
+    fallback_ids: Dict[str, str],
+    normalize: Callable[[str], str] = _norm
+) -> List[Tuple[str, List[Entity]]]:
+    """
+    Nhóm entity theo kết quả REDUCE; key LLM bỏ sót → nhóm riêng với ID dự phòng.
+
+    Key xuất hiện ở nhiều nhóm chỉ tính nhóm đầu; ID trùng nhau → gộp nhóm.
+    """
+    by_key = {e.key: e for e in entities}
+    grouped: Dict[str, List[Entity]] = {}
+    used = set()
+    for group in llm_groups if isinstance(llm_groups, list) else []:
+        if not isinstance(group, dict):
+            continue
+        members = [by_key[k] for k in group.get("members") or [] if k in by_key and k not in used]
+        if not members:
+            continue
+        final_id = normalize(group.get("id")) if group.get("id") else fallback_ids[members[0].key]
+        used.update(e.key for e in members)
+        grouped.setdefault(final_id, []).extend(members)
+    for e in entities:
+        if e.key not in used:
+            grouped.setdefault(fallback_ids[e.key], []).append(e)
+    return list(grouped.items())
+
+
+def apply_groups(merged: MergedStory, reduce_data: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    Dựng JSON cuối (format analyze_story) từ gộp sơ bộ + kết quả REDUCE.
+
+    Args:
+        reduce_data: JSON từ merge_story_entities (None = chỉ gộp bằng code)
+
+    Returns:
+        {"characters", "locations", "world_setting", "context_lock", "global_style"}
+    """
+    reduce_data = reduce_data if isinstance(reduce_data, dict) else {}
+
+    char_fallback = _fallback_character_ids(merged.characters)
+    loc_fallback = {e.key: _location_id(e.id) for e in merged.locations}
+
+    characters = [
+        _merge_character(final_id, entities)
+        for final_id, entities in _groups(merged.characters, reduce_data.get("characters"), char_fallback)
+    ]
+    locations = [
+        _merge_location(final_id, entities)
+        for final_id, entities in _groups(
+            merged.locations, reduce_data.get("locations"), loc_fallback, _location_id
+        )
+    ]
+    characters.sort(key=lambda c: (not _is_narrator(c["id"]), ROLE_RANK.get(c.get("role"), len(ROLE_RANK))))
+
+    world_setting = reduce_data.get("world_setting")
+    if not isinstance(world_setting, dict) or not world_setting:
+        world_setting = _merge_world_setting(merged.settings)
+
+    return {
+        "characters": characters,
+        "locations": locations,
+        "world_setting": world_setting,
+        "context_lock": str(reduce_data.get("context_lock") or ""),
+        "global_style": str(reduce_data.get("global_style") or ""),
+    }
+
+
+def story_outline(merged: MergedStory) -> str:
+    """Tóm tắt theo thời gian từ các đoạn (input gọn cho Director's Treatment)."""
+    return "\n".join(merged.outline)
@@ -0,0 +1,236 @@
+"""
+VE3 Tool - Structured LLM Output
+================================
+JSON schema cho các response chính của PromptGenerator + kiểm tra khi nhận.
+
+- DeepSeek: response_format {"type": "json_object"} (JSON mode - luôn là
+  JSON hợp lệ, schema đưa vào system prompt)
+- Ollama: format = JSON schema (grammar ép đúng cấu trúc khi sinh token)
+- Response từ provider có structured output → json.loads + validate,
+  không qua _extract_json. Chỉ repair khi provider không hỗ trợ / response
+  bị truncate (finish_reason=length)
+
+Validator chỉ hỗ trợ tập con JSON schema dùng ở đây: type, properties,
+required, items (không cần thêm dependency).
+
+Usage:
+    from modules.structured_output import SCENE_PROMPTS_SCHEMA, parse_structured
+
+    data, errors = parse_structured(response, SCENE_PROMPTS_SCHEMA)
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# ============================================================================
+# SCHEMAS
+# ============================================================================
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+# generate_scenes (config/prompts.yaml) → _generate_scene_prompts
+SCENE_PROMPTS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "scenes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "scene_id": {"type": "integer"},
+                    "characters_used": _STRING_LIST,
+                    "location_used": {"type": "string"},
+                    "reference_files": _STRING_LIST,
+                    "img_prompt": {"type": "string"},
+                    "video_prompt": {"type": "string"},
+                },
+                "required": ["scene_id", "img_prompt", "video_prompt"],
+            },
+        },
+    },
+    "required": ["scenes"],
+}
+
+# directors_shooting_plan → _convert_shooting_plan_to_scenes
+_SHOT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "shot_number": {"type": "integer"},
+        "purpose": {"type": "string"},
+        "emotional_weight": {"type": "string"},
+        "planned_duration": {"type": "number"},
+        "srt_range": {"type": "string"},
+        "srt_text": {"type": "string"},
+        "shot_type": {"type": "string"},
+        "camera_angle": {"type": "string"},
+        "characters_in_shot": _STRING_LIST,
+        "reference_files": _STRING_LIST,
+        "visual_description": {"type": "string"},
+        "img_prompt": {"type": "string"},
+    },
+    "required": ["srt_range", "img_prompt"],
+}
+
+SHOOTING_PLAN_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "shooting_plan": {
+            "type": "object",
+            "properties": {
+                "total_duration": {"type": "string"},
+                "total_shots": {"type": "integer"},
+                "story_parts": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "part_number": {"type": "integer"},
+                            "part_name": {"type": "string"},
+                            "location": {},
+                            "time_range": {"type": "string"},
+                            "shots": {"type": "array", "items": _SHOT_SCHEMA},
+                        },
+                        "required": ["shots"],
+                    },
+                },
+            },
+            "required": ["story_parts"],
+        },
+    },
+    "required": ["shooting_plan"],
+}
+
+# analyze_story_chunk (map-reduce phân tích truyện dài) → story_map_reduce.merge_chunks
+STORY_CHUNK_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "world_setting": {"type": "object"},
+        "characters": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "aliases": _STRING_LIST,
+                    "role": {"type": "string"},
+                    "is_child": {"type": "boolean"},
+                    "portrait_prompt": {"type": "string"},
+                    "character_lock": {"type": "string"},
+                    "appearances": _STRING_LIST,
+                },
+                "required": ["id", "name", "character_lock"],
+            },
+        },
+        "locations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "location_prompt": {"type": "string"},
+                    "location_lock": {"type": "string"},
+                    "appearances": _STRING_LIST,
+                },
+                "required": ["id", "name"],
+            },
+        },
+    },
+    "required": ["characters", "locations"],
+}
+
+_ENTITY_GROUPS = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"id": {"type": "string"}, "members": _STRING_LIST},
+        "required": ["id", "members"],
+    },
+}
+
+# merge_story_entities → story_map_reduce.apply_groups
+STORY_REDUCE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "world_setting": {"type": "object"},
+        "global_style": {"type": "string"},
+        "context_lock": {"type": "string"},
+        "characters": _ENTITY_GROUPS,
+        "locations": _ENTITY_GROUPS,
+    },
+    "required": ["characters", "locations"],
+}
+
+
+# ============================================================================
+# VALIDATE
+# ============================================================================
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def _is_type(value: Any, expected: str) -> bool:
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, _TYPES.get(expected, object))
+
+
+def validate_json(data: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """
+    Kiểm tra data theo schema (type / properties / required / items).
+
+    Returns:
+        List lỗi dạng "$.scenes[3].img_prompt: thiếu" (rỗng = hợp lệ)
+    """
+    expected = schema.get("type")
+    if expected and not _is_type(data, expected):
+        return [f"{path}: cần {expected}, nhận {type(data).__name__}"]
+
+    errors: List[str] = []
+    if isinstance(data, dict):
+        for key in schema.get("required", ()):
+            if key not in data:
+                errors.append(f"{path}.{key}: thiếu")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in data:
+                errors.extend(validate_json(data[key], sub_schema, f"{path}.{key}"))
+    elif isinstance(data, list) and "items" in schema:
+        for i, item in enumerate(data):
+            errors.extend(validate_json(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def parse_structured(text: str, schema: Dict[str, Any]) -> Tuple[Optional[Any], List[str]]:
+    """
+    Parse response của provider có structured output (không repair).
+
+    Returns:
+        (data, lỗi schema) - data None nếu không phải JSON hợp lệ
+    """
+    if not text or not text.strip():
+        return None, ["response rỗng"]
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        return None, [f"JSON lỗi tại {e.pos}: {e.msg}"]
+    return data, validate_json(data, schema)
+
+
+def schema_instruction(schema: Dict[str, Any]) -> str:
+    """Câu system prompt mô tả schema (provider chỉ có JSON mode, không nhận schema)."""
+    return (
+        "Respond ONLY with a JSON object matching this JSON schema "
+        "(extra keys allowed, required keys must be present): "
+        + json.dumps(schema, separators=(",", ":"))
+    )
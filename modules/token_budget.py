@@ -0,0 +1,225 @@
+"""
+VE3 Tool - Token Budget Batching
+================================
+Chia batch theo ngân sách token của provider thay vì số scene / số giây cố định.
+
+- Ước lượng token prompt + completion cho từng item (scene, dòng SRT)
+  bằng heuristic ký tự/token, hiệu chỉnh theo usage thật provider trả về
+- Đóng gói item vào batch sao cho prompt + completion nằm trong context và
+  completion nằm trong max output của provider (chừa biên an toàn)
+- Học từ kết quả: completion thật lớn/nhỏ hơn ước lượng → chỉnh hệ số;
+  bị truncate (finish_reason=length, JSON chưa đóng) → tăng hệ số mạnh
+  để các batch sau nhỏ lại
+
+Usage:
+    from modules.token_budget import TokenBudget
+
+    budget = TokenBudget("deepseek")
+    batches = budget.pack(
+        scenes, kind="scene_prompts",
+        prompt_tokens=lambda s: budget.tokens(s["text"]) + 60,
+        completion_tokens=lambda s: 320,
+        fixed_prompt_tokens=budget.tokens(template),
+    )
+    ...
+    budget.observe("scene_prompts", estimated_completion, response, usage)
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+# Heuristic mặc định: tiếng Anh ~4 ký tự/token; ký tự có dấu (tiếng Việt)
+# tốn thêm token → tính thêm theo số byte UTF-8 vượt quá 1
+DEFAULT_CHARS_PER_TOKEN = 4.0
+EXTRA_BYTES_PER_TOKEN = 2.0
+
+# Biên an toàn: chỉ dùng 85% budget
+DEFAULT_SAFETY = 0.85
+
+# EWMA cho hệ số hiệu chỉnh
+CALIBRATION_ALPHA = 0.3
+
+# Truncate → hệ số completion nhân thêm (batch sau nhỏ lại)
+TRUNCATION_BACKOFF = 1.5
+
+# Giới hạn hệ số completion (tránh 1 response lạ làm lệch hẳn)
+MIN_COMPLETION_RATIO = 0.3
+MAX_COMPLETION_RATIO = 6.0
+
+
+def estimate_tokens(text: str, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN) -> int:
+    """Ước lượng số token của text (heuristic, không cần tokenizer)."""
+    if not text:
+        return 0
+    chars = len(text)
+    extra_bytes = len(text.encode("utf-8")) - chars
+    return int(chars / chars_per_token + extra_bytes / EXTRA_BYTES_PER_TOKEN) + 1
+
+
+@dataclass(frozen=True)
+class ProviderBudget:
+    """Giới hạn token của 1 provider."""
+    context_tokens: int
+    max_output_tokens: int
+
+
+PROVIDER_BUDGETS: Dict[str, ProviderBudget] = {
+    # deepseek-chat: context 64K, output tối đa 8K
+    "deepseek": ProviderBudget(context_tokens=65536, max_output_tokens=8192),
+    # Ollama: trần num_ctx (ollama_max_ctx, prompt + output chung 1 context)
+    "ollama": ProviderBudget(context_tokens=32768, max_output_tokens=16000),
+}
+
+
+class TokenBudget:
+    """
+    Ước lượng token + đóng gói batch theo budget, học từ usage thật.
+
+    Thread-safe (batch scene prompts chạy song song).
+    """
+
+    def __init__(
+        self,
+        provider: str = "deepseek",
+        budget: Optional[ProviderBudget] = None,
+        safety: float = DEFAULT_SAFETY
+    ):
+        self.provider = provider
+        self.budget = budget or PROVIDER_BUDGETS.get(provider, PROVIDER_BUDGETS["deepseek"])
+        self.safety = safety
+        self.chars_per_token = DEFAULT_CHARS_PER_TOKEN
+        self._completion_ratio: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.truncations: Dict[str, int] = {}
+        self.observations: Dict[str, int] = {}
+
+    # =========================================================================
+    # ESTIMATE
+    # =========================================================================
+
+    def tokens(self, text: str) -> int:
+        """Ước lượng số token của text (theo ký tự/token đã hiệu chỉnh)."""
+        return estimate_tokens(text, self.chars_per_token)
+
+    def completion_ratio(self, kind: str) -> float:
+        """Hệ số completion thật / ước lượng đã học cho loại request."""
+        return self._completion_ratio.get(kind, 1.0)
+
+    def output_budget(self, max_output_tokens: Optional[int] = None) -> int:
+        """Số token completion tối đa cho 1 batch (đã trừ biên an toàn)."""
+        limit = self.budget.max_output_tokens
+        if max_output_tokens:
+            limit = min(limit, max_output_tokens)
+        return int(limit * self.safety)
+
+    # =========================================================================
+    # PACK
+    # =========================================================================
+
+    def pack(
+        self,
+        items: Sequence[Any],
+        kind: str,
+        prompt_tokens: Callable[[Any], int],
+        completion_tokens: Callable[[Any], int],
+        fixed_prompt_tokens: int = 0,
+        max_output_tokens: Optional[int] = None,
+        max_items: Optional[int] = None
+    ) -> List[List[Any]]:
+        """
+        Chia items thành batch liên tiếp (giữ thứ tự) theo budget.
+
+        Một batch đóng lại khi thêm item tiếp theo sẽ làm:
+        - completion ước lượng (× hệ số đã học) vượt output budget, hoặc
+        - fixed + prompt + completion vượt context budget, hoặc
+        - số item vượt max_items
+
+        Mỗi batch có ít nhất 1 item (item quá lớn đứng riêng).
+        """
+        ratio = self.completion_ratio(kind)
+        output_limit = self.output_budget(max_output_tokens)
+        context_limit = int(self.budget.context_tokens * self.safety)
+
+        batches: List[List[Any]] = []
+        current: List[Any] = []
+        prompt_sum = fixed_prompt_tokens
+        completion_sum = 0.0
+
+        for item in items:
+            p = prompt_tokens(item)
+            c = completion_tokens(item) * ratio
+            over = current and (
+                completion_sum + c > output_limit
+                or prompt_sum + p + completion_sum + c > context_limit
+                or (max_items and len(current) >= max_items)
+            )
+            if over:
+                batches.append(current)
+                current = []
+                prompt_sum = fixed_prompt_tokens
+                completion_sum = 0.0
+            current.append(item)
+            prompt_sum += p
+            completion_sum += c
+
+        if current:
+            batches.append(current)
+        return batches
+
+    # =========================================================================
+    # LEARN
+    # =========================================================================
+
+    def observe(
+        self,
+        kind: str,
+        estimated_completion: int,
+        response: str = "",
+        usage: Optional[Dict[str, Any]] = None,
+        truncated: bool = False,
+        prompt_text: str = ""
+    ) -> None:
+        """
+        Ghi nhận kết quả 1 request để hiệu chỉnh lần sau.
+
+        Args:
+            kind: Loại request (scene_prompts, director...)
+            estimated_completion: Completion đã ước lượng (chưa nhân hệ số)
+            response: Text trả về
+            usage: {"prompt_tokens", "completion_tokens", "finish_reason"} nếu provider có
+            truncated: Caller phát hiện response bị cắt (JSON chưa đóng...)
+            prompt_text: Prompt đã gửi (hiệu chỉnh ký tự/token theo prompt_tokens thật)
+        """
+        usage = usage or {}
+        truncated = truncated or usage.get("finish_reason") == "length"
+        actual = usage.get("completion_tokens") or (self.tokens(response) if response else 0)
+
+        with self._lock:
+            self.observations[kind] = self.observations.get(kind, 0) + 1
+
+            prompt_tokens = usage.get("prompt_tokens")
+            if prompt_text and prompt_tokens:
+                measured = len(prompt_text) / max(1, prompt_tokens)
+                if 1.0 <= measured <= 8.0:
+                    self.chars_per_token += CALIBRATION_ALPHA * (measured - self.chars_per_token)
+
+            ratio = self._completion_ratio.get(kind, 1.0)
+            if truncated:
+                self.truncations[kind] = self.truncations.get(kind, 0) + 1
+                ratio *= TRUNCATION_BACKOFF
+            elif actual and estimated_completion > 0:
+                ratio += CALIBRATION_ALPHA * (actual / estimated_completion - ratio)
+            self._completion_ratio[kind] = min(MAX_COMPLETION_RATIO, max(MIN_COMPLETION_RATIO, ratio))
+
+    def stats(self) -> Dict[str, Any]:
+        """Trạng thái đã học (log/debug)."""
+        with self._lock:
+            return {
+                "provider": self.provider,
+                "chars_per_token": round(self.chars_per_token, 2),
+                "completion_ratio": {k: round(v, 2) for k, v in self._completion_ratio.items()},
+                "truncations": dict(self.truncations),
+                "observations": dict(self.observations),
+            }
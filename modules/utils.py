@@ -4,7 +4,9 @@ VE3 Tool - Utility Functions
 Chứa các hàm tiện ích chung cho toàn bộ pipeline.
 """
 
+import binascii
 import logging
+import os
 import re
 import sys
 from datetime import timedelta
@@ -469,3 +471,67 @@ def format_duration(seconds: float) -> str:
     if hours > 0:
         return f"{hours:02d}:{minutes:02d}:{secs:02d}"
     return f"{minutes:02d}:{secs:02d}"
+
+
+# Base64 chunk: bội số của 4 để mỗi chunk decode độc lập (~768KB output/chunk)
+B64_CHUNK_CHARS = 1024 * 1024
+
+
+def decode_base64_to_file(b64_data: str, output_path: Path, chunk_chars: int = B64_CHUNK_CHARS) -> int:
+    """
+    Decode chuỗi base64 (vd: encodedImage từ Flow API) thẳng ra file theo chunk.
+
+    Không tạo bản sao full-size của payload: không split/strip/replace cả chuỗi,
+    không giữ toàn bộ bytes đã decode trong RAM. Bỏ qua prefix data URL
+    ("data:image/png;base64,") và whitespace/newline xen giữa.
+    Ghi ra file tạm rồi rename atomic.
+
+    Args:
+        b64_data: Chuỗi base64
+        output_path: File đích
+        chunk_chars: Số ký tự base64 mỗi chunk (bội số của 4)
+
+    Returns:
+        Số bytes đã ghi
+
+    Raises:
+        ValueError: Nếu base64 không hợp lệ
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    chunk_chars -= chunk_chars % 4
+
+    # Data URL prefix chỉ nằm ở đầu chuỗi - tìm "," trong vài chục ký tự đầu
+    start = 0
+    if b64_data.startswith("data:"):
+        start = b64_data.find(",", 0, 256) + 1
+
+    has_whitespace = any(ch in b64_data for ch in "\n\r \t")
+    tmp_path = output_path.with_name(output_path.name + ".part")
+    written = 0
+    carry = ""
+
+    try:
+        with open(tmp_path, "wb") as f:
+            for pos in range(start, len(b64_data), chunk_chars):
+                chunk = b64_data[pos:pos + chunk_chars]
+                if has_whitespace:
+                    chunk = carry + "".join(chunk.split())
+                    usable = len(chunk) - len(chunk) % 4
+                    chunk, carry = chunk[:usable], chunk[usable:]
+                data = binascii.a2b_base64(chunk)
+                f.write(data)
+                written += len(data)
+            if carry:
+                data = binascii.a2b_base64(carry)
+                f.write(data)
+                written += len(data)
+        os.replace(tmp_path, output_path)
+    except binascii.Error as e:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise ValueError(f"Invalid base64 data: {e}")
+
+    return written
@@ -2,12 +2,21 @@
 VE3 Tool - Voice to SRT Module
 ==============================
 Chuyển đổi file audio thành file subtitle SRT sử dụng Whisper.
+
+Backends (whisper_backend trong settings.yaml, "auto" = theo thứ tự):
+- faster_whisper: CTranslate2, int8 trên CPU - nhanh hơn nhiều lần PyTorch fp32,
+  word timestamps + Silero VAD có sẵn
+- whisper_timestamped: timestamp theo từ chính xác, PyTorch
+- whisper: openai-whisper gốc, PyTorch
 """
 
+import re
+import time
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 from modules.utils import get_logger, format_srt_time
+from modules.metrics import observe
 
 
 # ============================================================================
@@ -16,6 +25,7 @@ from modules.utils import get_logger, format_srt_time
 
 WHISPER_AVAILABLE = False
 WHISPER_TIMESTAMPED_AVAILABLE = False
+FASTER_WHISPER_AVAILABLE = False
 
 try:
     import whisper
@@ -29,6 +39,25 @@ try:
 except ImportError:
     pass
 
+try:
+    import faster_whisper
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    pass
+
+# Thứ tự ưu tiên khi whisper_backend = "auto"
+BACKENDS = ("faster_whisper", "whisper_timestamped", "whisper")
+
+
+def available_backends() -> List[str]:
+    """Các backend đã cài, theo thứ tự ưu tiên."""
+    installed = {
+        "faster_whisper": FASTER_WHISPER_AVAILABLE,
+        "whisper_timestamped": WHISPER_TIMESTAMPED_AVAILABLE,
+        "whisper": WHISPER_AVAILABLE,
+    }
+    return [name for name in BACKENDS if installed[name]]
+
 
 class WhisperNotFoundError(Exception):
     """Exception khi không tìm thấy Whisper."""
@@ -40,10 +69,13 @@ Whisper không được cài đặt. Vui lòng cài đặt một trong các pack
 Option 1 - Whisper gốc (OpenAI):
     pip install openai-whisper
 
-Option 2 - Whisper Timestamped (khuyến nghị, timestamp chính xác hơn):
+Option 2 - Whisper Timestamped (timestamp chính xác hơn):
     pip install whisper-timestamped
 
-Lưu ý: Cả hai đều yêu cầu FFmpeg được cài đặt trên hệ thống.
+Option 3 - faster-whisper (khuyến nghị cho máy không GPU, int8 nhanh nhất):
+    pip install faster-whisper
+
+Lưu ý: Option 1-2 yêu cầu FFmpeg được cài đặt trên hệ thống.
 - Windows: choco install ffmpeg hoặc download từ https://ffmpeg.org/
 - macOS: brew install ffmpeg
 - Linux: sudo apt install ffmpeg
@@ -60,41 +92,59 @@ class VoiceToSrt:
     Class chuyển đổi file audio thành file SRT.
     
     Sử dụng Whisper để transcribe audio và tạo subtitle với timestamp.
-    Ưu tiên whisper_timestamped nếu có vì cho timestamp chính xác hơn.
+    Backend "auto": faster_whisper (int8, nhanh nhất trên CPU) > whisper_timestamped
+    (timestamp chính xác hơn) > whisper gốc.
     """
     
     def __init__(
         self,
         model_name: str = "base",
         language: Optional[str] = None,
-        device: Optional[str] = None
+        device: Optional[str] = None,
+        backend: str = "auto",
+        compute_type: str = "int8",
+        cpu_threads: int = 0,
+        vad: bool = True
     ):
         """
         Khởi tạo VoiceToSrt converter.
         
         Args:
-            model_name: Tên model Whisper (tiny, base, small, medium, large)
+            model_name: Tên model Whisper (tiny, base, small, medium, large;
+                        faster_whisper thêm large-v3, distil-large-v3...)
             language: Ngôn ngữ (ví dụ: "vi", "en"). None để tự phát hiện.
             device: Device để chạy model (cpu, cuda). None để tự chọn.
+            backend: "auto", "faster_whisper", "whisper_timestamped", "whisper"
+            compute_type: faster_whisper - kiểu tính (int8, int8_float16, float16, float32)
+            cpu_threads: faster_whisper - số thread CPU (0 = mặc định CTranslate2)
+            vad: Bỏ đoạn im lặng bằng VAD trước khi transcribe
         """
         self.model_name = model_name
         self.language = language
         self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.vad = vad
         self.logger = get_logger("voice_to_srt")
         
         # Kiểm tra Whisper có sẵn không
-        if not WHISPER_AVAILABLE and not WHISPER_TIMESTAMPED_AVAILABLE:
+        installed = available_backends()
+        if not installed:
             raise WhisperNotFoundError()
         
-        # Chọn backend
-        self.use_timestamped = WHISPER_TIMESTAMPED_AVAILABLE
-        if self.use_timestamped:
-            self.logger.info("Using whisper_timestamped backend")
-        else:
-            self.logger.info("Using standard whisper backend")
+        # Chọn backend: backend chỉ định chưa cài → dùng backend ưu tiên đã cài
+        backend = (backend or "auto").lower().replace("-", "_")
+        if backend not in installed:
+            if backend != "auto":
+                self.logger.warning(f"Backend {backend} chưa cài, dùng {installed[0]}")
+            backend = installed[0]
+        self.backend = backend
+        self.use_timestamped = backend == "whisper_timestamped"
+        self.logger.info(f"Using {backend} backend")
         
         # Load model (lazy loading)
         self._model = None
+        self.load_seconds = 0.0
     
     def _load_model(self):
         """Load Whisper model (lazy loading)."""
@@ -102,8 +152,18 @@ class VoiceToSrt:
             return
         
         self.logger.info(f"Loading Whisper model: {self.model_name}")
+        start = time.time()
         
-        if self.use_timestamped:
+        if self.backend == "faster_whisper":
+            from faster_whisper import WhisperModel
+            options = {
+                "device": self.device or "auto",
+                "compute_type": self.compute_type,
+            }
+            if self.cpu_threads:
+                options["cpu_threads"] = self.cpu_threads
+            self._model = WhisperModel(self.model_name, **options)
+        elif self.use_timestamped:
             import whisper_timestamped
             self._model = whisper_timestamped.load_model(
                 self.model_name,
@@ -116,7 +176,8 @@ class VoiceToSrt:
                 device=self.device
             )
         
-        self.logger.info("Model loaded successfully")
+        self.load_seconds = time.time() - start
+        self.logger.info(f"Model loaded successfully ({self.load_seconds:.1f}s)")
     
     def transcribe(
         self,
@@ -155,14 +216,18 @@ class VoiceToSrt:
         self.logger.info(f"Transcribing: {input_audio_path}")
         
         # Transcribe
+        start = time.time()
         try:
-            if self.use_timestamped:
+            if self.backend == "faster_whisper":
+                result = self._transcribe_faster(input_audio_path, **kwargs)
+            elif self.use_timestamped:
                 result = self._transcribe_timestamped(input_audio_path, **kwargs)
             else:
                 result = self._transcribe_standard(input_audio_path, **kwargs)
         except Exception as e:
             self.logger.error(f"Transcription failed: {e}")
             raise RuntimeError(f"Transcription thất bại: {e}")
+        self._record_speed(result, time.time() - start)
         
         # Tạo file SRT
         self._write_srt(result, output_srt_path)
@@ -171,6 +236,65 @@ class VoiceToSrt:
         
         return result
     
+    def _record_speed(self, result: Dict[str, Any], seconds: float) -> None:
+        """Ghi thời gian transcribe + real-time factor (giây xử lý / giây audio) vào result."""
+        segments = result.get("segments") or []
+        duration = result.get("duration") or (segments[-1].get("end", 0) if segments else 0)
+        result["transcribe_seconds"] = round(seconds, 3)
+        if duration:
+            rtf = seconds / duration
+            result["rtf"] = round(rtf, 4)
+            observe("whisper_rtf", rtf, backend=self.backend, model=self.model_name)
+            self.logger.info(
+                f"[Whisper] {self.backend}/{self.model_name}: {duration:.0f}s audio trong "
+                f"{seconds:.1f}s (RTF {rtf:.3f})"
+            )
+
+    def _transcribe_faster(
+        self,
+        audio_path: Path,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Transcribe sử dụng faster_whisper (CTranslate2).
+
+        Trả về dict cùng format whisper_timestamped (segments + words) để
+        write_transcript dùng chung.
+        """
+        transcribe_options = {
+            "language": self.language,
+            "beam_size": 5,
+            "word_timestamps": True,
+            "vad_filter": self.vad,
+            "vad_parameters": {"min_silence_duration_ms": 500},
+        }
+        transcribe_options.update(kwargs)
+
+        # segments là generator - decode chạy khi duyệt
+        segments_iter, info = self._model.transcribe(str(audio_path), **transcribe_options)
+
+        segments = []
+        for seg in segments_iter:
+            segments.append({
+                "id": seg.id,
+                "start": seg.start,
+                "end": seg.end,
+                "text": seg.text,
+                "avg_logprob": seg.avg_logprob,
+                "no_speech_prob": seg.no_speech_prob,
+                "words": [
+                    {"text": w.word.strip(), "start": w.start, "end": w.end, "confidence": w.probability}
+                    for w in (seg.words or [])
+                ],
+            })
+
+        return {
+            "text": "".join(seg["text"] for seg in segments).strip(),
+            "segments": segments,
+            "language": info.language,
+            "duration": info.duration,
+        }
+
     def _transcribe_timestamped(
         self,
         audio_path: Path,
@@ -234,60 +358,15 @@ class VoiceToSrt:
     
     def _write_srt(self, result: Dict[str, Any], output_path: Path) -> None:
         """
-        Ghi kết quả transcription ra file SRT.
+        Ghi kết quả transcription ra file SRT (+ TXT cho đạo diễn).
 
         Args:
             result: Kết quả từ Whisper
             output_path: Path file SRT
         """
-        segments = result.get("segments", [])
+        write_transcript(result, output_path)
+        self.logger.info(f"TXT saved to: {output_path.with_suffix('.txt')}")
 
-        with open(output_path, "w", encoding="utf-8") as f:
-            for idx, segment in enumerate(segments, start=1):
-                start_time = segment.get("start", 0)
-                end_time = segment.get("end", 0)
-                text = segment.get("text", "").strip()
-
-                # Format thời gian SRT
-                start_str = self._seconds_to_srt_time(start_time)
-                end_str = self._seconds_to_srt_time(end_time)
-
-                # Ghi entry
-                f.write(f"{idx}\n")
-                f.write(f"{start_str} --> {end_str}\n")
-                f.write(f"{text}\n")
-                f.write("\n")
-
-        # Cũng xuất file TXT (full text không có timestamp) cho đạo diễn
-        self._write_txt(result, output_path)
-
-    def _write_txt(self, result: Dict[str, Any], srt_path: Path) -> None:
-        """
-        Ghi kết quả transcription ra file TXT (không có timestamp).
-        File TXT dùng cho đạo diễn để đọc và phân tích nội dung.
-
-        Args:
-            result: Kết quả từ Whisper
-            srt_path: Path file SRT (sẽ đổi đuôi thành .txt)
-        """
-        segments = result.get("segments", [])
-        txt_path = srt_path.with_suffix(".txt")
-
-        # Ghép tất cả text thành đoạn văn
-        full_text = " ".join([
-            segment.get("text", "").strip()
-            for segment in segments
-        ])
-
-        # Xử lý format: đảm bảo có space sau dấu câu
-        import re
-        full_text = re.sub(r'([.!?])([A-ZÀ-Ỹ])', r'\1 \2', full_text)
-
-        with open(txt_path, "w", encoding="utf-8") as f:
-            f.write(full_text)
-
-        self.logger.info(f"TXT saved to: {txt_path}")
-    
     @staticmethod
     def _seconds_to_srt_time(seconds: float) -> str:
         """
@@ -306,6 +385,51 @@ class VoiceToSrt:
         return f"{hours:02d}:{minutes:02d}:{secs:06.3f}".replace(".", ",")
 
 
+# ============================================================================
+# SRT / TXT OUTPUT
+# ============================================================================
+
+def write_transcript(result: Dict[str, Any], output_path: Path) -> None:
+    """
+    Ghi kết quả (format VoiceToSrt.transcribe / ForcedAligner.align) ra file
+    SRT + file TXT cùng tên (full text không có timestamp, cho đạo diễn).
+
+    Args:
+        result: Dict có "segments" (start, end, text)
+        output_path: Path file SRT
+    """
+    output_path = Path(output_path)
+    segments = result.get("segments", [])
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        for idx, segment in enumerate(segments, start=1):
+            start_time = segment.get("start", 0)
+            end_time = segment.get("end", 0)
+            text = segment.get("text", "").strip()
+
+            # Format thời gian SRT
+            start_str = VoiceToSrt._seconds_to_srt_time(start_time)
+            end_str = VoiceToSrt._seconds_to_srt_time(end_time)
+
+            # Ghi entry
+            f.write(f"{idx}\n")
+            f.write(f"{start_str} --> {end_str}\n")
+            f.write(f"{text}\n")
+            f.write("\n")
+
+    # Ghép tất cả text thành đoạn văn
+    full_text = " ".join([
+        segment.get("text", "").strip()
+        for segment in segments
+    ])
+
+    # Xử lý format: đảm bảo có space sau dấu câu
+    full_text = re.sub(r'([.!?])([A-ZÀ-Ỹ])', r'\1 \2', full_text)
+
+    with open(output_path.with_suffix(".txt"), "w", encoding="utf-8") as f:
+        f.write(full_text)
+
+
 # ============================================================================
 # CONVENIENCE FUNCTION
 # ============================================================================
@@ -314,7 +438,8 @@ def convert_voice_to_srt(
     input_audio_path: Path,
     output_srt_path: Path,
     model_name: str = "base",
-    language: Optional[str] = None
+    language: Optional[str] = None,
+    backend: str = "auto"
 ) -> Dict[str, Any]:
     """
     Hàm tiện ích để chuyển đổi voice thành SRT.
@@ -324,9 +449,10 @@ def convert_voice_to_srt(
         output_srt_path: Path để lưu file SRT
         model_name: Tên model Whisper
         language: Ngôn ngữ (None để tự phát hiện)
+        backend: Backend Whisper ("auto" = nhanh nhất đã cài)
         
     Returns:
         Kết quả transcription
     """
-    converter = VoiceToSrt(model_name=model_name, language=language)
+    converter = VoiceToSrt(model_name=model_name, language=language, backend=backend)
     return converter.transcribe(input_audio_path, output_srt_path)